@@ -0,0 +1,100 @@
+"""
+ルートの一括算出（Streamlitページを開かずに実行）
+
+観光案内所・宿泊施設向けに、出発地と訪問スポットの組み合わせのジョブ一覧（CSV）から、最適化した訪問順・
+総移動距離・総所要時間・Google Mapsのリンクをまとめて算出し、CSVに保存する。
+スポット間の移動時間はアプリと同じキャッシュ（.spots_cache/travel）を使い、CPU数のプロセスで並列に算出する。
+スポット数が同じジョブは、移動時間行列の作成と厳密解（Held-Karp法）をまとめて配列演算で行う
+（12箇所以下。それより多いジョブは1件ずつ局所探索で算出する）。
+
+ジョブ一覧の列:
+    ID        任意。結果の行の識別に使う（省略時は行番号）
+    モード    任意。観光 / 防災（省略時は観光）
+    緯度, 経度 出発地
+    スポット  訪問するスポット名を | で区切って並べる（spots.xlsxの観光・防災シートの名前）
+    移動手段  任意。車 / 徒歩 / 自転車 / 公共交通（driving / walking / bicycling / transit も可。
+              省略時は観光は車、防災は徒歩）
+
+使い方:
+    python batch_routes.py jobs.csv                             # routes.csv に保存
+    python batch_routes.py jobs.csv --output out.csv --workers 4
+    python batch_routes.py jobs.csv --no-roads                  # 道路データがあっても直線距離で計算
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+import pandas as pd
+
+import hita_concierge as app
+
+
+def load_spots(path: str):
+    """spots.xlsxを読み込む（ファイルがない場合はサンプルデータ）"""
+    if not os.path.exists(path):
+        print(f"⚠️ {path} が見つかりません（サンプルデータで算出します）")
+        return app.sample_spots_frames()
+    return app.read_spots_workbook(path)
+
+
+def load_roads(path: str):
+    """道路データを読み込む（読み込めない場合はNone）"""
+    if not path:
+        return None
+    try:
+        return app.load_road_network(path)
+    except (OSError, app.RoadDataError) as e:
+        print(f"⚠️ 道路データを読み込めません: {e}（直線距離で計算します）")
+        return None
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='日田市総合案内コンシェルジュのルート一括算出')
+    parser.add_argument('jobs', help='ジョブ一覧のCSV')
+    parser.add_argument('--output', default='routes.csv', help='結果を保存するCSV')
+    parser.add_argument('--spots', default=app.SPOTS_FILE, help='スポットデータ（Excel）')
+    parser.add_argument('--roads', default=app.find_road_network_file(), help='道路データ（OSM抽出）')
+    parser.add_argument('--no-roads', action='store_true', help='道路データを使わず直線距離で計算')
+    parser.add_argument('--workers', type=int, default=None, help='並列に算出するプロセス数（既定はCPU数）')
+    parser.add_argument('--chunk-size', type=int, default=app.BATCH_CHUNK_SIZE, help='ワーカーにまとめて渡すジョブ数（ワーカー内でまとめて算出する）')
+    args = parser.parse_args(argv)
+
+    tourism_df, disaster_df = load_spots(args.spots)
+    stores = {
+        'tourism': app.SpotStore.from_dataframe(tourism_df),
+        'disaster': app.SpotStore.from_dataframe(disaster_df),
+    }
+    versions = {'tourism': app.dataset_version(tourism_df), 'disaster': app.dataset_version(disaster_df)}
+    road_network = None if args.no_roads else load_roads(args.roads)
+
+    try:
+        jobs_df = pd.read_csv(args.jobs, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+        jobs = app.parse_route_jobs(jobs_df, stores)
+    except (OSError, ValueError) as e:
+        print(f"❌ ジョブ一覧を読み込めません: {e}")
+        return 1
+
+    started = time.perf_counter()
+    matrices = app.load_batch_matrices(jobs, stores, versions, road_network)
+    solve_started = time.perf_counter()
+    results = app.run_route_jobs(jobs, stores, matrices, workers=args.workers, chunk_size=args.chunk_size)
+    finished = time.perf_counter()
+
+    app.route_results_frame(results).to_csv(args.output, index=False, encoding='utf-8-sig')
+    errors = sum(1 for result in results if result.error)
+    unique = len({job.query for job in jobs if not job.error})
+    print(
+        f"🗺️ {len(jobs)}件（重複を除いて{unique}件）を算出しました: "
+        f"移動時間行列 {solve_started - started:.2f}秒、ルート {finished - solve_started:.2f}秒"
+        f"（{len(jobs) / max(finished - solve_started, 1e-9):,.0f}件/秒）"
+    )
+    if errors:
+        print(f"⚠️ {errors}件は算出できませんでした（エラー列を確認してください）")
+    print(f"💾 {args.output} に保存しました")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
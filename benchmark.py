@@ -0,0 +1,656 @@
+"""
+ホットパスのベンチマーク（Streamlitページを開かずに実行）
+
+距離計算・最適化ルート（営業時間つきスケジュール・所要時間と料金の上限つきの選択を含む）・スポット間の移動時間行列のキャッシュ・
+避難者の一括割り当て・道路ネットワークの経路探索・到達圏・想定区域の判定・公共交通の時刻表の経路探索・
+スポットの全文検索・地図作成・データ読み込みを、日田市周辺の合成データ（10 / 100 / 1,000 / 10,000件）で計測し、結果をJSONに保存する。
+
+使い方:
+    python benchmark.py                              # 計測して bench_output.json に保存
+    python benchmark.py --sizes 10 100 --repeats 5   # 件数と繰り返し回数を指定
+    python benchmark.py --compare old.json           # 過去の結果と比較（p50の比率を表示）
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import hita_concierge as app
+
+# 日田市周辺の範囲（緯度・経度）
+HITA_LAT_RANGE = (33.25, 33.40)
+HITA_LNG_RANGE = (130.85, 131.00)
+HITA_ORIGIN = [33.3219, 130.9414]  # 日田市中心部
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+ROUTE_STOPS = [12, 50]  # 最適化ルートの訪問スポット数（データ件数が少ない場合は件数まで）
+MATRIX_MAX_SPOTS = 2000  # 全地点間の距離行列を計測する最大件数（メモリ使用量の制限）
+REFERENCE_TIME_BUDGET_SEC = 3.0  # 参照解（局所探索）の計算時間上限
+SCHEDULE_START_MINUTES = 9 * 60  # 営業時間を考慮したスケジュールの出発時刻（9:00）
+BUDGET_TIME_LIMIT_MIN = 6 * 60  # 上限つきルートの所要時間の上限（分）
+BUDGET_FEE_YEN = 2000  # 上限つきルートの料金の上限（円）
+BUDGET_CHECK_TIME_LIMIT_MIN = 300  # 上限つきルートの回帰チェックの所要時間の上限（分。9:00出発）
+BUDGET_CHECK_FEE_YEN = 1500  # 上限つきルートの回帰チェックの料金の上限（円）
+EVACUEE_COUNT = 100000  # 一括割り当ての避難者数
+EVACUATION_MAX_SHELTERS = 100  # 一括割り当てに使う避難所の最大件数
+HAZARD_POLYGONS = 500  # 想定区域の合成ポリゴン数
+HAZARD_POLYGON_VERTICES = 64  # 合成ポリゴン1つの頂点数
+TRANSIT_ROUTE_STOPS = 15  # 合成の時刻表の1系統の停留所数
+TRANSIT_TRIPS_PER_ROUTE = 30  # 合成の時刻表の1系統の便数（6時から30分おき）
+TRANSIT_SERVICE_DATE = date(2026, 4, 1)  # 合成の時刻表の運行日
+REGRESSION_THRESHOLD = 1.2  # 比較時にp50がこの倍率を超えたら悪化とみなす
+
+CATEGORIES = ['歴史', '観光地', '店', '温泉']
+CONGESTION = ['空いている', '普通', '混雑']
+
+
+# 合成データ
+def generate_tourism_spots(n: int, seed: int = 0) -> pd.DataFrame:
+    """観光シートと同じカラム構成の合成データを作成"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'No': np.arange(1, n + 1),
+        'スポット名': [f'スポット{i}' for i in range(1, n + 1)],
+        'カテゴリ': rng.choice(CATEGORIES, n),
+        '緯度': rng.uniform(*HITA_LAT_RANGE, n),
+        '経度': rng.uniform(*HITA_LNG_RANGE, n),
+        '所要時間（参考）': rng.choice([15, 30, 45, 60, 90, 120], n),
+        '説明': [f'合成データの説明文 {i}。住所：日田市' for i in range(1, n + 1)],
+        '営業時間': rng.choice(['終日', '9:00-17:00', '10:00-21:00'], n),
+        '料金': rng.choice(['無料', '300円', '500円', '1000円'], n),
+        '待ち時間（分）': rng.integers(0, 40, n),
+        '混雑状況': rng.choice(CONGESTION, n),
+        'おすすめ度': rng.integers(1, 6, n),
+    })
+
+
+def generate_road_grid(n: int) -> Tuple[Dict[int, Tuple[float, float]], List[Tuple[Dict[str, str], List[int]]]]:
+    """約n交点の格子状の道路（交点の座標と道路のリスト、OSMデータの読み込み結果と同じ形）"""
+    side = max(2, int(np.ceil(np.sqrt(n))))
+    lats = np.linspace(*HITA_LAT_RANGE, side)
+    lngs = np.linspace(*HITA_LNG_RANGE, side)
+    nodes = {r * side + c: (float(lats[r]), float(lngs[c])) for r in range(side) for c in range(side)}
+    ways = [({'highway': 'residential'}, [r * side + c for c in range(side)]) for r in range(side)]
+    ways += [({'highway': 'secondary'}, [r * side + c for r in range(side)]) for c in range(side)]
+    return nodes, ways
+
+
+def generate_hazard_layer(n: int, seed: int = 0) -> 'app.HazardLayer':
+    """日田市周辺に散らばるn個の星形ポリゴンの想定区域"""
+    rng = np.random.default_rng(seed + 5)
+    angles = np.linspace(0, 2 * np.pi, HAZARD_POLYGON_VERTICES, endpoint=False)
+    features = []
+    for _ in range(n):
+        lat, lng = rng.uniform(*HITA_LAT_RANGE), rng.uniform(*HITA_LNG_RANGE)
+        radius = rng.uniform(0.001, 0.004, HAZARD_POLYGON_VERTICES)
+        ring = np.column_stack((lng + radius * np.cos(angles), lat + radius * np.sin(angles))).tolist()
+        features.append({'type': 'Feature', 'properties': {'種別': rng.choice(['浸水', '土砂'])},
+                         'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+    return app.parse_hazard_geojson({'type': 'FeatureCollection', 'features': features})
+
+
+def generate_transit_feed(n: int, seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """n停留所・約n/10系統の合成のGTFS（read_gtfs_feed() の読み込み結果と同じ形）"""
+    rng = np.random.default_rng(seed + 6)
+    n_stops = max(TRANSIT_ROUTE_STOPS, n)
+    stops = pd.DataFrame({
+        'stop_id': [f's{i}' for i in range(n_stops)],
+        'stop_name': [f'停留所{i}' for i in range(n_stops)],
+        'stop_lat': rng.uniform(*HITA_LAT_RANGE, n_stops).astype(str),
+        'stop_lon': rng.uniform(*HITA_LNG_RANGE, n_stops).astype(str),
+    })
+    n_routes = max(2, n // 10)
+    routes = pd.DataFrame({'route_id': [f'r{r}' for r in range(n_routes)],
+                           'route_short_name': [f'{r}系統' for r in range(n_routes)]})
+    trips = pd.DataFrame({
+        'route_id': np.repeat(routes['route_id'], TRANSIT_TRIPS_PER_ROUTE),
+        'service_id': 'daily',
+        'trip_id': [f'r{r}-{t}' for r in range(n_routes) for t in range(TRANSIT_TRIPS_PER_ROUTE)],
+    })
+    rows = []
+    for r in range(n_routes):
+        sequence = rng.choice(n_stops, TRANSIT_ROUTE_STOPS, replace=False)
+        hops = np.cumsum(rng.integers(120, 300, TRANSIT_ROUTE_STOPS))
+        for t in range(TRANSIT_TRIPS_PER_ROUTE):
+            for k, (stop, seconds) in enumerate(zip(sequence, 6 * 3600 + t * 1800 + int(rng.integers(0, 600)) + hops)):
+                clock = f'{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+                rows.append((f'r{r}-{t}', clock, clock, f's{stop}', str(k + 1)))
+    stop_times = pd.DataFrame(rows, columns=['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'])
+    calendar = pd.DataFrame({'service_id': ['daily'], 'start_date': ['20260101'], 'end_date': ['20271231'],
+                             **{day: ['1'] for day in ('monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+                                                       'saturday', 'sunday')}})
+    return {'stops.txt': stops, 'routes.txt': routes, 'trips.txt': trips, 'stop_times.txt': stop_times,
+            'calendar.txt': calendar}
+
+
+def generate_disaster_spots(n: int, seed: int = 0) -> pd.DataFrame:
+    """防災シートと同じカラム構成の合成データを作成"""
+    rng = np.random.default_rng(seed + 1)
+    return pd.DataFrame({
+        'No': np.arange(1, n + 1),
+        'スポット名': [f'避難所{i}' for i in range(1, n + 1)],
+        'カテゴリ': rng.choice(['避難所', '危険個所'], n, p=[0.85, 0.15]),
+        '緯度': rng.uniform(*HITA_LAT_RANGE, n),
+        '経度': rng.uniform(*HITA_LNG_RANGE, n),
+        '所要時間（参考）': 5,
+        '説明': [f'合成データの避難所 {i}' for i in range(1, n + 1)],
+        '収容人数': rng.integers(50, 1000, n),
+        '状態': rng.choice(['開設中', '待機中'], n),
+    })
+
+
+# 計測
+def measure(func: Callable[[], object], repeats: int, warmup: int = 1) -> Dict[str, float]:
+    """実行時間のパーセンタイル（ms）と、1回あたりのメモリ確保量のピーク（KiB）を計測"""
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        func()
+        timings.append((time.perf_counter_ns() - start) / 1e6)
+
+    # メモリ確保量は計測の影響を避けるため別に1回だけ実行
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = np.array(timings)
+    return {
+        'repeats': repeats,
+        'min_ms': float(timings.min()),
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p90_ms': float(np.percentile(timings, 90)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'peak_alloc_kib': peak / 1024,
+    }
+
+
+def reference_route_length(dist_matrix: np.ndarray, seed_order: List[int]) -> Dict[str, object]:
+    """巡回距離の参照値（12箇所以下は厳密解、それ以上は長時間の局所探索）"""
+    n_stops = dist_matrix.shape[0] - 1
+    if n_stops <= app.HELD_KARP_MAX_STOPS:
+        order = app.solve_held_karp(dist_matrix, seed_order, time.perf_counter() + REFERENCE_TIME_BUDGET_SEC)
+        method = 'held_karp'
+    else:
+        order = app.solve_local_search(dist_matrix, seed_order, time.perf_counter() + REFERENCE_TIME_BUDGET_SEC)
+        method = 'local_search_long'
+    return {'method': method, 'distance_km': app.path_length(dist_matrix, order)}
+
+
+def budget_check_spots() -> pd.DataFrame:
+    """上限つきルートの回帰チェック用の12箇所（1・9・10番目は18:00-翌2:00だけ営業で、おすすめ度が高く料金も予算内）"""
+    rng = np.random.default_rng(25)
+    evening = {0, 8, 9}
+    return pd.DataFrame({
+        'スポット名': [f'スポット{i}' for i in range(1, 13)],
+        '緯度': HITA_ORIGIN[0] + rng.uniform(-0.03, 0.03, 12),
+        '経度': HITA_ORIGIN[1] + rng.uniform(-0.03, 0.03, 12),
+        '所要時間（参考）': [60, 45, 90, 60, 120, 45, 60, 90, 60, 60, 45, 120],
+        '営業時間': ['18:00-翌2:00' if i in evening else ['9:00-17:00', '終日', '10:00-16:00'][i % 3] for i in range(12)],
+        '料金': ['500円' if i in evening else ['無料', '300円', '500円', '1000円'][i % 4] for i in range(12)],
+        'おすすめ度': [4 if i in evening else [2, 3, 1, 3][i % 4] for i in range(12)],
+    })
+
+
+def reference_budget_route(travel: np.ndarray, durations: np.ndarray, fees: np.ndarray, scores: np.ndarray,
+                           opens: np.ndarray, closes: np.ndarray, start_minutes: float,
+                           time_limit: float, budget: float) -> Tuple[float, float]:
+    """上限つきルートの参照値（全順序の深さ優先探索。上限を超えた順序からは広げない）: (おすすめ度の合計, 所要時間)"""
+    best = [(0.0, 0.0)]
+
+    def visit(route, current, now, fee, score):
+        best[0] = min(best[0], (-score, now - start_minutes))
+        for j in range(1, len(durations) + 1):
+            if j in route or not fee + fees[j - 1] <= budget:
+                continue
+            departure = float(app.window_departure(
+                now + travel[current, j], durations[j - 1], opens[j - 1], closes[j - 1]
+            ))
+            if departure - start_minutes <= time_limit:
+                visit(route + [j], j, departure, fee + fees[j - 1], score + scores[j - 1])
+
+    visit([], 0, float(start_minutes), 0.0, 0.0)
+    return -float(best[0][0]), best[0][1]
+
+
+def check_budget_schedule() -> Dict[str, object]:
+    """
+    営業時間つきの上限ルートの回帰チェック（参照値と同じおすすめ度の合計を上限内で回れるか）
+    夜だけ営業するスポットを選んでから上限を超えた分を削ると、おすすめ度の合計が参照値を大きく下回る
+    """
+    store = app.SpotStore.from_dataframe(budget_check_spots())
+    selected = list(range(len(store)))
+    schedule = app.schedule_tourism_route(
+        HITA_ORIGIN, store, selected, SCHEDULE_START_MINUTES,
+        time_limit=BUDGET_CHECK_TIME_LIMIT_MIN, budget_yen=BUDGET_CHECK_FEE_YEN
+    )
+    _, travel = app.route_matrices(HITA_ORIGIN, store, selected, app.TOURISM_SPEED_KMH)
+    reference_score, reference_time = reference_budget_route(
+        travel, (store.stay_minutes + store.wait_minutes).astype(np.float64), store.fees_yen, store.scores,
+        store.open_minutes, store.close_minutes, SCHEDULE_START_MINUTES,
+        BUDGET_CHECK_TIME_LIMIT_MIN, BUDGET_CHECK_FEE_YEN
+    )
+    score = float(store.scores[schedule.route].sum())
+    return {
+        'score': score,
+        'total_time_min': schedule.total_time,
+        'reference_score': reference_score,
+        'reference_time_min': reference_time,
+        'ok': bool(score >= reference_score - 1e-9 and schedule.total_time <= BUDGET_CHECK_TIME_LIMIT_MIN
+                   and float(store.fees_yen[schedule.route].sum()) <= BUDGET_CHECK_FEE_YEN),
+    }
+
+
+def bench_distance(spots: pd.DataFrame, repeats: int) -> Dict[str, object]:
+    """1地点→全地点・全地点間の距離計算"""
+    lats, lngs = spots['緯度'].to_numpy(), spots['経度'].to_numpy()
+    results = {
+        'calculate_distance_loop': measure(
+            lambda: [app.calculate_distance(HITA_ORIGIN[0], HITA_ORIGIN[1], lat, lng) for lat, lng in zip(lats, lngs)],
+            repeats
+        ),
+        'distances_from_point': measure(
+            lambda: app.distances_from_point(HITA_ORIGIN[0], HITA_ORIGIN[1], lats, lngs),
+            repeats
+        ),
+    }
+    if len(spots) <= MATRIX_MAX_SPOTS:
+        results['distance_matrix'] = measure(lambda: app.distance_matrix(lats, lngs), repeats)
+    return results
+
+
+def bench_routes(tourism: pd.DataFrame, disaster: pd.DataFrame, repeats: int, seed: int) -> Dict[str, object]:
+    """最適化ルートの計算時間と巡回距離の品質"""
+    rng = np.random.default_rng(seed)
+    tourism_store = app.SpotStore.from_dataframe(tourism)
+    disaster_store = app.SpotStore.from_dataframe(disaster)
+    results = {}
+
+    for n_stops in sorted({min(k, len(tourism)) for k in ROUTE_STOPS}):
+        selected = [int(i) for i in rng.choice(len(tourism), n_stops, replace=False)]
+        case = {}
+
+        for name, optimize, store in [
+            ('optimize_route_tourism', app.optimize_route_tourism, tourism_store),
+            ('optimize_route_disaster', app.optimize_route_disaster, disaster_store),
+        ]:
+            dist_matrix = app.route_distance_matrix(HITA_ORIGIN, store, selected)
+            seed_order = app.nearest_neighbor_order(dist_matrix)
+            reference = reference_route_length(dist_matrix, seed_order)
+
+            solvers = {}
+            for solver in ['greedy', 'auto']:
+                timing = measure(lambda: optimize(HITA_ORIGIN, store, selected, solver=solver), repeats)
+                _, total_distance, total_time = optimize(HITA_ORIGIN, store, selected, solver=solver)
+                timing.update({
+                    'total_distance_km': total_distance,
+                    'total_time_min': total_time,
+                    'gap_vs_reference_pct': 100 * (total_distance / reference['distance_km'] - 1)
+                    if reference['distance_km'] > 0 else 0.0,
+                })
+                solvers[solver] = timing
+            case[name] = {'reference': reference, 'solvers': solvers}
+
+        # 営業時間を考慮したスケジュール（訪問できた数と所要時間も記録）
+        timing = measure(
+            lambda: app.schedule_tourism_route(HITA_ORIGIN, tourism_store, selected, SCHEDULE_START_MINUTES), repeats
+        )
+        schedule = app.schedule_tourism_route(HITA_ORIGIN, tourism_store, selected, SCHEDULE_START_MINUTES)
+        timing.update({
+            'visited': len(schedule.route),
+            'infeasible': len(schedule.infeasible),
+            'total_time_min': schedule.total_time,
+        })
+        case['schedule_tourism_route'] = timing
+
+        # 所要時間・料金の上限つき（回るスポットの選択。厳密解と挿入法の得点も記録）
+        solvers = {}
+        for solver in ['exact', 'insertion'] if n_stops <= app.HELD_KARP_MAX_STOPS else ['insertion']:
+            timing = measure(lambda: app.optimize_route_budget(
+                HITA_ORIGIN, tourism_store, selected, BUDGET_TIME_LIMIT_MIN, BUDGET_FEE_YEN, solver=solver
+            ), repeats)
+            route, _, total_time, dropped = app.optimize_route_budget(
+                HITA_ORIGIN, tourism_store, selected, BUDGET_TIME_LIMIT_MIN, BUDGET_FEE_YEN, solver=solver
+            )
+            timing.update({
+                'visited': len(route),
+                'dropped': len(dropped),
+                'score': float(tourism_store.scores[route].sum()),
+                'total_time_min': total_time,
+            })
+            solvers[solver] = timing
+        case['optimize_route_budget'] = solvers
+
+        # 全セッション共通の結果キャッシュに載っている場合（並び順の違う同じ選択も同じキー）
+        route_cache = app.TTLCache(app.ROUTE_CACHE_SIZE, app.ROUTE_CACHE_TTL_SEC, max_bytes=app.ROUTE_CACHE_MAX_BYTES)
+
+        def cached_schedule():
+            shuffled = rng.permutation(selected).tolist()
+            key = app.route_cache_key('tourism_schedule', 'bench', HITA_ORIGIN, shuffled,
+                                      start_minutes=SCHEDULE_START_MINUTES)
+            return route_cache.get_or_compute(key, lambda: app.schedule_tourism_route(
+                HITA_ORIGIN, tourism_store, sorted(selected), SCHEDULE_START_MINUTES
+            ))
+
+        timing = measure(cached_schedule, repeats)
+        timing.update({'hit_rate': route_cache.stats().hit_rate, 'cached_bytes': route_cache.stats().size_bytes})
+        case['schedule_tourism_route_cached'] = timing
+
+        results[f'{n_stops}_stops'] = case
+    return results
+
+
+def bench_travel_matrix(tourism: pd.DataFrame, repeats: int, seed: int) -> Dict[str, object]:
+    """スポット間の移動時間行列のキャッシュ（作成・読み込み・1%のスポット移動時の差分計算）と、それを使った最適化ルート"""
+    spots = tourism.iloc[:MATRIX_MAX_SPOTS]
+    moved = spots.copy()
+    rng = np.random.default_rng(seed + 4)
+    picks = rng.choice(len(moved), max(1, len(moved) // 100), replace=False)
+    moved.iloc[picks, moved.columns.get_loc('緯度')] += 0.001
+    store = app.SpotStore.from_dataframe(spots)
+    moved_store = app.SpotStore.from_dataframe(moved)
+    stops = min(ROUTE_STOPS[-1], len(spots))
+    selected = sorted(rng.choice(len(spots), stops, replace=False).tolist())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        def build_cold():
+            for name in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, name))
+            return app.load_travel_matrix(store, 'base', 'driving', cache_dir=tmp_dir)
+
+        # 元のデータと一部を移動したデータを交互に読み込み、毎回差分だけを計算させる
+        versions = [(moved_store, 'moved'), (store, 'base')]
+
+        def update_moved():
+            versions.reverse()
+            return app.load_travel_matrix(versions[0][0], versions[0][1], 'driving', cache_dir=tmp_dir)
+
+        cold = measure(build_cold, max(1, min(repeats, 3)))
+        incremental = measure(update_moved, repeats)
+        matrix = app.load_travel_matrix(store, 'base', 'driving', cache_dir=tmp_dir)
+        return {
+            'spots': len(spots),
+            'load_travel_matrix_cold': cold,
+            'load_travel_matrix_warm': measure(
+                lambda: app.load_travel_matrix(store, 'base', 'driving', cache_dir=tmp_dir), repeats
+            ),
+            'load_travel_matrix_moved_1pct': incremental,
+            f'optimize_route_tourism_{stops}_direct': measure(
+                lambda: app.optimize_route_tourism(HITA_ORIGIN, store, selected), repeats
+            ),
+            f'optimize_route_tourism_{stops}_cached_matrix': measure(
+                lambda: app.optimize_route_tourism(HITA_ORIGIN, store, selected, travel_matrix=matrix), repeats
+            ),
+        }
+
+
+def bench_evacuation(disaster: pd.DataFrame, repeats: int, seed: int) -> Dict[str, object]:
+    """避難者の一括割り当て（収容人数つき）"""
+    shelters = disaster[app.shelter_mask(disaster)].head(EVACUATION_MAX_SHELTERS)
+    rng = np.random.default_rng(seed + 2)
+    origin_lats = rng.uniform(*HITA_LAT_RANGE, EVACUEE_COUNT)
+    origin_lngs = rng.uniform(*HITA_LNG_RANGE, EVACUEE_COUNT)
+    capacities = app.shelter_capacities(shelters)
+
+    def assign():
+        return app.assign_evacuees(
+            origin_lats, origin_lngs, shelters['緯度'].to_numpy(), shelters['経度'].to_numpy(), capacities
+        )
+
+    result = assign()
+    case = measure(assign, max(1, min(repeats, 3)), warmup=0)
+    case.update({
+        'evacuees': EVACUEE_COUNT,
+        'shelters': len(shelters),
+        'unassigned': result.unassigned,
+        'rounds': result.rounds,
+        'mean_walk_min': round(float(np.nanmean(result.walk_minutes)), 2) if result.unassigned < EVACUEE_COUNT else None,
+    })
+    return {'assign_evacuees': case}
+
+
+def bench_roads(n: int, repeats: int, seed: int) -> Dict[str, object]:
+    """道路グラフの作成と、道路に沿った経路・移動時間行列・到達圏（徒歩）"""
+    nodes, ways = generate_road_grid(n)
+    graph = app.build_road_graph(nodes, ways, 'walking')
+    rng = np.random.default_rng(seed + 3)
+    n_points = ROUTE_STOPS[0] + 1
+    lats = rng.uniform(*HITA_LAT_RANGE, n_points)
+    lngs = rng.uniform(*HITA_LNG_RANGE, n_points)
+    graph.nearest_node(lats[0], lngs[0])  # 空間インデックスを作成しておく
+
+    hazards = generate_hazard_layer(HAZARD_POLYGONS, seed)
+    safe_graph = app.hazard_road_graph(graph, hazards, app.HAZARD_AVOIDANCE['区域を通らない'])
+    point_lats = rng.uniform(*HITA_LAT_RANGE, n)
+    point_lngs = rng.uniform(*HITA_LNG_RANGE, n)
+
+    return {
+        'nodes': len(graph),
+        'build_road_graph': measure(lambda: app.build_road_graph(nodes, ways, 'walking'), repeats),
+        'road_route': measure(lambda: app.road_route(graph, (lats[0], lngs[0]), (lats[1], lngs[1])), repeats),
+        f'road_travel_matrices_{n_points}': measure(lambda: app.road_travel_matrices(graph, lats, lngs), repeats),
+        'isochrone': measure(lambda: app.compute_isochrone(HITA_ORIGIN, 'walking', graph).geojson, repeats),
+        'isochrone_straight': measure(lambda: app.compute_isochrone(HITA_ORIGIN, 'walking').geojson, repeats),
+        'hazard_locate': measure(lambda: hazards.locate(point_lats, point_lngs), repeats),
+        'hazard_road_graph': measure(
+            lambda: app.hazard_road_graph(graph, hazards, app.HAZARD_AVOIDANCE['区域を通らない']), repeats
+        ),
+        'hazard_road_route': measure(
+            lambda: app.road_route(safe_graph, (lats[0], lngs[0]), (lats[1], lngs[1])), repeats
+        ),
+    }
+
+
+def bench_transit(tourism: pd.DataFrame, n: int, repeats: int, seed: int) -> Dict[str, object]:
+    """公共交通の時刻表の作成と、最早到着の経路・移動時間行列・時刻表で計算する観光ルートのスケジュール"""
+    feed = generate_transit_feed(n, seed)
+    timetable = app.build_transit_timetable([feed], TRANSIT_SERVICE_DATE)
+    rng = np.random.default_rng(seed + 7)
+    selected = sorted(rng.choice(len(tourism), min(ROUTE_STOPS[0], len(tourism)), replace=False).tolist())
+    store = app.SpotStore.from_dataframe(tourism)
+    destination = (float(store.lats[selected[0]]), float(store.lngs[selected[0]]))
+    lats, lngs = store.lats[selected], store.lngs[selected]
+    timetable.earliest_arrival(HITA_ORIGIN, destination, SCHEDULE_START_MINUTES)  # 空間インデックスを作成しておく
+
+    return {
+        'stops': len(timetable),
+        'trips': timetable.trip_count,
+        'build_transit_timetable': measure(
+            lambda: app.build_transit_timetable([feed], TRANSIT_SERVICE_DATE), max(1, min(repeats, 3))
+        ),
+        'earliest_arrival': measure(
+            lambda: timetable.earliest_arrival(HITA_ORIGIN, destination, SCHEDULE_START_MINUTES), repeats
+        ),
+        f'travel_minutes_{len(selected)}x{len(selected)}': measure(
+            lambda: timetable.travel_minutes(lats, lngs, lats, lngs, SCHEDULE_START_MINUTES), repeats
+        ),
+        'schedule_tourism_route': measure(lambda: app.schedule_tourism_route(
+            HITA_ORIGIN, store, selected, start_minutes=SCHEDULE_START_MINUTES, transit=timetable
+        ), repeats),
+    }
+
+
+def bench_search(spots: pd.DataFrame, repeats: int) -> Dict[str, object]:
+    """スポットの全文検索（索引の作成、一致の少ない検索語・多い検索語・複数語の検索、AIプラン用のスポットの選択）"""
+    index = app.SpotSearchIndex(spots)
+    rare = spots['スポット名'].iloc[len(spots) // 2]
+    return {
+        'build_index': measure(lambda: app.SpotSearchIndex(spots), max(1, min(repeats, 3))),
+        'search_rare': measure(lambda: index.search(rare), repeats),
+        'search_common': measure(lambda: index.search('温泉'), repeats),
+        'search_multi_term': measure(lambda: index.search('歴史 説明文'), repeats),
+        'plan_spots_context': measure(lambda: app.build_spots_context(spots, app.select_plan_spots(
+            spots, index, ['歴史', '温泉'], '秋', '1000円以内', '3時間'
+        )), repeats),
+    }
+
+
+def bench_map(spots: pd.DataFrame, repeats: int) -> Dict[str, object]:
+    """地図作成（マーカーデータのキャッシュなし・ありの両方）とHTML描画"""
+    marker_data = app.build_marker_data(spots, HITA_ORIGIN[0], HITA_ORIGIN[1])
+
+    def build_and_render():
+        m, dynamic_layer = app.create_enhanced_map(
+            spots, HITA_ORIGIN, selected_spot=spots['スポット名'].iloc[0], show_route=True, marker_data=marker_data
+        )
+        return m.get_root().render()
+
+    return {
+        'create_enhanced_map_cold': measure(lambda: app.create_enhanced_map(spots, HITA_ORIGIN), repeats),
+        'create_enhanced_map_warm': measure(
+            lambda: app.create_enhanced_map(spots, HITA_ORIGIN, marker_data=marker_data), repeats
+        ),
+        'create_and_render_html': measure(build_and_render, repeats),
+    }
+
+
+def bench_load(tourism: pd.DataFrame, disaster: pd.DataFrame, repeats: int) -> Dict[str, object]:
+    """spots.xlsxの読み込み（列指向キャッシュなし・あり）"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        xlsx_path = os.path.join(tmp_dir, 'spots.xlsx')
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        with pd.ExcelWriter(xlsx_path) as writer:
+            tourism.to_excel(writer, sheet_name='観光', index=False)
+            disaster.to_excel(writer, sheet_name='防災', index=False)
+
+        def load_cold():
+            for name in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+                os.remove(os.path.join(cache_dir, name))
+            return app.read_spots_workbook(xlsx_path, cache_dir)
+
+        return {
+            'read_spots_workbook_cold': measure(load_cold, max(1, min(repeats, 3))),
+            'read_spots_workbook_warm': measure(lambda: app.read_spots_workbook(xlsx_path, cache_dir), repeats),
+        }
+
+
+def run_benchmarks(sizes: List[int], repeats: int, seed: int = 0) -> Dict[str, object]:
+    """全ベンチマークを実行"""
+    results = {}
+    for n in sizes:
+        print(f"▶ {n}件", file=sys.stderr)
+        tourism = generate_tourism_spots(n, seed)
+        disaster = generate_disaster_spots(n, seed)
+        results[str(n)] = {
+            'distance': bench_distance(tourism, repeats),
+            'routes': bench_routes(tourism, disaster, repeats, seed),
+            'travel_matrix': bench_travel_matrix(tourism, repeats, seed),
+            'evacuation': bench_evacuation(disaster, repeats, seed),
+            'roads': bench_roads(n, repeats, seed),
+            'transit': bench_transit(tourism, n, repeats, seed),
+            'search': bench_search(tourism, repeats),
+            'map': bench_map(tourism, repeats),
+            'load': bench_load(tourism, disaster, repeats),
+        }
+    return results
+
+
+def environment_info() -> Dict[str, str]:
+    """計測環境の情報"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = 'unknown'
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+# 比較
+def flatten_timings(results: Dict[str, object], prefix: str = '') -> Dict[str, float]:
+    """結果からp50を持つ項目を「パス: p50」の形で取り出す"""
+    flat = {}
+    for key, value in results.items():
+        path = f'{prefix}/{key}' if prefix else key
+        if isinstance(value, dict):
+            if 'p50_ms' in value:
+                flat[path] = value['p50_ms']
+            else:
+                flat.update(flatten_timings(value, path))
+    return flat
+
+
+def compare_results(current: Dict[str, object], previous: Dict[str, object]) -> List[str]:
+    """過去の結果とp50を比較し、悪化した項目を返す"""
+    now = flatten_timings(current['results'])
+    before = flatten_timings(previous['results'])
+    regressions = []
+
+    for path in sorted(now.keys() & before.keys()):
+        ratio = now[path] / before[path] if before[path] > 0 else float('inf')
+        mark = '⚠️' if ratio > REGRESSION_THRESHOLD else '  '
+        print(f"{mark} {path}: {before[path]:.3f}ms → {now[path]:.3f}ms (x{ratio:.2f})")
+        if ratio > REGRESSION_THRESHOLD:
+            regressions.append(path)
+    return regressions
+
+
+def print_summary(results: Dict[str, object]):
+    """主な計測値を表示"""
+    for path, p50 in flatten_timings(results).items():
+        print(f"{path}: p50 {p50:.3f}ms")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='日田市総合案内コンシェルジュのホットパス・ベンチマーク')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='合成スポットの件数')
+    parser.add_argument('--repeats', type=int, default=10, help='各項目の繰り返し回数')
+    parser.add_argument('--seed', type=int, default=0, help='合成データの乱数シード')
+    parser.add_argument('--output', default='bench_output.json', help='結果を保存するJSONファイル')
+    parser.add_argument('--compare', help='比較対象の過去の結果（JSON）')
+    args = parser.parse_args(argv)
+
+    report = {
+        'environment': environment_info(),
+        'settings': {'sizes': args.sizes, 'repeats': args.repeats, 'seed': args.seed},
+        'results': run_benchmarks(args.sizes, args.repeats, args.seed),
+        'checks': {'budget_schedule': check_budget_schedule()},
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_summary(report['results'])
+    print(f"💾 {args.output} に保存しました")
+
+    failed = [name for name, check in report['checks'].items() if not check['ok']]
+    for name in failed:
+        print(f"⚠️ {name}: 回帰チェックに失敗しました {report['checks'][name]}")
+    if failed:
+        return 1
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        regressions = compare_results(report, previous)
+        if regressions:
+            print(f"⚠️ {len(regressions)}項目でp50が{REGRESSION_THRESHOLD}倍を超えました")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
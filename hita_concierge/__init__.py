@@ -0,0 +1,97 @@
+"""
+日田市総合案内コンシェルジュのコア機能（Streamlitに依存しない）
+
+データ読み込み・距離計算・最適化ルート・リンク生成などをまとめたパッケージ。
+foliumとgoogle-generativeai（PBF形式の道路データを使う場合はosmium）は実行時にのみ読み込むため、
+ルートの一括算出（batch_routes.py）やベンチマークからは軽量に読み込める。
+"""
+from .ai import (
+    AI_CONTEXT_MAX_SPOTS, AI_CONTEXT_TOKEN_BUDGET, AI_PLAN_CACHE_SIZE, AI_PLAN_CACHE_TTL_SEC, GEMINI_MODEL_NAME,
+    INTEREST_KEYWORDS, SEASON_KEYWORDS, SpotsContext, ai_plan_cache_key, build_plan_prompt, build_spots_context,
+    current_season, estimate_tokens, genai_available, generate_plan, select_plan_spots, stream_plan_text,
+)
+from .batch import (
+    BATCH_CHUNK_SIZE, BATCH_RESULT_COLUMNS, BATCH_SPOT_SEPARATOR, RouteJob, RouteResult, load_batch_matrices,
+    parse_route_jobs, route_results_frame, run_route_jobs,
+)
+from .cache import CacheStats, TTLCache, approx_size
+from .data import (
+    DAY_TRIP_MINUTES, MINUTES_PER_DAY, SPOTS_CACHE_DIR, SPOTS_FILE, SpotsDataError, dataset_version,
+    file_sha1, parse_duration_minutes, parse_duration_text, parse_fee_text, parse_fee_yen, parse_opening_hours,
+    parse_opening_text, prepare_spots_frames, read_spots_workbook, sample_spots_frames, spots_file_mtime,
+    window_departure,
+)
+from .evacuation import (
+    DEFAULT_SHELTER_CAPACITY, WALK_SPEED_KMH, ShelterAssignment, assign_evacuees,
+    evacuee_assignment_table, evacuee_origins, shelter_capacities, shelter_load_table,
+    simulate_evacuees, solve_capacitated_assignment, walking_time_matrix,
+)
+from .geo import (
+    EARTH_RADIUS_KM, calculate_distance, cross_distance_matrix, distance_matrix,
+    distances_from_location, distances_from_point, paired_distances, route_distance_matrix,
+)
+from .hazards import (
+    HAZARD_AVOIDANCE, HAZARD_FILES, HazardDataError, HazardLayer, find_hazard_file, hazard_leg_factors,
+    hazard_road_graph, load_hazard_layer, parse_hazard_geojson,
+)
+from .isochrones import (
+    ISOCHRONE_GRID_SIZE, ISOCHRONE_MINUTES, ISOCHRONE_OFFROAD_KM, ISOCHRONE_ORIGIN_CELL_KM, Isochrone,
+    compute_isochrone, isochrone_origin,
+)
+from .links import create_google_maps_link, create_google_maps_multi_link
+from .live_status import (
+    LIVE_SOURCES_FILE, LIVE_STATUS_FIELDS, LiveSource, LiveStatus, LiveStatusError, LiveStatusService,
+    apply_live_status, find_live_sources_file, live_status_version, load_live_sources, parse_live_payload,
+    static_dataset_version,
+)
+from .maps import (
+    MARKER_CLUSTER_THRESHOLD, build_hazard_layer, build_isochrone_layer, build_marker_data, build_popup_html,
+    create_enhanced_map,
+)
+from .orienteering import (
+    ORIENTEERING_SOLVERS, optimize_route_budget, route_minutes, select_route_within_limits,
+    solve_orienteering_exact, solve_orienteering_insertion,
+)
+from .roads import (
+    PROFILE_SPEED_KMH, ROAD_NETWORK_FILES, ROAD_PROFILES, SNAP_MAX_KM, RoadDataError, RoadGraph,
+    RoadNetwork, RoadRoute, build_road_graph, find_road_network_file, load_road_network,
+    road_route, road_travel_block, road_travel_matrices, route_travel_matrices,
+)
+from .routing import (
+    HELD_KARP_BATCH_CELLS, HELD_KARP_MAX_STOPS, ROUTE_CACHE_MAX_BYTES, ROUTE_CACHE_ORIGIN_DECIMALS, ROUTE_CACHE_SIZE,
+    ROUTE_CACHE_TTL_SEC, ROUTE_SOLVERS, ROUTE_TIME_BUDGET_SEC, greedy_rank_order,
+    nearest_neighbor_order, normalize_route_query, optimize_route_disaster, optimize_route_tourism,
+    path_length, route_cache_key, solve_held_karp, solve_held_karp_batch, solve_local_search, solve_route_order,
+)
+from .schedule import (
+    TOURISM_SPEED_KMH, ScheduledStop, TourSchedule, format_clock, schedule_tourism_route,
+    solve_time_window_exact, solve_time_window_insertion,
+)
+from .search import SEARCH_FIELD_WEIGHTS, SEARCH_PREFIX_BONUS, SpotSearchIndex, normalize_search_text
+from .spatial import (
+    FACILITY_SEARCH_RADIUS_KM, SPATIAL_GRID_CELL_KM, SpatialGridIndex, shelter_mask,
+)
+from .spot_list import (
+    SPOT_LIST_PAGE_SIZE, SPOT_LIST_SORTS, SPOT_LIST_TABLE_COLUMNS, SPOT_LIST_TABLE_PAGE_SIZE,
+    SPOT_LIST_TABLE_THRESHOLD, SpotListIndex, paginate,
+)
+from .store import SpotStore, as_spot_store, route_coordinates
+from .tiles import (
+    TILE_ATTRIBUTION, TILE_BOUNDS, TILE_FETCH_WORKERS, TILE_MAX_ZOOM, TILE_MIN_ZOOM, TILE_SERVER_PORT, TILE_SOURCE_URL,
+    TILES_FILE,
+    MBTilesStore, TileServer, TileStoreError, download_tile, find_tiles_file, prefetch_tiles, start_tile_server,
+    tile_count, tile_range,
+)
+from .tracing import (
+    RERUN_SPAN, TRACE_ENV_VAR, TRACE_PROMETHEUS_FILE_ENV_VAR, SpanRecord, TraceRecorder, TraceRegistry,
+    begin_trace, finish_trace, span, trace_env_enabled, traced,
+)
+from .transit import (
+    TRANSIT_ACCESS_KM, TRANSIT_DEFAULT_START_MINUTES, TRANSIT_FEED_DIR, TRANSIT_MAX_TRANSFERS,
+    TRANSIT_MIN_TRANSFER_SEC, TRANSIT_TRANSFER_KM, TransitDataError, TransitJourney, TransitLeg, TransitTimetable,
+    build_transit_timetable, find_transit_feeds, load_transit_timetable, read_gtfs_feed,
+)
+from .travel_matrix import (
+    TRAVEL_MATRIX_DIR, TRAVEL_MODES, TRAVEL_ROAD_PROFILES, TRAVEL_SPEED_KMH, TravelMatrix,
+    load_travel_matrix, route_matrices,
+)
@@ -0,0 +1,187 @@
+"""AIプラン提案（Gemini）関連（google-generativeaiはプラン生成時に読み込む）"""
+import hashlib
+import importlib.util
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .data import parse_duration_text, parse_fee_text, parse_fee_yen
+from .search import SpotSearchIndex
+from .tracing import traced
+
+GEMINI_MODEL_NAME = 'gemini-2.0-flash-exp'
+AI_PLAN_CACHE_TTL_SEC = 60 * 60  # 生成したプランの保持時間（秒）
+AI_PLAN_CACHE_SIZE = 128  # 保持するプランの最大数
+AI_CONTEXT_MAX_SPOTS = 30  # プロンプトに入れるスポットの最大数
+AI_CONTEXT_TOKEN_BUDGET = 2000  # スポットリストのトークン数の上限（見積もり）
+AI_CONTEXT_DESCRIPTION_CHARS = 60  # スポットの説明をプロンプトに入れる最大文字数
+AI_CONTEXT_SEASON_WEIGHT = 0.5  # 季節のキーワードの一致を興味の一致に対してどれだけ重視するか
+
+# 興味のカテゴリーと季節ごとの検索キーワード（スポット名・カテゴリ・説明の全文検索に使う）
+INTEREST_KEYWORDS = {
+    '歴史': ['歴史', '史跡', '寺', '神社', '天領', '町並み', '資料館', '城'],
+    '自然': ['自然', '公園', '山', '川', '滝', '渓谷', 'ダム', '景観', '展望'],
+    'グルメ': ['グルメ', '店', '料理', '食', 'カフェ', '酒', '鮎', '焼きそば'],
+    '体験': ['体験', '工房', '見学', '祭', '焼'],
+    '温泉': ['温泉', '湯'],
+    '文化': ['文化', '伝統', '工芸', '美術', '博物館', '資料館', '祭'],
+}
+SEASON_KEYWORDS = {
+    '春': ['桜', '花', '春', 'ひな'],
+    '夏': ['川', '鵜飼', '花火', '祭', '夏'],
+    '秋': ['紅葉', 'もみじ', '祭', '秋'],
+    '冬': ['温泉', '湯', '冬'],
+}
+
+SYSTEM_PROMPT = "あなたは日田市の観光コンシェルジュです。現在の天気・季節を考慮しながら、以下の観光スポットリストとユーザーの要望に基づき、魅力的な観光プランを提案してください。"
+
+
+def genai_available() -> bool:
+    """google-generativeai がインストールされているか（読み込みはしない）"""
+    try:
+        return importlib.util.find_spec('google.generativeai') is not None
+    except ImportError:
+        return False
+
+
+def current_season(month: int) -> Tuple[str, str]:
+    """月から (季節, 季節の説明) を判定"""
+    if month in [3, 4, 5]:
+        return "春", "桜の季節で、温暖な気候"
+    elif month in [6, 7, 8]:
+        return "夏", "暑い季節で、川開き観光祭や祇園祭などのイベントがある時期"
+    elif month in [9, 10, 11]:
+        return "秋", "紅葉が美しく、天領まつりやもみじ祭りがある時期"
+    else:
+        return "冬", "寒い季節で、温泉が特に人気"
+
+
+@dataclass(frozen=True)
+class SpotsContext:
+    """プロンプト用のスポットリスト"""
+    text: str
+    spot_count: int  # リストに入れたスポット数
+    tokens: int  # トークン数の見積もり
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の見積もり（英数字は4文字で1、日本語などは1文字で1として多めに見積もる）"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return -(-ascii_chars // 4) + len(text) - ascii_chars
+
+
+def _keyword_scores(search_index: SpotSearchIndex, keywords: List[str]) -> np.ndarray:
+    """キーワードのいずれかに一致したスポットの点数（キーワードごとの検索の点数の最大値）"""
+    scores = np.zeros(len(search_index))
+    for keyword in keywords:
+        positions, keyword_scores = search_index.search(keyword)
+        scores[positions] = np.maximum(scores[positions], keyword_scores)
+    return scores
+
+
+@traced()
+def select_plan_spots(tourism_df: pd.DataFrame, search_index: SpotSearchIndex, interests: List[str],
+                      season: str, budget: str = '', duration: str = '',
+                      max_spots: int = AI_CONTEXT_MAX_SPOTS) -> np.ndarray:
+    """
+    プランの条件に合うスポットを関連度順に選ぶ（スポット数によらずプロンプトの大きさを一定に保つ）
+    興味のカテゴリー・季節のキーワードの全文検索の点数で順位をつけ、料金が予算を超えるスポットと
+    所要時間が滞在時間を超えるスポットは除く（読み取れない表記は条件なしとみなす）。同点はデータの順。
+    Returns: スポットの位置（最大 max_spots 件）
+    """
+    scores = np.zeros(len(tourism_df))
+    for interest in interests:
+        scores += _keyword_scores(search_index, INTEREST_KEYWORDS.get(interest, [interest]))
+    scores += AI_CONTEXT_SEASON_WEIGHT * _keyword_scores(search_index, SEASON_KEYWORDS.get(season, []))
+
+    allowed = np.ones(len(tourism_df), dtype=bool)
+    budget_yen = parse_fee_text(budget)
+    if not np.isnan(budget_yen) and '料金' in tourism_df.columns:
+        allowed &= ~(parse_fee_yen(tourism_df['料金']) > budget_yen)
+    stay_limit = parse_duration_text(duration)
+    if not np.isnan(stay_limit) and '所要時間（参考）' in tourism_df.columns:
+        stay = pd.to_numeric(tourism_df['所要時間（参考）'], errors='coerce').to_numpy(dtype=np.float64)
+        allowed &= ~(stay > stay_limit)
+
+    positions = np.flatnonzero(allowed)
+    return positions[np.argsort(-scores[positions], kind='stable')][:max_spots]
+
+
+def build_spots_context(tourism_df: pd.DataFrame, positions: Optional[np.ndarray] = None,
+                        token_budget: int = AI_CONTEXT_TOKEN_BUDGET) -> SpotsContext:
+    """
+    プロンプト用のスポットリストを作成（1スポット1行の区切り形式。説明は先頭だけ）
+    positions の順に、トークン数の見積もりが token_budget に収まるところまで入れる（Noneの場合は全件）
+    """
+    df = tourism_df if positions is None else tourism_df.iloc[positions]
+    header = "（形式: スポット名|カテゴリ|料金|所要時間（分）|説明）"
+    descriptions = df['説明'].fillna('').astype(str).str.replace(r'\s+', ' ', regex=True)
+    lines = (
+        df['スポット名'].astype(str) + "|" + df['カテゴリ'].astype(str)
+        + "|" + df['料金'].astype(str) + "|" + df['所要時間（参考）'].astype(str)
+        + "|" + descriptions.str.slice(0, AI_CONTEXT_DESCRIPTION_CHARS)
+    ).tolist()
+
+    # 行ごとの見積もり（改行の分を含む）の累計で、上限に収まる行数を決める
+    used = np.cumsum([estimate_tokens(line) + 1 for line in lines]) + estimate_tokens(header)
+    count = int(np.searchsorted(used, token_budget, side='right'))
+    return SpotsContext("\n".join([header] + lines[:count]), count, int(used[count - 1]) if count else estimate_tokens(header))
+
+
+def build_plan_prompt(spots_text: str, current_date: datetime, season: str, season_desc: str,
+                      budget: str, duration: str, interests: List[str], companion: str, request: str) -> str:
+    """プラン提案のプロンプトを作成"""
+    user_prompt = f"""
+現在の日付: {current_date.strftime('%Y年%m月%d日')}
+現在の季節: {season}（{season_desc}）
+
+観光スポットリスト:
+{spots_text}
+
+ユーザーの要望:
+- 予算: {budget}
+- 滞在時間: {duration}
+- 興味: {', '.join(interests)}
+- 同行者: {companion}
+{f'- その他の要望: {request}' if request else ''}
+
+上記の条件と現在の季節・天気を考慮して、日田市の観光プランを訪問順序を含めて具体的に提案してください。
+各スポットの魅力や、なぜそのスポットを選んだのか、季節に合わせたおすすめポイントも簡潔に説明してください。
+                        """
+    return f"{SYSTEM_PROMPT}\n\n{user_prompt}"
+
+
+def ai_plan_cache_key(version: str, budget: str, duration: str, interests: List[str],
+                      companion: str, season: str, request: str) -> str:
+    """プラン条件からキャッシュキーを作成"""
+    payload = json.dumps(
+        [GEMINI_MODEL_NAME, version, budget.strip(), duration.strip(), sorted(interests),
+         companion, season, request.strip()],
+        ensure_ascii=False
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+@traced()
+def generate_plan(api_key: str, prompt: str, stream: bool = False):
+    """
+    Geminiでプランを生成
+    stream=True の場合はストリーミング応答を返す（stream_plan_text でテキストを取り出す）
+    """
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    return model.generate_content(prompt, stream=True) if stream else model.generate_content(prompt)
+
+
+def stream_plan_text(response) -> Iterator[str]:
+    """Geminiのストリーミング応答からテキストを順に取り出す"""
+    for chunk in response:
+        text = getattr(chunk, 'text', '')
+        if text:
+            yield text
@@ -0,0 +1,263 @@
+"""ルートの一括算出（出発地とスポットの組み合わせのジョブ一覧から、プロセスプールで並列に算出する）"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .links import create_google_maps_multi_link
+from .roads import RoadNetwork
+from .routing import (
+    HELD_KARP_MAX_STOPS, normalize_route_query, optimize_route_disaster, optimize_route_tourism, solve_held_karp_batch,
+)
+from .store import SpotStore, route_coordinates
+from .travel_matrix import TRAVEL_MATRIX_DIR, TRAVEL_ROAD_PROFILES, TravelMatrix, load_travel_matrix
+
+# ジョブ一覧の列（緯度・経度・スポットは必須）。スポットは名前を区切り文字で並べる
+BATCH_KINDS = {'観光': 'tourism', '防災': 'disaster', 'tourism': 'tourism', 'disaster': 'disaster'}
+BATCH_MODES = {
+    'driving': 'driving', 'walking': 'walking', 'bicycling': 'bicycling', 'transit': 'transit',
+    '車': 'driving', '徒歩': 'walking', '自転車': 'bicycling', '公共交通': 'transit',
+}
+BATCH_DEFAULT_MODES = {'tourism': 'driving', 'disaster': 'walking'}  # 移動手段の列が空の場合
+BATCH_MATRIX_MODES = {'transit': 'driving'}  # 移動時間行列のない手段の代用（アプリと同じく公共交通は車）
+BATCH_SPOT_SEPARATOR = '|'
+BATCH_CHUNK_SIZE = 1024  # ワーカーにまとめて渡すジョブ数（プロセス間通信の回数を減らし、一括で算出する件数を増やす）
+BATCH_RESULT_COLUMNS = [
+    'ID', 'モード', '移動手段', '訪問順', 'スポット数', '総移動距離（km）', '総所要時間（分）', 'Google Maps', 'エラー'
+]
+
+
+@dataclass(frozen=True)
+class RouteJob:
+    """1件のルート算出の条件（出発地は丸め、スポットは重複なしの昇順にそろえたもの）"""
+    job_id: str
+    kind: str  # 'tourism' / 'disaster'
+    mode: str  # Google Mapsのリンクの移動手段（'driving' / 'walking' / 'bicycling' / 'transit'）
+    origin: Tuple[float, float]
+    selected: Tuple[int, ...]  # スポットの位置
+    error: str = ''  # 読み込めなかった理由（正常な場合は空）
+
+    @property
+    def query(self) -> Tuple[str, str, Tuple[float, float], Tuple[int, ...]]:
+        """算出結果を共有できる条件（リンクの移動手段だけが違うジョブは同じ算出結果を使う）"""
+        return self.kind, BATCH_MATRIX_MODES.get(self.mode, self.mode), self.origin, self.selected
+
+
+@dataclass(frozen=True)
+class RouteResult:
+    """1件のルート算出の結果"""
+    job_id: str
+    kind: str
+    mode: str
+    route: Tuple[int, ...]  # 訪問順のスポットの位置
+    route_names: Tuple[str, ...]
+    total_km: float
+    total_minutes: float
+    maps_url: str
+    error: str = ''
+
+
+def _job_from_row(job_id: str, kind_label: str, mode_label: str, lat: float, lng: float, spots_text: str,
+                  stores: Mapping[str, SpotStore]) -> RouteJob:
+    kind = BATCH_KINDS.get(kind_label.strip().removesuffix('モード') or '観光')
+    if kind is None:
+        return RouteJob(job_id, '', mode_label, (lat, lng), (), f"未対応のモードです: {kind_label}")
+    mode = BATCH_MODES.get(mode_label.strip() or BATCH_DEFAULT_MODES[kind])
+    if mode is None:
+        return RouteJob(job_id, kind, mode_label, (lat, lng), (), f"未対応の移動手段です: {mode_label}")
+    if pd.isna(lat) or pd.isna(lng):
+        return RouteJob(job_id, kind, mode, (lat, lng), (), "出発地の緯度・経度が読めません")
+
+    names = [name.strip() for name in spots_text.split(BATCH_SPOT_SEPARATOR) if name.strip()]
+    unknown = [name for name in names if name not in stores[kind].name_to_index]
+    if not names or unknown:
+        reason = f"スポットが見つかりません: {', '.join(unknown)}" if unknown else "スポットが指定されていません"
+        return RouteJob(job_id, kind, mode, (lat, lng), (), reason)
+
+    origin, selected = normalize_route_query([lat, lng], stores[kind].indices_of(names))
+    return RouteJob(job_id, kind, mode, (origin[0], origin[1]), tuple(selected))
+
+
+def parse_route_jobs(jobs_df: pd.DataFrame, stores: Mapping[str, SpotStore]) -> List[RouteJob]:
+    """
+    ジョブ一覧の表をジョブのリストに変換（読み込めない行はエラーつきのジョブにする）
+    Args:
+        jobs_df: ID（任意）・モード（任意、観光 / 防災）・緯度・経度・スポット（名前を | で区切る）・
+                 移動手段（任意）の列を持つ表
+        stores: データセット（'tourism' / 'disaster'）ごとのスポットのストア
+    Raises:
+        ValueError: 必須の列がない場合
+    """
+    missing = [col for col in ('緯度', '経度', 'スポット') if col not in jobs_df.columns]
+    if missing:
+        raise ValueError(f"ジョブ一覧に必須の列がありません: {', '.join(missing)}")
+    n = len(jobs_df)
+
+    def text_column(col, default=''):
+        if col not in jobs_df.columns:
+            return [default] * n
+        return jobs_df[col].fillna('').astype(str).tolist()
+
+    ids = text_column('ID') if 'ID' in jobs_df.columns else [str(i) for i in range(1, n + 1)]
+    lats = pd.to_numeric(jobs_df['緯度'], errors='coerce').tolist()
+    lngs = pd.to_numeric(jobs_df['経度'], errors='coerce').tolist()
+    return [
+        _job_from_row(*row, stores)
+        for row in zip(ids, text_column('モード'), text_column('移動手段'), lats, lngs, text_column('スポット'))
+    ]
+
+
+def load_batch_matrices(jobs: List[RouteJob], stores: Mapping[str, SpotStore], versions: Mapping[str, str],
+                        road_network: Optional[RoadNetwork] = None,
+                        cache_dir: str = TRAVEL_MATRIX_DIR) -> Dict[Tuple[str, str], TravelMatrix]:
+    """ジョブで使うデータセットと移動手段の組み合わせごとに、スポット間の移動時間行列を読み込む"""
+    matrices = {}
+    for kind, matrix_mode, _, _ in {job.query for job in jobs if not job.error}:
+        if (kind, matrix_mode) in matrices:
+            continue
+        graph = road_network.graph(TRAVEL_ROAD_PROFILES[matrix_mode]) if road_network is not None else None
+        matrices[(kind, matrix_mode)] = load_travel_matrix(
+            stores[kind], versions[kind], matrix_mode, graph, name=kind, cache_dir=cache_dir
+        )
+    return matrices
+
+
+# プロセスプールのワーカー（スポットのストアと移動時間行列は起動時に1回だけ受け取る）
+_worker_context: Dict[str, Mapping] = {}
+
+
+def _init_worker(stores: Mapping[str, SpotStore], matrices: Mapping[Tuple[str, str], TravelMatrix]):
+    _worker_context.update(stores=stores, matrices=matrices)
+
+
+def _solve_query(stores: Mapping[str, SpotStore], matrices: Mapping[Tuple[str, str], TravelMatrix],
+                 query: Tuple[str, str, Tuple[float, float], Tuple[int, ...]]) -> Tuple[Tuple[int, ...], float, float]:
+    kind, matrix_mode, origin, selected = query
+    optimize = optimize_route_tourism if kind == 'tourism' else optimize_route_disaster
+    route, total_km, total_minutes = optimize(
+        list(origin), stores[kind], list(selected), travel_matrix=matrices[(kind, matrix_mode)]
+    )
+    return tuple(route), float(total_km), float(total_minutes)
+
+
+def _solve_group(stores: Mapping[str, SpotStore], matrices: Mapping[Tuple[str, str], TravelMatrix],
+                 queries: List[tuple]) -> List[Tuple[Tuple[int, ...], float, float]]:
+    """
+    データセット・移動手段・スポット数の同じクエリをまとめて算出する
+    行列の作成とHeld-Karp法を配列演算で一括に行う（1件ずつ算出した場合と同じ訪問順になる）
+    """
+    kind, matrix_mode = queries[0][:2]
+    store = stores[kind]
+    origins = np.array([query[2] for query in queries], dtype=np.float64)
+    selected = np.array([query[3] for query in queries], dtype=np.int64)
+    km, minutes = matrices[(kind, matrix_mode)].batch_route_matrices(origins, selected)
+
+    # 時刻表・想定区域を使わないため、観光・防災とも距離で順序を決める
+    orders = solve_held_karp_batch(km)
+    rows = np.arange(len(queries))[:, None]
+    prev = np.concatenate((np.zeros((len(queries), 1), dtype=np.int64), orders[:, :-1]), axis=1)
+    routes = np.take_along_axis(selected, orders - 1, axis=1)
+    total_km = km[rows, prev, orders].sum(axis=1)
+    total_minutes = minutes[rows, prev, orders].sum(axis=1)
+    if kind == 'tourism':
+        total_minutes += store.stay_minutes[selected].sum(axis=1).astype(np.int64)
+        total_minutes += store.wait_minutes[selected].sum(axis=1).astype(np.int64)
+    return [
+        (tuple(route), float(total), float(duration))
+        for route, total, duration in zip(routes.tolist(), total_km, total_minutes)
+    ]
+
+
+def _solve_queries(stores: Mapping[str, SpotStore], matrices: Mapping[Tuple[str, str], TravelMatrix],
+                   queries: List[tuple]) -> List[Tuple[Tuple[int, ...], float, float]]:
+    """クエリをスポット数ごとにまとめて算出する（厳密解の対象より多い場合は1件ずつ局所探索で算出）"""
+    groups: Dict[Tuple[str, str, int], List[int]] = {}
+    for pos, (kind, matrix_mode, _, selected) in enumerate(queries):
+        groups.setdefault((kind, matrix_mode, len(selected)), []).append(pos)
+
+    solved = [None] * len(queries)
+    for (_, _, n_stops), positions in groups.items():
+        group = [queries[pos] for pos in positions]
+        if n_stops <= HELD_KARP_MAX_STOPS:
+            results = _solve_group(stores, matrices, group)
+        else:
+            results = [_solve_query(stores, matrices, query) for query in group]
+        for pos, result in zip(positions, results):
+            solved[pos] = result
+    return solved
+
+
+def _solve_chunk(queries: List[tuple]) -> List[Tuple[Tuple[int, ...], float, float]]:
+    return _solve_queries(_worker_context['stores'], _worker_context['matrices'], queries)
+
+
+def _pool_context():
+    """
+    forkが使える環境ではforkでワーカーを起動する
+    ストアと移動時間行列（キャッシュファイルのメモリマップ）をコピーせず、親プロセスと同じページを読む
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+
+def _job_result(job: RouteJob, store: Optional[SpotStore],
+                solved: Optional[Tuple[Tuple[int, ...], float, float]]) -> RouteResult:
+    if job.error:
+        return RouteResult(job.job_id, job.kind, job.mode, (), (), 0.0, 0.0, '', job.error)
+    route, total_km, total_minutes = solved
+    coords = route_coordinates(store, list(route))
+    url = create_google_maps_multi_link(list(job.origin), coords[:-1], coords[-1], job.mode)
+    names = tuple(store.names[idx] for idx in route)
+    return RouteResult(job.job_id, job.kind, job.mode, route, names, total_km, total_minutes, url)
+
+
+def run_route_jobs(jobs: List[RouteJob], stores: Mapping[str, SpotStore],
+                   matrices: Mapping[Tuple[str, str], TravelMatrix], workers: Optional[int] = None,
+                   chunk_size: int = BATCH_CHUNK_SIZE) -> List[RouteResult]:
+    """
+    ジョブを並列に算出する（同じ条件のジョブは1回だけ算出する）
+    Args:
+        jobs: parse_route_jobs() のジョブ
+        stores: データセットごとのスポットのストア
+        matrices: load_batch_matrices() の移動時間行列
+        workers: ワーカーのプロセス数（Noneの場合はCPU数。1以下、またはジョブが少ない場合はこのプロセスで算出）
+        chunk_size: ワーカーにまとめて渡すジョブ数
+    Returns:
+        ジョブと同じ順の結果
+    """
+    # スポット数の同じクエリが同じワーカーに渡るように並べる（ワーカー内でまとめて算出する）
+    queries = sorted(
+        dict.fromkeys(job.query for job in jobs if not job.error), key=lambda query: (query[:2], len(query[3]))
+    )
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(queries) <= chunk_size:
+        solved = _solve_queries(stores, matrices, queries)
+    else:
+        chunks = [queries[start:start + chunk_size] for start in range(0, len(queries), chunk_size)]
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=_pool_context(),
+                                 initializer=_init_worker, initargs=(stores, matrices)) as pool:
+            solved = [result for chunk in pool.map(_solve_chunk, chunks) for result in chunk]
+
+    by_query = dict(zip(queries, solved))
+    return [_job_result(job, stores.get(job.kind), by_query.get(job.query)) for job in jobs]
+
+
+def route_results_frame(results: List[RouteResult]) -> pd.DataFrame:
+    """結果の表（CSV出力用）"""
+    kind_labels = {'tourism': '観光', 'disaster': '防災'}
+    return pd.DataFrame([[
+        result.job_id,
+        kind_labels.get(result.kind, ''),
+        result.mode,
+        BATCH_SPOT_SEPARATOR.join(result.route_names),
+        len(result.route),
+        round(result.total_km, 2),
+        round(result.total_minutes, 1),
+        result.maps_url,
+        result.error,
+    ] for result in results], columns=BATCH_RESULT_COLUMNS)
@@ -0,0 +1,113 @@
+"""有効期限つきLRUキャッシュ（スレッドセーフ）"""
+import dataclasses
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Tuple
+
+import numpy as np
+
+
+def approx_size(value: Any) -> int:
+    """値のおおよそのメモリ使用量（バイト。リスト・辞書・データクラスは中身も数える）"""
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) + (0 if value.flags.owndata else value.nbytes)
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        return size + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(approx_size(item) for item in value)
+    if dataclasses.is_dataclass(value):
+        return size + sum(approx_size(getattr(value, f.name)) for f in dataclasses.fields(value))
+    return size
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    """キャッシュの利用状況"""
+    entries: int
+    size_bytes: int
+    hits: int
+    misses: int
+    evictions: int  # 上限を超えて削除した数（期限切れは含まない）
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class TTLCache:
+    """
+    一定時間で失効し、上限を超えると最も古く使われた項目から削除するキャッシュ
+    max_bytes を指定すると、値のおおよそのメモリ使用量の合計も上限以下に保つ。
+    """
+
+    def __init__(self, max_entries: int, ttl_sec: float, max_bytes: Optional[int] = None,
+                 sizeof: Callable[[Any], int] = approx_size):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._items: 'OrderedDict[str, Tuple[float, Any, int]]' = OrderedDict()
+        self._size_bytes = 0
+        self._hits = self._misses = self._evictions = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, key: str):
+        self._size_bytes -= self._items.pop(key)[2]
+
+    def get(self, key: str) -> Optional[Any]:
+        """値を取得（なければ・失効していればNone）"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and time.monotonic() - item[0] > self.ttl_sec:
+                self._remove(key)
+                item = None
+            if item is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, value: Any):
+        """値を保存（上限を超えた分は古い順に削除。1件で max_bytes を超える値は保存しない）"""
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._items[key] = (time.monotonic(), value, size)
+            self._size_bytes += size
+            while len(self._items) > self.max_entries or (
+                    self.max_bytes is not None and self._size_bytes > self.max_bytes):
+                self._remove(next(iter(self._items)))
+                self._evictions += 1
+
+    def delete(self, key: str):
+        """値を削除（なければ何もしない）"""
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """値を取得し、なければ計算して保存（計算中はロックしないため、同時に同じ計算が走ることがある）"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def stats(self) -> CacheStats:
+        """件数・メモリ使用量・ヒット数などの利用状況"""
+        with self._lock:
+            return CacheStats(len(self._items), self._size_bytes, self._hits, self._misses, self._evictions)
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,322 @@
+"""スポットデータ（spots.xlsx）の読み込み"""
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .tracing import traced
+
+SPOTS_FILE = 'spots.xlsx'
+SPOTS_CACHE_DIR = '.spots_cache'  # 変換済みデータのキャッシュ置き場
+SPOTS_CACHE_FORMAT = 2  # 変換処理を変えたら上げる（古いキャッシュを無効化）
+
+MINUTES_PER_DAY = 24 * 60
+# 営業時間の「9:00-17:00」「9時～17時」「18:00-翌2:00」などの時間帯
+_TIME_PATTERN = r'(\d{1,2})\s*(?::\s*(\d{2})|時\s*(?:(\d{1,2})\s*分)?)'
+_OPENING_RANGE_RE = re.compile(_TIME_PATTERN + r'\s*(?:-|~|〜|–|—|から)\s*(翌)?\s*' + _TIME_PATTERN)
+# 料金の「500円」「1,000円」「1万円」や、金額だけの「500」
+_YEN_RE = re.compile(r'(\d+(?:,\d{3})*(?:\.\d+)?)\s*(万)?\s*円')
+_NUMBER_ONLY_RE = re.compile(r'\s*(\d+(?:,\d{3})*)\s*')
+# 滞在時間の「3時間」「2時間半」「1時間30分」「90分」「半日」「1日」
+_HOURS_RE = re.compile(r'(\d+(?:\.\d+)?)\s*時間(半)?')
+_MINUTES_RE = re.compile(r'(\d+)\s*分')
+_DAYS_RE = re.compile(r'(\d+)\s*日')
+DAY_TRIP_MINUTES = 8 * 60  # 滞在時間の「1日」を観光に使える時間とみなす長さ（分）
+
+
+class SpotsDataError(Exception):
+    """spots.xlsxの内容が想定どおりでない場合のエラー"""
+
+
+def parse_duration_minutes(values: pd.Series, default: int = 60) -> pd.Series:
+    """所要時間の値を数値に一括変換（「60分」→60、空欄・「-」などはデフォルト値）"""
+    numeric = pd.to_numeric(values, errors='coerce')
+    # 「60分」のような文字列から最初の数値を抽出
+    extracted = pd.to_numeric(values.astype(str).str.extract(r'(\d+)', expand=False), errors='coerce')
+    return numeric.fillna(extracted).fillna(default).astype(int)
+
+
+def parse_fee_text(text) -> float:
+    """
+    料金・予算の表記を円に変換（「無料」→0、「大人500円・子供300円」は最初の金額、読み取れない場合はnan）
+    """
+    normalized = unicodedata.normalize('NFKC', str(text)).strip()
+    if normalized.startswith('無料'):
+        return 0.0
+    match = _YEN_RE.search(normalized)
+    if match:
+        return float(match.group(1).replace(',', '')) * (10000 if match.group(2) else 1)
+    match = _NUMBER_ONLY_RE.fullmatch(normalized)
+    return float(match.group(1).replace(',', '')) if match else np.nan
+
+
+def parse_fee_yen(values: pd.Series) -> np.ndarray:
+    """料金の列を円の配列に一括変換（同じ表記は1回だけ解析。読み取れない場合はnan）"""
+    codes, uniques = pd.factorize(values.fillna('').astype(str))
+    table = np.array([parse_fee_text(text) for text in uniques], dtype=np.float64)
+    return table[codes]
+
+
+def parse_duration_text(text) -> float:
+    """滞在時間の表記を分に変換（「3時間」→180、「半日」→240、「1日」→480、読み取れない場合はnan）"""
+    normalized = unicodedata.normalize('NFKC', str(text))
+    if '半日' in normalized:
+        return DAY_TRIP_MINUTES / 2
+    days = _DAYS_RE.search(normalized)
+    if days or '一日' in normalized:
+        return float(int(days.group(1)) if days else 1) * DAY_TRIP_MINUTES
+    hours = _HOURS_RE.search(normalized)
+    minutes = _MINUTES_RE.search(normalized)
+    if not hours and not minutes:
+        return np.nan
+    total = float(hours.group(1)) * 60 + (30 if hours.group(2) else 0) if hours else 0.0
+    return total + (int(minutes.group(1)) if minutes else 0)
+
+
+def parse_opening_text(text: str) -> List[Tuple[float, float]]:
+    """
+    営業時間の文字列を (開始, 終了) の時間帯リストに変換（0時からの分）
+    「終日」や読み取れない表記は終日営業として扱う。終了が開始以前の場合は翌日の時刻とみなす。
+    """
+    normalized = unicodedata.normalize('NFKC', str(text))
+    windows = []
+    for match in _OPENING_RANGE_RE.finditer(normalized):
+        open_h, open_m, open_m_kanji, next_day, close_h, close_m, close_m_kanji = match.groups()
+        opens = int(open_h) * 60 + int(open_m or open_m_kanji or 0)
+        closes = int(close_h) * 60 + int(close_m or close_m_kanji or 0)
+        if next_day or closes <= opens:
+            closes += MINUTES_PER_DAY
+        windows.append((float(opens), float(closes)))
+
+    if not windows:
+        return [(0.0, np.inf)]
+    return sorted(windows)
+
+
+def parse_opening_hours(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    営業時間の列を時間帯の配列に一括変換（同じ表記は1回だけ解析）
+    Returns: (開始の配列, 終了の配列) ※形状は (件数, 時間帯の最大数)、足りない分は開始inf・終了-infで埋める
+    """
+    codes, uniques = pd.factorize(values.astype(str))
+    parsed = [parse_opening_text(text) for text in uniques]
+    width = max((len(windows) for windows in parsed), default=1)
+
+    # 表記ごとの時間帯表を作り、行ごとに参照する
+    open_table = np.full((len(parsed), width), np.inf)
+    close_table = np.full((len(parsed), width), -np.inf)
+    for u, windows in enumerate(parsed):
+        for w, (open_min, close_min) in enumerate(windows):
+            open_table[u, w] = open_min
+            close_table[u, w] = close_min
+    return open_table[codes], close_table[codes]
+
+
+def window_departure(arrival, duration, opens: np.ndarray, closes: np.ndarray) -> np.ndarray:
+    """
+    到着時刻から、営業時間内に見学を終えて出発できる最早時刻を一括計算（間に合わない場合はinf）
+    opens / closes は末尾の次元が時間帯
+    """
+    arrival = np.asarray(arrival, dtype=np.float64)[..., None]
+    duration = np.asarray(duration, dtype=np.float64)[..., None]
+    finish = np.maximum(arrival, opens) + duration
+    return np.where(finish <= closes, finish, np.inf).min(axis=-1)
+
+
+def prepare_spots_frames(tourism_df: pd.DataFrame, disaster_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """必須カラムの確認と、欠けているカラムの補完・型変換"""
+    # カラム名の確認と標準化
+    required_cols_tourism = ['No', 'スポット名', '緯度', '経度', '説明']
+    required_cols_disaster = ['No', 'スポット名', '緯度', '経度', '説明']
+
+    # 必須カラムの確認
+    for col in required_cols_tourism:
+        if col not in tourism_df.columns:
+            raise SpotsDataError(f"観光シートに'{col}'カラムがありません")
+
+    for col in required_cols_disaster:
+        if col not in disaster_df.columns:
+            raise SpotsDataError(f"防災シートに'{col}'カラムがありません")
+
+    # 観光データの処理
+    if '所要時間（参考）' in tourism_df.columns:
+        tourism_df['所要時間（参考）'] = parse_duration_minutes(tourism_df['所要時間（参考）'])
+    else:
+        tourism_df['所要時間（参考）'] = 60  # デフォルト60分
+
+    if 'カテゴリ' not in tourism_df.columns:
+        tourism_df['カテゴリ'] = '観光地'
+    if '営業時間' not in tourism_df.columns:
+        tourism_df['営業時間'] = '終日'
+    if '料金' not in tourism_df.columns:
+        tourism_df['料金'] = '無料'
+    if '待ち時間（分）' not in tourism_df.columns:
+        tourism_df['待ち時間（分）'] = 0
+    if '混雑状況' not in tourism_df.columns:
+        tourism_df['混雑状況'] = '空いている'
+    if 'おすすめ度' not in tourism_df.columns:
+        tourism_df['おすすめ度'] = 1
+
+    # 防災データの処理
+    if '所要時間（参考）' in disaster_df.columns:
+        disaster_df['所要時間（参考）'] = parse_duration_minutes(disaster_df['所要時間（参考）'])
+
+    if '収容人数' not in disaster_df.columns:
+        disaster_df['収容人数'] = 0
+    if '状態' not in disaster_df.columns:
+        disaster_df['状態'] = '待機中'
+
+    # 待ち時間と収容人数を数値型に変換
+    tourism_df['待ち時間（分）'] = pd.to_numeric(tourism_df['待ち時間（分）'], errors='coerce').fillna(0).astype(int)
+    tourism_df['おすすめ度'] = pd.to_numeric(tourism_df['おすすめ度'], errors='coerce').fillna(1)
+    disaster_df['収容人数'] = pd.to_numeric(disaster_df['収容人数'], errors='coerce').fillna(0).astype(int)
+
+    return tourism_df, disaster_df
+
+
+def file_sha1(path: str) -> str:
+    """ファイル内容のSHA-1ハッシュ値"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_storage() -> str:
+    """キャッシュの保存形式（pyarrowがあればFeather、なければpickle）"""
+    # pyarrowの読み込みは重いため、インストール有無だけを確認する
+    return 'feather' if importlib.util.find_spec('pyarrow') is not None else 'pickle'
+
+
+def _cache_paths(cache_dir: str, storage: str) -> Dict[str, str]:
+    extension = 'feather' if storage == 'feather' else 'pkl'
+    return {
+        'meta': os.path.join(cache_dir, 'meta.json'),
+        'tourism': os.path.join(cache_dir, f'tourism.{extension}'),
+        'disaster': os.path.join(cache_dir, f'disaster.{extension}'),
+    }
+
+
+def _write_frame(df: pd.DataFrame, path: str, storage: str):
+    if storage == 'feather':
+        df.to_feather(path)
+    else:
+        df.to_pickle(path)
+
+
+def _read_frame(path: str, storage: str) -> pd.DataFrame:
+    return pd.read_feather(path) if storage == 'feather' else pd.read_pickle(path)
+
+
+@traced()
+def read_spots_workbook(path: str = SPOTS_FILE, cache_dir: str = SPOTS_CACHE_DIR) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    spots.xlsxを変換済みの列指向キャッシュ経由で読み込む
+    キャッシュはxlsxの更新日時・サイズで照合し、変わっていればハッシュ値で内容を確認する。
+    一致しない場合のみExcelを読み直してキャッシュを作り直す。
+    """
+    stat = os.stat(path)
+    storage = _cache_storage()
+    paths = _cache_paths(cache_dir, storage)
+
+    # キャッシュの照合
+    meta = None
+    try:
+        with open(paths['meta'], encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    if meta and meta.get('format') == SPOTS_CACHE_FORMAT and meta.get('storage') == storage:
+        same_stat = meta.get('mtime_ns') == stat.st_mtime_ns and meta.get('size') == stat.st_size
+        # 更新日時だけが変わった場合（コピー・チェックアウトなど）は内容のハッシュ値で判定
+        if same_stat or file_sha1(path) == meta.get('sha1'):
+            try:
+                tourism_df = _read_frame(paths['tourism'], storage)
+                disaster_df = _read_frame(paths['disaster'], storage)
+            except (OSError, ValueError):
+                pass  # キャッシュが壊れている場合は作り直す
+            else:
+                if not same_stat:
+                    meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                    try:
+                        with open(paths['meta'], 'w', encoding='utf-8') as f:
+                            json.dump(meta, f)
+                    except OSError:
+                        pass
+                return tourism_df, disaster_df
+
+    # Excelから読み込み（1回の読み込みで両シートを取得）
+    sheets = pd.read_excel(path, sheet_name=['観光', '防災'])
+    tourism_df, disaster_df = prepare_spots_frames(sheets['観光'], sheets['防災'])
+
+    # キャッシュの書き込み（書き込めない環境ではキャッシュなしで続行）
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_frame(tourism_df, paths['tourism'], storage)
+        _write_frame(disaster_df, paths['disaster'], storage)
+        with open(paths['meta'], 'w', encoding='utf-8') as f:
+            json.dump({
+                'format': SPOTS_CACHE_FORMAT,
+                'storage': storage,
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'sha1': file_sha1(path),
+            }, f)
+    except (OSError, ValueError, TypeError):
+        # 数値と文字列が混在する列など、形式に変換できないデータもキャッシュなしで続行
+        pass
+
+    return tourism_df, disaster_df
+
+
+def spots_file_mtime(path: str = SPOTS_FILE) -> float:
+    """spots.xlsxの更新日時（ファイルがない場合は0）"""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def sample_spots_frames() -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """spots.xlsxがない場合に使うサンプルデータ"""
+    tourism_df = pd.DataFrame({
+        'No': [1, 2, 3, 4, 5, 6],
+        'スポット名': ['豆田町', '日田温泉', '咸宜園', '天ヶ瀬温泉', '小鹿田焼の里', '大山ダム'],
+        '緯度': [33.3219, 33.3200, 33.3240, 33.2967, 33.3500, 33.3800],
+        '経度': [130.9414, 130.9400, 130.9430, 130.9167, 130.9600, 130.9200],
+        '所要時間（参考）': [60, 120, 45, 90, 75, 30],
+        '説明': ['江戸時代の町並みが残る歴史的な地区', '日田の名湯・温泉施設',
+               '日本最大の私塾跡・歴史的教育施設', '自然豊かな温泉街',
+               '伝統工芸の陶器の里', '美しい景観のダム'],
+        'カテゴリ': ['歴史', 'グルメ', '歴史', '自然', '体験', '自然'],
+        '営業時間': ['終日', '9:00-21:00', '9:00-17:00', '終日', '9:00-17:00', '終日'],
+        '料金': ['無料', '500円', '300円', '無料', '無料', '無料'],
+        '待ち時間（分）': [0, 15, 0, 10, 5, 0],
+        '混雑状況': ['空いている', '混雑', '普通', '空いている', '空いている', '空いている']
+    })
+    disaster_df = pd.DataFrame({
+        'No': [1, 2, 3, 4, 5],
+        'スポット名': ['日田市役所（避難所）', '中央公民館', '総合体育館', '桂林公民館', '三花公民館'],
+        '緯度': [33.3219, 33.3250, 33.3180, 33.3300, 33.3100],
+        '経度': [130.9414, 130.9450, 130.9380, 130.9500, 130.9350],
+        '所要時間（参考）': [60, 60, 60, 60, 60],
+        '説明': ['市役所・第一避難所', '中央地区の避難所', '大規模避難所',
+               '桂林地区の避難所', '三花地区の避難所'],
+        '収容人数': [500, 300, 800, 200, 250],
+        '状態': ['開設中', '開設中', '開設中', '待機中', '待機中']
+    })
+    return tourism_df, disaster_df
+
+
+def dataset_version(spots_df: pd.DataFrame) -> str:
+    """データフレームの内容から版を表すハッシュ値を算出"""
+    row_hashes = pd.util.hash_pandas_object(spots_df, index=True).to_numpy()
+    return hashlib.sha1(row_hashes.tobytes()).hexdigest()[:16]
@@ -0,0 +1,293 @@
+"""避難者の一括割り当て（避難所の収容人数を考慮した輸送問題）"""
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from .geo import cross_distance_matrix
+from .spatial import KM_PER_DEG_LAT
+from .tracing import traced
+
+WALK_SPEED_KMH = 4  # 徒歩の速度（km/h）
+DEFAULT_SHELTER_CAPACITY = 200  # 収容人数が不明（0・空欄）の避難所の想定人数
+ASSIGNMENT_CHUNK_ROWS = 65536  # 徒歩時間行列を一度に計算する避難者数（メモリ使用量の制限）
+AUCTION_EPSILON_MIN = 0.01  # 価格の最小引き上げ幅（分）。最適解との差は1人あたりこの値以内
+AUCTION_EPSILON_FACTOR = 5  # 価格の引き上げ幅を段階ごとに縮める倍率
+EVACUEE_HEADCOUNT_COLUMN = '人数'  # 避難者CSVの任意列（1行あたりの人数）
+
+
+@dataclass(frozen=True)
+class ShelterAssignment:
+    """避難者の割り当て結果（避難所は割り当てに渡した順の番号）"""
+    shelter_of: np.ndarray  # int64 (避難者数,) 割り当て先の避難所番号（収容しきれない場合は-1）
+    walk_minutes: np.ndarray  # float64 (避難者数,) 徒歩時間（未割り当てはnan）
+    load: np.ndarray  # int64 (避難所数,) 割り当て人数
+    capacities: np.ndarray  # int64 (避難所数,) 収容人数
+    nearest_load: np.ndarray  # int64 (避難所数,) 全員が最寄りの避難所へ向かった場合の人数（比較用）
+    rounds: int  # 価格調整の反復回数
+
+    @property
+    def unassigned(self) -> int:
+        """収容しきれなかった人数"""
+        return int(np.count_nonzero(self.shelter_of < 0))
+
+    @property
+    def total_walk_minutes(self) -> float:
+        """割り当てられた避難者の徒歩時間の合計（分）"""
+        return float(np.nansum(self.walk_minutes))
+
+
+def shelter_capacities(disaster_df: pd.DataFrame, default_capacity: int = DEFAULT_SHELTER_CAPACITY) -> np.ndarray:
+    """避難所の収容人数（不明な場合は default_capacity）"""
+    if '収容人数' not in disaster_df.columns:
+        return np.full(len(disaster_df), default_capacity, dtype=np.int64)
+    capacities = pd.to_numeric(disaster_df['収容人数'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+    return np.where(capacities > 0, capacities, default_capacity)
+
+
+def walking_time_matrix(origin_lats, origin_lngs, shelter_lats, shelter_lngs,
+                        speed_kmh: float = WALK_SPEED_KMH) -> np.ndarray:
+    """各避難者から各避難所への徒歩時間（分、形状は (避難者数, 避難所数)）"""
+    origin_lats = np.asarray(origin_lats, dtype=np.float64)
+    origin_lngs = np.asarray(origin_lngs, dtype=np.float64)
+    minutes = np.empty((len(origin_lats), len(shelter_lats)))
+    # 中間配列が大きくなりすぎないよう、避難者を区切って計算する
+    for lo in range(0, len(origin_lats), ASSIGNMENT_CHUNK_ROWS):
+        hi = lo + ASSIGNMENT_CHUNK_ROWS
+        minutes[lo:hi] = cross_distance_matrix(origin_lats[lo:hi], origin_lngs[lo:hi], shelter_lats, shelter_lngs)
+    minutes *= 60 / speed_kmh
+    return minutes
+
+
+def _place_vacancies(count: int, prices: np.ndarray, room: np.ndarray, epsilon: float) -> np.ndarray:
+    """空き枠（費用0の仮想の避難者）を、価格が最安値から epsilon 以内の避難所の余裕へ安い順に配置する"""
+    placed = np.zeros(len(prices), dtype=np.int64)
+    if count <= 0:
+        return placed
+    cheapest = prices.min()
+    for j in np.argsort(prices, kind='stable'):
+        if prices[j] > cheapest + epsilon or count == 0:
+            break
+        take = min(count, max(int(room[j]), 0))
+        placed[j] += take
+        count -= take
+    # 余裕が足りない分は最安の避難所へ置き、定員超過として価格調整に任せる
+    placed[np.argmin(prices)] += count
+    return placed
+
+
+def solve_capacitated_assignment(cost: np.ndarray, capacities: np.ndarray,
+                                 epsilon: float = AUCTION_EPSILON_MIN) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    収容人数つきの割り当て（輸送問題）を避難所側のオークション法で解く
+    全員を「費用＋避難所の価格」が最小の避難所へ割り当て、定員を超えた避難所は
+    超過人数分の避難者が移るところまで価格を引き上げる。これを超過がなくなるまで繰り返す。
+    総収容人数と人数をそろえる（不足分は費用0の受け皿、余りは費用0の空き枠）ことで
+    終了時には全避難所がちょうど満員になり、費用の合計は最適解との差が1人あたり epsilon 以内になる。
+    価格の引き上げ幅は大きな値から epsilon まで段階的に縮める（ε-スケーリング）。
+    Args:
+        cost: 費用行列（形状は (避難者数, 避難所数)）
+        capacities: 避難所の収容人数
+        epsilon: 最終段階の価格の最小引き上げ幅
+    Returns:
+        (割り当て先の避難所番号（収容しきれない場合は-1）, 避難所の価格, 反復回数)
+    """
+    n, m = cost.shape
+    # 分単位の費用は単精度で十分（丸め誤差は引き上げ幅より十分小さい）。行の取り出しが速くなる
+    cost = np.asarray(cost, dtype=np.float32)
+    capacities = np.asarray(capacities, dtype=np.int64)
+    if n == 0 or m == 0:
+        return np.full(n, -1, dtype=np.int64), np.zeros(m), 0
+
+    spare = int(capacities.sum()) - n
+    if spare < 0:
+        # 収容しきれない人数分の受け皿（費用0）を最後の列に追加。誰が残るかは徒歩時間の合計で決まる
+        cost = np.concatenate((cost, np.zeros((n, 1), dtype=cost.dtype)), axis=1)
+        capacities = np.append(capacities, -spare)
+    k = len(capacities)
+    prices = np.zeros(k)
+    assignment = np.argmin(cost, axis=1)
+    vacant = np.zeros(k, dtype=np.int64)
+    if spare > 0:
+        vacant += _place_vacancies(spare, prices, capacities - np.bincount(assignment, minlength=k), epsilon)
+
+    # 2番目に良い避難所とその費用は、その避難所の価格が上がるか本人が移るまで変わらない（価格は下がらない）
+    second_shelter = np.zeros(n, dtype=np.int64)
+    second_cost = np.zeros(n, dtype=cost.dtype)
+    checked_round = np.full(n, -1, dtype=np.int64)  # 2番目を求めた反復（-1は未計算）
+    raised_round = np.zeros(k, dtype=np.int64)  # 価格を最後に上げた反復
+
+    rounds = 0
+    phase_epsilon = max(float(np.ptp(cost)) / AUCTION_EPSILON_FACTOR, epsilon)
+    while True:
+        # 段階の開始時に、新しい引き上げ幅で条件を満たさなくなった避難者・空き枠を移し直す
+        reduced = cost + prices.astype(cost.dtype)
+        own = reduced[np.arange(n), assignment]
+        moved = np.flatnonzero(own - reduced.min(axis=1) > phase_epsilon)
+        assignment[moved] = np.argmin(reduced[moved], axis=1)
+        checked_round[moved] = -1
+        stale = prices > prices.min() + phase_epsilon
+        released = int(vacant[stale].sum())
+        vacant[stale] = 0
+        room = capacities - np.bincount(assignment, minlength=k) - vacant
+        vacant += _place_vacancies(released, prices, room, phase_epsilon)
+
+        while True:
+            load = np.bincount(assignment, minlength=k) + vacant
+            over = np.flatnonzero(load > capacities)
+            if not len(over):
+                break
+            rounds += 1
+
+            # 定員超過の避難所にいる避難者ごとに、2番目に良い避難所との差（価格がこれ以上上がると移る）
+            over_mask = np.zeros(k, dtype=bool)
+            over_mask[over] = True
+            members = np.flatnonzero(over_mask[assignment])
+            own_shelter = assignment[members]
+            price_values = prices.astype(cost.dtype)
+            outdated = members[checked_round[members] <= raised_round[second_shelter[members]]]
+            if len(outdated):
+                reduced = cost[outdated] + price_values
+                rows = np.arange(len(outdated))
+                reduced[rows, assignment[outdated]] = np.inf
+                second_shelter[outdated] = np.argmin(reduced, axis=1)
+                second_cost[outdated] = reduced[rows, second_shelter[outdated]]
+                checked_round[outdated] = rounds
+            margin = second_cost[members] - (cost[members, own_shelter] + price_values[own_shelter])
+            order = np.argsort(own_shelter, kind='stable')
+            bounds = np.searchsorted(own_shelter[order], np.append(over, k))
+
+            # 空き枠の差は「他の避難所の最安値 − 自分の価格」
+            two_cheapest = np.partition(prices, 1)[:2] if k > 1 else np.array([np.inf, np.inf])
+            leaving = []
+            released = 0
+            for j, lo, hi in zip(over, bounds[:-1], bounds[1:]):
+                # 差の小さい順に超過人数分が移るところまで価格を上げる（空き枠は同じ差の避難者より先に移す）
+                excess = int(load[j] - capacities[j])
+                group = order[lo:hi]
+                group_margin = margin[group]
+                vacancies = int(vacant[j])
+                below = len(group)
+                if vacancies:
+                    others = two_cheapest[1] if prices[j] == two_cheapest[0] else two_cheapest[0]
+                    vacancy_margin = others - prices[j]
+                    below = int(np.count_nonzero(group_margin < vacancy_margin))
+                if below < excess <= below + vacancies:
+                    # 差が空き枠より小さい避難者は全員移り、残りは空き枠が移る
+                    movers = np.flatnonzero(group_margin < vacancy_margin)
+                    movable_vacant = excess - below
+                    threshold = vacancy_margin
+                else:
+                    movable_vacant = vacancies if excess > below else 0
+                    movable_real = excess - movable_vacant
+                    movers = np.argpartition(group_margin, movable_real - 1)[:movable_real]
+                    threshold = group_margin[movers].max()
+                prices[j] += threshold + phase_epsilon
+                raised_round[j] = rounds
+                leaving.append(group[movers])
+                vacant[j] -= movable_vacant
+                released += movable_vacant
+
+            leaving = members[np.concatenate(leaving)]
+            assignment[leaving] = np.argmin(cost[leaving] + prices.astype(cost.dtype), axis=1)
+            checked_round[leaving] = -1
+            if released:
+                room = capacities - np.bincount(assignment, minlength=k) - vacant
+                vacant += _place_vacancies(released, prices, room, phase_epsilon)
+
+        if phase_epsilon <= epsilon:
+            break
+        phase_epsilon = max(phase_epsilon / AUCTION_EPSILON_FACTOR, epsilon)
+
+    assignment[assignment >= m] = -1
+    return assignment, prices[:m], rounds
+
+
+@traced()
+def assign_evacuees(origin_lats, origin_lngs, shelter_lats, shelter_lngs, capacities,
+                    speed_kmh: float = WALK_SPEED_KMH) -> ShelterAssignment:
+    """
+    多数の避難者を、収容人数を守りつつ徒歩時間の合計が最小になるよう避難所へ割り当てる
+    Args:
+        origin_lats, origin_lngs: 避難者の位置
+        shelter_lats, shelter_lngs: 避難所の位置
+        capacities: 避難所の収容人数
+        speed_kmh: 徒歩の速度（km/h）
+    """
+    capacities = np.asarray(capacities, dtype=np.int64)
+    minutes = walking_time_matrix(origin_lats, origin_lngs, shelter_lats, shelter_lngs, speed_kmh)
+    if len(capacities) and len(minutes):
+        nearest_load = np.bincount(np.argmin(minutes, axis=1), minlength=len(capacities))
+    else:
+        nearest_load = np.zeros(len(capacities), dtype=np.int64)
+
+    shelter_of, _, rounds = solve_capacitated_assignment(minutes, capacities)
+    assigned = shelter_of >= 0
+    walk_minutes = np.full(len(shelter_of), np.nan)
+    walk_minutes[assigned] = minutes[np.flatnonzero(assigned), shelter_of[assigned]]
+
+    return ShelterAssignment(
+        shelter_of=shelter_of,
+        walk_minutes=walk_minutes,
+        load=np.bincount(shelter_of[assigned], minlength=len(capacities)),
+        capacities=capacities,
+        nearest_load=nearest_load,
+        rounds=rounds,
+    )
+
+
+def evacuee_origins(origins_df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    避難者の表（緯度・経度、任意で人数）を1人1行の位置に展開する
+    Raises:
+        ValueError: 緯度・経度の列がない場合
+    """
+    missing = [col for col in ('緯度', '経度') if col not in origins_df.columns]
+    if missing:
+        raise ValueError(f"避難者データに必須の列がありません: {', '.join(missing)}")
+    coords = origins_df[['緯度', '経度']].apply(pd.to_numeric, errors='coerce')
+    valid = coords.notna().all(axis=1).to_numpy()
+    if EVACUEE_HEADCOUNT_COLUMN in origins_df.columns:
+        counts = pd.to_numeric(origins_df[EVACUEE_HEADCOUNT_COLUMN], errors='coerce').fillna(1)
+        counts = np.clip(counts.to_numpy(dtype=np.int64), 0, None)
+    else:
+        counts = np.ones(len(origins_df), dtype=np.int64)
+    counts = np.where(valid, counts, 0)
+    return (np.repeat(coords['緯度'].to_numpy(), counts),
+            np.repeat(coords['経度'].to_numpy(), counts))
+
+
+def simulate_evacuees(center_lat: float, center_lng: float, count: int, radius_km: float,
+                      seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """中心から半径 radius_km の円内に一様に分布する仮想の避難者の位置"""
+    rng = np.random.default_rng(seed)
+    distance_km = radius_km * np.sqrt(rng.random(count))
+    angle = rng.uniform(0, 2 * np.pi, count)
+    lats = center_lat + distance_km * np.sin(angle) / KM_PER_DEG_LAT
+    lngs = center_lng + distance_km * np.cos(angle) / (KM_PER_DEG_LAT * np.cos(np.radians(center_lat)))
+    return lats, lngs
+
+
+def shelter_load_table(result: ShelterAssignment, shelter_names) -> pd.DataFrame:
+    """避難所ごとの収容人数・割り当て人数・充足率（最寄りへ向かった場合との比較つき）"""
+    capacities = result.capacities
+    utilization = np.divide(result.load * 100, capacities, out=np.zeros(len(capacities)), where=capacities > 0)
+    return pd.DataFrame({
+        '避難所': list(shelter_names),
+        '収容人数': capacities,
+        '割り当て人数': result.load,
+        '充足率（%）': utilization.round(1),
+        '最寄りのみの場合': result.nearest_load,
+    })
+
+
+def evacuee_assignment_table(origin_lats, origin_lngs, result: ShelterAssignment, shelter_names) -> pd.DataFrame:
+    """避難者1人ごとの割り当て先と徒歩時間（収容しきれない場合は避難所が空欄）"""
+    names = np.asarray(list(shelter_names) + [''], dtype=object)
+    return pd.DataFrame({
+        '緯度': origin_lats,
+        '経度': origin_lngs,
+        '避難所': names[result.shelter_of],
+        '徒歩（分）': result.walk_minutes.round(1),
+    })
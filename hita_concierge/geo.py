@@ -0,0 +1,87 @@
+"""距離計算（単体・NumPyによる一括計算）"""
+from math import radians, sin, cos, sqrt, atan2
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from .store import SpotStore
+
+EARTH_RADIUS_KM = 6371.0  # 地球の半径（km）
+
+
+def calculate_distance(lat1, lng1, lat2, lng2):
+    """2点間の距離を計算（km）- ヒュベニの公式"""
+    R = 6371  # 地球の半径（km）
+
+    lat1_rad = radians(lat1)
+    lat2_rad = radians(lat2)
+    delta_lat = radians(lat2 - lat1)
+    delta_lng = radians(lng2 - lng1)
+
+    a = sin(delta_lat/2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(delta_lng/2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1-a))
+
+    return R * c
+
+
+def distances_from_point(lat: float, lng: float, lats, lngs) -> np.ndarray:
+    """1地点から複数地点への距離を一括計算（km）"""
+    lats_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs_rad = np.radians(np.asarray(lngs, dtype=np.float64))
+    lat_rad = np.radians(lat)
+
+    a = (np.sin((lats_rad - lat_rad) / 2) ** 2
+         + np.cos(lat_rad) * np.cos(lats_rad) * np.sin((lngs_rad - np.radians(lng)) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(np.clip(1 - a, 0.0, None)))
+
+
+def paired_distances(lats_a, lngs_a, lats_b, lngs_b) -> np.ndarray:
+    """地点Aと地点Bの組ごとの距離を一括計算（km、同じ長さの配列どうし）"""
+    lats_a = np.radians(np.asarray(lats_a, dtype=np.float64))
+    lngs_a = np.radians(np.asarray(lngs_a, dtype=np.float64))
+    lats_b = np.radians(np.asarray(lats_b, dtype=np.float64))
+    lngs_b = np.radians(np.asarray(lngs_b, dtype=np.float64))
+
+    a = (np.sin((lats_b - lats_a) / 2) ** 2
+         + np.cos(lats_a) * np.cos(lats_b) * np.sin((lngs_b - lngs_a) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(np.clip(1 - a, 0.0, None)))
+
+
+def distance_matrix(lats, lngs) -> np.ndarray:
+    """全地点間の距離行列を一括計算（km）"""
+    lats_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs_rad = np.radians(np.asarray(lngs, dtype=np.float64))
+
+    delta_lat = lats_rad[:, None] - lats_rad[None, :]
+    delta_lng = lngs_rad[:, None] - lngs_rad[None, :]
+    a = (np.sin(delta_lat / 2) ** 2
+         + np.cos(lats_rad)[:, None] * np.cos(lats_rad)[None, :] * np.sin(delta_lng / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(np.clip(1 - a, 0.0, None)))
+
+
+def cross_distance_matrix(lats_a, lngs_a, lats_b, lngs_b) -> np.ndarray:
+    """地点群Aの各地点から地点群Bの各地点への距離行列（km、形状は (Aの件数, Bの件数)）"""
+    lats_a = np.radians(np.asarray(lats_a, dtype=np.float64))[:, None]
+    lngs_a = np.radians(np.asarray(lngs_a, dtype=np.float64))[:, None]
+    lats_b = np.radians(np.asarray(lats_b, dtype=np.float64))[None, :]
+    lngs_b = np.radians(np.asarray(lngs_b, dtype=np.float64))[None, :]
+
+    a = (np.sin((lats_b - lats_a) / 2) ** 2
+         + np.cos(lats_a) * np.cos(lats_b) * np.sin((lngs_b - lngs_a) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(np.clip(1 - a, 0.0, None)))
+
+
+def distances_from_location(location: List[float], spots_df: pd.DataFrame) -> np.ndarray:
+    """現在地からデータフレームの全スポットへの距離を一括計算（km）"""
+    return distances_from_point(
+        location[0], location[1],
+        spots_df['緯度'].to_numpy(), spots_df['経度'].to_numpy()
+    )
+
+
+def route_distance_matrix(current_loc: List[float], spots: SpotStore, selected_indices: List[int]) -> np.ndarray:
+    """現在地（行・列0）と選択スポット（行・列1〜）の距離行列を作成"""
+    lats = np.concatenate(([current_loc[0]], spots.lats[selected_indices]))
+    lngs = np.concatenate(([current_loc[1]], spots.lngs[selected_indices]))
+    return distance_matrix(lats, lngs)
@@ -0,0 +1,402 @@
+"""浸水・土砂災害の想定区域（ローカルのGeoJSON）の判定と、区域を避ける避難ルートの重みづけ"""
+import hashlib
+import json
+import os
+from dataclasses import dataclass, replace
+from functools import cached_property
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .roads import RoadGraph
+from .tracing import traced
+
+# 座標は経度を x、緯度を y とした平面で扱う（市内の範囲では十分な精度）
+HAZARD_FILES = ('hazard.geojson', 'hazards.geojson')  # 想定区域の既定のファイル名
+HAZARD_KIND_PROPERTIES = ('種別', 'kind', 'hazard', 'type')  # 区域の種別を表すプロパティ（先に見つかったもの）
+HAZARD_NAME_PROPERTIES = ('名称', 'name')
+HAZARD_DEFAULT_KIND = '浸水'  # 種別のプロパティがない場合
+# 区域を通る辺・区間の重みの倍率（大きな倍率は通行止めと同じ扱い。区域内から出る経路は残す）
+HAZARD_AVOIDANCE = {'区域を通らない': 1000.0, 'なるべく避ける': 3.0, '考慮しない': 1.0}
+HAZARD_COLORS = {'浸水': '#1f77b4', '洪水': '#1f77b4', '土砂': '#8c564b', '土砂災害': '#8c564b'}  # 地図の塗り色
+HAZARD_DEFAULT_COLOR = '#d62728'
+HAZARD_NODE_CAPACITY = 4  # STR木の1節点の子の数（一括検索では小さいほうが無駄な組が少ない）
+HAZARD_QUERY_CHUNK = 65536  # まとめて検索する点・線分の数（一時配列のメモリ使用量の制限）
+
+
+class HazardDataError(Exception):
+    """想定区域データの読み込みエラー"""
+
+
+def _str_order(boxes: np.ndarray, capacity: int) -> np.ndarray:
+    """STR（Sort-Tile-Recursive）の詰め込み順（中心の x で縦に切り分け、切り分けた中を y で並べる）"""
+    n = len(boxes)
+    leaves = -(-n // capacity)
+    slice_size = capacity * max(1, int(np.ceil(np.sqrt(leaves))))
+    by_x = np.argsort(boxes[:, 0] + boxes[:, 2], kind='stable')
+    slices = np.arange(n) // slice_size
+    return by_x[np.lexsort(((boxes[by_x, 1] + boxes[by_x, 3]), slices))]
+
+
+def _expand_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """[starts[i], starts[i] + counts[i]) を順につないだ連番"""
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.cumsum(counts)
+    return np.arange(total, dtype=np.int64) - np.repeat(ends - counts - starts, counts)
+
+
+class _STRTree:
+    """
+    矩形のSTR木（NumPy配列による一括検索）
+    下の階層から順に、各階層の矩形の列 (x最小, y最小, x最大, y最大) と、子の範囲（1つ下の階層の連続した位置）を持つ。
+    矩形は列ごとの1次元配列で持つ（組ごとの取り出しは2次元配列の行より1次元配列のほうが速い）。
+    """
+
+    def __init__(self, boxes: np.ndarray, capacity: int = HAZARD_NODE_CAPACITY):
+        order = _str_order(boxes, capacity) if len(boxes) else np.zeros(0, dtype=np.int64)
+        self.items = order  # 葉の階層の位置 → 元の矩形の番号
+        children = boxes[order]
+        self.levels: List[Tuple[Tuple[np.ndarray, ...], Optional[np.ndarray], Optional[np.ndarray]]] = [
+            (_box_columns(children), None, None)
+        ]
+        while len(children) > capacity:
+            starts = np.arange(0, len(children), capacity)
+            counts = np.minimum(capacity, len(children) - starts)
+            parents = np.column_stack((
+                np.minimum.reduceat(children[:, 0], starts), np.minimum.reduceat(children[:, 1], starts),
+                np.maximum.reduceat(children[:, 2], starts), np.maximum.reduceat(children[:, 3], starts),
+            ))
+            parent_order = _str_order(parents, capacity)
+            children = parents[parent_order]
+            self.levels.append((_box_columns(children), starts[parent_order], counts[parent_order]))
+
+    def query(self, boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        矩形と重なる矩形の組を一括で検索
+        Returns: (検索した矩形の番号, 重なる元の矩形の番号)
+        """
+        min_x, min_y, max_x, max_y = _box_columns(boxes)
+        top = len(self.levels[-1][0][0])
+        query = np.repeat(np.arange(len(boxes)), top)
+        node = np.tile(np.arange(top), len(boxes))
+        for (node_min_x, node_min_y, node_max_x, node_max_y), starts, counts in reversed(self.levels):
+            hit = ((min_x[query] <= node_max_x[node]) & (node_min_x[node] <= max_x[query])
+                   & (min_y[query] <= node_max_y[node]) & (node_min_y[node] <= max_y[query]))
+            query, node = query[hit], node[hit]
+            if starts is not None:
+                child_counts = counts[node]
+                query = np.repeat(query, child_counts)
+                node = _expand_ranges(starts[node], child_counts)
+        return query, self.items[node]
+
+
+def _box_columns(boxes: np.ndarray) -> Tuple[np.ndarray, ...]:
+    return tuple(np.ascontiguousarray(boxes[:, k]) for k in range(4))
+
+
+def _orientation(ax, ay, bx, by, cx, cy) -> np.ndarray:
+    """点 c が線分 a→b の左側なら正、右側なら負、同一直線上なら0"""
+    return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+
+@dataclass(frozen=True)
+class HazardLayer:
+    """
+    想定区域のポリゴン（穴あき・マルチポリゴンは区域ごとに分けたもの）
+    頂点は coords[ring_ptr[r]:ring_ptr[r + 1]]（閉じた環）、区域 p の環は ring_ptr の位置 polygon_ptr[p]〜polygon_ptr[p + 1]
+    """
+    coords: np.ndarray  # float64 (頂点数, 2) [経度, 緯度]
+    ring_ptr: np.ndarray  # int64 (環の数 + 1,)
+    polygon_ptr: np.ndarray  # int64 (区域数 + 1,)
+    kinds: Tuple[str, ...]  # 区域ごとの種別（浸水・土砂など）
+    names: Tuple[str, ...]  # 区域ごとの名称（ない場合は空）
+    source: str  # 読み込んだファイル
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    @cached_property
+    def _edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """全ての環の辺 (x1, y1, x2, y2)、辺の区域、辺の矩形"""
+        ring_sizes = np.diff(self.ring_ptr)
+        ring_polygon = np.repeat(np.arange(len(self)), np.diff(self.polygon_ptr))
+        starts = _expand_ranges(self.ring_ptr[:-1], ring_sizes - 1)  # 閉じた環の最後の頂点からは辺を出さない
+        edges = np.column_stack((self.coords[starts], self.coords[starts + 1]))
+        edge_polygon = np.repeat(ring_polygon, ring_sizes - 1)
+        boxes = np.column_stack((
+            np.minimum(edges[:, 0], edges[:, 2]), np.minimum(edges[:, 1], edges[:, 3]),
+            np.maximum(edges[:, 0], edges[:, 2]), np.maximum(edges[:, 1], edges[:, 3]),
+        ))
+        return edges, edge_polygon, boxes
+
+    @cached_property
+    def _tree(self) -> _STRTree:
+        """辺の矩形のSTR木（地点の判定は水平の半直線、線分の判定は線分の矩形で検索する）"""
+        return _STRTree(self._edges[2])
+
+    @cached_property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """全区域を囲む矩形 (経度最小, 緯度最小, 経度最大, 緯度最大)"""
+        if not len(self.coords):
+            return 0.0, 0.0, 0.0, 0.0
+        low, high = self.coords.min(axis=0), self.coords.max(axis=0)
+        return float(low[0]), float(low[1]), float(high[0]), float(high[1])
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """区域の内容から算出したハッシュ値（重みづけした道路グラフの照合に使う）"""
+        digest = hashlib.sha1('\x00'.join(self.kinds).encode())
+        for array in (self.coords, self.ring_ptr, self.polygon_ptr):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()[:16]
+
+    @cached_property
+    def _polygon_boxes(self) -> np.ndarray:
+        """区域ごとの矩形 (x最小, y最小, x最大, y最大)"""
+        edges, edge_polygon, boxes = self._edges
+        starts = np.searchsorted(edge_polygon, np.arange(len(self)))
+        return np.column_stack((
+            np.minimum.reduceat(boxes[:, 0], starts), np.minimum.reduceat(boxes[:, 1], starts),
+            np.maximum.reduceat(boxes[:, 2], starts), np.maximum.reduceat(boxes[:, 3], starts),
+        ))
+
+    @cached_property
+    def _polygon_tree(self) -> _STRTree:
+        """区域の矩形のSTR木（地点を含みうる区域の絞り込みに使う）"""
+        return _STRTree(self._polygon_boxes)
+
+    @traced()
+    def locate(self, lats, lngs) -> np.ndarray:
+        """
+        各地点を含む区域（交差数判定）
+        区域の矩形に含まれる地点と区域の組だけを、区域の矩形の近い側の端までの半直線で判定する。
+        Returns: 区域の番号（どの区域にも含まれない地点は-1。重なる区域は番号の小さいもの）
+        """
+        ys = np.asarray(lats, dtype=np.float64)
+        xs = np.asarray(lngs, dtype=np.float64)
+        result = np.full(len(xs), -1, dtype=np.int64)
+        if not len(self) or not len(xs):
+            return result
+        edges, edge_polygon, _ = self._edges
+        polygon_boxes = self._polygon_boxes
+        for start in range(0, len(xs), HAZARD_QUERY_CHUNK):
+            px, py = xs[start:start + HAZARD_QUERY_CHUNK], ys[start:start + HAZARD_QUERY_CHUNK]
+            point, polygon = self._polygon_tree.query(np.column_stack((px, py, px, py)))
+            qx, qy = px[point], py[point]
+            min_x, max_x = polygon_boxes[polygon, 0], polygon_boxes[polygon, 2]
+            to_left = (qx - min_x) < (max_x - qx)
+            rays = np.column_stack((np.where(to_left, min_x, qx), qy, np.where(to_left, qx, max_x), qy))
+            pair, edge = self._tree.query(rays)
+            own = edge_polygon[edge] == polygon[pair]
+            pair, edge = pair[own], edge[own]
+            x1, y1, x2, y2 = edges[edge].T
+            ray_x, ray_y = qx[pair], qy[pair]
+            spans = (y1 > ray_y) != (y2 > ray_y)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cross_x = x1 + (ray_y - y1) * (x2 - x1) / (y2 - y1)
+            crossing = spans & np.where(to_left[pair], cross_x < ray_x, cross_x > ray_x)
+            # 地点と区域の組ごとに交差数を数え、奇数なら内側
+            inside = np.bincount(pair[crossing], minlength=len(point)) % 2 == 1
+            # 区域の番号の大きい順に書き込み、最後に小さい番号が残るようにする
+            hits = np.flatnonzero(inside)
+            hits = hits[np.lexsort((-polygon[hits], point[hits]))]
+            result[start + point[hits]] = polygon[hits]
+        return result
+
+    def contains(self, lats, lngs) -> np.ndarray:
+        """各地点がいずれかの区域に含まれるか"""
+        return self.locate(lats, lngs) >= 0
+
+    @traced()
+    def segments_cross(self, lats1, lngs1, lats2, lngs2) -> np.ndarray:
+        """各線分が区域を通るか（区域の境界と交わる、または端点が区域に含まれる）"""
+        ay = np.asarray(lats1, dtype=np.float64)
+        ax = np.asarray(lngs1, dtype=np.float64)
+        by = np.asarray(lats2, dtype=np.float64)
+        bx = np.asarray(lngs2, dtype=np.float64)
+        result = np.zeros(len(ax), dtype=bool)
+        if not len(self) or not len(ax):
+            return result
+        edges, _, _ = self._edges
+        for start in range(0, len(ax), HAZARD_QUERY_CHUNK):
+            chunk = slice(start, start + HAZARD_QUERY_CHUNK)
+            sx1, sy1, sx2, sy2 = ax[chunk], ay[chunk], bx[chunk], by[chunk]
+            boxes = np.column_stack((
+                np.minimum(sx1, sx2), np.minimum(sy1, sy2), np.maximum(sx1, sx2), np.maximum(sy1, sy2),
+            ))
+            segment, edge = self._tree.query(boxes)
+            x1, y1, x2, y2 = edges[edge].T
+            qx1, qy1, qx2, qy2 = sx1[segment], sy1[segment], sx2[segment], sy2[segment]
+            # 矩形が重なる組のうち、互いの端点が相手の線分の両側（または線上）にあるものが交わる
+            intersects = (
+                (_orientation(qx1, qy1, qx2, qy2, x1, y1) * _orientation(qx1, qy1, qx2, qy2, x2, y2) <= 0)
+                & (_orientation(x1, y1, x2, y2, qx1, qy1) * _orientation(x1, y1, x2, y2, qx2, qy2) <= 0)
+            )
+            result[start + np.unique(segment[intersects])] = True
+        # 境界と交わらない線分は、端点が区域に含まれる場合だけ区域を通る（区域の中に収まる線分）
+        rest = np.flatnonzero(~result)
+        result[rest] = self.contains(ay[rest], ax[rest])
+        return result
+
+    def path_crosses(self, coordinates: Sequence[Tuple[float, float]]) -> bool:
+        """(緯度, 経度) の折れ線が区域を通るか"""
+        if len(coordinates) < 2:
+            return bool(len(coordinates) and self.contains([coordinates[0][0]], [coordinates[0][1]])[0])
+        points = np.asarray(coordinates, dtype=np.float64)
+        return bool(self.segments_cross(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1]).any())
+
+    @cached_property
+    def geojson(self) -> Dict[str, object]:
+        """地図表示用のGeoJSON（読み込み時のポリゴンから1回だけ作り、再実行ごとにファイルを読み直さない）"""
+        features = []
+        for p in range(len(self)):
+            rings = [
+                np.round(self.coords[self.ring_ptr[r]:self.ring_ptr[r + 1]], 6).tolist()
+                for r in range(self.polygon_ptr[p], self.polygon_ptr[p + 1])
+            ]
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Polygon', 'coordinates': rings},
+                'properties': {
+                    '種別': self.kinds[p],
+                    '名称': self.names[p],
+                    'color': HAZARD_COLORS.get(self.kinds[p], HAZARD_DEFAULT_COLOR),
+                },
+            })
+        return {'type': 'FeatureCollection', 'features': features}
+
+
+# GeoJSONの読み込み
+
+def _property(properties: Dict[str, object], keys: Sequence[str], default: str) -> str:
+    for key in keys:
+        value = properties.get(key)
+        if value not in (None, ''):
+            return str(value)
+    return default
+
+
+def _closed_ring(ring) -> np.ndarray:
+    points = np.asarray(ring, dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] < 2:
+        raise HazardDataError("ポリゴンの座標が読めません")
+    points = points[:, :2]
+    if len(points) and not np.array_equal(points[0], points[-1]):
+        points = np.vstack((points, points[:1]))
+    return points
+
+
+def parse_hazard_geojson(data: Dict[str, object], source: str = '') -> HazardLayer:
+    """
+    GeoJSON（FeatureCollection / Feature）の Polygon・MultiPolygon を想定区域にする（その他の図形は無視）
+    Raises:
+        HazardDataError: 形式が読めない場合・区域が含まれない場合
+    """
+    if data.get('type') == 'FeatureCollection':
+        features = data.get('features') or []
+    elif data.get('type') == 'Feature':
+        features = [data]
+    else:
+        raise HazardDataError("GeoJSONのFeatureCollectionではありません")
+
+    rings: List[np.ndarray] = []
+    polygon_ptr = [0]
+    kinds: List[str] = []
+    names: List[str] = []
+    for feature in features:
+        geometry = (feature or {}).get('geometry') or {}
+        properties = (feature or {}).get('properties') or {}
+        if geometry.get('type') == 'Polygon':
+            parts = [geometry.get('coordinates') or []]
+        elif geometry.get('type') == 'MultiPolygon':
+            parts = geometry.get('coordinates') or []
+        else:
+            continue
+        kind = _property(properties, HAZARD_KIND_PROPERTIES, HAZARD_DEFAULT_KIND)
+        name = _property(properties, HAZARD_NAME_PROPERTIES, '')
+        for part in parts:
+            part_rings = [_closed_ring(ring) for ring in part if len(ring) >= 3]
+            if not part_rings:
+                continue
+            rings += part_rings
+            polygon_ptr.append(len(rings))
+            kinds.append(kind)
+            names.append(name)
+    if not kinds:
+        raise HazardDataError("想定区域データにポリゴンが含まれていません")
+
+    ring_ptr = np.zeros(len(rings) + 1, dtype=np.int64)
+    np.cumsum([len(ring) for ring in rings], out=ring_ptr[1:])
+    return HazardLayer(
+        coords=np.ascontiguousarray(np.vstack(rings)),
+        ring_ptr=ring_ptr,
+        polygon_ptr=np.array(polygon_ptr, dtype=np.int64),
+        kinds=tuple(kinds),
+        names=tuple(names),
+        source=source,
+    )
+
+
+def find_hazard_file(directory: str = '.') -> Optional[str]:
+    """既定の想定区域データのファイルを探す（見つからない場合はNone）"""
+    for name in HAZARD_FILES:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+@traced()
+def load_hazard_layer(path: str) -> HazardLayer:
+    """
+    浸水・土砂災害の想定区域（GeoJSON）を読み込み、判定用の索引を作成
+    Raises:
+        FileNotFoundError: ファイルがない場合
+        HazardDataError: 形式が読めない場合・区域が含まれない場合
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HazardDataError(f"想定区域データを読み込めません: {e}") from e
+    if not isinstance(data, dict):
+        raise HazardDataError("GeoJSONのFeatureCollectionではありません")
+    layer = parse_hazard_geojson(data, source=path)
+    layer._tree, layer._polygon_tree  # 索引は読み込み時に作っておく（キャッシュした区域を全セッションで共有する）
+    return layer
+
+
+# 避難ルートの重みづけ
+
+@traced()
+def hazard_road_graph(graph: RoadGraph, layer: HazardLayer, factor: float) -> RoadGraph:
+    """
+    区域を通る道路の重みを factor 倍にした道路グラフ（探索だけに使い、所要時間・距離は元のまま）
+    区域の中にいる場合も区域の外へ出る経路は見つかるよう、辺は取り除かずに重みだけを上げる。
+    factor は1以上（重みが所要時間を下回るとA*の下限見積もりが成り立たない）。
+    """
+    if factor == 1.0:
+        return graph
+    u = np.repeat(np.arange(len(graph)), np.diff(graph.indptr))
+    v = graph.indices.astype(np.int64)
+    # 往復の辺は同じ線分なので、交点の組ごとに1回だけ判定する
+    pairs, inverse = np.unique(np.minimum(u, v) * len(graph) + np.maximum(u, v), return_inverse=True)
+    a, b = pairs // len(graph), pairs % len(graph)
+    crossing = layer.segments_cross(graph.lats[a], graph.lngs[a], graph.lats[b], graph.lngs[b])[inverse]
+    costs = np.where(crossing, graph.minutes * np.float32(factor), graph.minutes).astype(np.float32)
+    return replace(graph, costs=costs)
+
+
+def hazard_leg_factors(layer: HazardLayer, lats, lngs, factor: float) -> np.ndarray:
+    """地点間を直線で結んだ区間ごとの重みの倍率（区域を通る区間は factor、それ以外は1）"""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    i, j = np.triu_indices(len(lats), k=1)
+    crossing = layer.segments_cross(lats[i], lngs[i], lats[j], lngs[j])
+    factors = np.ones((len(lats), len(lats)))
+    factors[i[crossing], j[crossing]] = factors[j[crossing], i[crossing]] = factor
+    return factors
@@ -0,0 +1,258 @@
+"""到達圏（出発地から指定した分数以内に行ける範囲）の計算"""
+from dataclasses import dataclass
+from functools import cached_property
+from math import ceil, cos, floor, radians
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .geo import distances_from_point, paired_distances
+from .roads import ACCESS_SPEED_KMH, PROFILE_SPEED_KMH, ROAD_PROFILES, SNAP_MAX_KM, RoadGraph
+from .spatial import KM_PER_DEG_LAT
+from .tracing import traced
+
+ISOCHRONE_MINUTES = (15, 30, 60)  # 到達圏の区切り（分）
+ISOCHRONE_GRID_SIZE = 200  # 到達圏を塗り分けるグリッドの1辺のセル数（範囲に合わせてセルの大きさを決める）
+ISOCHRONE_MIN_CELL_KM = 0.05  # グリッドの1セルの最小の大きさ（km）
+ISOCHRONE_OFFROAD_KM = 0.2  # 道路の交点から歩いて届く範囲として塗る距離（km。道路のないセルを塗る範囲）
+ISOCHRONE_ORIGIN_CELL_KM = 0.1  # 出発地をまとめるセルの大きさ（km。同じセルの出発地は計算結果を共有する）
+ISOCHRONE_COLORS = {15: '#2ca02c', 30: '#ff7f0e', 60: '#d62728'}  # 地図の塗り色（区切りの分数ごと）
+ISOCHRONE_DEFAULT_COLOR = '#9467bd'
+
+# 境界の辺の向き（右・上・左・下。x は列、y は行）と、それぞれを左に曲がった向き
+_DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+_LEFT_TURN = (1, 2, 3, 0)
+
+
+def isochrone_origin(lat: float, lng: float) -> Tuple[float, float]:
+    """出発地を含むセル（ISOCHRONE_ORIGIN_CELL_KM）の中心（到達圏はこの地点から計算し、キャッシュを共有する）"""
+    cell_lat = ISOCHRONE_ORIGIN_CELL_KM / KM_PER_DEG_LAT
+    center_lat = (floor(lat / cell_lat) + 0.5) * cell_lat
+    cell_lng = ISOCHRONE_ORIGIN_CELL_KM / (KM_PER_DEG_LAT * max(cos(radians(center_lat)), 1e-6))
+    center_lng = (floor(lng / cell_lng) + 0.5) * cell_lng
+    return round(center_lat, 6), round(center_lng, 6)
+
+
+def _trace_rings(mask: np.ndarray) -> List[np.ndarray]:
+    """
+    塗ったセルの境界の環（グリッドの頂点 (x, y) = (列, 行) の配列。塗ったセルを左に見る向きで、閉じていない）
+    外側の環は反時計回り、穴は時計回りになる。斜めに接するセルは、頂点で左に曲がって別の環にする
+    """
+    rows, cols = np.nonzero(mask)
+    padded = np.pad(mask, 1)
+    width = mask.shape[1] + 1
+    starts, heads = [], []
+    # 下・右・上・左の辺（隣のセルが空の場合だけ境界）。辺の始点はセルの左下の頂点からのずれ
+    for direction, (dr, dc), (x, y) in (
+        (0, (-1, 0), (0, 0)), (1, (0, 1), (1, 0)), (2, (1, 0), (1, 1)), (3, (0, -1), (0, 1)),
+    ):
+        edge = ~padded[rows + 1 + dr, cols + 1 + dc]
+        starts.append((rows[edge] + y) * width + cols[edge] + x)
+        heads.append(np.full(int(edge.sum()), direction))
+    starts, heads = np.concatenate(starts).tolist(), np.concatenate(heads).tolist()
+
+    # 頂点から出る辺（斜めに接する頂点だけ2本で、入ってきた辺から左に曲がる）
+    outgoing: Dict[int, List[int]] = {}
+    for vertex, direction in zip(starts, heads):
+        outgoing.setdefault(vertex, []).append(direction)
+    saddles = {vertex for vertex, choices in outgoing.items() if len(choices) > 1}
+    steps = [dy * width + dx for dx, dy in _DIRECTIONS]
+
+    # 残っている辺からたどり、最初の辺に戻ったら1つの環
+    rings = []
+    for start in list(outgoing):
+        while outgoing[start]:
+            first = outgoing[start][0]
+            vertex, direction, corners = start, first, []
+            while True:
+                outgoing[vertex].remove(direction)
+                vertex += steps[direction]
+                if vertex in saddles:
+                    turn = _LEFT_TURN[direction]
+                else:
+                    turn = outgoing[vertex][0] if outgoing[vertex] else first
+                if turn != direction:
+                    corners.append(vertex)  # 向きが変わる頂点だけを残す
+                if vertex == start and turn == first:
+                    break
+                direction = turn
+            ring = np.array(corners, dtype=np.int64)
+            rings.append(np.column_stack((ring % width, ring // width)))
+    return rings
+
+
+def _ring_area(ring: np.ndarray) -> float:
+    """環の符号つき面積（反時計回りが正）"""
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def _ring_contains(ring: np.ndarray, x: float, y: float) -> bool:
+    """点 (x, y) が環の内側か（交差数判定。点はグリッドの頂点・辺に重ならないものとする）"""
+    x1, y1 = ring[:, 0], ring[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    spans = (y1 > y) != (y2 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cross_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return bool(np.count_nonzero(spans & (cross_x > x)) % 2)
+
+
+def _grid_polygons(mask: np.ndarray) -> List[List[np.ndarray]]:
+    """塗ったセルをまとめたポリゴン（外側の環と、その中の穴の環のリスト）"""
+    rings = _trace_rings(mask)
+    areas = [_ring_area(ring) for ring in rings]
+    boxes = [(*ring.min(axis=0), *ring.max(axis=0)) for ring in rings]
+    outers = [i for i, area in enumerate(areas) if area > 0]
+    polygons = {i: [rings[i]] for i in outers}
+    for i, area in enumerate(areas):
+        if area > 0:
+            continue
+        # 穴の最初の辺の右側（穴の内側）のセルの中心を含む、最も小さい外側の環に入れる
+        (x0, y0), (x1, y1) = rings[i][0], rings[i][1]
+        dx, dy = np.sign(x1 - x0), np.sign(y1 - y0)
+        px, py = x0 + 0.5 * (dx + dy), y0 + 0.5 * (dy - dx)
+        parents = [
+            j for j in outers
+            if boxes[j][0] < px < boxes[j][2] and boxes[j][1] < py < boxes[j][3] and _ring_contains(rings[j], px, py)
+        ]
+        if parents:
+            polygons[min(parents, key=lambda j: areas[j])].append(rings[i])
+    return list(polygons.values())
+
+
+@dataclass(frozen=True)
+class Isochrone:
+    """
+    到達圏（出発地を中心とするグリッドの各セルの中心までの所要時間）
+    セル (i, j) は緯度 lat0 + i * cell_lat 〜、経度 lng0 + j * cell_lng 〜 の範囲
+    """
+    origin: Tuple[float, float]  # 計算した出発地（緯度, 経度）
+    mode: str  # 'walking' / 'driving'
+    limits: Tuple[int, ...]  # 区切りの分数（昇順）
+    lat0: float
+    lng0: float
+    cell_lat: float  # セルの大きさ（度）
+    cell_lng: float
+    minutes: np.ndarray  # float32 (行数, 列数) 最大の区切りまでに届かないセルはinf
+    on_roads: bool  # 道路データで計算したか（Falseは直線距離）
+
+    @property
+    def cell_km(self) -> float:
+        return self.cell_lat * KM_PER_DEG_LAT
+
+    def minutes_at(self, lats, lngs) -> np.ndarray:
+        """各地点を含むセルまでの所要時間（分）。届かない地点・グリッドの外の地点はinf"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        rows = np.floor((lats - self.lat0) / self.cell_lat).astype(np.int64)
+        cols = np.floor((lngs - self.lng0) / self.cell_lng).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.minutes.shape[0]) & (cols >= 0) & (cols < self.minutes.shape[1])
+        result = np.full(len(lats), np.inf)
+        result[inside] = self.minutes[rows[inside], cols[inside]]
+        return result
+
+    def _coordinates(self, ring: np.ndarray) -> List[List[float]]:
+        """グリッドの頂点の環を閉じた [経度, 緯度] の環にする"""
+        points = np.column_stack((self.lng0 + ring[:, 0] * self.cell_lng, self.lat0 + ring[:, 1] * self.cell_lat))
+        points = np.round(points, 6)
+        return np.vstack((points, points[:1])).tolist()
+
+    @cached_property
+    def geojson(self) -> Dict[str, object]:
+        """地図表示用のGeoJSON（区切りごとに、その分数以内に行けるセルをまとめたマルチポリゴン。広い区切りから順）"""
+        features = []
+        for limit in reversed(self.limits):
+            polygons = _grid_polygons(self.minutes <= limit)
+            if not polygons:
+                continue
+            features.append({
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'MultiPolygon',
+                    'coordinates': [[self._coordinates(ring) for ring in polygon] for polygon in polygons],
+                },
+                'properties': {
+                    '分': limit,
+                    '名称': f"{limit}分以内",
+                    'color': ISOCHRONE_COLORS.get(limit, ISOCHRONE_DEFAULT_COLOR),
+                },
+            })
+        return {'type': 'FeatureCollection', 'features': features}
+
+
+@traced()
+def compute_isochrone(origin: Sequence[float], mode: str = 'walking', graph: Optional[RoadGraph] = None,
+                      limits: Sequence[int] = ISOCHRONE_MINUTES) -> Isochrone:
+    """
+    出発地から limits の最大の分数以内に行ける範囲
+    graph（mode と同じ移動手段の道路グラフ）を渡すと、道路に沿った所要時間に、交点からセルの中心までの
+    徒歩を加えて計算する（道路のないセルは、ISOCHRONE_OFFROAD_KM 以内の交点から歩いて届く場合だけ含める）。
+    渡さない場合・出発地が道路から遠い場合は直線距離で計算する。
+    """
+    if mode not in ROAD_PROFILES:
+        raise ValueError(f"未対応の移動手段です: {mode}")
+    limits = tuple(sorted({int(limit) for limit in limits}))
+    max_minutes = float(limits[-1])
+    lat, lng = float(origin[0]), float(origin[1])
+
+    # 道路に沿って届く交点と所要時間（出発地そのものも所要時間0の点として含める）
+    points = None
+    if graph is not None:
+        source, access_km = graph.nearest_node(lat, lng)
+        if source >= 0 and access_km <= SNAP_MAX_KM:
+            access = access_km / ACCESS_SPEED_KMH * 60
+            times = graph.travel_within(source, max_minutes - access) + access
+            reached = np.flatnonzero(np.isfinite(times))
+            points = (np.append(graph.lats[reached], lat), np.append(graph.lngs[reached], lng),
+                      np.append(times[reached], 0.0))
+
+    # 届く範囲に合わせたグリッド（出発地が中央のセルの中心。道路から歩く分の余白をとる）
+    if points is not None:
+        radius_km = float(distances_from_point(lat, lng, points[0], points[1]).max())
+    else:
+        radius_km = max_minutes / 60 * PROFILE_SPEED_KMH[mode]
+    cell_km = max(2 * radius_km / ISOCHRONE_GRID_SIZE, ISOCHRONE_MIN_CELL_KM)
+    walk_cells = ceil(ISOCHRONE_OFFROAD_KM / cell_km)
+    half = ceil(radius_km / cell_km) + walk_cells
+    size = 2 * half + 1
+    cell_lat = cell_km / KM_PER_DEG_LAT
+    cell_lng = cell_km / (KM_PER_DEG_LAT * max(cos(radians(lat)), 1e-6))
+    lat0 = lat - (half + 0.5) * cell_lat
+    lng0 = lng - (half + 0.5) * cell_lng
+    center_lats = lat0 + (np.arange(size) + 0.5) * cell_lat
+    center_lngs = lng0 + (np.arange(size) + 0.5) * cell_lng
+
+    if points is None:
+        grid_lats, grid_lngs = np.meshgrid(center_lats, center_lngs, indexing='ij')
+        minutes = distances_from_point(lat, lng, grid_lats.ravel(), grid_lngs.ravel()) / PROFILE_SPEED_KMH[mode] * 60
+    else:
+        # 交点を含むセルの中心まで歩いた時間の最小値から、隣のセルへ歩いて広げる（距離変換）
+        point_lats, point_lngs, point_minutes = points
+        rows = np.floor((point_lats - lat0) / cell_lat).astype(np.int64)
+        cols = np.floor((point_lngs - lng0) / cell_lng).astype(np.int64)
+        walk_km = paired_distances(point_lats, point_lngs, center_lats[rows], center_lngs[cols])
+        minutes = np.full(size * size, np.inf)
+        np.minimum.at(minutes, rows * size + cols, point_minutes + walk_km / ACCESS_SPEED_KMH * 60)
+        minutes = minutes.reshape(size, size)
+        step = cell_km / ACCESS_SPEED_KMH * 60
+        for _ in range(walk_cells):
+            spread = minutes.copy()
+            for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)):
+                target = spread[max(dr, 0):size + min(dr, 0), max(dc, 0):size + min(dc, 0)]
+                source = minutes[max(-dr, 0):size + min(-dr, 0), max(-dc, 0):size + min(-dc, 0)]
+                np.minimum(target, source + step * (1.0 if dr == 0 or dc == 0 else 2 ** 0.5), out=target)
+            minutes = spread
+    minutes = minutes.reshape(size, size)
+    minutes[minutes > max_minutes] = np.inf
+
+    return Isochrone(
+        origin=(lat, lng),
+        mode=mode,
+        limits=limits,
+        lat0=lat0,
+        lng0=lng0,
+        cell_lat=cell_lat,
+        cell_lng=cell_lng,
+        minutes=minutes.astype(np.float32),
+        on_roads=points is not None,
+    )
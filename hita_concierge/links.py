@@ -0,0 +1,47 @@
+"""Google Mapsの外部リンク生成"""
+from typing import List, Tuple
+
+
+# Google Mapsリンク生成関数（単一目的地）
+def create_google_maps_link(origin, destination, mode='driving'):
+    """Google Mapsの外部リンクを生成（単一目的地）"""
+    modes = {
+        'driving': 'driving',
+        'walking': 'walking',
+        'bicycling': 'bicycling',
+        'transit': 'transit'
+    }
+    base_url = "https://www.google.com/maps/dir/?api=1"
+    link = f"{base_url}&origin={origin[0]},{origin[1]}&destination={destination[0]},{destination[1]}&travelmode={modes[mode]}"
+    return link
+
+
+# Google Mapsリンク生成関数（複数経由地）
+def create_google_maps_multi_link(origin: List[float], waypoints: List[Tuple[float, float]], destination: Tuple[float, float], mode='driving') -> str:
+    """
+    Google Mapsの外部リンクを生成（複数経由地対応）
+    Args:
+        origin: 出発地 [緯度, 経度]
+        waypoints: 経由地のリスト [(緯度, 経度), ...]
+        destination: 最終目的地 (緯度, 経度)
+        mode: 移動手段
+    Returns:
+        Google Maps URL
+    """
+    modes = {
+        'driving': 'driving',
+        'walking': 'walking',
+        'bicycling': 'bicycling',
+        'transit': 'transit'
+    }
+
+    base_url = "https://www.google.com/maps/dir/?api=1"
+    url = f"{base_url}&origin={origin[0]},{origin[1]}&destination={destination[0]},{destination[1]}"
+
+    if waypoints:
+        waypoints_str = "|".join([f"{lat},{lng}" for lat, lng in waypoints])
+        url += f"&waypoints={waypoints_str}"
+
+    url += f"&travelmode={modes.get(mode, 'driving')}"
+
+    return url
@@ -0,0 +1,434 @@
+"""
+施設ごとのリアルタイム情報（待ち時間・混雑状況・避難所の状態・店舗の営業状況）の非同期取得
+
+情報源（HTTP/JSON）は live_sources.json に列挙する。取得はバックグラウンドのイベントループで並行して行い、
+結果は共有のTTLキャッシュに保持するため、画面の描画は取得を待たずにキャッシュ済みの値を使う。
+"""
+import asyncio
+import json
+import os
+import ssl
+import threading
+import time
+from dataclasses import dataclass
+from math import inf
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+from .cache import TTLCache
+from .data import dataset_version
+
+LIVE_SOURCES_FILE = 'live_sources.json'  # 情報源の設定ファイルの既定のファイル名
+LIVE_STATUS_FIELDS = ('待ち時間（分）', '混雑状況', '状態')  # 上書きするスポットデータの列
+LIVE_FIELD_ALIASES = {'wait_minutes': '待ち時間（分）', 'congestion': '混雑状況', 'status': '状態'}
+LIVE_SOURCE_KINDS = ('spot', 'store')  # スポット（観光・防災データの列を上書き）・店舗（営業状況の一覧）
+LIVE_TIMEOUT_SEC = 2.0  # 情報源ごとの応答待ちの上限（秒）
+LIVE_REFRESH_SEC = 30.0  # 同じ情報源を取得し直すまでの間隔（秒）
+LIVE_TTL_SEC = 300.0  # 取得した値を使う期限（秒。過ぎたらExcelの値に戻す）
+LIVE_MAX_CONNECTIONS_PER_HOST = 8  # ホストごとの同時接続数の上限
+LIVE_MAX_RESPONSE_BYTES = 1 << 20  # 応答の大きさの上限
+
+
+class LiveStatusError(Exception):
+    """リアルタイム情報の設定・取得エラー"""
+
+
+@dataclass(frozen=True)
+class LiveSource:
+    """1つの情報源"""
+    name: str
+    url: str  # http:// または https:// のJSON
+    kind: str = 'spot'
+    spot: Optional[str] = None  # 応答が1施設分のオブジェクトの場合の施設名
+    timeout_sec: float = LIVE_TIMEOUT_SEC
+
+
+@dataclass(frozen=True)
+class LiveStatus:
+    """キャッシュ済みのリアルタイム情報"""
+    spots: Mapping[str, Mapping[str, object]]  # スポット名 → {列名: 値}
+    stores: Tuple[Tuple[str, str], ...]  # (店舗名, 営業状況)
+    errors: Mapping[str, str]  # 取得できなかった情報源 → 理由
+    updated_at: Optional[float]  # 使った値のうち最も古い取得時刻（time.time()。値がない場合はNone）
+
+
+# 設定ファイルと応答の読み取り
+def find_live_sources_file(directory: str = '.') -> Optional[str]:
+    """情報源の設定ファイルを探す（ない場合はNone）"""
+    path = os.path.join(directory, LIVE_SOURCES_FILE)
+    return path if os.path.isfile(path) else None
+
+
+def load_live_sources(path: str) -> List[LiveSource]:
+    """
+    情報源の設定ファイルを読み込む
+    {"sources": [{"name": ..., "url": ..., "kind": "spot" | "store", "spot": ..., "timeout_sec": ...}]}
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    except OSError as e:
+        raise LiveStatusError(f"{os.path.basename(path)}を読み込めません: {e}") from e
+    except ValueError as e:
+        raise LiveStatusError(f"{os.path.basename(path)}がJSONとして読めません: {e}") from e
+
+    entries = config.get('sources') if isinstance(config, dict) else config
+    if not isinstance(entries, list):
+        raise LiveStatusError(f"{os.path.basename(path)}に情報源の一覧（sources）がありません")
+
+    sources = []
+    for i, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or not isinstance(entry.get('url'), str):
+            raise LiveStatusError(f"{i}件目の情報源にURLがありません")
+        url = entry['url']
+        if urlsplit(url).scheme not in ('http', 'https') or not url.isascii():
+            raise LiveStatusError(f"{i}件目の情報源のURLに対応していません: {url}")
+        kind = entry.get('kind', 'spot')
+        if kind not in LIVE_SOURCE_KINDS:
+            raise LiveStatusError(f"{i}件目の情報源の種類に対応していません: {kind}")
+        try:
+            timeout_sec = float(entry.get('timeout_sec', LIVE_TIMEOUT_SEC))
+        except (TypeError, ValueError):
+            timeout_sec = 0.0
+        if not timeout_sec > 0:
+            raise LiveStatusError(f"{i}件目の情報源のタイムアウトは正の秒数で指定してください")
+        sources.append(LiveSource(
+            name=str(entry.get('name', url)),
+            url=url,
+            kind=kind,
+            spot=str(entry['spot']) if entry.get('spot') is not None else None,
+            timeout_sec=timeout_sec,
+        ))
+
+    names = [source.name for source in sources]
+    duplicated = sorted({name for name in names if names.count(name) > 1})
+    if duplicated:
+        raise LiveStatusError(f"情報源の名前が重複しています: {', '.join(duplicated)}")
+    return sources
+
+
+def parse_live_payload(payload: object, source: LiveSource) -> List[Tuple[str, Dict[str, object]]]:
+    """
+    応答のJSONを (施設名, {列名: 値}) のリストに変換
+    1施設分のオブジェクト（施設名は設定の spot）、施設ごとのオブジェクトの配列、{"items": 配列} のいずれか。
+    """
+    if isinstance(payload, dict) and isinstance(payload.get('items'), list):
+        payload = payload['items']
+    records = payload if isinstance(payload, list) else [payload]
+
+    parsed = []
+    for record in records:
+        if not isinstance(record, dict):
+            raise LiveStatusError("応答の形式が想定と異なります")
+        name = record.get('スポット名', record.get('name', source.spot))
+        if not name:
+            raise LiveStatusError("応答に施設名（スポット名）がありません")
+        fields = {}
+        for key, value in record.items():
+            column = LIVE_FIELD_ALIASES.get(key, key)
+            if column not in LIVE_STATUS_FIELDS or value is None:
+                continue
+            if column == '待ち時間（分）':
+                try:
+                    value = max(0, int(round(float(value))))
+                except (TypeError, ValueError, OverflowError):
+                    raise LiveStatusError(f"待ち時間が数値ではありません: {value}") from None
+            else:
+                value = str(value)
+            fields[column] = value
+        if fields:
+            parsed.append((str(name), fields))
+    return parsed
+
+
+def apply_live_status(spots_df: pd.DataFrame, status: Optional[LiveStatus]) -> pd.DataFrame:
+    """スポットデータの待ち時間・混雑状況・状態をリアルタイム情報で上書き（該当がなければ元のデータのまま）"""
+    if status is None or not status.spots:
+        return spots_df
+    mask = spots_df['スポット名'].isin(status.spots.keys())
+    if not mask.any():
+        return spots_df
+
+    spots_df = spots_df.copy()
+    names = spots_df.loc[mask, 'スポット名']
+    for column in LIVE_STATUS_FIELDS:
+        if column not in spots_df.columns:
+            continue
+        values = names.map(lambda name: status.spots[name].get(column))
+        values = values[values.notna()]
+        if len(values):
+            if column == '待ち時間（分）':
+                values = values.astype(spots_df[column].dtype)
+            spots_df.loc[values.index, column] = values
+    return spots_df
+
+
+def live_status_version(spots_df: pd.DataFrame) -> str:
+    """リアルタイム情報で上書きする列（待ち時間・混雑状況・状態）だけの版（待ち時間や状態を使うキャッシュのキーに加える）"""
+    return dataset_version(spots_df[[column for column in LIVE_STATUS_FIELDS if column in spots_df.columns]])
+
+
+def static_dataset_version(spots_df: pd.DataFrame) -> str:
+    """リアルタイム情報で上書きする列を除いた版（座標だけを使う移動時間行列などは情報の更新で作り直さない）"""
+    return dataset_version(spots_df.drop(columns=list(LIVE_STATUS_FIELDS), errors='ignore'))
+
+
+# HTTP/1.1の接続プール（標準ライブラリのみ）
+class _ConnectionPool:
+    """ホストごとに接続を使い回すHTTPクライアント（同時接続数はホストごとに上限あり）"""
+
+    def __init__(self, max_per_host: int):
+        self.max_per_host = max_per_host
+        self.opened = 0  # 新たに開いた接続の数
+        self._idle: Dict[tuple, List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+        self._slots: Dict[tuple, asyncio.Semaphore] = {}
+        self._ssl: Optional[ssl.SSLContext] = None
+
+    async def _connect(self, scheme: str, host: str, port: int):
+        if scheme == 'https' and self._ssl is None:
+            self._ssl = ssl.create_default_context()
+        self.opened += 1
+        return await asyncio.open_connection(host, port, ssl=self._ssl if scheme == 'https' else None)
+
+    async def get_json(self, url: str) -> object:
+        """URLのJSONを取得（応答が200以外・JSONでない場合は LiveStatusError）"""
+        parts = urlsplit(url)
+        scheme = parts.scheme
+        if scheme not in ('http', 'https') or not parts.hostname:
+            raise LiveStatusError(f"対応していないURLです: {url}")
+        key = (scheme, parts.hostname, parts.port or (443 if scheme == 'https' else 80))
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        request = (f'GET {target} HTTP/1.1\r\nHost: {parts.netloc}\r\nAccept: application/json\r\n'
+                   'User-Agent: hita-concierge\r\nConnection: keep-alive\r\n\r\n').encode('ascii')
+
+        slots = self._slots.setdefault(key, asyncio.Semaphore(self.max_per_host))
+        async with slots:
+            idle = self._idle.setdefault(key, [])
+            while True:
+                reused = bool(idle)
+                reader, writer = idle.pop() if reused else await self._connect(*key)
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    status, body, keep_alive = await _read_response(reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused:
+                        continue  # 相手が閉じた待機中の接続は、新しい接続でやり直す
+                    raise
+                except BaseException:
+                    writer.close()  # タイムアウト（キャンセル）時も途中の接続は使い回さない
+                    raise
+                break
+            if keep_alive:
+                idle.append((reader, writer))
+            else:
+                writer.close()
+
+        if status != 200:
+            raise LiveStatusError(f"HTTP {status}")
+        try:
+            return json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            raise LiveStatusError("応答がJSONとして読めません") from None
+
+    def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, bytes, bool]:
+    """応答を読み取る。Returns: (ステータスコード, 本文, 接続を使い回せるか)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("応答がないまま接続が閉じられました")
+    try:
+        version, status = status_line.decode('latin-1').split()[:2]
+        status = int(status)
+    except ValueError:
+        raise LiveStatusError("HTTPの応答として読めません") from None
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        chunks, total = [], 0
+        while True:
+            try:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+            except ValueError:
+                raise LiveStatusError("HTTPの応答として読めません") from None
+            if size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            total += size
+            if total > LIVE_MAX_RESPONSE_BYTES:
+                raise LiveStatusError("応答が大きすぎます")
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise LiveStatusError("HTTPの応答として読めません") from None
+        if length > LIVE_MAX_RESPONSE_BYTES:
+            raise LiveStatusError("応答が大きすぎます")
+        body = await reader.readexactly(length)
+    else:
+        # 長さの指定がない応答は接続が閉じられるまで読む
+        body = await reader.read(LIVE_MAX_RESPONSE_BYTES + 1)
+        if len(body) > LIVE_MAX_RESPONSE_BYTES:
+            raise LiveStatusError("応答が大きすぎます")
+        keep_alive = False
+    return status, body, keep_alive
+
+
+# 取得サービス
+class LiveStatusService:
+    """
+    情報源をバックグラウンドのイベントループで並行して取得し、結果を共有のTTLキャッシュに保持する
+    refresh() は取得を始めるだけで待たずに戻り、snapshot() はキャッシュ済みの値だけを返す。
+    from_file() で作成すると、refresh() のたびに設定ファイルの更新を確認して情報源を読み込み直す。
+    """
+
+    def __init__(self, sources: Sequence[LiveSource], refresh_sec: float = LIVE_REFRESH_SEC,
+                 ttl_sec: float = LIVE_TTL_SEC, max_connections_per_host: int = LIVE_MAX_CONNECTIONS_PER_HOST):
+        self.sources = tuple(sources)
+        self.refresh_sec = refresh_sec
+        self.max_connections_per_host = max_connections_per_host
+        self.cache = TTLCache(max(1, len(self.sources)), ttl_sec)  # 情報源の名前 → (取得時刻, 施設ごとの値)
+        self._errors: Dict[str, str] = {}
+        self._attempted: Dict[str, float] = {}  # 最後に取得を始めた時刻（monotonic）
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pool: Optional[_ConnectionPool] = None
+        self.sources_path: Optional[str] = None  # 情報源の設定ファイル（from_file で作成した場合）
+        self._sources_mtime: Optional[float] = None
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> 'LiveStatusService':
+        """
+        設定ファイルから作成（読み込めない場合も情報源なしで作成し、理由はファイル名をキーに errors に記録する）
+        ファイルが更新されると refresh() で読み込み直すため、設定を変えてもサービスを作り直す必要はない
+        """
+        service = cls((), **kwargs)
+        service.sources_path = path
+        service._reload_sources()
+        return service
+
+    def _reload_sources(self):
+        """設定ファイルが更新されていれば情報源を読み込み直す（読み込めない場合は前の情報源のまま）"""
+        try:
+            mtime = os.path.getmtime(self.sources_path)
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime == self._sources_mtime:
+            return
+        self._sources_mtime = mtime
+        config_name = os.path.basename(self.sources_path)
+        try:
+            sources = tuple(load_live_sources(self.sources_path))
+        except LiveStatusError as e:
+            with self._lock:
+                self._errors[config_name] = str(e)
+            return
+
+        # 定義の変わらない情報源は取得済みの値と取得時刻を引き継ぎ、それ以外はすぐに取得する
+        names = {source.name for source in set(sources) & set(self.sources)}
+        for source in self.sources:
+            if source.name not in names:
+                self.cache.delete(source.name)
+        with self._lock:
+            self.sources = sources
+            self.cache.max_entries = max(1, len(sources))
+            self._attempted = {name: t for name, t in self._attempted.items() if name in names}
+            self._errors = {name: error for name, error in self._errors.items() if name in names}
+
+    async def _fetch_source(self, pool: _ConnectionPool, source: LiveSource):
+        try:
+            payload = await asyncio.wait_for(pool.get_json(source.url), source.timeout_sec)
+            records = parse_live_payload(payload, source)
+        except asyncio.TimeoutError:
+            error = f"{source.timeout_sec:g}秒以内に応答がありません"
+        except Exception as e:
+            # 長すぎるヘッダー行など想定外の応答も、取得できなかった情報源として記録する（Futureに埋もれさせない）
+            error = str(e) or type(e).__name__
+        else:
+            if source not in self.sources:
+                return  # 取得中に設定から外された情報源
+            self.cache.set(source.name, (time.time(), records))
+            with self._lock:
+                self._errors.pop(source.name, None)
+            return
+        with self._lock:
+            self._errors[source.name] = error
+
+    async def fetch_all(self, sources: Optional[Sequence[LiveSource]] = None, pool: Optional[_ConnectionPool] = None):
+        """情報源（省略時はすべて）を並行して取得しキャッシュに保存（失敗は errors に記録）"""
+        owned = pool is None
+        pool = pool or _ConnectionPool(self.max_connections_per_host)
+        try:
+            await asyncio.gather(*(self._fetch_source(pool, source) for source in sources or self.sources))
+        finally:
+            if owned:
+                pool.close()
+
+    def refresh(self) -> bool:
+        """間隔が過ぎた情報源の取得をバックグラウンドで始める（待たずに戻る）。始めた場合はTrue"""
+        if self.sources_path is not None:
+            self._reload_sources()
+        now = time.monotonic()
+        with self._lock:
+            due = [source for source in self.sources
+                   if now - self._attempted.get(source.name, -inf) >= self.refresh_sec]
+            if not due:
+                return False
+            for source in due:
+                self._attempted[source.name] = now
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._pool = _ConnectionPool(self.max_connections_per_host)
+                threading.Thread(target=self._loop.run_forever, name='live-status', daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.fetch_all(due, self._pool), self._loop)
+        return True
+
+    def snapshot(self) -> LiveStatus:
+        """キャッシュ済みの値（期限切れの情報源は含めない）"""
+        spots: Dict[str, Dict[str, object]] = {}
+        stores = []
+        fetched = []
+        for source in self.sources:
+            cached = self.cache.get(source.name)
+            if cached is None:
+                continue
+            fetched_at, records = cached
+            fetched.append(fetched_at)
+            for name, fields in records:
+                if source.kind == 'store':
+                    stores.append((name, str(fields.get('状態', ''))))
+                else:
+                    spots.setdefault(name, {}).update(fields)
+        with self._lock:
+            errors = dict(self._errors)
+        return LiveStatus(spots, tuple(stores), errors, min(fetched) if fetched else None)
+
+    def close(self):
+        """バックグラウンドのイベントループを止める"""
+        with self._lock:
+            loop, pool = self._loop, self._pool
+            self._loop = self._pool = None
+        if loop is not None:
+            loop.call_soon_threadsafe(pool.close)
+            loop.call_soon_threadsafe(loop.stop)
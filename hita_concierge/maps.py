@@ -0,0 +1,217 @@
+"""Foliumマップの作成（foliumは地図作成時に読み込む）"""
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .geo import calculate_distance, distances_from_point
+from .hazards import HazardLayer
+from .isochrones import Isochrone
+from .roads import RoadRoute
+from .store import as_spot_store
+from .tiles import TileServer
+from .tracing import traced
+
+if TYPE_CHECKING:
+    import folium
+    from folium.plugins import FastMarkerCluster
+
+MARKER_CLUSTER_THRESHOLD = 100  # この件数を超えるとマーカーをクラスタ表示
+HAZARD_FILL_OPACITY = 0.25  # 想定区域の塗りの不透明度
+ISOCHRONE_FILL_OPACITY = 0.15  # 到達圏の塗りの不透明度（区切りごとに重ねて塗る）
+MAP_MAX_ZOOM = 19  # 地図の最大ズーム（タイルサーバーの最大ズームより先はタイルを引き伸ばす）
+
+# マーカーをブラウザ側でデータから生成するコールバック（行: [緯度, 経度, ポップアップHTML, ツールチップ]）
+MARKER_CALLBACK_JS = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.setIcon(L.AwesomeMarkers.icon({icon: 'info-sign', markerColor: 'blue', prefix: 'glyphicon'}));
+    marker.bindPopup(row[2], {maxWidth: 300});
+    marker.bindTooltip(row[3]);
+    return marker;
+}
+"""
+
+
+def build_popup_html(row: dict, distance: float) -> str:
+    """スポットのポップアップHTMLを作成"""
+    popup_html = f"""
+        <div style="width: 250px; font-family: sans-serif;">
+            <h4 style="margin: 0 0 10px 0; color: #1f77b4;">{row['スポット名']}</h4>
+            <p style="margin: 5px 0;"><b>📝 説明:</b><br>{row['説明']}</p>
+            <p style="margin: 5px 0;"><b>📏 現在地から:</b> {distance:.2f} km</p>
+        """
+
+    # カテゴリ情報（観光モード）
+    if 'カテゴリ' in row:
+        popup_html += f'<p style="margin: 5px 0;"><b>🏷️ カテゴリ:</b> {row["カテゴリ"]}</p>'
+    if '営業時間' in row:
+        popup_html += f'<p style="margin: 5px 0;"><b>🕐 営業時間:</b> {row["営業時間"]}</p>'
+    if '料金' in row:
+        popup_html += f'<p style="margin: 5px 0;"><b>💰 料金:</b> {row["料金"]}</p>'
+
+    # 収容人数情報（防災モード）
+    if '収容人数' in row:
+        popup_html += f'<p style="margin: 5px 0;"><b>👥 収容人数:</b> {row["収容人数"]}名</p>'
+    if '状態' in row:
+        status_color = 'green' if row['状態'] == '開設中' else 'orange'
+        popup_html += f'<p style="margin: 5px 0;"><b>🚨 状態:</b> <span style="color: {status_color};">{row["状態"]}</span></p>'
+
+    popup_html += "</div>"
+    return popup_html
+
+
+@traced()
+def build_marker_data(spots_df: pd.DataFrame, center_lat: float, center_lng: float) -> List[list]:
+    """
+    スポットマーカーのデータを作成
+    Returns: [[緯度, 経度, ポップアップHTML, ツールチップ], ...]
+    """
+    # 座標は列指向ストアから取得し、現在地から全スポットへの距離を一括計算
+    spots = as_spot_store(spots_df)
+    distances = distances_from_point(center_lat, center_lng, spots.lats, spots.lngs)
+
+    # 行ごとのSeriesを作らず辞書で参照
+    return [
+        [float(lat), float(lng), build_popup_html(row, distance), str(row['スポット名'])]
+        for lat, lng, distance, row in zip(spots.lats, spots.lngs, distances, spots_df.to_dict('records'))
+    ]
+
+
+def build_marker_layer(marker_data: List[list]) -> 'FastMarkerCluster':
+    """
+    スポットマーカーのレイヤーを作成
+    マーカーはデータ配列からブラウザ側で生成し、件数が多い場合のみクラスタ表示する
+    """
+    from folium.plugins import FastMarkerCluster
+
+    options = {} if len(marker_data) > MARKER_CLUSTER_THRESHOLD else {'disableClusteringAtZoom': 1}
+    return FastMarkerCluster(marker_data, callback=MARKER_CALLBACK_JS, name='スポット', **options)
+
+
+def build_hazard_layer(hazard_layer: HazardLayer) -> 'folium.GeoJson':
+    """想定区域のレイヤーを作成（読み込み時に作ったGeoJSONを使い、ファイルは読み直さない）"""
+    import folium
+
+    return folium.GeoJson(
+        hazard_layer.geojson,
+        name='浸水・土砂災害の想定区域',
+        style_function=lambda feature: {
+            'color': feature['properties']['color'],
+            'fillColor': feature['properties']['color'],
+            'weight': 1,
+            'fillOpacity': HAZARD_FILL_OPACITY,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=['種別', '名称'], aliases=['種別', '名称']),
+    )
+
+
+def build_isochrone_layer(isochrone: Isochrone, max_minutes: Optional[int] = None) -> 'folium.GeoJson':
+    """到達圏のレイヤーを作成（max_minutes 以下の区切りを、広い区切りから重ねて塗る）"""
+    import folium
+
+    features = [
+        feature for feature in isochrone.geojson['features']
+        if max_minutes is None or feature['properties']['分'] <= max_minutes
+    ]
+    return folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        name='到達圏',
+        style_function=lambda feature: {
+            'color': feature['properties']['color'],
+            'fillColor': feature['properties']['color'],
+            'weight': 1,
+            'fillOpacity': ISOCHRONE_FILL_OPACITY,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=['名称'], aliases=['到達圏']),
+    )
+
+
+@traced()
+def create_enhanced_map(spots_df, center_location, selected_spot=None, show_route=False,
+                        marker_data: Optional[List[list]] = None,
+                        road_route: Optional[RoadRoute] = None,
+                        hazard_layer: Optional[HazardLayer] = None,
+                        tile_server: Optional[TileServer] = None,
+                        isochrone: Optional[Isochrone] = None,
+                        isochrone_minutes: Optional[int] = None) -> Tuple['folium.Map', 'folium.FeatureGroup']:
+    """
+    Foliumマップを作成
+    Returns: (スポットマーカー入りの地図, 再実行ごとに変わる要素のレイヤー)
+    marker_data に build_marker_data の結果（キャッシュ済みのもの）を渡すと再計算を省略する。
+    road_route を渡すと、選択スポットへのルートを直線ではなく道路に沿って表示する。
+    hazard_layer を渡すと、浸水・土砂災害の想定区域を重ねて表示する。
+    tile_server を渡すと、公開のタイルサーバーの代わりにローカルのタイルサーバーの地図を表示する。
+    isochrone を渡すと、現在地からの到達圏（isochrone_minutes 以下の区切り）を重ねて表示する。
+    2つ目の戻り値は st_folium の feature_group_to_add に渡すと地図を再読み込みせずに更新できる。
+    """
+    import folium
+
+    if marker_data is None:
+        marker_data = build_marker_data(spots_df, center_location[0], center_location[1])
+
+    if tile_server is not None:
+        m = folium.Map(location=center_location, zoom_start=13, tiles=None)
+        folium.TileLayer(
+            tiles=tile_server.url,
+            attr=tile_server.attribution,
+            name='地図',
+            min_zoom=tile_server.min_zoom,
+            max_zoom=MAP_MAX_ZOOM,
+            max_native_zoom=tile_server.max_zoom,
+        ).add_to(m)
+    else:
+        m = folium.Map(
+            location=center_location,
+            zoom_start=13,
+            tiles='OpenStreetMap'
+        )
+    if hazard_layer is not None:
+        build_hazard_layer(hazard_layer).add_to(m)
+    build_marker_layer(marker_data).add_to(m)
+
+    dynamic_layer = folium.FeatureGroup(name='現在地・ルート')
+
+    # 到達圏（現在地ごとに変わるため、再実行ごとに差し替えるレイヤーに入れる）
+    if isochrone is not None:
+        build_isochrone_layer(isochrone, isochrone_minutes).add_to(dynamic_layer)
+
+    # 現在地マーカー（赤・大きめ）
+    folium.Marker(
+        center_location,
+        popup=folium.Popup("📍 <b>現在地</b>", max_width=200),
+        tooltip="現在地",
+        icon=folium.Icon(color='red', icon='home', prefix='fa')
+    ).add_to(dynamic_layer)
+
+    # 選択されたスポットを強調表示
+    matches = np.flatnonzero(spots_df['スポット名'].to_numpy() == selected_spot) if selected_spot else []
+    if len(matches) > 0:
+        selected_row = spots_df.iloc[matches[0]]
+        lat, lng = float(selected_row['緯度']), float(selected_row['経度'])
+        folium.Marker(
+            [lat, lng],
+            tooltip=selected_spot,
+            icon=folium.Icon(color='green', icon='info-sign')
+        ).add_to(dynamic_layer)
+
+        # 選択されたスポットへのルートを表示（道路データがない場合は直線）
+        if show_route and road_route is not None:
+            folium.PolyLine(
+                locations=road_route.coordinates,
+                color='red',
+                weight=4,
+                opacity=0.8,
+                popup=f"道路距離: {road_route.distance_km:.2f} km（約{int(road_route.minutes)}分）"
+            ).add_to(dynamic_layer)
+        elif show_route:
+            distance = calculate_distance(center_location[0], center_location[1], lat, lng)
+            folium.PolyLine(
+                locations=[center_location, [lat, lng]],
+                color='red',
+                weight=3,
+                opacity=0.7,
+                popup=f"直線距離: {distance:.2f} km"
+            ).add_to(dynamic_layer)
+
+    return m, dynamic_layer
@@ -0,0 +1,278 @@
+"""時間・予算の上限つきの観光ルート（選択スポットから回るスポットと順序を選ぶオリエンテーリング問題）"""
+import time
+from math import inf
+from typing import List, Optional, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .data import window_departure
+from .roads import RoadGraph
+from .routing import HELD_KARP_MAX_STOPS, ROUTE_TIME_BUDGET_SEC, path_length, solve_local_search
+from .store import SpotStore, as_spot_store
+from .tracing import traced
+from .transit import TRANSIT_DEFAULT_START_MINUTES, TransitTimetable
+from .travel_matrix import TravelMatrix, route_matrices
+
+# 所要時間の行列は行・列0が出発地、1〜nが選択スポット。ルートは1〜nの位置リストで扱う。
+# 時刻は出発日の0時からの分で扱い、営業時間外に着いた場合は開館まで待つ（schedule.py と同じ）。
+ORIENTEERING_SOLVERS = ('auto', 'exact', 'insertion')
+
+
+def _departures(travel: np.ndarray, durations: np.ndarray, opens: np.ndarray, closes: np.ndarray,
+                start_minutes: float, route: List[int]) -> np.ndarray:
+    """出発時刻と、順序どおりに回った各スポットの出発時刻（営業時間内に回れない場合は以降inf）"""
+    departures = np.empty(len(route) + 1)
+    departures[0] = start_minutes
+    current = 0
+    for i, p in enumerate(route, 1):
+        departures[i] = window_departure(
+            departures[i - 1] + travel[current, p], durations[p - 1], opens[p - 1], closes[p - 1]
+        )
+        current = p
+    return departures
+
+
+def route_minutes(travel: np.ndarray, durations: np.ndarray, opens: np.ndarray, closes: np.ndarray,
+                  start_minutes: float, route: List[int]) -> float:
+    """出発から順序どおりに回り終えるまでの所要時間（開館待ちを含む。営業時間内に回れない場合はinf）"""
+    return float(_departures(travel, durations, opens, closes, start_minutes, route)[-1]) - start_minutes
+
+
+def solve_orienteering_exact(travel: np.ndarray, durations: np.ndarray, fees: np.ndarray, scores: np.ndarray,
+                             opens: np.ndarray, closes: np.ndarray, start_minutes: float,
+                             time_limit: float, budget: float) -> List[int]:
+    """
+    動的計画法による厳密解（訪問する集合と最後のスポットごとの最早出発時刻。上限を超えた集合からは広げない）
+    Returns: おすすめ度の合計が最大のルート（同じ場合は所要時間が最短のもの）
+    """
+    n = travel.shape[0] - 1
+    if n == 0:
+        return []
+
+    bits = 1 << np.arange(n)
+    full = 1 << n
+    masks = np.arange(full)
+    members = (masks[:, None] & bits) > 0
+    mask_fees = np.where(members, fees, 0.0).sum(axis=1)  # 料金不明（nan）を含む集合だけがnanになる
+    mask_scores = members @ scores
+    sizes = members.sum(axis=1)
+    cost = travel[1:, 1:]
+    end = start_minutes + time_limit
+
+    # dp[mask, j]: maskのスポットをすべて回ってjを出発する最早時刻（上限を超える・営業時間に間に合わない場合はinf）
+    dp = np.full((full, n), np.inf)
+    parent = np.full((full, n), -1, dtype=np.int64)
+    first = window_departure(start_minutes + travel[0, 1:], durations, opens, closes)
+    dp[bits, np.arange(n)] = np.where((first <= end) & (fees <= budget), first, np.inf)
+
+    # 訪問数の同じ集合をまとめて計算し、上限内の集合がなくなったらそれより大きい集合も打ち切る
+    for size in range(2, n + 1):
+        layer = masks[(sizes == size) & (mask_fees <= budget)]
+        if not len(layer):
+            break
+        # arrivals[mask, j, k]: kを出発してjに着く時刻。到着が早いほど出発も早いため最早到着だけを時間帯と照合する
+        arrivals = dp[layer[:, None] ^ bits] + cost.T
+        best = np.argmin(arrivals, axis=2)
+        earliest = np.take_along_axis(arrivals, best[..., None], axis=2)[..., 0]
+        values = window_departure(earliest, durations, opens, closes)
+        values[values > end] = np.inf
+        dp[layer] = values
+        parent[layer] = best
+        if not np.isfinite(values).any():
+            break
+
+    # おすすめ度の合計が最大の集合（同じ場合は所要時間が最短）。どこも回れない場合は空
+    finish = dp.min(axis=1)
+    finish[0] = start_minutes
+    feasible = np.flatnonzero(np.isfinite(finish))
+    mask = int(feasible[np.lexsort((finish[feasible], -mask_scores[feasible]))[0]])
+
+    route = []
+    last = int(np.argmin(dp[mask])) if mask else -1
+    while last >= 0:
+        route.append(last + 1)
+        prev = int(parent[mask, last])
+        mask ^= 1 << last
+        last = prev
+    return route[::-1]
+
+
+def _insertion_finishes(travel: np.ndarray, durations: np.ndarray, opens: np.ndarray, closes: np.ndarray,
+                        route: List[int], departures: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """
+    finish[c, k]: ルートの k 番目のスポットの後ろ（0は出発地の直後）に candidates[c] を入れた場合の最後の出発時刻
+    後続のスポットの開館待ち・営業時間も考慮する（回れなくなる場合はinf）
+    """
+    prev = np.array([0] + route)
+    finish = window_departure(
+        departures[None, :] + travel[prev[None, :], candidates[:, None]], durations[candidates - 1][:, None],
+        opens[candidates - 1][:, None], closes[candidates - 1][:, None]
+    )
+    # 後続のスポットを順に回る（q 番目のスポットの直前は、k = q - 1 なら挿入したスポット、それ以外は元のルートの前のスポット）
+    for q, stop in enumerate(route, 1):
+        arrive = finish[:, :q] + travel[prev[q - 1], stop]
+        arrive[:, q - 1] = finish[:, q - 1] + travel[candidates, stop]
+        finish[:, :q] = window_departure(arrive, durations[stop - 1], opens[stop - 1], closes[stop - 1])
+    return finish
+
+
+def _insert_greedily(travel: np.ndarray, durations: np.ndarray, fees: np.ndarray, scores: np.ndarray,
+                     opens: np.ndarray, closes: np.ndarray, start_minutes: float, time_limit: float, budget: float,
+                     route: List[int], banned: Set[int]) -> List[int]:
+    """時間あたりのおすすめ度が最も高いスポットを、最後の出発が最も早くなる位置に入れられなくなるまで入れる"""
+    route = list(route)
+    departures = _departures(travel, durations, opens, closes, start_minutes, route)
+    used_fee = float(fees[np.asarray(route, dtype=np.int64) - 1].sum())
+    remaining = np.r_[False, scores > 0]  # おすすめ度が0のスポットは入れても得点が増えない
+    remaining[route] = False
+    remaining[list(banned)] = False
+    while True:
+        candidates = np.flatnonzero(remaining)
+        candidates = candidates[used_fee + fees[candidates - 1] <= budget]
+        if not len(candidates):
+            return route
+        finish = _insertion_finishes(travel, durations, opens, closes, route, departures, candidates)
+        position = np.argmin(finish, axis=1)
+        best_finish = finish[np.arange(len(candidates)), position]
+        fits = best_finish <= start_minutes + time_limit
+        if not fits.any():
+            return route
+        # 開館待ちの間に回れる場合は増える時間が0になるため、下限を設けて比べる
+        delta = best_finish - departures[-1]
+        ratio = np.where(fits, scores[candidates - 1] / np.maximum(delta, 1e-9), -np.inf)
+        best = int(np.lexsort((delta, -ratio))[0])
+        stop = int(candidates[best])
+        route.insert(int(position[best]), stop)
+        departures = _departures(travel, durations, opens, closes, start_minutes, route)
+        used_fee += float(fees[stop - 1])
+        remaining[stop] = False
+
+
+def _fill_route(travel: np.ndarray, durations: np.ndarray, fees: np.ndarray, scores: np.ndarray,
+                opens: np.ndarray, closes: np.ndarray, start_minutes: float, time_limit: float, budget: float,
+                route: List[int], banned: Set[int], deadline: float) -> List[int]:
+    """
+    挿入と順序の短縮（2-opt・Or-opt）を、空いた時間に入れられるスポットがなくなるまで繰り返す
+    短縮した順序は、営業時間内に回れて最後の出発が早くなる場合だけ採用する
+    """
+    while True:
+        route = _insert_greedily(
+            travel, durations, fees, scores, opens, closes, start_minutes, time_limit, budget, route, banned
+        )
+        if len(route) < 3 or time.perf_counter() >= deadline:
+            return route
+        sub = np.array([0] + route)
+        order = solve_local_search(travel[np.ix_(sub, sub)], list(range(1, len(route) + 1)), deadline)
+        shorter = [route[p - 1] for p in order]
+        if (route_minutes(travel, durations, opens, closes, start_minutes, shorter)
+                >= route_minutes(travel, durations, opens, closes, start_minutes, route) - 1e-9):
+            return route
+        route = shorter
+
+
+def solve_orienteering_insertion(travel: np.ndarray, durations: np.ndarray, fees: np.ndarray, scores: np.ndarray,
+                                 opens: np.ndarray, closes: np.ndarray, start_minutes: float,
+                                 time_limit: float, budget: float, deadline: float) -> List[int]:
+    """
+    挿入法による近似解（時間あたりのおすすめ度が高いスポットから入れ、順序を短縮して空いた時間にさらに入れる）
+    その後、おすすめ度の低いスポットを1つ外して入れ直し、おすすめ度の合計が増える（同じなら時間が短い）場合に採用する
+    """
+    windows = (opens, closes, start_minutes, time_limit, budget)
+
+    def key(route):
+        return (-float(scores[np.asarray(route, dtype=np.int64) - 1].sum()),
+                route_minutes(travel, durations, opens, closes, start_minutes, route))
+
+    route = _fill_route(travel, durations, fees, scores, *windows, [], set(), deadline)
+    best_key = key(route)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for stop in sorted(route, key=lambda p: scores[p - 1]):
+            if time.perf_counter() >= deadline:
+                break
+            trial = _fill_route(
+                travel, durations, fees, scores, *windows, [p for p in route if p != stop], {stop}, deadline
+            )
+            trial_key = key(trial)
+            if trial_key[0] < best_key[0] or (trial_key[0] == best_key[0] and trial_key[1] < best_key[1] - 1e-9):
+                route, best_key, improved = trial, trial_key, True
+                break
+    return route
+
+
+def select_route_within_limits(travel: np.ndarray, durations: np.ndarray, fees: np.ndarray, scores: np.ndarray,
+                               opens: np.ndarray, closes: np.ndarray, start_minutes: float,
+                               time_limit: float = inf, budget: float = inf, solver: str = 'auto',
+                               time_budget: float = ROUTE_TIME_BUDGET_SEC) -> List[int]:
+    """
+    上限内で回るスポットと順序を算出
+    Args:
+        travel: 所要時間の行列（分。行・列0が出発地）
+        durations: スポットごとの滞在＋待ち時間（分）
+        fees: スポットごとの料金（円。不明はnanで、予算を指定した場合は選ばない）
+        scores: スポットごとのおすすめ度
+        opens / closes: スポットごとの営業時間（0時からの分。末尾の次元が時間帯）
+        start_minutes: 出発時刻（0時からの分）
+        time_limit: 出発から最後のスポットを出るまでの上限（分。開館待ちを含む）
+        budget: 料金の合計の上限（円）
+        solver: 'auto'（HELD_KARP_MAX_STOPS 箇所以下は厳密解） / 'exact' / 'insertion'
+        time_budget: 近似解の計算時間上限（秒）
+    Returns:
+        訪問順の位置リスト（1〜n）
+    """
+    if solver not in ORIENTEERING_SOLVERS:
+        raise ValueError(f"未対応のソルバーです: {solver}")
+    durations = np.asarray(durations, dtype=np.float64)
+    fees = np.asarray(fees, dtype=np.float64)
+    if not np.isfinite(budget):
+        fees = np.nan_to_num(fees, nan=0.0)  # 予算の指定がなければ料金不明でも選べる
+    scores = np.asarray(scores, dtype=np.float64)
+    args = (travel, durations, fees, scores, opens, closes, float(start_minutes), time_limit, budget)
+    if solver == 'auto':
+        solver = 'exact' if travel.shape[0] - 1 <= HELD_KARP_MAX_STOPS else 'insertion'
+    if solver == 'exact':
+        return solve_orienteering_exact(*args)
+    return solve_orienteering_insertion(*args, time.perf_counter() + time_budget)
+
+
+@traced()
+def optimize_route_budget(current_loc: List[float], spots: Union[SpotStore, pd.DataFrame], selected_indices: List[int],
+                          time_limit: float = inf, budget_yen: float = inf, solver: str = 'auto',
+                          road_graph: Optional[RoadGraph] = None,
+                          travel_matrix: Optional[TravelMatrix] = None,
+                          transit: Optional[TransitTimetable] = None,
+                          start_minutes: float = TRANSIT_DEFAULT_START_MINUTES
+                          ) -> Tuple[List[int], float, float, List[int]]:
+    """
+    観光モード用の時間・予算の上限つきの最適化経路算出（選択スポットをすべて回れない場合に、回るスポットを選ぶ）
+    start_minutes に出発し、営業時間内に回って最後のスポットを出るまで（移動＋滞在・待ち時間＋開館待ち）が
+    time_limit 分以内、料金の合計が budget_yen 円以内で、おすすめ度の合計が最大になるスポットと訪問順を選ぶ
+    （同じ場合は所要時間が最短のもの。予算を指定した場合、料金不明のスポットは選ばない）
+    road_graph・travel_matrix・transit は optimize_route_tourism と同じ
+    Returns: (訪問順のインデックスリスト, 総移動距離, 総所要時間, 除外したインデックスのリスト)
+    """
+    if not selected_indices:
+        return [], 0.0, 0.0, []
+
+    spots = as_spot_store(spots)
+    dist_matrix, time_matrix = route_matrices(
+        current_loc, spots, selected_indices, 40, road_graph, travel_matrix,  # 直線距離は時速40kmで計算（分）
+        transit, start_minutes
+    )
+    durations = (spots.stay_minutes[selected_indices] + spots.wait_minutes[selected_indices]).astype(np.float64)
+    opens = spots.open_minutes[selected_indices]
+    closes = spots.close_minutes[selected_indices]
+    order = select_route_within_limits(
+        time_matrix, durations, spots.fees_yen[selected_indices], spots.scores[selected_indices], opens, closes,
+        start_minutes, time_limit, budget_yen, solver
+    )
+
+    visited = set(order)
+    return (
+        [selected_indices[pos - 1] for pos in order],
+        path_length(dist_matrix, order),
+        route_minutes(time_matrix, durations, opens, closes, start_minutes, order),
+        [idx for pos, idx in enumerate(selected_indices, 1) if pos not in visited],
+    )
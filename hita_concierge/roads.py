@@ -0,0 +1,486 @@
+"""道路ネットワークによる経路探索（ローカルのOSM抽出データのみ使用し、外部サービスに接続しない）"""
+import hashlib
+import heapq
+import os
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from functools import cached_property
+from importlib.util import find_spec
+from math import inf
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .geo import cross_distance_matrix, distance_matrix, distances_from_point, paired_distances
+from .spatial import SpatialGridIndex
+from .store import SpotStore, as_spot_store
+from .tracing import traced
+
+# 道路データは行・列0が出発地、1〜nが訪問スポットの行列にして既存のソルバーへ渡す
+ROAD_NETWORK_FILES = ('hita.osm.pbf', 'hita.osm')  # 道路データ（OSM抽出）の既定のファイル名
+ROAD_PROFILES = ('walking', 'driving')  # 徒歩・車
+PROFILE_SPEED_KMH = {'walking': 4, 'driving': 40}  # 道路でつながらない区間の速度（直線距離で計算）
+ACCESS_SPEED_KMH = 4  # 地点から最寄りの道路までの移動速度（徒歩）
+SNAP_MAX_KM = 0.5  # 最寄りの道路までこれより遠い地点は直線距離で計算
+ROAD_SNAP_CELL_KM = 0.2  # 道路の交点を検索する空間インデックスのセルの大きさ（km）
+
+# 車の道路種別ごとの速度（km/h）。maxspeedタグがあればそちらを使う
+DRIVING_SPEEDS_KMH = {
+    'motorway': 80, 'motorway_link': 40,
+    'trunk': 50, 'trunk_link': 30,
+    'primary': 50, 'primary_link': 30,
+    'secondary': 40, 'secondary_link': 30,
+    'tertiary': 40, 'tertiary_link': 30,
+    'unclassified': 30, 'residential': 30,
+    'living_street': 15, 'service': 15, 'track': 10,
+}
+# 徒歩で通れる道路種別（高速道路を除く）
+WALKING_HIGHWAYS = frozenset(
+    set(DRIVING_SPEEDS_KMH) - {'motorway', 'motorway_link'}
+    | {'footway', 'path', 'pedestrian', 'steps', 'cycleway', 'bridleway'}
+)
+_USED_TAGS = ('highway', 'oneway', 'junction', 'access', 'foot', 'motor_vehicle', 'maxspeed')
+_CLOSED = ('no', 'private')
+
+
+class RoadDataError(Exception):
+    """道路データの読み込みエラー"""
+
+
+@dataclass(frozen=True)
+class RoadRoute:
+    """道路に沿った経路"""
+    coordinates: List[Tuple[float, float]]  # 出発地〜道路上の交点〜目的地の (緯度, 経度)
+    distance_km: float
+    minutes: float
+
+
+@dataclass(frozen=True)
+class RoadGraph:
+    """1つの移動手段の道路グラフ（CSR形式。交点 u から出る辺は indices[indptr[u]:indptr[u + 1]]）"""
+    profile: str
+    lats: np.ndarray  # float64 (交点数,)
+    lngs: np.ndarray  # float64 (交点数,)
+    indptr: np.ndarray  # int64 (交点数 + 1,)
+    indices: np.ndarray  # int32 (辺数,) 行き先の交点
+    lengths_km: np.ndarray  # float32 (辺数,)
+    minutes: np.ndarray  # float32 (辺数,)
+    max_speed_kmh: float  # A*の下限見積もりに使う最高速度
+    costs: Optional[np.ndarray] = None  # float32 (辺数,) 探索に使う重み。Noneの場合は minutes
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices)
+
+    @cached_property
+    def _adjacency(self) -> Tuple[list, list, list, list]:
+        """
+        探索用のリスト（要素ごとのアクセスはNumPy配列よりリストが速い）
+        重み（costs）がある場合は、探索中に積み上げる距離を複素数（実部: 距離、虚部: 所要時間）にして
+        1回の足し算で両方を積み上げる（重みのないグラフの探索は従来のまま）
+        """
+        if self.costs is None:
+            return self.indptr.tolist(), self.indices.tolist(), self.minutes.tolist(), self.lengths_km.tolist()
+        carried = (self.lengths_km.astype(np.float64) + 1j * self.minutes).tolist()
+        return self.indptr.tolist(), self.indices.tolist(), self.costs.tolist(), carried
+
+    def _split_carried(self, weight: float, carried) -> Tuple[float, float]:
+        """探索結果の (重み, 積み上げた距離) を (所要時間, 距離) にする"""
+        if self.costs is None:
+            return weight, carried
+        return carried.imag, carried.real
+
+    @cached_property
+    def _snap_index(self) -> SpatialGridIndex:
+        return SpatialGridIndex(self.lats, self.lngs, ROAD_SNAP_CELL_KM)
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """グラフの内容から算出したハッシュ値（道路データの版の照合に使う）"""
+        digest = hashlib.sha1(self.profile.encode())
+        for array in (self.lats, self.lngs, self.indptr, self.indices, self.lengths_km, self.minutes):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        if self.costs is not None:
+            digest.update(np.ascontiguousarray(self.costs).tobytes())
+        return digest.hexdigest()[:16]
+
+    def nearest_node(self, lat: float, lng: float) -> Tuple[int, float]:
+        """最寄りの交点と距離（km）。道路がない場合は (-1, inf)"""
+        nodes, distances = self._snap_index.query_nearest(lat, lng, k=1)
+        if not len(nodes):
+            return -1, inf
+        return int(nodes[0]), float(distances[0])
+
+    @property
+    def undirected(self) -> bool:
+        """すべての道路が双方向か（徒歩）"""
+        return self.profile == 'walking'
+
+    def shortest_path(self, source: int, target: int) -> Optional[Tuple[List[int], float, float]]:
+        """
+        A*による最短時間経路（下限見積もりは直線距離を最高速度で割った時間）
+        costs がある場合は重みが最小の経路を探し、その経路の所要時間・距離を返す
+        Returns: (交点のリスト, 所要時間（分）, 距離（km）) ※つながっていない場合はNone
+        """
+        indptr, indices, minutes, lengths = self._adjacency
+        estimate = (distances_from_point(self.lats[target], self.lngs[target], self.lats, self.lngs)
+                    / self.max_speed_kmh * 60).tolist()
+        best = [inf] * len(self)
+        km = [0.0] * len(self)
+        parent = [-1] * len(self)
+        best[source] = 0.0
+        heap = [(estimate[source], 0.0, source)]
+        heappop, heappush = heapq.heappop, heapq.heappush
+        while heap:
+            _, elapsed, u = heappop(heap)
+            if u == target:
+                break
+            if elapsed > best[u]:
+                continue
+            lo, hi = indptr[u], indptr[u + 1]
+            base_km = km[u]
+            for v, edge_minutes, edge_km in zip(indices[lo:hi], minutes[lo:hi], lengths[lo:hi]):
+                candidate = elapsed + edge_minutes
+                if candidate < best[v]:
+                    best[v] = candidate
+                    km[v] = base_km + edge_km
+                    parent[v] = u
+                    heappush(heap, (candidate + estimate[v], candidate, v))
+        else:
+            return None
+
+        path = [target]
+        while parent[path[-1]] >= 0:
+            path.append(parent[path[-1]])
+        return (path[::-1], *self._split_carried(best[target], km[target]))
+
+    def travel_from(self, source: int, targets: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        1つの交点から複数の交点への最短時間（Dijkstra法。全目的地が確定した時点で打ち切る）
+        costs がある場合は重みが最小の経路を探し、その経路の所要時間・距離を返す
+        Returns: (所要時間（分）, 距離（km）) ※つながっていない目的地はinf
+        """
+        indptr, indices, minutes, lengths = self._adjacency
+        best = [inf] * len(self)
+        km = [inf] * len(self)
+        best[source] = km[source] = 0.0
+        remaining = set(targets)
+        heap = [(0.0, source)]
+        heappop, heappush = heapq.heappop, heapq.heappush
+        while heap and remaining:
+            elapsed, u = heappop(heap)
+            if elapsed > best[u]:
+                continue
+            remaining.discard(u)
+            lo, hi = indptr[u], indptr[u + 1]
+            base_km = km[u]
+            for v, edge_minutes, edge_km in zip(indices[lo:hi], minutes[lo:hi], lengths[lo:hi]):
+                candidate = elapsed + edge_minutes
+                if candidate < best[v]:
+                    best[v] = candidate
+                    km[v] = base_km + edge_km
+                    heappush(heap, (candidate, v))
+
+        # 打ち切り時点で未確定の目的地は、つながっていない
+        found = [t not in remaining for t in targets]
+        reached = [self._split_carried(best[t], km[t]) if ok else (inf, inf) for t, ok in zip(targets, found)]
+        return (np.array([minutes for minutes, _ in reached], dtype=np.float64),
+                np.array([distance for _, distance in reached], dtype=np.float64))
+
+    def travel_within(self, source: int, max_minutes: float) -> np.ndarray:
+        """
+        1つの交点から max_minutes 以内に着ける全交点への最短時間（Dijkstra法。到達圏の計算に使う）
+        costs がある場合は重みで探索し、重みで打ち切る
+        Returns: 交点ごとの所要時間（分）※max_minutes 以内に着けない交点はinf
+        """
+        indptr, indices, weights, _ = self._adjacency
+        best = [inf] * len(self)
+        best[source] = 0.0
+        heap = [(0.0, source)]
+        heappop, heappush = heapq.heappop, heapq.heappush
+        while heap:
+            elapsed, u = heappop(heap)
+            if elapsed > best[u]:
+                continue
+            lo, hi = indptr[u], indptr[u + 1]
+            for v, edge_minutes in zip(indices[lo:hi], weights[lo:hi]):
+                candidate = elapsed + edge_minutes
+                if candidate < best[v] and candidate <= max_minutes:
+                    best[v] = candidate
+                    heappush(heap, (candidate, v))
+        return np.array(best, dtype=np.float64)
+
+
+@dataclass(frozen=True)
+class RoadNetwork:
+    """徒歩・車の道路グラフ"""
+    walking: RoadGraph
+    driving: RoadGraph
+    source: str  # 読み込んだファイル
+
+    def graph(self, profile: str) -> RoadGraph:
+        """移動手段（'walking' / 'driving'）のグラフ"""
+        if profile not in ROAD_PROFILES:
+            raise ValueError(f"未対応の移動手段です: {profile}")
+        return getattr(self, profile)
+
+
+# OSMデータの読み込み
+
+def _read_osm_xml(path: str) -> Tuple[Dict[int, Tuple[float, float]], List[Tuple[Dict[str, str], List[int]]]]:
+    """OSM XML（.osm）から交点の座標と道路（highwayタグつきのway）を読み込む"""
+    nodes = {}
+    ways = []
+    for _, elem in ET.iterparse(path, events=('end',)):
+        if elem.tag == 'node':
+            nodes[int(elem.get('id'))] = (float(elem.get('lat')), float(elem.get('lon')))
+            elem.clear()
+        elif elem.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag') if tag.get('k') in _USED_TAGS}
+            if 'highway' in tags:
+                ways.append((tags, [int(nd.get('ref')) for nd in elem.iter('nd')]))
+            elem.clear()
+        elif elem.tag == 'relation':
+            elem.clear()
+    return nodes, ways
+
+
+def _read_osm_pbf(path: str) -> Tuple[Dict[int, Tuple[float, float]], List[Tuple[Dict[str, str], List[int]]]]:
+    """OSM PBF（.osm.pbf）から交点の座標と道路を読み込む（osmiumが必要）"""
+    if find_spec('osmium') is None:
+        raise RoadDataError("PBF形式の道路データの読み込みには osmium（pip install osmium）が必要です")
+    import osmium
+
+    nodes = {}
+    ways = []
+
+    class WayHandler(osmium.SimpleHandler):
+        def way(self, way):
+            tags = {tag.k: tag.v for tag in way.tags if tag.k in _USED_TAGS}
+            if 'highway' not in tags:
+                return
+            refs = []
+            for node in way.nodes:
+                if node.location.valid():
+                    nodes[node.ref] = (node.location.lat, node.location.lon)
+                    refs.append(node.ref)
+            ways.append((tags, refs))
+
+    WayHandler().apply_file(path, locations=True)
+    return nodes, ways
+
+
+def _way_speed(tags: Dict[str, str], profile: str) -> Optional[float]:
+    """道路の速度（km/h）。その移動手段で通れない場合はNone"""
+    highway = tags.get('highway')
+    access = tags.get('access')
+    if profile == 'walking':
+        if highway not in WALKING_HIGHWAYS or tags.get('foot') in _CLOSED:
+            return None
+        if access in _CLOSED and tags.get('foot') not in ('yes', 'designated'):
+            return None
+        return float(PROFILE_SPEED_KMH['walking'])
+
+    if highway not in DRIVING_SPEEDS_KMH or tags.get('motor_vehicle') in _CLOSED:
+        return None
+    if access in _CLOSED and tags.get('motor_vehicle') not in ('yes', 'destination'):
+        return None
+    maxspeed = tags.get('maxspeed', '').split()
+    if maxspeed and maxspeed[0].isdigit() and int(maxspeed[0]) > 0:
+        return float(maxspeed[0])
+    return float(DRIVING_SPEEDS_KMH[highway])
+
+
+def _way_direction(tags: Dict[str, str], profile: str) -> int:
+    """通行方向（0: 双方向、1: 記載順のみ、-1: 逆順のみ）。徒歩は常に双方向"""
+    if profile == 'walking':
+        return 0
+    oneway = tags.get('oneway', '')
+    if oneway == '-1':
+        return -1
+    if oneway in ('yes', 'true', '1') or tags.get('junction') == 'roundabout' or tags.get('highway') == 'motorway':
+        return 1
+    return 0
+
+
+def build_road_graph(nodes: Dict[int, Tuple[float, float]], ways: List[Tuple[Dict[str, str], List[int]]],
+                     profile: str) -> RoadGraph:
+    """交点の座標と道路のリストから、移動手段ごとのCSRグラフを作成"""
+    sources, targets, speeds = [], [], []
+    for tags, refs in ways:
+        speed = _way_speed(tags, profile)
+        refs = [ref for ref in refs if ref in nodes]
+        if speed is None or len(refs) < 2:
+            continue
+        direction = _way_direction(tags, profile)
+        if direction >= 0:
+            sources += refs[:-1]
+            targets += refs[1:]
+            speeds += [speed] * (len(refs) - 1)
+        if direction <= 0:
+            sources += refs[1:]
+            targets += refs[:-1]
+            speeds += [speed] * (len(refs) - 1)
+
+    # 道路に使われている交点だけを0からの連番にする
+    node_ids = np.unique(np.array(sources + targets, dtype=np.int64))
+    coords = np.array([nodes[int(node_id)] for node_id in node_ids], dtype=np.float64).reshape(-1, 2)
+    u = np.searchsorted(node_ids, np.array(sources, dtype=np.int64))
+    v = np.searchsorted(node_ids, np.array(targets, dtype=np.int64))
+    speeds = np.array(speeds, dtype=np.float64)
+
+    lengths = paired_distances(coords[u, 0], coords[u, 1], coords[v, 0], coords[v, 1])
+    order = np.argsort(u, kind='stable')
+    indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(u, minlength=len(node_ids)), out=indptr[1:])
+
+    return RoadGraph(
+        profile=profile,
+        lats=np.ascontiguousarray(coords[:, 0]),
+        lngs=np.ascontiguousarray(coords[:, 1]),
+        indptr=indptr,
+        indices=v[order].astype(np.int32),
+        lengths_km=lengths[order].astype(np.float32),
+        minutes=(lengths / speeds * 60)[order].astype(np.float32),
+        max_speed_kmh=float(speeds.max()) if len(speeds) else float(PROFILE_SPEED_KMH[profile]),
+    )
+
+
+def find_road_network_file(directory: str = '.') -> Optional[str]:
+    """既定の道路データのファイルを探す（見つからない場合はNone）"""
+    for name in ROAD_NETWORK_FILES:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+@traced()
+def load_road_network(path: str) -> RoadNetwork:
+    """
+    OSM抽出データ（.osm.pbf / .osm）から徒歩・車の道路グラフを作成
+    Raises:
+        FileNotFoundError: ファイルがない場合
+        RoadDataError: 形式が読めない場合・道路が含まれない場合
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    try:
+        if path.endswith('.pbf'):
+            nodes, ways = _read_osm_pbf(path)
+        else:
+            nodes, ways = _read_osm_xml(path)
+    except ET.ParseError as e:
+        raise RoadDataError(f"道路データを読み込めません: {e}") from e
+    if not ways:
+        raise RoadDataError("道路データに道路（highway）が含まれていません")
+
+    return RoadNetwork(
+        walking=build_road_graph(nodes, ways, 'walking'),
+        driving=build_road_graph(nodes, ways, 'driving'),
+        source=path,
+    )
+
+
+# 経路と移動時間行列
+
+def _snap_points(graph: RoadGraph, lats: np.ndarray, lngs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """各地点の最寄りの交点と距離（km）。道路から SNAP_MAX_KM 以上離れた地点の交点は-1"""
+    snapped = [graph.nearest_node(lat, lng) for lat, lng in zip(lats, lngs)]
+    nodes = np.array([node if snap_km <= SNAP_MAX_KM else -1 for node, snap_km in snapped], dtype=np.int64)
+    access_km = np.array([snap_km for _, snap_km in snapped], dtype=np.float64)
+    return nodes, access_km
+
+
+def road_travel_matrices(graph: RoadGraph, lats, lngs) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    道路に沿った全地点間の距離（km）と所要時間（分）の行列
+    道路から SNAP_MAX_KM 以上離れた地点や、道路でつながらない組は直線距離で計算する。
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    km = distance_matrix(lats, lngs)
+    minutes = km / PROFILE_SPEED_KMH[graph.profile] * 60
+
+    snapped_nodes, snapped_km = _snap_points(graph, lats, lngs)
+    on_road = np.flatnonzero(snapped_nodes >= 0).tolist()
+    nodes = snapped_nodes[on_road].tolist()
+    access_km = snapped_km[on_road]
+    for row, i in enumerate(on_road):
+        # 双方向のグラフでは行列が対称のため、後ろの地点だけを探索して両側を埋める
+        first = row + 1 if graph.undirected else 0
+        road_minutes, road_km = graph.travel_from(nodes[row], nodes[first:])
+        reachable = np.isfinite(road_minutes)
+        cols = np.arange(first, len(on_road))
+        reachable &= cols != row
+        targets = np.array(on_road, dtype=np.int64)[cols[reachable]]
+        access = access_km[row] + access_km[cols[reachable]]
+        km[i, targets] = road_km[reachable] + access
+        minutes[i, targets] = road_minutes[reachable] + access / ACCESS_SPEED_KMH * 60
+        if graph.undirected:
+            km[targets, i] = km[i, targets]
+            minutes[targets, i] = minutes[i, targets]
+    return km, minutes
+
+
+def road_travel_block(graph: RoadGraph, from_lats, from_lngs, to_lats, to_lngs) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    道路に沿った地点群Aの各地点から地点群Bの各地点への距離（km）と所要時間（分）の行列
+    形状は (Aの件数, Bの件数)。道路から遠い地点や、つながらない組は直線距離で計算する。
+    """
+    from_lats = np.asarray(from_lats, dtype=np.float64)
+    from_lngs = np.asarray(from_lngs, dtype=np.float64)
+    to_lats = np.asarray(to_lats, dtype=np.float64)
+    to_lngs = np.asarray(to_lngs, dtype=np.float64)
+    km = cross_distance_matrix(from_lats, from_lngs, to_lats, to_lngs)
+    minutes = km / PROFILE_SPEED_KMH[graph.profile] * 60
+
+    from_nodes, from_access = _snap_points(graph, from_lats, from_lngs)
+    to_nodes, to_access = _snap_points(graph, to_lats, to_lngs)
+    cols = np.flatnonzero(to_nodes >= 0)
+    targets = to_nodes[cols].tolist()
+    for i in np.flatnonzero(from_nodes >= 0):
+        road_minutes, road_km = graph.travel_from(int(from_nodes[i]), targets)
+        # 同じ地点どうしは直線距離（0）のまま
+        reachable = np.isfinite(road_minutes) & (km[i, cols] > 0)
+        hit = cols[reachable]
+        access = from_access[i] + to_access[hit]
+        km[i, hit] = road_km[reachable] + access
+        minutes[i, hit] = road_minutes[reachable] + access / ACCESS_SPEED_KMH * 60
+    return km, minutes
+
+
+def route_travel_matrices(graph: RoadGraph, current_loc: List[float], spots: Union[SpotStore, pd.DataFrame],
+                          selected_indices: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """現在地（行・列0）と選択スポット（行・列1〜）の道路距離・所要時間の行列"""
+    spots = as_spot_store(spots)
+    lats = np.concatenate(([current_loc[0]], spots.lats[selected_indices]))
+    lngs = np.concatenate(([current_loc[1]], spots.lngs[selected_indices]))
+    return road_travel_matrices(graph, lats, lngs)
+
+
+@traced()
+def road_route(graph: RoadGraph, origin: Sequence[float], destination: Sequence[float]) -> Optional[RoadRoute]:
+    """道路に沿った2地点間の経路（道路から遠い・つながらない場合はNone）"""
+    source, source_km = graph.nearest_node(origin[0], origin[1])
+    target, target_km = graph.nearest_node(destination[0], destination[1])
+    if source < 0 or max(source_km, target_km) > SNAP_MAX_KM:
+        return None
+    found = graph.shortest_path(source, target)
+    if found is None:
+        return None
+
+    path, road_minutes, road_km = found
+    access_km = source_km + target_km
+    coordinates = ([(float(origin[0]), float(origin[1]))]
+                   + [(float(graph.lats[node]), float(graph.lngs[node])) for node in path]
+                   + [(float(destination[0]), float(destination[1]))])
+    return RoadRoute(
+        coordinates=coordinates,
+        distance_km=road_km + access_km,
+        minutes=road_minutes + access_km / ACCESS_SPEED_KMH * 60,
+    )
@@ -0,0 +1,308 @@
+"""巡回順序ソルバーと最適化経路の算出"""
+import hashlib
+import json
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .hazards import HazardLayer, hazard_leg_factors
+from .roads import RoadGraph
+from .store import SpotStore, as_spot_store
+from .tracing import traced
+from .transit import TRANSIT_DEFAULT_START_MINUTES, TransitTimetable
+from .travel_matrix import TravelMatrix, route_matrices
+
+# 距離行列は行・列0が出発地、1〜nが訪問スポット。順序は1〜nの位置リストで扱う。
+HELD_KARP_MAX_STOPS = 12  # 厳密解（Held-Karp）を使う最大スポット数
+HELD_KARP_BATCH_CELLS = 1 << 22  # まとめて解く場合の一時配列の要素数の上限（約32MB）
+ROUTE_TIME_BUDGET_SEC = 0.15  # 局所探索の計算時間上限（秒）
+ROUTE_CACHE_SIZE = 1024  # 全セッション共通で保持する算出結果の最大数
+ROUTE_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 保持する算出結果のメモリ使用量の上限（目安）
+ROUTE_CACHE_TTL_SEC = 60 * 60  # 算出結果の保持時間（秒）
+ROUTE_CACHE_ORIGIN_DECIMALS = 5  # キャッシュ照合時に出発地の緯度・経度を丸める桁数（約1m）
+
+
+def path_length(dist_matrix: np.ndarray, order: List[int]) -> float:
+    """出発地から順序どおりに巡回した総距離（出発地へは戻らない）"""
+    path = [0] + list(order)
+    return float(dist_matrix[path[:-1], path[1:]].sum())
+
+
+def greedy_rank_order(dist_matrix: np.ndarray, wait_times: np.ndarray) -> List[int]:
+    """距離ランキング＋待ち時間ランキングのスコア（S = RD + RW）による貪欲法"""
+    wait_times = np.asarray(wait_times, dtype=np.float64)
+    unvisited = np.arange(1, dist_matrix.shape[0])
+    order = []
+    current = 0
+
+    while len(unvisited):
+        distances = dist_matrix[current, unvisited]
+        waits = wait_times[unvisited - 1]
+
+        # ランキング（同じ値は同順位）
+        distance_ranks = np.searchsorted(np.sort(distances), distances) + 1
+        wait_time_ranks = np.searchsorted(np.sort(waits), waits) + 1
+        scores = distance_ranks + wait_time_ranks
+
+        # スコアが同点の場合は距離が近い方を優先
+        best = int(np.lexsort((distances, scores))[0])
+        current = int(unvisited[best])
+        order.append(current)
+        unvisited = np.delete(unvisited, best)
+
+    return order
+
+
+def nearest_neighbor_order(dist_matrix: np.ndarray) -> List[int]:
+    """最近傍法による巡回順序"""
+    unvisited = list(range(1, dist_matrix.shape[0]))
+    order = []
+    current = 0
+
+    while unvisited:
+        nearest = int(np.argmin(dist_matrix[current, unvisited]))
+        current = unvisited.pop(nearest)
+        order.append(current)
+
+    return order
+
+
+def solve_held_karp(dist_matrix: np.ndarray, seed_order: List[int], deadline: float) -> List[int]:
+    """Held-Karp法（動的計画法）による厳密解"""
+    if dist_matrix.shape[0] - 1 <= 1:
+        return list(seed_order)
+    return [int(pos) for pos in solve_held_karp_batch(dist_matrix[None])[0]]
+
+
+def solve_held_karp_batch(dist_matrices: np.ndarray) -> np.ndarray:
+    """
+    スポット数の同じ複数の距離行列をまとめてHeld-Karp法で解く（ルートの一括算出用）
+    Args:
+        dist_matrices: 距離行列を重ねた配列（形状は (件数, n+1, n+1)、各行列の行・列0が出発地）
+    Returns:
+        訪問順の位置（形状は (件数, n)、各行が1〜n）
+    """
+    dist_matrices = np.asarray(dist_matrices, dtype=np.float64)
+    count, n = dist_matrices.shape[0], dist_matrices.shape[1] - 1
+    if n <= 1:
+        return np.ones((count, n), dtype=np.int64)
+
+    bits = 1 << np.arange(n)
+    full = 1 << n
+    masks = np.arange(full)
+    sizes = ((masks[:, None] & bits) > 0).sum(axis=1)
+    layers = [masks[sizes == size] for size in range(2, n + 1)]
+    # 一時配列（件数×集合数×n×n）が HELD_KARP_BATCH_CELLS 要素に収まる件数ずつ解く
+    step = max(1, HELD_KARP_BATCH_CELLS // (max(len(layer) for layer in layers) * n * n))
+
+    orders = np.empty((count, n), dtype=np.int64)
+    for start in range(0, count, step):
+        dist = dist_matrices[start:start + step]
+        rows = np.arange(len(dist))
+        cost_t = dist[:, 1:, 1:].transpose(0, 2, 1)[:, None]
+
+        # dp[i, mask, j]: i件目でmaskのスポットをすべて訪問してjで終わる最小距離
+        dp = np.full((len(dist), full, n), np.inf)
+        parent = np.full((len(dist), full, n), -1, dtype=np.int64)
+        dp[:, bits, np.arange(n)] = dist[:, 0, 1:]
+
+        # 訪問数の同じ集合をまとめて計算する（j を含まない集合の値は未計算の inf のまま残る）
+        for layer in layers:
+            # candidates[i, mask, j, k]: kを経由してjに到達する距離
+            candidates = dp[:, layer[:, None] ^ bits] + cost_t
+            best = np.argmin(candidates, axis=3)
+            dp[:, layer] = np.take_along_axis(candidates, best[..., None], axis=3)[..., 0]
+            parent[:, layer] = best
+
+        # 終点から経路を復元
+        mask = np.full(len(dist), full - 1)
+        last = np.argmin(dp[:, full - 1], axis=1)
+        for step_pos in range(n - 1, -1, -1):
+            orders[start + rows, step_pos] = last + 1
+            prev = parent[rows, mask, last]
+            mask = mask ^ (1 << last)
+            last = prev
+
+    return orders
+
+
+def solve_local_search(dist_matrix: np.ndarray, seed_order: List[int], deadline: float) -> List[int]:
+    """初期順序を2-opt・Or-optで改善する局所探索（時間上限あり）"""
+    n = dist_matrix.shape[0] - 1
+    if n <= 1:
+        return list(seed_order)
+
+    # 終点を固定しないため、全スポットから距離0のダミー終点を追加する
+    dist = np.zeros((n + 2, n + 2))
+    dist[:n + 1, :n + 1] = dist_matrix
+    path = np.array([0] + list(seed_order) + [n + 1])
+    eps = 1e-12
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+
+        # 2-opt: 区間 path[i..j] を反転
+        for i in range(1, n):
+            j = np.arange(i + 1, n + 1)
+            delta = (dist[path[i - 1], path[j]] + dist[path[i], path[j + 1]]
+                     - dist[path[i - 1], path[i]] - dist[path[j], path[j + 1]])
+            best = int(np.argmin(delta))
+            if delta[best] < -eps:
+                path[i:j[best] + 1] = path[i:j[best] + 1][::-1]
+                improved = True
+            if time.perf_counter() >= deadline:
+                break
+
+        # Or-opt: 1〜3スポットの区間を別の位置へ移動（反転も考慮）
+        for seg_len in (1, 2, 3):
+            i = 1
+            while i + seg_len <= n and time.perf_counter() < deadline:
+                segment = path[i:i + seg_len]
+                first, last = segment[0], segment[-1]
+                removal_gain = (dist[path[i - 1], first] + dist[last, path[i + seg_len]]
+                                - dist[path[i - 1], path[i + seg_len]])
+                rest = np.concatenate((path[:i], path[i + seg_len:]))
+                left, right = rest[:-1], rest[1:]
+                forward = dist[left, first] + dist[last, right] - dist[left, right]
+                backward = dist[left, last] + dist[first, right] - dist[left, right]
+                insert_cost = np.minimum(forward, backward)
+                k = int(np.argmin(insert_cost))
+                if insert_cost[k] - removal_gain < -eps:
+                    moved = segment if forward[k] <= backward[k] else segment[::-1]
+                    path = np.concatenate((rest[:k + 1], moved, rest[k + 1:]))
+                    improved = True
+                i += 1
+
+    return [int(p) for p in path[1:-1]]
+
+
+ROUTE_SOLVERS: Dict[str, Callable[[np.ndarray, List[int], float], List[int]]] = {
+    'greedy': lambda dist_matrix, seed_order, deadline: list(seed_order),
+    'held_karp': solve_held_karp,
+    'local_search': solve_local_search,
+}
+
+
+def solve_route_order(dist_matrix: np.ndarray, seed_order: List[int], solver: str = 'auto',
+                      time_budget: float = ROUTE_TIME_BUDGET_SEC) -> List[int]:
+    """
+    ソルバーを選択して巡回順序を算出
+    Args:
+        dist_matrix: 距離行列（行・列0が出発地）
+        seed_order: 初期順序（貪欲法の結果）
+        solver: 'auto' / 'greedy' / 'held_karp' / 'local_search'
+        time_budget: 計算時間上限（秒）
+    Returns:
+        訪問順の位置リスト（1〜n）
+    """
+    if solver == 'auto':
+        n_stops = dist_matrix.shape[0] - 1
+        solver = 'held_karp' if n_stops <= HELD_KARP_MAX_STOPS else 'local_search'
+
+    deadline = time.perf_counter() + time_budget
+    order = ROUTE_SOLVERS[solver](dist_matrix, seed_order, deadline)
+
+    # 初期順序より悪化した場合は初期順序を採用
+    if path_length(dist_matrix, order) > path_length(dist_matrix, seed_order):
+        return list(seed_order)
+    return order
+
+
+# 最適化経路算出関数（観光モード：待ち時間考慮）
+@traced()
+def optimize_route_tourism(current_loc: List[float], spots: Union[SpotStore, pd.DataFrame], selected_indices: List[int],
+                           solver: str = 'auto', road_graph: Optional[RoadGraph] = None,
+                           travel_matrix: Optional[TravelMatrix] = None,
+                           transit: Optional[TransitTimetable] = None,
+                           start_minutes: float = TRANSIT_DEFAULT_START_MINUTES) -> Tuple[List[int], float, float]:
+    """
+    観光モード用の最適化経路算出（待ち時間と距離を考慮）
+    待ち時間＋距離ランキングの貪欲法を初期解とし、ソルバーで移動距離を短縮する
+    road_graph（車）を渡すと直線距離の代わりに道路距離・所要時間で計算する
+    travel_matrix を渡すとスポット間は計算済みの行列を使い、現在地からの距離だけを計算する
+    transit（公共交通の時刻表）を渡すと start_minutes に出発した所要時間で計算し、距離の代わりに所要時間を短縮する
+    Returns: (訪問順のインデックスリスト, 総移動距離, 総所要時間)
+    """
+    if not selected_indices:
+        return [], 0.0, 0.0
+
+    spots = as_spot_store(spots)
+
+    # 現在地と選択スポット間の距離を一括計算（行・列0が現在地）
+    dist_matrix, time_matrix = route_matrices(
+        current_loc, spots, selected_indices, 40, road_graph, travel_matrix,  # 直線距離は時速40kmで計算（分）
+        transit, start_minutes
+    )
+    stay_times = spots.stay_minutes[selected_indices]
+    wait_times = spots.wait_minutes[selected_indices]
+
+    # 公共交通は便の待ち時間で距離と所要時間が比例しないため、所要時間で順序を決める
+    cost_matrix = time_matrix if transit is not None else dist_matrix
+    seed_order = greedy_rank_order(cost_matrix, wait_times)
+    order = solve_route_order(cost_matrix, seed_order, solver)
+
+    route = [selected_indices[pos - 1] for pos in order]
+    total_distance = path_length(dist_matrix, order)
+    total_time = path_length(time_matrix, order)
+    total_time += int(stay_times.sum()) + int(wait_times.sum())
+
+    return route, total_distance, float(total_time)
+
+
+# 最適化経路算出関数（防災モード：最近傍法）
+@traced()
+def optimize_route_disaster(current_loc: List[float], spots: Union[SpotStore, pd.DataFrame], selected_indices: List[int],
+                            solver: str = 'auto', road_graph: Optional[RoadGraph] = None,
+                            travel_matrix: Optional[TravelMatrix] = None, hazards: Optional[HazardLayer] = None,
+                            hazard_factor: float = 1.0) -> Tuple[List[int], float, float]:
+    """
+    防災モード用の最適化経路算出（距離のみ考慮）
+    最近傍法を初期解とし、ソルバーで移動距離を短縮する
+    road_graph（徒歩）を渡すと直線距離の代わりに道路距離・所要時間で計算する
+    travel_matrix（徒歩）を渡すとスポット間は計算済みの行列を使い、現在地からの距離だけを計算する
+    hazards を渡すと、直線距離で計算する場合に想定区域を通る区間の距離を hazard_factor 倍にして順序を決める
+    （道路で計算する場合は hazard_road_graph() で重みづけした道路グラフを使う）。総移動距離・総所要時間は実際の値
+    Returns: (訪問順のインデックスリスト, 総移動距離, 総所要時間)
+    """
+    if not selected_indices:
+        return [], 0.0, 0.0
+
+    # 現在地と選択スポット間の距離を一括計算（行・列0が現在地）
+    dist_matrix, time_matrix = route_matrices(
+        current_loc, spots, selected_indices, 4, road_graph, travel_matrix  # 直線距離は徒歩時速4kmで計算（分）
+    )
+
+    cost_matrix = dist_matrix
+    straight = road_graph is None and (travel_matrix is None or travel_matrix.road_graph is None)
+    if hazards is not None and hazard_factor != 1.0 and straight:
+        spots = as_spot_store(spots)
+        lats = np.concatenate(([current_loc[0]], spots.lats[selected_indices]))
+        lngs = np.concatenate(([current_loc[1]], spots.lngs[selected_indices]))
+        cost_matrix = dist_matrix * hazard_leg_factors(hazards, lats, lngs, hazard_factor)
+
+    seed_order = nearest_neighbor_order(cost_matrix)
+    order = solve_route_order(cost_matrix, seed_order, solver)
+
+    route = [selected_indices[pos - 1] for pos in order]
+    total_distance = path_length(dist_matrix, order)
+    total_time = path_length(time_matrix, order)
+
+    return route, total_distance, total_time
+
+
+# 算出結果の共有キャッシュ用（同じ出発地・同じスポットの組み合わせを1回の計算で済ませる）
+def normalize_route_query(current_loc: List[float], selected_indices: List[int]) -> Tuple[List[float], List[int]]:
+    """出発地を ROUTE_CACHE_ORIGIN_DECIMALS 桁に丸め、選択スポットを重複なしの昇順にそろえる"""
+    origin = [round(float(current_loc[0]), ROUTE_CACHE_ORIGIN_DECIMALS),
+              round(float(current_loc[1]), ROUTE_CACHE_ORIGIN_DECIMALS)]
+    return origin, sorted({int(idx) for idx in selected_indices})
+
+
+def route_cache_key(kind: str, version: str, current_loc: List[float], selected_indices: List[int], **params) -> str:
+    """算出の種類・データの版・正規化した出発地と選択スポット・その他の条件からキャッシュキーを作成"""
+    origin, selected = normalize_route_query(current_loc, selected_indices)
+    payload = json.dumps([kind, version, origin, selected, sorted(params.items())], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
@@ -0,0 +1,338 @@
+"""営業時間を考慮した観光ルートのスケジュール作成（時間枠つき巡回問題）"""
+import time
+from dataclasses import dataclass, field
+from math import inf
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .data import MINUTES_PER_DAY, window_departure
+from .orienteering import select_route_within_limits
+from .roads import RoadGraph
+from .routing import HELD_KARP_MAX_STOPS, ROUTE_TIME_BUDGET_SEC, path_length
+from .store import SpotStore, as_spot_store
+from .tracing import traced
+from .transit import TransitTimetable
+from .travel_matrix import TravelMatrix, route_matrices
+
+# 時刻はすべて出発日の0時からの分で扱う。移動時間行列は行・列0が出発地、1〜nが訪問スポット。
+TOURISM_SPEED_KMH = 40  # 観光モードの移動速度（km/h）
+
+
+@dataclass(frozen=True)
+class ScheduledStop:
+    """訪問スポットの時刻（0時からの分）"""
+    index: int  # スポットの位置
+    arrival: float  # 到着
+    start: float  # 入場（開館待ちのあと。ここから待ち時間＋所要時間）
+    departure: float  # 出発
+
+    @property
+    def idle_minutes(self) -> float:
+        """開館までの待ち時間（分）"""
+        return self.start - self.arrival
+
+
+@dataclass(frozen=True)
+class TourSchedule:
+    """営業時間を考慮した訪問スケジュール"""
+    route: List[int]  # 訪問順のスポットの位置
+    stops: List[ScheduledStop]  # 訪問順の時刻
+    infeasible: List[int]  # 営業時間内に回れないため除外したスポットの位置
+    total_distance: float  # 総移動距離（km）
+    total_time: float  # 出発から最後のスポットを出るまで（分）
+    start_minutes: float  # 出発時刻
+    over_limit: List[int] = field(default_factory=list)  # 所要時間・予算の上限に収まらないため除外したスポットの位置
+    unknown_fee: List[int] = field(default_factory=list)  # 予算を指定した場合に、料金不明のため除外したスポットの位置
+
+
+def format_clock(minutes: float) -> str:
+    """0時からの分を「9:05」形式に変換（翌日の場合は「翌」をつける）"""
+    minutes = int(round(minutes))
+    day, rest = divmod(minutes, MINUTES_PER_DAY)
+    return f"{'翌' if day else ''}{rest // 60}:{rest % 60:02d}"
+
+
+def _departure(arrival: float, duration: float, windows: List[Tuple[float, float]]) -> float:
+    """window_departure の1スポット版（時間帯は開始の早い順）"""
+    for opens, closes in windows:
+        finish = max(arrival, opens) + duration
+        if finish <= closes:
+            return finish
+    return inf
+
+
+def solve_time_window_exact(travel: np.ndarray, durations: np.ndarray, opens: np.ndarray, closes: np.ndarray,
+                            start_minutes: float) -> List[int]:
+    """
+    部分集合の動的計画法による厳密解
+    dp[mask, j]: maskのスポットを訪問してjを出発する最早時刻。
+    訪問できるスポット数が最大で、その中で最後の出発が最も早い順序を返す。
+    """
+    n = len(durations)
+    if n == 0:
+        return []
+
+    bits = 1 << np.arange(n)
+    full = 1 << n
+    dp = np.full((full, n), np.inf)
+    parent = np.full((full, n), -1, dtype=np.int64)
+    dp[bits, np.arange(n)] = window_departure(start_minutes + travel[0, 1:], durations, opens, closes)
+    cost = travel[1:, 1:]
+
+    for mask in range(1, full):
+        members = np.flatnonzero(mask & bits)
+        if len(members) < 2:
+            continue
+        # arrivals[i, k]: kを出発してiに到着する時刻
+        arrivals = dp[mask ^ bits[members]][:, members] + cost[np.ix_(members, members)].T
+        best = np.argmin(arrivals, axis=1)
+        earliest = arrivals[np.arange(len(members)), best]
+        reachable = np.isfinite(earliest)
+        if not reachable.any():
+            continue  # このスポットの組み合わせは回れない（枝刈り）
+        # 到着が早いほど出発も早い（待てば開館する）ため、最早到着だけを時間帯と照合すればよい
+        dp[mask, members] = window_departure(earliest, durations[members], opens[members], closes[members])
+        parent[mask, members] = members[best]
+
+    # 訪問数が最大、次に最後の出発が最も早い組み合わせを選ぶ
+    finish = dp.min(axis=1)
+    feasible = np.flatnonzero(np.isfinite(finish))
+    if len(feasible) == 0:
+        return []
+    counts = ((feasible[:, None] & bits[None, :]) > 0).sum(axis=1)
+    mask = int(feasible[np.lexsort((finish[feasible], -counts))[0]])
+
+    # 終点から経路を復元
+    last = int(np.argmin(dp[mask]))
+    order = []
+    while last >= 0:
+        order.append(last + 1)
+        prev = int(parent[mask, last])
+        mask ^= 1 << last
+        last = prev
+
+    return order[::-1]
+
+
+def _route_departures(travel: List[List[float]], durations: List[float], windows: List[List[Tuple[float, float]]],
+                      route: List[int], start_minutes: float) -> Optional[List[float]]:
+    """順序どおりに回った場合の各スポットの出発時刻（回れない場合はNone）"""
+    departures = []
+    current, now = 0, start_minutes
+    for j in route:
+        now = _departure(now + travel[current][j], durations[j - 1], windows[j - 1])
+        if now == inf:
+            return None
+        departures.append(now)
+        current = j
+    return departures
+
+
+def _insertion_finish(travel: List[List[float]], durations: List[float], windows: List[List[Tuple[float, float]]],
+                      route: List[int], departures: List[float], start_minutes: float, stop: int, pos: int) -> float:
+    """route の pos 番目に stop を挿入した場合の最後の出発時刻（回れない場合はinf）"""
+    prev = route[pos - 1] if pos else 0
+    now = departures[pos - 1] if pos else start_minutes
+    now = _departure(now + travel[prev][stop], durations[stop - 1], windows[stop - 1])
+    current = stop
+
+    for q in range(pos, len(route)):
+        if now == inf:
+            return inf
+        j = route[q]
+        now = _departure(now + travel[current][j], durations[j - 1], windows[j - 1])
+        if now <= departures[q]:
+            # 後続の時刻が変わらなくなった時点で確定（以降は元のスケジュールと同じ）
+            return departures[-1]
+        current = j
+    return now
+
+
+def _best_insertion(travel, durations, windows, route, departures, start_minutes, stop) -> Tuple[float, int]:
+    """最後の出発が最も早くなる挿入位置（挿入できない場合は (inf, -1)）"""
+    best_finish, best_pos = inf, -1
+    for pos in range(len(route) + 1):
+        finish = _insertion_finish(travel, durations, windows, route, departures, start_minutes, stop, pos)
+        if finish < best_finish:
+            best_finish, best_pos = finish, pos
+    return best_finish, best_pos
+
+
+def _insert_and_improve(travel, durations, windows, start_minutes, pending: List[int], deadline: float) -> List[int]:
+    """pending の順に挿入し、再配置と保留スポットの再挿入で改善する"""
+    route: List[int] = []
+    departures: List[float] = []
+    unplaced = []
+    for stop in pending:
+        finish, pos = _best_insertion(travel, durations, windows, route, departures, start_minutes, stop)
+        if pos < 0:
+            unplaced.append(stop)
+            continue
+        route.insert(pos, stop)
+        departures = _route_departures(travel, durations, windows, route, start_minutes)
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+
+        # 再配置: 1スポットを取り出して最良の位置へ挿入し直す（取り出しても時刻は遅くならない）
+        for i in range(len(route)):
+            if time.perf_counter() >= deadline:
+                break
+            stop = route[i]
+            rest = route[:i] + route[i + 1:]
+            rest_departures = _route_departures(travel, durations, windows, rest, start_minutes)
+            finish, pos = _best_insertion(travel, durations, windows, rest, rest_departures, start_minutes, stop)
+            if pos >= 0 and finish < departures[-1] - 1e-9:
+                route = rest[:pos] + [stop] + rest[pos:]
+                departures = _route_departures(travel, durations, windows, route, start_minutes)
+                improved = True
+
+        # 保留したスポットを改善後のルートへ再挿入
+        for stop in list(unplaced):
+            finish, pos = _best_insertion(travel, durations, windows, route, departures, start_minutes, stop)
+            if pos >= 0:
+                route.insert(pos, stop)
+                departures = _route_departures(travel, durations, windows, route, start_minutes)
+                unplaced.remove(stop)
+                improved = True
+
+    return route
+
+
+def solve_time_window_insertion(travel: np.ndarray, durations: np.ndarray, opens: np.ndarray, closes: np.ndarray,
+                                start_minutes: float, deadline: float) -> List[int]:
+    """
+    挿入法＋再配置による近似解（時間上限あり）
+    閉館の早い順・開館の早い順・近い順の3通りの順序でスポットを挿入し、挿入できないものは保留する。
+    それぞれ再配置と保留スポットの再挿入で改善し、訪問数が最大で最後の出発が最も早いものを返す。
+    """
+    n = len(durations)
+    travel_list = travel.tolist()
+    duration_list = [float(d) for d in durations]
+    windows = [
+        [(float(o), float(c)) for o, c in zip(opens[j], closes[j]) if np.isfinite(o)]
+        for j in range(n)
+    ]
+    earliest_open = np.min(opens, axis=1)
+    latest_close = np.where(np.isfinite(opens), closes, -np.inf).max(axis=1)
+    stops = range(1, n + 1)
+    orderings = [
+        sorted(stops, key=lambda j: (latest_close[j - 1], travel_list[0][j])),
+        sorted(stops, key=lambda j: (earliest_open[j - 1], travel_list[0][j])),
+        sorted(stops, key=lambda j: travel_list[0][j]),
+    ]
+
+    best_route: List[int] = []
+    best_key = (0, 0.0)
+    for pending in orderings:
+        route = _insert_and_improve(travel_list, duration_list, windows, start_minutes, pending, deadline)
+        departures = _route_departures(travel_list, duration_list, windows, route, start_minutes)
+        key = (-len(route), departures[-1] if departures else 0.0)
+        if not best_route or key < best_key:
+            best_route, best_key = route, key
+        if time.perf_counter() >= deadline:
+            break
+
+    return best_route
+
+
+@traced()
+def schedule_tourism_route(current_loc: List[float], spots: Union[SpotStore, pd.DataFrame], selected_indices: List[int],
+                           start_minutes: float, speed_kmh: float = TOURISM_SPEED_KMH,
+                           time_budget: float = ROUTE_TIME_BUDGET_SEC,
+                           road_graph: Optional[RoadGraph] = None,
+                           travel_matrix: Optional[TravelMatrix] = None,
+                           transit: Optional[TransitTimetable] = None,
+                           time_limit: float = inf, budget_yen: float = inf) -> TourSchedule:
+    """
+    営業時間・所要時間・待ち時間を考慮した観光ルートのスケジュールを作成
+    12箇所以下は厳密解、それ以上は挿入法による近似解。営業時間内に回れないスポットは除外して返す。
+    Args:
+        current_loc: 出発地 [緯度, 経度]
+        spots: スポットのストア（またはデータフレーム）
+        selected_indices: 訪問したいスポットの位置
+        start_minutes: 出発時刻（0時からの分）
+        speed_kmh: 移動速度（km/h）
+        time_budget: 近似解の計算時間上限（秒）
+        road_graph: 道路グラフ（渡すと直線距離・speed_kmh の代わりに道路距離・所要時間で計算）
+        travel_matrix: スポット間の移動時間行列（渡すと road_graph・speed_kmh より優先し、現在地からの距離だけを計算）
+        transit: 公共交通の時刻表（渡すと最も優先し、出発時刻からの便で所要時間を計算。距離は直線距離）
+        time_limit: 出発から最後のスポットを出るまでの上限（分）
+        budget_yen: 料金の合計の上限（円）
+    上限を指定すると、営業時間・上限内でおすすめ度の合計が最大になるスポットと順序を選ぶ（orienteering。開館待ちも
+    所要時間に含める）。予算を指定した場合、料金不明のスポットは予算内か判断できないため除外して別に返す
+    """
+    if not selected_indices:
+        return TourSchedule([], [], [], 0.0, 0.0, float(start_minutes))
+
+    spots = as_spot_store(spots)
+    dist_matrix, travel = route_matrices(
+        current_loc, spots, selected_indices, speed_kmh, road_graph, travel_matrix, transit, start_minutes
+    )
+    durations = (spots.stay_minutes[selected_indices] + spots.wait_minutes[selected_indices]).astype(np.float64)
+    opens = spots.open_minutes[selected_indices]
+    closes = spots.close_minutes[selected_indices]
+
+    # 出発地から直行しても間に合わないスポットは、どの順序でも回れないため先に除外する
+    direct = window_departure(start_minutes + travel[0, 1:], durations, opens, closes)
+    candidates = np.flatnonzero(np.isfinite(direct))
+    fees = spots.fees_yen[selected_indices]
+    unknown_fee = set()
+    if np.isfinite(budget_yen):
+        # 料金不明のスポットは予算内か判断できないため、無料とみなさず除外して別に知らせる
+        unknown = np.isnan(fees[candidates])
+        unknown_fee.update(int(p) + 1 for p in candidates[unknown])
+        candidates = candidates[~unknown]
+    sub_travel = travel[np.ix_(np.r_[0, candidates + 1], np.r_[0, candidates + 1])]
+
+    # 上限を指定した場合は、営業時間・上限内でおすすめ度の合計が最大になるスポットと順序を選ぶ
+    limited = np.isfinite(time_limit) or np.isfinite(budget_yen)
+    if limited:
+        sub_order = select_route_within_limits(
+            sub_travel, durations[candidates], fees[candidates], spots.scores[selected_indices][candidates],
+            opens[candidates], closes[candidates], start_minutes, time_limit, budget_yen, time_budget=time_budget
+        )
+    elif len(candidates) <= HELD_KARP_MAX_STOPS:
+        sub_order = solve_time_window_exact(
+            sub_travel, durations[candidates], opens[candidates], closes[candidates], start_minutes
+        )
+    else:
+        sub_order = solve_time_window_insertion(
+            sub_travel, durations[candidates], opens[candidates], closes[candidates], start_minutes,
+            time.perf_counter() + time_budget
+        )
+    order = [int(candidates[p - 1]) + 1 for p in sub_order]
+
+    # 訪問順の時刻
+    stops = []
+    current, now = 0, float(start_minutes)
+    for p in order:
+        arrival = now + float(travel[current, p])
+        departure = float(window_departure(arrival, durations[p - 1], opens[p - 1], closes[p - 1]))
+        stops.append(ScheduledStop(
+            index=selected_indices[p - 1],
+            arrival=arrival,
+            start=departure - float(durations[p - 1]),
+            departure=departure,
+        ))
+        current, now = p, departure
+
+    visited = set(order)
+    # 上限を指定した場合、回れる候補のうち選ばれなかったスポットは上限に収まらないもの
+    over_limit = {int(p) + 1 for p in candidates if int(p) + 1 not in visited} if limited else set()
+    return TourSchedule(
+        route=[selected_indices[p - 1] for p in order],
+        stops=stops,
+        infeasible=[
+            idx for p, idx in enumerate(selected_indices, 1)
+            if p not in visited and p not in over_limit and p not in unknown_fee
+        ],
+        total_distance=path_length(dist_matrix, order),
+        total_time=now - float(start_minutes),
+        start_minutes=float(start_minutes),
+        over_limit=[idx for p, idx in enumerate(selected_indices, 1) if p in over_limit],
+        unknown_fee=[idx for p, idx in enumerate(selected_indices, 1) if p in unknown_fee],
+    )
@@ -0,0 +1,136 @@
+"""スポットの全文検索（文字単位のN-gram（1・2文字）の転置索引）"""
+import re
+import unicodedata
+from typing import List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .tracing import traced
+
+SEARCH_FIELD_WEIGHTS = {'スポット名': 3, 'カテゴリ': 2, '説明': 1}  # 検索対象の列と一致したときの点数（整数）
+SEARCH_PREFIX_BONUS = 2  # スポット名（または括弧内の読み）が検索語で始まる場合の加点
+_BIGRAM_SHIFT = 21  # 2文字の符号（1文字目 << 21 | 2文字目）。Unicodeの最大値は21ビットに収まる
+_KATAKANA = ''.join(chr(c) for c in range(0x30A1, 0x30F7))
+_KATA_TO_HIRA = str.maketrans(_KATAKANA, ''.join(chr(ord(c) - 0x60) for c in _KATAKANA))
+_TERM_SEPARATOR = re.compile(r'\s+')
+
+
+def normalize_search_text(text: str) -> str:
+    """検索用の正規化（全角・半角をそろえ、英字は小文字、カタカナはひらがなにする）"""
+    return unicodedata.normalize('NFKC', text).lower().translate(_KATA_TO_HIRA)
+
+
+class _GramIndex:
+    """
+    1つの列の位置つき転置索引（CSR形式）
+    全行を区切り文字（\x00）でつないだ文字列での出現位置を、符号 grams[g] ごとに offsets[indptr[g]:indptr[g + 1]] に昇順で持つ
+    """
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        chars = np.frombuffer(('\x00'.join(texts) + '\x00').encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+        self.chars = chars.astype(np.int32)
+        self.row_of = np.repeat(np.arange(len(texts), dtype=np.int32), [len(text) + 1 for text in texts])
+        self.row_start = np.concatenate(([0], np.flatnonzero(chars == 0)[:-1] + 1)).astype(np.int32)
+        # 1文字・2文字の符号と出現位置を一括で作る（区切り文字をまたぐ2文字は除く）
+        single = chars != 0
+        pair = single[:-1] & single[1:]
+        offsets = np.arange(len(chars), dtype=np.int32 if len(chars) < 2 ** 31 else np.int64)
+        codes = np.concatenate((chars[single], (chars[:-1][pair] << _BIGRAM_SHIFT) | chars[1:][pair]))
+        offsets = np.concatenate((offsets[single], offsets[:-1][pair]))
+
+        order = np.argsort(codes, kind='stable')  # 同じ符号の中では出現位置の昇順
+        codes = codes[order]
+        self.offsets = offsets[order]
+        self.grams, starts = np.unique(codes, return_index=True)
+        self.indptr = np.append(starts, len(codes)).astype(np.int64)
+
+    def _posting_range(self, code: int) -> Tuple[int, int]:
+        pos = int(np.searchsorted(self.grams, code))
+        if pos == len(self.grams) or self.grams[pos] != code:
+            return 0, 0
+        return int(self.indptr[pos]), int(self.indptr[pos + 1])
+
+    def occurrences(self, term: str) -> np.ndarray:
+        """term の出現位置（昇順）"""
+        if len(term) == 1:
+            begin, end = self._posting_range(ord(term))
+            return self.offsets[begin:end]
+        # 出現数の最も少ない2文字の位置から開始位置の候補を作り、残りの文字は文字列の配列で直接確認する
+        ranges = [
+            (self._posting_range((ord(a) << _BIGRAM_SHIFT) | ord(b)), k) for k, (a, b) in enumerate(zip(term, term[1:]))
+        ]
+        (begin, end), k0 = min(ranges, key=lambda item: item[0][1] - item[0][0])
+        starts = self.offsets[begin:end] - k0
+        starts = starts[(starts >= 0) & (starts + len(term) <= len(self.chars))]
+        keep = np.ones(len(starts), dtype=bool)
+        for k, char in enumerate(term):
+            if k not in (k0, k0 + 1):
+                keep &= self.chars[starts + k] == ord(char)
+        return starts[keep]
+
+    def rows(self, starts: np.ndarray) -> np.ndarray:
+        """出現位置を含む行（重複なしの昇順）"""
+        rows = self.row_of[starts]
+        if len(rows) > 1:
+            rows = rows[np.concatenate(([True], rows[1:] != rows[:-1]))]  # 出現位置の昇順なので行も昇順
+        return rows
+
+    def prefix_rows(self, starts: np.ndarray) -> np.ndarray:
+        """行の先頭、または括弧（読み）の直後から始まる出現を含む行"""
+        at_head = starts == self.row_start[self.row_of[starts]]
+        after_paren = np.zeros(len(starts), dtype=bool)
+        inner = starts > 0
+        after_paren[inner] = self.chars[starts[inner] - 1] == ord('(')
+        return self.rows(starts[at_head | after_paren])
+
+
+class SpotSearchIndex:
+    """
+    スポット名・カテゴリ・説明の全文検索の索引（データ読み込みごとに1回作る）
+    検索語は空白で区切ると全ての語を含むスポットに絞り込み、列の重みと前方一致の加点で順位をつける。
+    カタカナとひらがなは区別しない（スポット名の括弧内の読みも、どちらの表記でも見つかる）。
+    """
+
+    def __init__(self, spots_df: pd.DataFrame, field_weights: Mapping[str, int] = SEARCH_FIELD_WEIGHTS):
+        self.size = len(spots_df)
+        self.field_weights = {col: weight for col, weight in field_weights.items() if col in spots_df.columns}
+        self.fields = {
+            col: _GramIndex([normalize_search_text(text) for text in spots_df[col].fillna('').astype(str)])
+            for col in self.field_weights
+        }
+
+    def __len__(self) -> int:
+        return self.size
+
+    @traced()
+    def search(self, query: str, limit: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        検索語に一致するスポットを関連度順に返す（同点はデータの順。検索語が空の場合は全件）
+        Returns: (スポットの位置, 点数)
+        """
+        terms = [term for term in _TERM_SEPARATOR.split(normalize_search_text(query)) if term]
+        if not terms:
+            positions = np.arange(self.size)
+            return positions[:limit], np.zeros(len(positions[:limit]), dtype=np.int64)
+
+        scores = np.zeros(self.size, dtype=np.int64)
+        matched = np.ones(self.size, dtype=bool)
+        for term in terms:
+            term_matched = np.zeros(self.size, dtype=bool)
+            for col, index in self.fields.items():
+                starts = index.occurrences(term)
+                found = index.rows(starts)
+                term_matched[found] = True
+                scores[found] += self.field_weights[col]
+                if col == 'スポット名' and len(found):
+                    scores[index.prefix_rows(starts)] += SEARCH_PREFIX_BONUS
+            matched &= term_matched
+
+        positions = np.flatnonzero(matched)
+        keys = -scores[positions]
+        if len(keys) and keys.min() > np.iinfo(np.int16).min:
+            keys = keys.astype(np.int16)  # 16ビット整数の安定ソートは基数ソートで速い
+        positions = positions[np.argsort(keys, kind='stable')][:limit]
+        return positions, scores[positions]
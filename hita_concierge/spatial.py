@@ -0,0 +1,133 @@
+"""空間インデックス（グリッド分割による近傍・半径検索）"""
+from math import radians, cos
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .geo import distances_from_point
+
+SPATIAL_GRID_CELL_KM = 0.5  # グリッドの1セルの大きさ（km）
+FACILITY_SEARCH_RADIUS_KM = 0.5  # 周辺施設の検索半径（km）
+KM_PER_DEG_LAT = 111.195  # 緯度1度あたりの距離（km）
+
+
+class SpatialGridIndex:
+    """緯度経度をグリッドに分割し、k近傍検索と半径検索を行う空間インデックス"""
+
+    def __init__(self, lats, lngs, cell_km: float = SPATIAL_GRID_CELL_KM):
+        self.lats = np.ascontiguousarray(lats, dtype=np.float64)
+        self.lngs = np.ascontiguousarray(lngs, dtype=np.float64)
+        self.cell_km = cell_km
+
+        # セルの大きさ（度）。経度方向は基準緯度のcosで補正する
+        ref_lat = float(np.mean(self.lats)) if len(self.lats) else 0.0
+        self.cell_lat = cell_km / KM_PER_DEG_LAT
+        self.cell_lng = cell_km / (KM_PER_DEG_LAT * max(cos(radians(ref_lat)), 1e-6))
+        # 緯度による経度方向のセル幅の変化を考慮した、1セルあたりの最小保証距離（km）
+        max_abs_lat = float(np.max(np.abs(self.lats))) if len(self.lats) else 0.0
+        self.min_cell_km = cell_km * min(1.0, cos(radians(max_abs_lat + 1.0)) / max(cos(radians(ref_lat)), 1e-6))
+
+        # セルごとに点の位置をまとめる
+        rows = np.floor(self.lats / self.cell_lat).astype(np.int64)
+        cols = np.floor(self.lngs / self.cell_lng).astype(np.int64)
+        order = np.lexsort((cols, rows))
+        self.cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if len(order):
+            keys = np.stack((rows[order], cols[order]), axis=1)
+            boundaries = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+            for group in np.split(order, boundaries):
+                self.cells[(int(rows[group[0]]), int(cols[group[0]]))] = group
+            self.row_range = (int(rows.min()), int(rows.max()))
+            self.col_range = (int(cols.min()), int(cols.max()))
+
+    @classmethod
+    def from_dataframe(cls, spots_df: pd.DataFrame, cell_km: float = SPATIAL_GRID_CELL_KM) -> 'SpatialGridIndex':
+        """データフレームの緯度・経度からインデックスを作成"""
+        return cls(spots_df['緯度'].to_numpy(), spots_df['経度'].to_numpy(), cell_km)
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def _cell_of(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(np.floor(lat / self.cell_lat)), int(np.floor(lng / self.cell_lng))
+
+    def _collect(self, row_lo: int, row_hi: int, col_lo: int, col_hi: int) -> np.ndarray:
+        """指定範囲のセルに含まれる点の位置を取得"""
+        row_lo, row_hi = max(row_lo, self.row_range[0]), min(row_hi, self.row_range[1])
+        col_lo, col_hi = max(col_lo, self.col_range[0]), min(col_hi, self.col_range[1])
+        if row_lo > row_hi or col_lo > col_hi:
+            return np.empty(0, dtype=np.int64)
+
+        if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) > len(self.cells):
+            # 範囲が広い場合は登録済みセルを走査する方が速い
+            groups = [
+                group for (r, c), group in self.cells.items()
+                if row_lo <= r <= row_hi and col_lo <= c <= col_hi
+            ]
+        else:
+            groups = [
+                self.cells[(r, c)]
+                for r in range(row_lo, row_hi + 1)
+                for c in range(col_lo, col_hi + 1)
+                if (r, c) in self.cells
+            ]
+        return np.concatenate(groups) if groups else np.empty(0, dtype=np.int64)
+
+    def query_radius(self, lat: float, lng: float, radius_km: float, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        半径内の点を検索
+        Returns: (位置の配列, 距離の配列) ※距離の近い順
+        """
+        if not self.cells:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        reach = int(np.ceil(radius_km / self.min_cell_km))
+        row, col = self._cell_of(lat, lng)
+        candidates = self._collect(row - reach, row + reach, col - reach, col + reach)
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+
+        distances = distances_from_point(lat, lng, self.lats[candidates], self.lngs[candidates])
+        inside = distances <= radius_km
+        order = np.argsort(distances[inside], kind='stable')
+        return candidates[inside][order], distances[inside][order]
+
+    def query_nearest(self, lat: float, lng: float, k: int = 1, mask: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        最も近いk個の点を検索（現在地のセルから外側へ探索範囲を広げる）
+        Returns: (位置の配列, 距離の配列) ※距離の近い順
+        """
+        if not self.cells or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        row, col = self._cell_of(lat, lng)
+        # グリッドに届くまでの探索範囲と、全セルを含むまでの探索範囲
+        reach = max(
+            self.row_range[0] - row, row - self.row_range[1],
+            self.col_range[0] - col, col - self.col_range[1], 0
+        )
+        max_reach = max(
+            abs(row - self.row_range[0]), abs(row - self.row_range[1]),
+            abs(col - self.col_range[0]), abs(col - self.col_range[1])
+        )
+
+        while True:
+            candidates = self._collect(row - reach, row + reach, col - reach, col + reach)
+            if mask is not None:
+                candidates = candidates[mask[candidates]]
+            distances = distances_from_point(lat, lng, self.lats[candidates], self.lngs[candidates])
+
+            # 探索範囲内であることが保証される距離以内にk個見つかれば確定
+            covered_km = reach * self.min_cell_km
+            if np.count_nonzero(distances <= covered_km) >= k or reach >= max_reach:
+                order = np.argsort(distances, kind='stable')[:k]
+                return candidates[order], distances[order]
+            reach += 1
+
+
+def shelter_mask(disaster_df: pd.DataFrame) -> np.ndarray:
+    """防災データのうち避難所として使える行（危険個所を除く）"""
+    if 'カテゴリ' in disaster_df.columns:
+        return (disaster_df['カテゴリ'] != '危険個所').to_numpy()
+    return np.ones(len(disaster_df), dtype=bool)
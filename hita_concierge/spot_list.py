@@ -0,0 +1,77 @@
+"""スポット一覧の検索・並び替え・ページ分割（全件分の索引を事前に作り、表示するページだけを取り出す）"""
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .links import create_google_maps_link
+from .search import SpotSearchIndex
+
+SPOT_LIST_SORTS = ('関連度順', '番号順', '距離が近い順', '名前順')  # 関連度順は検索語がない場合は番号順と同じ
+SPOT_LIST_PAGE_SIZE = 20  # カード表示の1ページの件数
+SPOT_LIST_TABLE_PAGE_SIZE = 200  # 表表示の1ページの件数
+SPOT_LIST_TABLE_THRESHOLD = 100  # 件数がこれより多い場合は表表示を既定にする
+SPOT_LIST_TABLE_COLUMNS = ['スポット名', 'カテゴリ', '距離（km）', '営業時間', '料金', '説明', 'Google Maps']
+
+
+class SpotListIndex:
+    """スポット一覧用の索引（全文検索の索引と名前順の順位を、データ読み込みごとに1回だけ作る）"""
+
+    def __init__(self, spots_df: pd.DataFrame):
+        def text_column(col):
+            if col not in spots_df.columns:
+                return [''] * len(spots_df)
+            return spots_df[col].fillna('').astype(str).tolist()
+
+        self.names = text_column('スポット名')
+        self.descriptions = text_column('説明')
+        self.categories = text_column('カテゴリ')
+        self.hours = text_column('営業時間')
+        self.fees = text_column('料金')
+        self.lats = spots_df['緯度'].to_numpy(dtype=np.float64)
+        self.lngs = spots_df['経度'].to_numpy(dtype=np.float64)
+        self.search_index = SpotSearchIndex(spots_df)
+        self.name_rank = np.empty(len(self.names), dtype=np.int64)
+        self.name_rank[np.argsort(np.array(self.names, dtype=object), kind='stable')] = np.arange(len(self.names))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def search(self, query: str) -> np.ndarray:
+        """スポット名・カテゴリ・説明に検索語を含むスポットの位置（関連度順。空の場合は全件）"""
+        return self.search_index.search(query)[0]
+
+    def ordered(self, positions: np.ndarray, sort_by: str, distances: np.ndarray) -> np.ndarray:
+        """検索結果（関連度順）を並び替える（distances は全スポットへの距離）"""
+        if sort_by == '距離が近い順':
+            return positions[np.argsort(distances[positions], kind='stable')]
+        if sort_by == '名前順':
+            return positions[np.argsort(self.name_rank[positions], kind='stable')]
+        if sort_by == '番号順':
+            return np.sort(positions)
+        return positions
+
+    def page_table(self, positions: np.ndarray, distances: np.ndarray, current_loc: List[float],
+                   mode: str = 'driving') -> pd.DataFrame:
+        """表表示用のページの表（Google Mapsのリンクはページ内のスポットの分だけ作る）"""
+        return pd.DataFrame({
+            'スポット名': [self.names[i] for i in positions],
+            'カテゴリ': [self.categories[i] for i in positions],
+            '距離（km）': distances[positions],
+            '営業時間': [self.hours[i] for i in positions],
+            '料金': [self.fees[i] for i in positions],
+            '説明': [self.descriptions[i] for i in positions],
+            'Google Maps': [
+                create_google_maps_link(current_loc, (self.lats[i], self.lngs[i]), mode) for i in positions
+            ],
+        }, columns=SPOT_LIST_TABLE_COLUMNS)
+
+
+def paginate(positions: np.ndarray, page: int, page_size: int) -> Tuple[np.ndarray, int, int]:
+    """
+    ページを取り出す
+    Returns: (ページ内の位置, 範囲内に収めたページ番号（0始まり）, ページ数)
+    """
+    pages = max(1, -(-len(positions) // page_size))
+    page = min(max(int(page), 0), pages - 1)
+    return positions[page * page_size:(page + 1) * page_size], page, pages
@@ -0,0 +1,90 @@
+"""スポットデータの列指向ストア（読み取り専用）"""
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import List, Mapping, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .data import parse_fee_yen, parse_opening_hours
+
+
+def _readonly_array(values, dtype) -> np.ndarray:
+    """連続領域の読み取り専用配列を作成"""
+    array = np.ascontiguousarray(values, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+
+@dataclass(frozen=True)
+class SpotStore:
+    """最適化・地図作成用に、スポットの列データを配列で保持する"""
+    names: Tuple[str, ...]
+    lats: np.ndarray  # float64
+    lngs: np.ndarray  # float64
+    stay_minutes: np.ndarray  # int64（所要時間（参考））
+    wait_minutes: np.ndarray  # int64（待ち時間（分））
+    open_minutes: np.ndarray  # float64 (件数, 時間帯数)（営業時間の開始、0時からの分）
+    close_minutes: np.ndarray  # float64 (件数, 時間帯数)（営業時間の終了、0時からの分）
+    fees_yen: np.ndarray  # float64（料金の円換算。読み取れない場合はnan）
+    scores: np.ndarray  # float64（おすすめ度。時間・予算の上限つきルートで合計を最大化する）
+    name_to_index: Mapping[str, int]  # スポット名 → 位置（重複時は先頭）
+
+    @classmethod
+    def from_dataframe(cls, spots_df: pd.DataFrame) -> 'SpotStore':
+        """データフレームからストアを作成"""
+        names = tuple(spots_df['スポット名'].astype(str))
+        n = len(names)
+
+        def int_column(col, default):
+            if col not in spots_df.columns:
+                return np.full(n, default, dtype=np.int64)
+            return pd.to_numeric(spots_df[col], errors='coerce').fillna(default).to_numpy(dtype=np.int64)
+
+        name_to_index = {}
+        for i, name in enumerate(names):
+            name_to_index.setdefault(name, i)
+
+        # 営業時間は読み込み時に1回だけ時間帯へ変換する（列がない場合は終日）
+        hours = spots_df['営業時間'] if '営業時間' in spots_df.columns else pd.Series(['終日'] * n, dtype=object)
+        open_minutes, close_minutes = parse_opening_hours(hours)
+        # 料金も読み込み時に1回だけ円へ変換する（「無料」は0円。読み取れない表記は無料とみなさずnanのまま）
+        fees = parse_fee_yen(spots_df['料金']) if '料金' in spots_df.columns else np.full(n, np.nan)
+        if 'おすすめ度' in spots_df.columns:
+            scores = pd.to_numeric(spots_df['おすすめ度'], errors='coerce').fillna(1).clip(lower=0).to_numpy()
+        else:
+            scores = np.ones(n)
+
+        return cls(
+            names=names,
+            lats=_readonly_array(spots_df['緯度'].to_numpy(), np.float64),
+            lngs=_readonly_array(spots_df['経度'].to_numpy(), np.float64),
+            stay_minutes=_readonly_array(int_column('所要時間（参考）', 60), np.int64),
+            wait_minutes=_readonly_array(int_column('待ち時間（分）', 0), np.int64),
+            open_minutes=_readonly_array(open_minutes, np.float64),
+            close_minutes=_readonly_array(close_minutes, np.float64),
+            fees_yen=_readonly_array(fees, np.float64),
+            scores=_readonly_array(scores, np.float64),
+            name_to_index=MappingProxyType(name_to_index),
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def coords(self, idx: int) -> Tuple[float, float]:
+        """スポットの (緯度, 経度)"""
+        return float(self.lats[idx]), float(self.lngs[idx])
+
+    def indices_of(self, names: List[str]) -> List[int]:
+        """スポット名のリストを位置のリストに変換"""
+        return [self.name_to_index[name] for name in names]
+
+
+def as_spot_store(spots: Union[SpotStore, pd.DataFrame]) -> SpotStore:
+    """データフレームが渡された場合はストアに変換"""
+    return SpotStore.from_dataframe(spots) if isinstance(spots, pd.DataFrame) else spots
+
+
+def route_coordinates(spots: SpotStore, route: List[int]) -> List[Tuple[float, float]]:
+    """訪問順の (緯度, 経度) リスト"""
+    return [spots.coords(idx) for idx in route]
@@ -0,0 +1,339 @@
+"""
+地図タイルのオフライン配信（日田市周辺のタイルをMBTiles（SQLite）に保存し、ローカルのHTTPサーバーから配信する）
+
+タイルは事前に取得（シード）しておき、地図は公開のタイルサーバーではなくローカルのサーバーを参照する。
+災害時に外部のネットワークが使えない場合も地図を表示でき、利用者ごとに公開サーバーへアクセスすることもない。
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# タイルの座標は XYZ（y は北から）。MBTilesの tile_row は TMS（y は南から）のため保存時に反転する
+TILES_FILE = 'hita.mbtiles'  # タイルの保存先の既定のファイル名
+TILE_BOUNDS = (130.75, 33.05, 131.20, 33.45)  # 日田市周辺の範囲（西端の経度, 南端の緯度, 東端の経度, 北端の緯度）
+TILE_MIN_ZOOM = 10  # シードする最小ズーム
+TILE_MAX_ZOOM = 16  # シードする最大ズーム（17以上は件数が4倍ずつ増える）
+TILE_SOURCE_URL = ''  # シード元の既定はなし（公開のOSMサーバーからの一括取得は利用規約違反。許可されたサーバーを指定する）
+TILE_ATTRIBUTION = '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
+TILE_USER_AGENT = 'hita-concierge-tile-seeder/1.0'
+TILE_FETCH_WORKERS = 2  # シード時の同時取得数（シード元の負荷を抑える）
+TILE_FETCH_TIMEOUT_SEC = 10.0
+TILE_WRITE_BATCH = 256  # まとめて書き込むタイル数（1トランザクション）
+TILE_SERVER_HOST = '127.0.0.1'
+TILE_SERVER_PORT = 8765
+TILE_CACHE_MAX_AGE_SEC = 7 * 24 * 60 * 60  # ブラウザにタイルを保持させる期間（秒）
+TILE_URL_ENV_VAR = 'HITA_TILE_URL'  # ブラウザから見たタイルサーバーのURL（別のホストから閲覧する場合に設定）
+TILE_FORMATS = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+
+class TileStoreError(Exception):
+    """タイルの保存先の読み込みエラー"""
+
+
+def tile_range(bounds: Sequence[float], zoom: int) -> Tuple[int, int, int, int]:
+    """範囲を含むタイルの番号の範囲 (x最小, x最大, y最小, y最大)（両端を含む。y は北から）"""
+    west, south, east, north = bounds
+    n = 1 << zoom
+
+    def tile_x(lng):
+        return min(n - 1, max(0, int((lng + 180.0) / 360.0 * n)))
+
+    def tile_y(lat):
+        lat_rad = math.radians(max(-85.0511, min(85.0511, lat)))
+        return min(n - 1, max(0, int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)))
+
+    return tile_x(west), tile_x(east), tile_y(north), tile_y(south)
+
+
+def tile_count(bounds: Sequence[float], zooms: Iterable[int]) -> int:
+    """範囲を含むタイルの件数（ズームの合計）"""
+    total = 0
+    for zoom in zooms:
+        x0, x1, y0, y1 = tile_range(bounds, zoom)
+        total += (x1 - x0 + 1) * (y1 - y0 + 1)
+    return total
+
+
+class MBTilesStore:
+    """
+    MBTiles形式（SQLite）のタイルの保存先
+    読み込みはスレッドごとの接続で並行に行い、書き込みはまとめて1トランザクションで行う。
+    """
+
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+        if readonly:
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            try:
+                self.metadata()
+            except sqlite3.DatabaseError as e:
+                raise TileStoreError(f"タイルの保存先を読み込めません: {e}") from e
+        else:
+            with self._connection() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, "
+                    "tile_data BLOB, PRIMARY KEY (zoom_level, tile_column, tile_row))"
+                )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def metadata(self) -> Dict[str, str]:
+        """メタデータ（name / format / bounds / minzoom / maxzoom / attribution など）"""
+        return dict(self._connection().execute("SELECT name, value FROM metadata").fetchall())
+
+    def set_metadata(self, values: Dict[str, object]):
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                [(name, str(value)) for name, value in values.items()]
+            )
+
+    def get_tile(self, zoom: int, x: int, y: int) -> Optional[bytes]:
+        """タイルの画像（ない場合はNone。y は北から）"""
+        row = self._connection().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (zoom, x, (1 << zoom) - 1 - y)
+        ).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def put_tiles(self, tiles: Iterable[Tuple[int, int, int, bytes]]):
+        """(ズーム, x, y, 画像) をまとめて書き込む"""
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                [(zoom, x, (1 << zoom) - 1 - y, sqlite3.Binary(data)) for zoom, x, y, data in tiles]
+            )
+
+    def missing_tiles(self, bounds: Sequence[float], zoom: int) -> List[Tuple[int, int, int]]:
+        """範囲のうち、まだ保存していないタイル (ズーム, x, y)（保存済みのタイルは範囲の検索1回で調べる）"""
+        x0, x1, y0, y1 = tile_range(bounds, zoom)
+        flip = (1 << zoom) - 1
+        rows = self._connection().execute(
+            "SELECT tile_column, tile_row FROM tiles WHERE zoom_level = ? "
+            "AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?",
+            (zoom, x0, x1, flip - y1, flip - y0)
+        ).fetchall()
+        width, height = x1 - x0 + 1, y1 - y0 + 1
+        have = np.zeros((height, width), dtype=bool)
+        if rows:
+            stored = np.array(rows, dtype=np.int64)
+            have[flip - stored[:, 1] - y0, stored[:, 0] - x0] = True
+        ys, xs = np.nonzero(~have)
+        return [(zoom, int(x), int(y)) for x, y in zip(xs + x0, ys + y0)]
+
+    def tile_counts(self) -> Dict[int, int]:
+        """ズームごとの保存済みのタイル数"""
+        return dict(self._connection().execute(
+            "SELECT zoom_level, COUNT(*) FROM tiles GROUP BY zoom_level ORDER BY zoom_level"
+        ).fetchall())
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def find_tiles_file(directory: str = '.') -> Optional[str]:
+    """既定のタイルの保存先を探す（見つからない場合はNone）"""
+    path = os.path.join(directory, TILES_FILE)
+    return path if os.path.exists(path) else None
+
+
+# シード（事前取得）
+
+def download_tile(source_url: str, zoom: int, x: int, y: int, timeout: float = TILE_FETCH_TIMEOUT_SEC) -> bytes:
+    """シード元から1枚のタイルを取得"""
+    request = urllib.request.Request(
+        source_url.format(z=zoom, x=x, y=y), headers={'User-Agent': TILE_USER_AGENT}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def _batches(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def prefetch_tiles(store: MBTilesStore, bounds: Sequence[float] = TILE_BOUNDS,
+                   zooms: Iterable[int] = range(TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1),
+                   source_url: str = TILE_SOURCE_URL, workers: int = TILE_FETCH_WORKERS,
+                   fetch: Optional[Callable[[int, int, int], bytes]] = None,
+                   progress: Optional[Callable[[int, int], None]] = None) -> Tuple[int, int]:
+    """
+    範囲のタイルをズームごとに取得して保存する（保存済みのタイルは取得しない）
+    Args:
+        store: 保存先
+        bounds: 範囲（西端の経度, 南端の緯度, 東端の経度, 北端の緯度）
+        zooms: 取得するズーム
+        source_url: シード元のURL（{z} / {x} / {y} を置き換える。fetch を省略する場合は必須）
+        workers: 同時に取得する数
+        fetch: (ズーム, x, y) から画像を返す関数（省略時は source_url から取得）
+        progress: (処理済みの件数, 取得する件数) を受け取る関数
+    Returns:
+        (保存した件数, 取得できなかった件数)
+    Raises:
+        ValueError: source_url と fetch のどちらも指定されていない場合
+    """
+    if fetch is None and not source_url:
+        raise ValueError("シード元のURLを指定してください（一括取得が許可されたタイルサーバー）")
+    zooms = sorted(set(zooms))
+    fetch = fetch or (lambda zoom, x, y: download_tile(source_url, zoom, x, y))
+    missing = [tile for zoom in zooms for tile in store.missing_tiles(bounds, zoom)]
+    saved = failed = 0
+
+    def fetch_one(tile):
+        try:
+            return tile, fetch(*tile)
+        except OSError:
+            return tile, None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for batch in _batches(missing, TILE_WRITE_BATCH):
+            fetched = [(zoom, x, y, data) for (zoom, x, y), data in pool.map(fetch_one, batch) if data]
+            store.put_tiles(fetched)
+            saved += len(fetched)
+            failed += len(batch) - len(fetched)
+            if progress is not None:
+                progress(saved + failed, len(missing))
+
+    counts = store.tile_counts()
+    metadata = store.metadata()
+    image_format = os.path.splitext(source_url.split('?')[0])[1].lstrip('.').lower() or 'png'
+    store.set_metadata({
+        'name': metadata.get('name', '日田市'),
+        'format': metadata.get('format', image_format if image_format in TILE_FORMATS else 'png'),
+        'bounds': ','.join(str(v) for v in bounds),
+        'minzoom': min(counts) if counts else zooms[0],
+        'maxzoom': max(counts) if counts else zooms[-1],
+        'attribution': metadata.get('attribution', TILE_ATTRIBUTION),
+    })
+    return saved, failed
+
+
+# ローカルのタイルサーバー
+
+class _TileRequestHandler(BaseHTTPRequestHandler):
+    """/{z}/{x}/{y}.{拡張子} のタイルを返す（ETagとCache-Controlつき）"""
+    server: 'ThreadingHTTPServer'
+
+    def do_GET(self):
+        tile_server: TileServer = self.server.tile_server
+        parts = self.path.split('?')[0].strip('/').split('/')
+        try:
+            zoom, x = int(parts[-3]), int(parts[-2])
+            y = int(parts[-1].split('.')[0])
+        except (IndexError, ValueError):
+            self._send_empty(400)
+            return
+        data = tile_server.store.get_tile(zoom, x, y)
+        if data is None:
+            self._send_empty(404, max_age=60)  # 範囲外のタイルは短時間だけ保持させる
+            return
+
+        etag = f'"{hashlib.sha1(data).hexdigest()[:16]}"'
+        if self.headers.get('If-None-Match') == etag:
+            self._send_empty(304, etag=etag, max_age=TILE_CACHE_MAX_AGE_SEC)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', tile_server.content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self._cache_headers(etag, TILE_CACHE_MAX_AGE_SEC)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _cache_headers(self, etag: Optional[str], max_age: int):
+        self.send_header('Cache-Control', f'public, max-age={max_age}')
+        self.send_header('Last-Modified', self.server.tile_server.last_modified)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if etag:
+            self.send_header('ETag', etag)
+
+    def _send_empty(self, status: int, etag: Optional[str] = None, max_age: int = 0):
+        self.send_response(status)
+        self._cache_headers(etag, max_age)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass  # リクエストごとのログは出さない
+
+
+@dataclass
+class TileServer:
+    """バックグラウンドのスレッドで動くタイルサーバー（シードし直したタイルも再起動せずに配信する）"""
+    store: MBTilesStore
+    httpd: ThreadingHTTPServer
+    thread: threading.Thread
+    url: str  # ブラウザから見たタイルのURL（{z} / {x} / {y} を含む）
+    content_type: str
+    min_zoom: int
+    max_zoom: int  # 保存済みの最大ズーム（これより拡大した地図はこのズームのタイルを引き伸ばす）
+    attribution: str
+
+    @property
+    def last_modified(self) -> str:
+        return formatdate(os.path.getmtime(self.store.path), usegmt=True)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.store.close()
+
+
+def start_tile_server(path: str, host: str = TILE_SERVER_HOST, port: int = TILE_SERVER_PORT,
+                      public_url: Optional[str] = None) -> TileServer:
+    """
+    MBTilesのタイルを配信するサーバーをバックグラウンドで起動
+    Args:
+        path: MBTilesファイル
+        host, port: 待ち受けるアドレス（port=0 の場合は空いているポート）
+        public_url: ブラウザから見たサーバーのURL（省略時は環境変数 HITA_TILE_URL、なければ http://{host}:{port}）
+    Raises:
+        FileNotFoundError: ファイルがない場合
+        TileStoreError: MBTilesとして読めない場合
+        OSError: ポートを使えない場合
+    """
+    store = MBTilesStore(path, readonly=True)
+    metadata = store.metadata()
+    image_format = metadata.get('format', 'png')
+    httpd = ThreadingHTTPServer((host, port), _TileRequestHandler)
+    httpd.daemon_threads = True
+    base_url = (public_url or os.environ.get(TILE_URL_ENV_VAR) or f'http://{host}:{httpd.server_port}').rstrip('/')
+    thread = threading.Thread(target=httpd.serve_forever, name='tile-server', daemon=True)
+    server = TileServer(
+        store=store,
+        httpd=httpd,
+        thread=thread,
+        url=f'{base_url}/{{z}}/{{x}}/{{y}}.{image_format}',
+        content_type=TILE_FORMATS.get(image_format, 'application/octet-stream'),
+        min_zoom=int(metadata.get('minzoom', 0)),
+        max_zoom=int(metadata.get('maxzoom', 18)),
+        attribution=metadata.get('attribution', TILE_ATTRIBUTION),
+    )
+    httpd.tile_server = server
+    thread.start()
+    return server
@@ -0,0 +1,214 @@
+"""
+ホットパスの処理時間の計測（再実行ごと・ナノ秒単位）
+
+計測は begin_trace() で記録を始めたスレッド（Streamlitでは再実行中のスクリプト）の中だけで行う。
+記録していない場合の span() / traced() はコンテキスト変数を1回参照するだけで、計測の負荷はほぼない。
+集計は TraceRegistry に積み上げ、Prometheusのテキスト形式や構造化ログ（JSON）で出力できる。
+"""
+import functools
+import json
+import logging
+import os
+import threading
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import perf_counter_ns, time
+from typing import Callable, Dict, List, Mapping, Optional
+
+TRACE_ENV_VAR = 'HITA_TRACE'  # 1 にするとデバッグ表示の有無にかかわらず全ての再実行を計測
+TRACE_PROMETHEUS_FILE_ENV_VAR = 'HITA_TRACE_PROM_FILE'  # 指定するとPrometheus形式の集計をこのファイルに書き出す
+TRACE_BUCKETS_SEC = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # ヒストグラムの区切り
+RERUN_SPAN = 'rerun'  # 再実行全体の処理時間の名前
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SpanRecord:
+    """1回の計測結果"""
+    name: str
+    start_ns: int  # 記録開始からの経過（ナノ秒）
+    duration_ns: int
+    depth: int  # 入れ子の深さ（0が最上位）
+
+
+@dataclass
+class TraceRecorder:
+    """1回の再実行の計測結果"""
+    started_ns: int = field(default_factory=perf_counter_ns)
+    started_at: float = field(default_factory=time)  # 記録開始の時刻（time.time()）
+    spans: List[SpanRecord] = field(default_factory=list)
+    total_ns: Optional[int] = None  # finish_trace() 後に設定
+    depth: int = 0
+
+    def ordered_spans(self) -> List[SpanRecord]:
+        """開始順の計測結果"""
+        return sorted(self.spans, key=lambda s: (s.start_ns, s.depth))
+
+    def to_log_record(self) -> dict:
+        """構造化ログ用の辞書"""
+        return {
+            'event': 'trace',
+            'started_at': self.started_at,
+            'total_ms': (self.total_ns or 0) / 1e6,
+            'spans': [{'name': s.name, 'start_ms': s.start_ns / 1e6, 'duration_ms': s.duration_ns / 1e6,
+                       'depth': s.depth} for s in self.ordered_spans()],
+        }
+
+
+_current: ContextVar[Optional[TraceRecorder]] = ContextVar('hita_trace', default=None)
+
+
+class _Span:
+    __slots__ = ('recorder', 'name', 'start_ns', 'depth')
+
+    def __init__(self, recorder: TraceRecorder, name: str):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.depth = self.recorder.depth
+        self.recorder.depth += 1
+        self.start_ns = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end_ns = perf_counter_ns()
+        recorder = self.recorder
+        recorder.depth -= 1
+        recorder.spans.append(
+            SpanRecord(self.name, self.start_ns - recorder.started_ns, end_ns - self.start_ns, self.depth)
+        )
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def trace_env_enabled() -> bool:
+    """環境変数で全ての再実行の計測が有効になっているか"""
+    return os.environ.get(TRACE_ENV_VAR, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def begin_trace(enabled: bool) -> Optional[TraceRecorder]:
+    """現在のスレッドで計測の記録を始める（enabled がFalseの場合は前回の記録も止める）"""
+    recorder = TraceRecorder() if enabled else None
+    _current.set(recorder)
+    return recorder
+
+
+def span(name: str):
+    """with文で囲んだ区間の処理時間を計測（記録中でなければ何もしない）"""
+    recorder = _current.get()
+    return _NULL_SPAN if recorder is None else _Span(recorder, name)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """関数の処理時間を計測するデコレーター（名前の省略時はモジュール名.関数名）"""
+    def decorate(func: Callable) -> Callable:
+        label = name or f'{func.__module__.rsplit(".", 1)[-1]}.{func.__qualname__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _current.get()
+            if recorder is None:
+                return func(*args, **kwargs)
+            with _Span(recorder, label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class TraceRegistry:
+    """処理ごとの処理時間の集計（回数・合計・最大・ヒストグラム。スレッドセーフ）"""
+
+    def __init__(self, buckets_sec=TRACE_BUCKETS_SEC):
+        self.buckets_ns = tuple(int(b * 1e9) for b in buckets_sec)
+        self._stats: Dict[str, List] = {}  # 名前 → [回数, 合計ns, 最大ns, 区切りごとの件数]
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, duration_ns: int):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = [0, 0, 0, [0] * len(self.buckets_ns)]
+            stats[0] += 1
+            stats[1] += duration_ns
+            stats[2] = max(stats[2], duration_ns)
+            counts = stats[3]
+            for i, bound in enumerate(self.buckets_ns):
+                if duration_ns <= bound:
+                    counts[i] += 1
+                    break
+
+    def summary(self) -> List[dict]:
+        """処理ごとの回数・平均・最大（ms）。合計時間の長い順"""
+        with self._lock:
+            rows = [{'name': name, 'count': count, 'total_ms': total / 1e6, 'mean_ms': total / count / 1e6,
+                     'max_ms': peak / 1e6} for name, (count, total, peak, _) in self._stats.items()]
+        return sorted(rows, key=lambda row: -row['total_ms'])
+
+    def prometheus_text(self, gauges: Optional[Mapping[str, float]] = None) -> str:
+        """Prometheusのテキスト形式（処理時間のヒストグラムと、任意のゲージ）"""
+        lines = [
+            '# HELP hita_span_duration_seconds Duration of traced hot paths per rerun.',
+            '# TYPE hita_span_duration_seconds histogram',
+        ]
+        with self._lock:
+            snapshot = {name: (count, total, list(counts)) for name, (count, total, _, counts) in self._stats.items()}
+        for name in sorted(snapshot):
+            count, total, counts = snapshot[name]
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, n in zip(self.buckets_ns, counts):
+                cumulative += n
+                lines.append(f'hita_span_duration_seconds_bucket{{span="{label}",le="{bound / 1e9:g}"}} {cumulative}')
+            lines.append(f'hita_span_duration_seconds_bucket{{span="{label}",le="+Inf"}} {count}')
+            lines.append(f'hita_span_duration_seconds_sum{{span="{label}"}} {total / 1e9:.9f}')
+            lines.append(f'hita_span_duration_seconds_count{{span="{label}"}} {count}')
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus_file(self, path: str, gauges: Optional[Mapping[str, float]] = None):
+        """Prometheusのテキスト形式をファイルに書き出す（node_exporterのtextfile収集向けに置き換えで書く）"""
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text(gauges))
+        os.replace(temp_path, path)
+
+
+def finish_trace(recorder: Optional[TraceRecorder], registry: TraceRegistry,
+                 gauges: Optional[Mapping[str, float]] = None) -> Optional[TraceRecorder]:
+    """
+    記録を終えて集計に加え、構造化ログ（INFO、JSON）を出力する
+    環境変数 HITA_TRACE_PROM_FILE が指定されていればPrometheus形式の集計も書き出す
+    """
+    if recorder is None:
+        return None
+    recorder.total_ns = perf_counter_ns() - recorder.started_ns
+    _current.set(None)
+    registry.observe(RERUN_SPAN, recorder.total_ns)
+    for record in recorder.spans:
+        registry.observe(record.name, record.duration_ns)
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(recorder.to_log_record(), ensure_ascii=False))
+    prometheus_file = os.environ.get(TRACE_PROMETHEUS_FILE_ENV_VAR)
+    if prometheus_file:
+        try:
+            registry.write_prometheus_file(prometheus_file, gauges)
+        except OSError as e:
+            logger.warning("Prometheus形式の集計を書き出せません: %s", e)
+    return recorder
@@ -0,0 +1,571 @@
+"""公共交通（GTFS）の時刻表による経路探索（RAPTOR。ローカルのGTFSファイルのみ使用し、外部サービスに接続しない）"""
+import hashlib
+import io
+import os
+import zipfile
+from dataclasses import dataclass
+from datetime import date
+from functools import cached_property
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .geo import distances_from_point, route_distance_matrix
+from .roads import PROFILE_SPEED_KMH
+from .spatial import SpatialGridIndex
+from .store import SpotStore, as_spot_store
+from .tracing import traced
+
+# 時刻表の時刻は運行日の0時からの秒（GTFSと同じく深夜は24:00:00以降）、クエリの時刻は0時からの分で扱う。
+# 系統（pattern）は停留所の並びが同じで追い越しのない便の集まり。系統の停留所の並びを全系統つないだものを「停車」と呼び、
+# RAPTORの各ラウンドは全停車を配列のまま一括で走査する（便の時刻は停車ごとに便の出発順に並べて持つ）
+TRANSIT_FEED_DIR = 'gtfs'  # GTFSファイル（.zip または展開したフォルダ）の既定の置き場
+TRANSIT_WALK_KMH = PROFILE_SPEED_KMH['walking']  # 停留所までの徒歩・乗り換えの徒歩の速度
+TRANSIT_ACCESS_KM = 1.0  # 出発地・目的地から停留所まで歩く最大距離
+TRANSIT_TRANSFER_KM = 0.3  # 乗り換えで歩く停留所間の最大距離
+TRANSIT_MIN_TRANSFER_SEC = 60  # 乗り換えに必要な最小時間（秒）
+TRANSIT_MAX_TRANSFERS = 3  # 乗り換え回数の上限（RAPTORのラウンド数は +1）
+TRANSIT_PROFILE_WINDOW_MIN = 120  # スポット間の所要時間を平均する出発時刻の幅（分）
+TRANSIT_PROFILE_SAMPLES = 4  # 平均する出発時刻の数
+TRANSIT_DEFAULT_START_MINUTES = 9 * 60  # 出発時刻を指定しない場合（9:00）
+_REQUIRED_FILES = ('stops.txt', 'routes.txt', 'trips.txt', 'stop_times.txt')
+_OPTIONAL_FILES = ('calendar.txt', 'calendar_dates.txt')
+_WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+_ACCESS, _RIDE, _WALK = 1, 2, 3  # 停留所に着いた方法（ラウンドごとのラベル）
+_TIME_SPAN = 1 << 20  # 停車ごとの時刻を1つの昇順の配列で検索するための間隔（秒。時刻表の時刻はこれより小さい）
+
+
+class TransitDataError(Exception):
+    """GTFSの読み込みエラー"""
+
+
+@dataclass(frozen=True)
+class TransitLeg:
+    """経路の1区間（徒歩または乗車）"""
+    kind: str  # '徒歩' / '乗車'
+    route_name: str  # 系統名（徒歩は空）
+    from_name: str
+    to_name: str
+    depart: float  # 0時からの分
+    arrive: float
+
+
+@dataclass(frozen=True)
+class TransitJourney:
+    """出発地から目的地までの最早到着の経路"""
+    legs: List[TransitLeg]
+    depart: float  # 出発時刻（0時からの分）
+    arrive: float  # 到着時刻（0時からの分）
+
+    @property
+    def minutes(self) -> float:
+        return self.arrive - self.depart
+
+    @property
+    def transfers(self) -> int:
+        return max(0, sum(leg.kind == '乗車' for leg in self.legs) - 1)
+
+
+def _csr_entries(indptr: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """CSR形式の行の要素の位置と、要素ごとの行"""
+    starts, ends = indptr[rows], indptr[rows + 1]
+    counts = ends - starts
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=rows.dtype)
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+    return np.arange(total) + offsets, np.repeat(rows, counts)
+
+
+@dataclass(frozen=True)
+class TransitTimetable:
+    """1日分の時刻表（RAPTOR用の配列。系統 p の停車は pattern_stops[pattern_indptr[p]:pattern_indptr[p + 1]]）"""
+    service_date: date
+    stop_names: Tuple[str, ...]
+    stop_lats: np.ndarray  # float64 (停留所数,)
+    stop_lngs: np.ndarray  # float64 (停留所数,)
+    pattern_names: Tuple[str, ...]  # 系統名
+    pattern_indptr: np.ndarray  # int64 (系統数 + 1,) 系統の停留所の範囲
+    pattern_stops: np.ndarray  # int32 (停車数,) 系統ごとの停留所の並び
+    time_indptr: np.ndarray  # int64 (系統数 + 1,) 系統の時刻の範囲（停留所数 × 便数）
+    arrivals: np.ndarray  # int32 到着時刻（秒）。系統ごとに停車の順、停車ごとに便の出発順
+    departures: np.ndarray  # int32 出発時刻（秒）
+    transfer_indptr: np.ndarray  # int64 (停留所数 + 1,) 歩いて乗り換えられる停留所の範囲
+    transfer_stops: np.ndarray  # int32
+    transfer_seconds: np.ndarray  # int32
+    source: str  # 読み込んだGTFSファイル
+
+    def __len__(self) -> int:
+        return len(self.stop_lats)
+
+    @property
+    def pattern_count(self) -> int:
+        return len(self.pattern_names)
+
+    @property
+    def trip_count(self) -> int:
+        return int(sum(self._trip_times(p)[0].shape[0] for p in range(self.pattern_count)))
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """時刻表の内容から算出したハッシュ値（算出結果のキャッシュの照合に使う）"""
+        digest = hashlib.sha1(self.service_date.isoformat().encode())
+        for array in (self.stop_lats, self.stop_lngs, self.pattern_indptr, self.pattern_stops,
+                      self.arrivals, self.departures, self.transfer_stops, self.transfer_seconds):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()[:16]
+
+    @cached_property
+    def _stop_index(self) -> SpatialGridIndex:
+        return SpatialGridIndex(self.stop_lats, self.stop_lngs)
+
+    @cached_property
+    def _stop_entries(self) -> Tuple[np.ndarray, ...]:
+        """
+        停車ごとの (系統, 系統の先頭か, 便数, 時刻の開始位置, 系統ごとの区切りの値) と、
+        停車の番号 × _TIME_SPAN + 出発時刻 の昇順の配列（全停車の乗れる便を1回の二分探索で求める）
+        """
+        lengths = np.diff(self.pattern_indptr)
+        trips = np.diff(self.time_indptr) // np.maximum(lengths, 1)
+        patterns = np.repeat(np.arange(len(lengths)), lengths)
+        positions = np.arange(len(self.pattern_stops)) - self.pattern_indptr[patterns]
+        first = positions == 0
+        entry_trips = trips[patterns]
+        starts = self.time_indptr[patterns] + positions * entry_trips
+        # 系統ごとの累積最小を1回で求めるため、後ろの系統ほど小さくなる値を足す
+        offsets = patterns * (int(trips.max(initial=0)) + 1)
+        keys = np.repeat(np.arange(len(patterns), dtype=np.int64), entry_trips) * _TIME_SPAN + self.departures
+        return patterns, first, entry_trips, starts, offsets, keys
+
+    def _trip_times(self, pattern: int) -> Tuple[np.ndarray, np.ndarray]:
+        """系統の (到着, 出発) の表（便数, 停留所数）"""
+        width = int(self.pattern_indptr[pattern + 1] - self.pattern_indptr[pattern])
+        begin, end = self.time_indptr[pattern], self.time_indptr[pattern + 1]
+        return self.arrivals[begin:end].reshape(width, -1).T, self.departures[begin:end].reshape(width, -1).T
+
+    def _walk_stops(self, lats, lngs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """地点ごとに歩いて行ける停留所の (地点, 停留所, 徒歩の秒数)"""
+        points, stops, seconds = [], [], []
+        for i, (lat, lng) in enumerate(zip(np.atleast_1d(lats), np.atleast_1d(lngs))):
+            found, km = self._stop_index.query_radius(float(lat), float(lng), TRANSIT_ACCESS_KM)
+            points.append(np.full(len(found), i, dtype=np.int64))
+            stops.append(found)
+            seconds.append(km / TRANSIT_WALK_KMH * 3600)
+        if not points:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(points), np.concatenate(stops), np.concatenate(seconds)
+
+    def _raptor(self, access_stops: np.ndarray, access_arrivals: np.ndarray, with_labels: bool = False,
+                max_transfers: int = TRANSIT_MAX_TRANSFERS) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        RAPTOR（乗車回数ごとのラウンドで、前のラウンドで着いた停留所から乗れる便を全系統まとめて走査する）
+        Returns:
+            (tau, labels) tau[k, s] は k回以内の乗車で停留所 s に着く最早時刻（秒）。
+            labels は経路の復元用（着いた方法・系統・便・乗車位置・降車位置・歩く前の停留所。with_labels の場合のみ）
+        """
+        n = len(self)
+        rounds = max_transfers + 1
+        patterns, first, entry_trips, starts, offsets, keys = self._stop_entries
+        entry_ids = np.arange(len(patterns))
+        tau = np.full((rounds + 1, n), np.inf)
+        np.minimum.at(tau[0], access_stops, access_arrivals)
+        labels = {key: np.full((rounds + 1, n), -1, dtype=np.int32)
+                  for key in ('kind', 'pattern', 'trip', 'board', 'alight', 'walk_from')} if with_labels else {}
+        if with_labels:
+            labels['kind'][0, np.isfinite(tau[0])] = _ACCESS
+        best = tau[0].copy()
+        marked = np.isfinite(tau[0])
+
+        for k in range(1, rounds + 1):
+            if not marked.any():
+                tau = tau[:k]
+                labels = {key: value[:k] for key, value in labels.items()}
+                break
+            tau[k] = tau[k - 1]
+            for value in labels.values():
+                value[k] = value[k - 1]
+
+            # 前のラウンドで着いた停留所だけで乗る（2回目以降の乗車は乗り換え時間をみる）
+            board_time = np.where(marked, tau[k - 1] + (TRANSIT_MIN_TRANSFER_SEC if k > 1 else 0), np.inf)
+            board_time = np.ceil(np.minimum(board_time[self.pattern_stops], _TIME_SPAN - 1)).astype(np.int64)
+            # 停車ごとに乗れる最初の便（便は出発順で追い越しがないため、乗れない便の数が位置になる）
+            catch = np.searchsorted(keys, entry_ids * _TIME_SPAN + board_time) - starts
+            riding = np.minimum.accumulate(catch - offsets) + offsets
+            on = np.empty_like(riding)  # その停車に着くまでに乗っている便（乗っていない場合は便数）
+            on[1:] = riding[:-1]
+            on[first] = entry_trips[first]
+            reach = np.flatnonzero(on < entry_trips)
+            times = self.arrivals[starts[reach] + on[reach]]
+            reached = self.pattern_stops[reach]
+            better = times < best[reached]
+            reach, times, reached = reach[better], times[better], reached[better]
+
+            ridden = np.zeros(n, dtype=bool)
+            if len(reach):
+                # 同じ停留所に複数の系統で着く場合は最も早いもの
+                order = np.lexsort((times, reached))
+                reach, times, reached = reach[order], times[order], reached[order]
+                unique = np.concatenate(([True], reached[1:] != reached[:-1]))
+                reach, times, reached = reach[unique], times[unique], reached[unique]
+                best[reached] = times
+                tau[k, reached] = times
+                ridden[reached] = True
+            if len(reach) and with_labels:
+                board_at = np.maximum.accumulate(np.where(catch < on, entry_ids, 0))
+                pattern_start = self.pattern_indptr[patterns[reach]]
+                labels['kind'][k, reached] = _RIDE
+                labels['pattern'][k, reached] = patterns[reach]
+                labels['trip'][k, reached] = on[reach]
+                labels['board'][k, reached] = board_at[reach - 1] - pattern_start
+                labels['alight'][k, reached] = reach - pattern_start
+                labels['walk_from'][k, reached] = -1
+
+            # 降りた停留所から歩いて乗り換えられる停留所（歩く方が早ければ降りた停留所も更新する。
+            # 乗車のラベルは残すため、歩いた経路の復元では歩き始めた停留所の降車時刻から歩く）
+            sources = np.flatnonzero(ridden)
+            entries, origins = _csr_entries(self.transfer_indptr, sources)
+            targets = self.transfer_stops[entries]
+            times = tau[k, origins] + self.transfer_seconds[entries]
+            keep = times < best[targets]
+            if keep.any():
+                targets, origins, times = targets[keep], origins[keep], times[keep]
+                order = np.lexsort((times, targets))
+                targets, origins, times = targets[order], origins[order], times[order]
+                unique = np.concatenate(([True], targets[1:] != targets[:-1]))
+                targets, origins, times = targets[unique], origins[unique], times[unique]
+                best[targets] = times
+                tau[k, targets] = times
+                ridden[targets] = True
+                if with_labels:
+                    labels['kind'][k, targets] = _WALK
+                    labels['walk_from'][k, targets] = origins
+            marked = ridden
+        return tau, labels
+
+    def _arrivals(self, lat: float, lng: float, depart_sec: float,
+                  egress: Tuple[np.ndarray, np.ndarray, np.ndarray], direct_seconds: np.ndarray) -> np.ndarray:
+        """出発地から目的地群への最早到着時刻（秒。歩いて直接向かう場合を含む）"""
+        _, access_stops, access_seconds = self._walk_stops(lat, lng)
+        arrival = depart_sec + direct_seconds
+        if not len(access_stops) or not len(egress[0]):
+            return arrival
+        tau, _ = self._raptor(access_stops, depart_sec + access_seconds)
+        best = tau.min(axis=0)
+        points, stops, seconds = egress
+        np.minimum.at(arrival, points, best[stops] + seconds)
+        return arrival
+
+    @traced()
+    def travel_minutes(self, from_lats, from_lngs, to_lats, to_lngs, depart_minutes: float) -> np.ndarray:
+        """
+        地点群Aから地点群Bへ、depart_minutes に出発した場合の所要時間（分）の行列
+        時刻表で早く着けない場合は歩いて直接向かう時間
+        """
+        from_lats, from_lngs = np.atleast_1d(from_lats), np.atleast_1d(from_lngs)
+        to_lats, to_lngs = np.atleast_1d(to_lats), np.atleast_1d(to_lngs)
+        egress = self._walk_stops(to_lats, to_lngs)
+        depart_sec = depart_minutes * 60.0
+        result = np.zeros((len(from_lats), len(to_lats)))
+        for i, (lat, lng) in enumerate(zip(from_lats.tolist(), from_lngs.tolist())):
+            direct = distances_from_point(lat, lng, to_lats, to_lngs) / TRANSIT_WALK_KMH * 3600
+            result[i] = (self._arrivals(lat, lng, depart_sec, egress, direct) - depart_sec) / 60.0
+        return result
+
+    def average_travel_minutes(self, from_lats, from_lngs, to_lats, to_lngs, depart_minutes: float,
+                               window_minutes: float = TRANSIT_PROFILE_WINDOW_MIN,
+                               samples: int = TRANSIT_PROFILE_SAMPLES) -> np.ndarray:
+        """出発時刻を depart_minutes から window_minutes の間で変えた所要時間（分）の平均（便を待つ時間を含む）"""
+        offsets = np.linspace(0, window_minutes, max(1, samples), endpoint=False)
+        return np.mean([
+            self.travel_minutes(from_lats, from_lngs, to_lats, to_lngs, depart_minutes + offset)
+            for offset in offsets
+        ], axis=0)
+
+    def route_matrices(self, current_loc: List[float], spots: Union[SpotStore, pd.DataFrame],
+                       selected_indices: List[int],
+                       start_minutes: float = TRANSIT_DEFAULT_START_MINUTES) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        現在地（行・列0）と選択スポット（行・列1〜）の直線距離（km）・所要時間（分）の行列
+        現在地からは start_minutes に出発した所要時間、スポット間は出発時刻をずらした平均（どの順で回っても使える値）
+        """
+        spots = as_spot_store(spots)
+        indices = np.asarray(selected_indices, dtype=np.int64)
+        lats, lngs = spots.lats[indices], spots.lngs[indices]
+        km = route_distance_matrix(current_loc, spots, selected_indices)
+        minutes = np.zeros_like(km)
+        minutes[0, 1:] = self.travel_minutes(current_loc[0], current_loc[1], lats, lngs, start_minutes)[0]
+        minutes[1:, 0] = minutes[0, 1:]  # 出発地へは戻らないため列0はソルバーで使われない
+        minutes[1:, 1:] = self.average_travel_minutes(lats, lngs, lats, lngs, start_minutes)
+        np.fill_diagonal(minutes, 0.0)
+        return km, minutes
+
+    @traced()
+    def earliest_arrival(self, from_loc: List[float], to_loc: List[float], depart_minutes: float) -> TransitJourney:
+        """出発地から目的地へ、depart_minutes に出発して最も早く着く経路（時刻表で早く着けない場合は徒歩のみ）"""
+        depart_sec = depart_minutes * 60.0
+        direct_sec = float(distances_from_point(from_loc[0], from_loc[1], [to_loc[0]], [to_loc[1]])[0]) \
+            / TRANSIT_WALK_KMH * 3600
+        walk_only = TransitJourney(
+            [TransitLeg('徒歩', '', '出発地', '目的地', depart_minutes, depart_minutes + direct_sec / 60.0)],
+            depart_minutes, depart_minutes + direct_sec / 60.0,
+        )
+        _, access_stops, access_seconds = self._walk_stops(from_loc[0], from_loc[1])
+        _, egress_stops, egress_seconds = self._walk_stops(to_loc[0], to_loc[1])
+        if not len(access_stops) or not len(egress_stops):
+            return walk_only
+        tau, labels = self._raptor(access_stops, depart_sec + access_seconds, with_labels=True)
+        # 目的地の最寄りの停留所のうち、降りてから歩いた到着が最も早いもの（同着は乗車回数の少ないもの）
+        totals = tau[:, egress_stops] + egress_seconds
+        k, j = np.unravel_index(np.argmin(totals), totals.shape)
+        if not np.isfinite(totals[k, j]) or totals[k, j] >= depart_sec + direct_sec or k == 0:
+            return walk_only
+
+        stop = int(egress_stops[j])
+        arrive = float(totals[k, j]) / 60.0
+        legs = [TransitLeg('徒歩', '', self.stop_names[stop], '目的地', float(tau[k, stop]) / 60.0, arrive)]
+        while k > 0:
+            walk_to = None
+            if labels['kind'][k, stop] == _WALK:
+                walk_to, stop = stop, int(labels['walk_from'][k, stop])
+            pattern, trip = int(labels['pattern'][k, stop]), int(labels['trip'][k, stop])
+            board, alight = int(labels['board'][k, stop]), int(labels['alight'][k, stop])
+            arrivals, departures = self._trip_times(pattern)
+            board_stop = int(self.pattern_stops[self.pattern_indptr[pattern] + board])
+            alight_minutes = float(arrivals[trip, alight]) / 60.0
+            if walk_to is not None:
+                legs.append(TransitLeg('徒歩', '', self.stop_names[stop], self.stop_names[walk_to],
+                                       alight_minutes, float(tau[k, walk_to]) / 60.0))
+            legs.append(TransitLeg('乗車', self.pattern_names[pattern], self.stop_names[board_stop],
+                                   self.stop_names[stop], float(departures[trip, board]) / 60.0, alight_minutes))
+            stop = board_stop
+            k -= 1
+            # 前のラウンドの値のまま引き継いだ停留所は、着いたラウンドまで戻る
+            while k > 0 and tau[k - 1, stop] == tau[k, stop]:
+                k -= 1
+        first_stop = self.stop_names[stop]
+        legs.append(TransitLeg('徒歩', '', '出発地', first_stop, depart_minutes, float(tau[0, stop]) / 60.0))
+        return TransitJourney(legs[::-1], depart_minutes, arrive)
+
+
+# GTFSの読み込み
+
+def find_transit_feeds(directory: str = '.') -> List[str]:
+    """既定の置き場（gtfs フォルダ）のGTFSファイル（.zip または stops.txt のあるフォルダ）"""
+    feed_dir = os.path.join(directory, TRANSIT_FEED_DIR)
+    if not os.path.isdir(feed_dir):
+        return []
+    feeds = []
+    for name in sorted(os.listdir(feed_dir)):
+        path = os.path.join(feed_dir, name)
+        if name.lower().endswith('.zip') or os.path.exists(os.path.join(path, 'stops.txt')):
+            feeds.append(path)
+    if os.path.exists(os.path.join(feed_dir, 'stops.txt')):
+        feeds.append(feed_dir)
+    return feeds
+
+
+def read_gtfs_feed(path: str) -> Dict[str, pd.DataFrame]:
+    """
+    GTFSファイル（.zip または展開したフォルダ）の表を文字列のまま読み込む
+    Raises:
+        FileNotFoundError: ファイルがない場合
+        TransitDataError: 形式が読めない場合・必須のファイルがない場合
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+
+    def read(handle) -> pd.DataFrame:
+        return pd.read_csv(handle, dtype=str, keep_default_na=False, encoding='utf-8-sig', skipinitialspace=True)
+
+    tables = {}
+    try:
+        if os.path.isdir(path):
+            for name in _REQUIRED_FILES + _OPTIONAL_FILES:
+                file_path = os.path.join(path, name)
+                if os.path.exists(file_path):
+                    tables[name] = read(file_path)
+        else:
+            with zipfile.ZipFile(path) as archive:
+                # フォルダごと圧縮したファイルにも対応する
+                members = {os.path.basename(member): member for member in archive.namelist()}
+                for name in _REQUIRED_FILES + _OPTIONAL_FILES:
+                    if name in members:
+                        tables[name] = read(io.BytesIO(archive.read(members[name])))
+    except (zipfile.BadZipFile, pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise TransitDataError(f"GTFSを読み込めません（{os.path.basename(path)}）: {e}") from e
+
+    missing = [name for name in _REQUIRED_FILES if name not in tables]
+    if missing:
+        raise TransitDataError(f"GTFSに必須のファイルがありません（{os.path.basename(path)}）: {', '.join(missing)}")
+    return tables
+
+
+def _active_services(feed: Dict[str, pd.DataFrame], service_date: date) -> set:
+    """運行日に運行するサービスID（calendar.txt の曜日・期間と calendar_dates.txt の例外）"""
+    ymd = service_date.strftime('%Y%m%d')
+    active = set()
+    calendar = feed.get('calendar.txt')
+    if calendar is not None and len(calendar):
+        weekday = _WEEKDAYS[service_date.weekday()]
+        running = (calendar[weekday] == '1') & (calendar['start_date'] <= ymd) & (calendar['end_date'] >= ymd)
+        active |= set(calendar.loc[running, 'service_id'])
+    dates = feed.get('calendar_dates.txt')
+    if dates is not None and len(dates):
+        today = dates[dates['date'] == ymd]
+        active |= set(today.loc[today['exception_type'] == '1', 'service_id'])
+        active -= set(today.loc[today['exception_type'] == '2', 'service_id'])
+    return active
+
+
+def _parse_gtfs_times(values: pd.Series) -> np.ndarray:
+    """「H:MM:SS」を0時からの秒に変換（空欄はNaN。同じ時刻の文字列は1回だけ変換する）"""
+    codes, uniques = pd.factorize(values.str.strip())
+    parts = pd.Series(uniques, dtype=str).str.split(':', expand=True)
+    if parts.shape[1] != 3:
+        return np.full(len(values), np.nan)
+    h, m, s = (pd.to_numeric(parts[i], errors='coerce').to_numpy(dtype=np.float64) for i in range(3))
+    seconds = np.append(h * 3600 + m * 60 + s, np.nan)  # 欠損（codes == -1）は末尾のNaN
+    return seconds[codes]
+
+
+def _feed_stop_times(feed: Dict[str, pd.DataFrame], prefix: str, service_date: date) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """1つのGTFSの停留所と、運行日の便の停車時刻（ID は他のGTFSと重ならないよう prefix をつける）"""
+    stops = feed['stops.txt']
+    if 'location_type' in stops.columns:
+        stops = stops[stops['location_type'].isin(['', '0'])]  # 駅舎・出入口は除く
+    stops = pd.DataFrame({
+        'stop': prefix + stops['stop_id'],
+        'name': stops['stop_name'] if 'stop_name' in stops.columns else stops['stop_id'],
+        'lat': pd.to_numeric(stops['stop_lat'], errors='coerce'),
+        'lng': pd.to_numeric(stops['stop_lon'], errors='coerce'),
+    }).dropna(subset=['lat', 'lng'])
+
+    routes = feed['routes.txt']
+    short = routes['route_short_name'] if 'route_short_name' in routes.columns else pd.Series('', index=routes.index)
+    long = routes['route_long_name'] if 'route_long_name' in routes.columns else pd.Series('', index=routes.index)
+    route_names = dict(zip(routes['route_id'], short.where(short != '', long).where(lambda s: s != '', routes['route_id'])))
+
+    trips = feed['trips.txt']
+    trips = trips[trips['service_id'].isin(_active_services(feed, service_date))]
+    trip_routes = dict(zip(trips['trip_id'], trips['route_id'].map(route_names).fillna('')))
+
+    stop_times = feed['stop_times.txt']
+    stop_times = stop_times[stop_times['trip_id'].isin(trip_routes)]
+    arrivals = _parse_gtfs_times(stop_times['arrival_time'])
+    departures = _parse_gtfs_times(stop_times['departure_time'])
+    stop_times = pd.DataFrame({
+        'trip': prefix + stop_times['trip_id'],
+        'route': stop_times['trip_id'].map(trip_routes),
+        'stop': prefix + stop_times['stop_id'],
+        'seq': pd.to_numeric(stop_times['stop_sequence'], errors='coerce'),
+        'arr': np.where(np.isnan(arrivals), departures, arrivals),
+        'dep': np.where(np.isnan(departures), arrivals, departures),
+    })
+    return stops, stop_times
+
+
+@traced()
+def build_transit_timetable(feeds: Sequence[Dict[str, pd.DataFrame]], service_date: date,
+                            source: str = '') -> TransitTimetable:
+    """
+    GTFSの表（read_gtfs_feed()）から運行日の時刻表の配列を作成（複数のGTFSは停留所を歩いて乗り換えられる1つの時刻表にする）
+    時刻が空欄の停車（時刻を定めない停留所）を含む便は除く。
+    Raises:
+        TransitDataError: 運行日に運行する便がない場合
+    """
+    parts = [_feed_stop_times(feed, f'{k}:', service_date) for k, feed in enumerate(feeds)]
+    stops = pd.concat([stops for stops, _ in parts], ignore_index=True).drop_duplicates('stop')
+    stop_times = pd.concat([stop_times for _, stop_times in parts], ignore_index=True)
+
+    # 停留所の位置に置き換え、時刻・順番の読めない停車を含む便と停車が1つだけの便を除く
+    stop_pos = pd.Index(stops['stop']).get_indexer(stop_times['stop'])
+    valid = (stop_pos >= 0) & stop_times['seq'].notna().to_numpy() & ~np.isnan(stop_times['arr'].to_numpy()) \
+        & ~np.isnan(stop_times['dep'].to_numpy())
+    stop_times = stop_times.assign(stop_pos=stop_pos)
+    bad_trips = set(stop_times.loc[~valid, 'trip'])
+    stop_times = stop_times[~stop_times['trip'].isin(bad_trips)]
+    stop_times = stop_times[stop_times.groupby('trip')['trip'].transform('size') >= 2]
+    if stop_times.empty:
+        raise TransitDataError(f"{service_date:%Y年%m月%d日}に運行する便が時刻表にありません")
+    stop_times = stop_times.sort_values(['trip', 'seq'], kind='stable')
+
+    # 時刻表に出てくる停留所だけを残す
+    used = np.unique(stop_times['stop_pos'].to_numpy())
+    remap = np.full(len(stops), -1, dtype=np.int64)
+    remap[used] = np.arange(len(used))
+    stops = stops.iloc[used]
+    trip_codes, _ = pd.factorize(stop_times['trip'], sort=False)
+    boundaries = np.flatnonzero(np.diff(trip_codes)) + 1
+    stop_seq = np.split(remap[stop_times['stop_pos'].to_numpy()], boundaries)
+    arr_seq = np.split(stop_times['arr'].to_numpy(), boundaries)
+    dep_seq = np.split(stop_times['dep'].to_numpy(), boundaries)
+    route_seq = stop_times['route'].to_numpy()[np.concatenate(([0], boundaries))]
+
+    # 停留所の並びが同じ便をまとめ、追い越しのある便は別の系統に分ける（系統の中の便は全停留所で時刻順）
+    groups: Dict[Tuple[str, Tuple[int, ...]], List[int]] = {}
+    for t, sequence in enumerate(stop_seq):
+        groups.setdefault((route_seq[t], tuple(sequence.tolist())), []).append(t)
+    pattern_names, pattern_stops, pattern_times = [], [], []
+    for (name, sequence), trips in groups.items():
+        lanes: List[List[int]] = []
+        for t in sorted(trips, key=lambda t: dep_seq[t][0]):
+            for lane in lanes:
+                last = lane[-1]
+                if np.all(dep_seq[t] >= dep_seq[last]) and np.all(arr_seq[t] >= arr_seq[last]):
+                    lane.append(t)
+                    break
+            else:
+                lanes.append([t])
+        for lane in lanes:
+            pattern_names.append(name)
+            pattern_stops.append(np.array(sequence, dtype=np.int32))
+            pattern_times.append((np.stack([arr_seq[t] for t in lane]), np.stack([dep_seq[t] for t in lane])))
+
+    lengths = np.array([len(s) for s in pattern_stops], dtype=np.int64)
+    sizes = np.array([arr.size for arr, _ in pattern_times], dtype=np.int64)
+    n_stops = len(stops)
+
+    # 歩いて乗り換えられる停留所（CSR）
+    lats, lngs = stops['lat'].to_numpy(dtype=np.float64), stops['lng'].to_numpy(dtype=np.float64)
+    index = SpatialGridIndex(lats, lngs)
+    transfer_stops, transfer_seconds, transfer_counts = [], [], []
+    for s in range(n_stops):
+        found, km = index.query_radius(lats[s], lngs[s], TRANSIT_TRANSFER_KM)
+        other = found != s
+        transfer_stops.append(found[other])
+        transfer_seconds.append(np.round(km[other] / TRANSIT_WALK_KMH * 3600))
+        transfer_counts.append(int(other.sum()))
+    transfer_indptr = np.zeros(n_stops + 1, dtype=np.int64)
+    np.cumsum(transfer_counts, out=transfer_indptr[1:])
+
+    return TransitTimetable(
+        service_date=service_date,
+        stop_names=tuple(stops['name'].astype(str)),
+        stop_lats=np.ascontiguousarray(lats),
+        stop_lngs=np.ascontiguousarray(lngs),
+        pattern_names=tuple(str(name) for name in pattern_names),
+        pattern_indptr=np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+        pattern_stops=np.concatenate(pattern_stops).astype(np.int32),
+        time_indptr=np.concatenate(([0], np.cumsum(sizes))).astype(np.int64),
+        arrivals=np.concatenate([arr.T.ravel() for arr, _ in pattern_times]).astype(np.int32),
+        departures=np.concatenate([dep.T.ravel() for _, dep in pattern_times]).astype(np.int32),
+        transfer_indptr=transfer_indptr,
+        transfer_stops=np.concatenate(transfer_stops).astype(np.int32),
+        transfer_seconds=np.concatenate(transfer_seconds).astype(np.int32),
+        source=source,
+    )
+
+
+@traced()
+def load_transit_timetable(paths: Sequence[str], service_date: date) -> TransitTimetable:
+    """
+    GTFSファイル（路線バス・JRなど複数可）から運行日の時刻表を作成
+    Raises:
+        FileNotFoundError: ファイルがない場合
+        TransitDataError: 形式が読めない場合・運行日に運行する便がない場合
+    """
+    if not paths:
+        raise TransitDataError("GTFSファイルが指定されていません")
+    feeds = [read_gtfs_feed(path) for path in paths]
+    return build_transit_timetable(feeds, service_date, source=', '.join(os.path.basename(p) for p in paths))
@@ -0,0 +1,273 @@
+"""スポット間の移動時間行列の永続キャッシュ（メモリマップ。データ変更時は追加・移動したスポットのみ再計算）"""
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .data import SPOTS_CACHE_DIR
+from .geo import cross_distance_matrix, paired_distances, route_distance_matrix
+from .roads import PROFILE_SPEED_KMH, RoadGraph, road_travel_block, route_travel_matrices
+from .store import SpotStore, as_spot_store
+from .tracing import traced
+from .transit import TRANSIT_DEFAULT_START_MINUTES, TransitTimetable
+
+# 行列は行が出発、列が到着のスポット。クエリ時は出発地からのベクトルだけを計算して組み合わせる
+TRAVEL_MODES = ('driving', 'walking', 'bicycling')  # 車・徒歩・自転車
+TRAVEL_SPEED_KMH = {'driving': PROFILE_SPEED_KMH['driving'], 'walking': PROFILE_SPEED_KMH['walking'], 'bicycling': 15}
+TRAVEL_ROAD_PROFILES = {'driving': 'driving', 'walking': 'walking', 'bicycling': 'walking'}  # 移動手段ごとの道路グラフ
+TRAVEL_MATRIX_DIR = os.path.join(SPOTS_CACHE_DIR, 'travel')  # 行列のキャッシュ置き場
+TRAVEL_MATRIX_FORMAT = 1  # 計算方法を変えたら上げる（古いキャッシュを無効化）
+TRAVEL_MATRIX_CHUNK_ROWS = 1024  # まとめて計算・コピーする行数（一時配列のメモリ使用量の制限）
+
+
+@dataclass(frozen=True)
+class TravelMatrix:
+    """スポット間の距離（km）と所要時間（分）の行列（キャッシュファイルのメモリマップ）"""
+    mode: str
+    version: str  # データの版（dataset_version）
+    lats: np.ndarray  # float64 (スポット数,)
+    lngs: np.ndarray  # float64 (スポット数,)
+    km: np.ndarray  # float32 (スポット数, スポット数)
+    minutes: np.ndarray  # float32 (スポット数, スポット数)
+    road_graph: Optional[RoadGraph]
+    recomputed: int  # 読み込み時に計算し直したスポット数（キャッシュをそのまま使えた場合は0）
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def origin_vectors(self, lat: float, lng: float, indices) -> Tuple[np.ndarray, np.ndarray]:
+        """出発地から指定スポットへの距離（km）と所要時間（分）"""
+        indices = np.asarray(indices, dtype=np.int64)
+        km, minutes = _travel_block(self.mode, self.road_graph, [lat], [lng], self.lats[indices], self.lngs[indices])
+        return km[0], minutes[0]
+
+    def route_matrices(self, current_loc: List[float], selected_indices: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """現在地（行・列0）と選択スポット（行・列1〜）の距離・所要時間の行列"""
+        indices = np.asarray(selected_indices, dtype=np.int64)
+        origin_km, origin_minutes = self.origin_vectors(current_loc[0], current_loc[1], indices)
+        return _with_origin(self.km, indices, origin_km), _with_origin(self.minutes, indices, origin_minutes)
+
+    def batch_route_matrices(self, origins, selected) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        複数の出発地と選択スポット（組ごとに同じ数）の route_matrices をまとめて作成（ルートの一括算出用）
+        Args:
+            origins: 出発地の緯度・経度（形状は (件数, 2)）
+            selected: 選択スポットの位置（形状は (件数, n)）
+        Returns:
+            (距離, 所要時間) の行列を重ねた配列（形状は (件数, n+1, n+1)）
+        """
+        origins = np.asarray(origins, dtype=np.float64)
+        indices = np.asarray(selected, dtype=np.int64)
+        if self.road_graph is None:
+            # 直線距離は出発地とスポットの組ごとに一括計算する
+            origin_km = paired_distances(origins[:, :1], origins[:, 1:], self.lats[indices], self.lngs[indices])
+            origin_minutes = origin_km / TRAVEL_SPEED_KMH[self.mode] * 60
+        else:
+            vectors = [self.origin_vectors(lat, lng, row) for (lat, lng), row in zip(origins, indices)]
+            origin_km = np.array([km for km, _ in vectors]).reshape(indices.shape)
+            origin_minutes = np.array([minutes for _, minutes in vectors]).reshape(indices.shape)
+        return _with_origin(self.km, indices, origin_km), _with_origin(self.minutes, indices, origin_minutes)
+
+
+def _with_origin(matrix: np.ndarray, indices: np.ndarray, origin: np.ndarray) -> np.ndarray:
+    # indices・origin が2次元の場合は行ごとに1つの行列を作り、重ねて返す
+    n = indices.shape[-1]
+    result = np.zeros(indices.shape[:-1] + (n + 1, n + 1))
+    result[..., 1:, 1:] = matrix[indices[..., :, None], indices[..., None, :]]
+    result[..., 0, 1:] = origin
+    # 出発地へは戻らないため列0はソルバーで使われない（対称とみなして埋める）
+    result[..., 1:, 0] = origin
+    return result
+
+
+def _travel_block(mode: str, road_graph: Optional[RoadGraph], from_lats, from_lngs,
+                  to_lats, to_lngs) -> Tuple[np.ndarray, np.ndarray]:
+    """地点群Aから地点群Bへの距離（km）と所要時間（分）"""
+    if road_graph is None:
+        km = cross_distance_matrix(from_lats, from_lngs, to_lats, to_lngs)
+        return km, km / TRAVEL_SPEED_KMH[mode] * 60
+    km, minutes = road_travel_block(road_graph, from_lats, from_lngs, to_lats, to_lngs)
+    if road_graph.profile != mode:
+        # 自転車は徒歩の道路グラフの距離を自転車の速度で割る
+        minutes = km / TRAVEL_SPEED_KMH[mode] * 60
+    return km, minutes
+
+
+def _matrix_paths(cache_dir: str, name: str, mode: str) -> Dict[str, str]:
+    prefix = os.path.join(cache_dir, f'{name}-{mode}')
+    return {
+        'meta': f'{prefix}.json',
+        'km': f'{prefix}.km.npy',
+        'minutes': f'{prefix}.minutes.npy',
+    }
+
+
+def _fill_matrices(km_out: np.ndarray, minutes_out: np.ndarray, spots: SpotStore, mode: str,
+                   road_graph: Optional[RoadGraph], old_pos: np.ndarray,
+                   old_km: Optional[np.ndarray], old_minutes: Optional[np.ndarray]):
+    """前回の行列から引き継げる値をコピーし、追加・移動したスポットの行・列だけを計算する"""
+    kept = np.flatnonzero(old_pos >= 0)
+    fresh = np.flatnonzero(old_pos < 0)
+    chunk = TRAVEL_MATRIX_CHUNK_ROWS
+
+    # 行単位で読み書きする（追加・移動したスポットの列は後で上書きされる）
+    row_buffer = np.zeros((min(chunk, len(kept)), len(old_pos)), dtype=np.float32)
+    for start in range(0, len(kept), chunk):
+        rows = kept[start:start + chunk]
+        buffer = row_buffer[:len(rows)]
+        for old, out in ((old_km, km_out), (old_minutes, minutes_out)):
+            buffer[:, kept] = np.take(old[old_pos[rows]], old_pos[kept], axis=1)
+            out[rows] = buffer
+
+    # 直線距離・双方向の道路グラフは行列が対称のため、行を計算して列にも写す
+    symmetric = road_graph is None or road_graph.undirected
+    for start in range(0, len(fresh), chunk):
+        rows = fresh[start:start + chunk]
+        km, minutes = _travel_block(mode, road_graph, spots.lats[rows], spots.lngs[rows], spots.lats, spots.lngs)
+        km_out[rows] = km
+        minutes_out[rows] = minutes
+        if symmetric:
+            km_out[:, rows] = km.T
+            minutes_out[:, rows] = minutes.T
+    if not symmetric and len(fresh):
+        for start in range(0, len(kept), chunk):
+            rows = kept[start:start + chunk]
+            km, minutes = _travel_block(
+                mode, road_graph, spots.lats[rows], spots.lngs[rows], spots.lats[fresh], spots.lngs[fresh]
+            )
+            km_out[np.ix_(rows, fresh)] = km
+            minutes_out[np.ix_(rows, fresh)] = minutes
+
+
+@traced()
+def load_travel_matrix(spots: Union[SpotStore, pd.DataFrame], version: str, mode: str,
+                       road_graph: Optional[RoadGraph] = None, name: str = 'spots',
+                       cache_dir: str = TRAVEL_MATRIX_DIR) -> TravelMatrix:
+    """
+    スポット間の移動時間行列をキャッシュファイルから読み込む（メモリマップ）
+    キャッシュはデータの版（dataset_version）・移動手段・道路データで照合する。データが変わった場合は
+    スポット名と座標が前回と同じスポット間の値を引き継ぎ、追加・移動したスポットの行・列だけを計算する。
+    書き込めない環境ではキャッシュなしでメモリ上に計算する。
+    Args:
+        spots: スポットのストア（またはデータフレーム）
+        version: データの版（dataset_version）
+        mode: 移動手段（'driving' / 'walking' / 'bicycling'）
+        road_graph: 道路グラフ（移動手段に対応するもの。Noneの場合は直線距離）
+        name: キャッシュファイル名（データセットごとに分ける）
+        cache_dir: キャッシュ置き場
+    """
+    if mode not in TRAVEL_MODES:
+        raise ValueError(f"未対応の移動手段です: {mode}")
+    spots = as_spot_store(spots)
+    n = len(spots)
+    road = road_graph.fingerprint if road_graph is not None else None
+    paths = _matrix_paths(cache_dir, name, mode)
+
+    def result(km, minutes, recomputed):
+        return TravelMatrix(mode, version, spots.lats, spots.lngs, km, minutes, road_graph, recomputed)
+
+    # キャッシュの照合（移動手段の速度・道路データが変わった場合は全体を計算し直す）
+    meta = None
+    try:
+        with open(paths['meta'], encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    old_km = old_minutes = None
+    old_pos = np.full(n, -1, dtype=np.int64)
+    if (meta and meta.get('format') == TRAVEL_MATRIX_FORMAT and meta.get('road') == road
+            and meta.get('speed_kmh') == TRAVEL_SPEED_KMH[mode]):
+        try:
+            old_km = np.load(paths['km'], mmap_mode='r')
+            old_minutes = np.load(paths['minutes'], mmap_mode='r')
+        except (OSError, ValueError):
+            old_km = old_minutes = None  # キャッシュが壊れている場合は作り直す
+        else:
+            old_n = len(meta['names'])
+            if old_km.shape != (old_n, old_n) or old_minutes.shape != (old_n, old_n):
+                old_km = old_minutes = None
+
+    if old_km is not None:
+        if meta.get('version') == version and len(meta['names']) == n:
+            return result(old_km, old_minutes, 0)
+        old_keys = {}
+        for j, key in enumerate(zip(meta['names'], meta['lats'], meta['lngs'])):
+            old_keys.setdefault(tuple(key), j)
+        old_pos = np.array(
+            [old_keys.get(key, -1) for key in zip(spots.names, spots.lats.tolist(), spots.lngs.tolist())],
+            dtype=np.int64
+        )
+
+    recomputed = int((old_pos < 0).sum())
+    new_meta = {
+        'format': TRAVEL_MATRIX_FORMAT,
+        'version': version,
+        'road': road,
+        'speed_kmh': TRAVEL_SPEED_KMH[mode],
+        'names': list(spots.names),
+        'lats': spots.lats.tolist(),
+        'lngs': spots.lngs.tolist(),
+    }
+
+    # スポットの並びが前回と同じ場合は行列をそのまま使い、版だけを書き換える
+    if old_km is not None and recomputed == 0 and np.array_equal(old_pos, np.arange(n)) and len(old_km) == n:
+        try:
+            with open(paths['meta'], 'w', encoding='utf-8') as f:
+                json.dump(new_meta, f)
+        except OSError:
+            pass
+        return result(old_km, old_minutes, 0)
+
+    # 一時ファイルに書き込んでから置き換える（書き込めない環境ではメモリ上に計算）
+    temp = {key: f'{path}.tmp' for key, path in paths.items()}
+    try:
+        if n == 0:
+            raise OSError("空の行列はメモリマップできない")
+        os.makedirs(cache_dir, exist_ok=True)
+        km_out = np.lib.format.open_memmap(temp['km'], mode='w+', dtype=np.float32, shape=(n, n))
+        minutes_out = np.lib.format.open_memmap(temp['minutes'], mode='w+', dtype=np.float32, shape=(n, n))
+    except OSError:
+        km_out = np.zeros((n, n), dtype=np.float32)
+        minutes_out = np.zeros((n, n), dtype=np.float32)
+        _fill_matrices(km_out, minutes_out, spots, mode, road_graph, old_pos, old_km, old_minutes)
+        return result(km_out, minutes_out, recomputed)
+
+    _fill_matrices(km_out, minutes_out, spots, mode, road_graph, old_pos, old_km, old_minutes)
+    km_out.flush()
+    minutes_out.flush()
+    del old_km, old_minutes
+    try:
+        # 置き換えの途中で中断しても古い照合情報と新しい行列が混ざらないよう、照合情報を先に消す
+        if os.path.exists(paths['meta']):
+            os.remove(paths['meta'])
+        os.replace(temp['km'], paths['km'])
+        os.replace(temp['minutes'], paths['minutes'])
+        with open(temp['meta'], 'w', encoding='utf-8') as f:
+            json.dump(new_meta, f)
+        os.replace(temp['meta'], paths['meta'])
+    except OSError:
+        return result(km_out, minutes_out, recomputed)
+    return result(np.load(paths['km'], mmap_mode='r'), np.load(paths['minutes'], mmap_mode='r'), recomputed)
+
+
+def route_matrices(current_loc: List[float], spots: Union[SpotStore, pd.DataFrame], selected_indices: List[int],
+                   speed_kmh: float, road_graph: Optional[RoadGraph] = None,
+                   travel_matrix: Optional[TravelMatrix] = None, transit: Optional[TransitTimetable] = None,
+                   start_minutes: float = TRANSIT_DEFAULT_START_MINUTES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    現在地（行・列0）と選択スポット（行・列1〜）の距離（km）・所要時間（分）の行列
+    公共交通の時刻表（start_minutes に出発）、移動時間行列のキャッシュ、道路グラフ、
+    直線距離（speed_kmh で所要時間を計算）の順に使えるものを使う
+    """
+    if transit is not None:
+        return transit.route_matrices(current_loc, spots, selected_indices, start_minutes)
+    if travel_matrix is not None:
+        return travel_matrix.route_matrices(current_loc, selected_indices)
+    if road_graph is not None:
+        return route_travel_matrices(road_graph, current_loc, spots, selected_indices)
+    dist_matrix = route_distance_matrix(current_loc, as_spot_store(spots), selected_indices)
+    return dist_matrix, dist_matrix / speed_kmh * 60
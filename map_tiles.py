@@ -0,0 +1,99 @@
+"""
+地図タイルの事前取得（シード）とローカル配信（Streamlitページを開かずに実行）
+
+日田市周辺のタイルを指定したズームの範囲で取得して hita.mbtiles に保存する。アプリと同じフォルダに
+hita.mbtiles があると、アプリの地図は公開のタイルサーバーではなくローカルのタイルサーバーから表示する。
+シード元は一括取得が許可されたタイルサーバー（自前のサーバーや契約したサービス）を --source で指定すること。
+
+使い方:
+    python map_tiles.py seed --source "https://tiles.example.jp/{z}/{x}/{y}.png"                             # ズーム10〜16を取得
+    python map_tiles.py seed --source "https://tiles.example.jp/{z}/{x}/{y}.png" --zooms 12 14 --workers 4   # ズームの範囲を指定
+    python map_tiles.py info                                                                                 # 保存済みのタイル数
+    python map_tiles.py serve --port 8765                                                                    # タイルサーバーだけを起動
+"""
+import argparse
+import sys
+import time
+from typing import List
+
+import hita_concierge as app
+
+
+def seed(args) -> int:
+    zooms = range(args.zooms[0], args.zooms[1] + 1)
+    bounds = tuple(args.bounds)
+    store = app.MBTilesStore(args.output)
+    total = app.tile_count(bounds, zooms)
+    print(f"🗺️ ズーム{zooms.start}〜{zooms.stop - 1}の{total:,}枚のうち、保存していないタイルを取得します")
+
+    started = time.perf_counter()
+
+    def progress(done, missing):
+        print(f"\r  {done:,} / {missing:,}枚", end='', file=sys.stderr)
+
+    saved, failed = app.prefetch_tiles(
+        store, bounds, zooms, source_url=args.source, workers=args.workers, progress=progress
+    )
+    print(file=sys.stderr)
+    print(f"💾 {saved:,}枚を {args.output} に保存しました（{time.perf_counter() - started:.1f}秒）")
+    if failed:
+        print(f"⚠️ {failed:,}枚は取得できませんでした（もう一度実行すると取得できなかった分だけ取得します）")
+    return 0
+
+
+def info(args) -> int:
+    try:
+        store = app.MBTilesStore(args.output, readonly=True)
+    except (OSError, app.TileStoreError) as e:
+        print(f"❌ タイルの保存先を読み込めません: {e}")
+        return 1
+    metadata = store.metadata()
+    print(f"📁 {args.output}（範囲: {metadata.get('bounds', '-')}）")
+    for zoom, count in store.tile_counts().items():
+        print(f"  ズーム{zoom}: {count:,}枚")
+    return 0
+
+
+def serve(args) -> int:
+    try:
+        server = app.start_tile_server(args.output, host=args.host, port=args.port)
+    except (OSError, app.TileStoreError) as e:
+        print(f"❌ タイルサーバーを起動できません: {e}")
+        return 1
+    print(f"🌐 {server.url} で配信しています（Ctrl+Cで終了）")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.close()
+    return 0
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='日田市総合案内コンシェルジュの地図タイルのシードと配信')
+    parser.add_argument('--output', default=app.TILES_FILE, help='タイルの保存先（MBTiles）')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='タイルを取得して保存する')
+    seed_parser.add_argument('--zooms', type=int, nargs=2, default=[app.TILE_MIN_ZOOM, app.TILE_MAX_ZOOM],
+                             metavar=('MIN', 'MAX'), help='取得するズームの範囲')
+    seed_parser.add_argument('--bounds', type=float, nargs=4, default=list(app.TILE_BOUNDS),
+                             metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'), help='取得する範囲（経度・緯度）')
+    seed_parser.add_argument('--source', required=True,
+                             help='シード元のURL（{z} / {x} / {y}。一括取得が許可されたタイルサーバー）')
+    seed_parser.add_argument('--workers', type=int, default=app.TILE_FETCH_WORKERS, help='同時に取得する数')
+    seed_parser.set_defaults(func=seed)
+
+    info_parser = commands.add_parser('info', help='保存済みのタイル数を表示する')
+    info_parser.set_defaults(func=info)
+
+    serve_parser = commands.add_parser('serve', help='タイルサーバーだけを起動する')
+    serve_parser.add_argument('--host', default='0.0.0.0', help='待ち受けるアドレス')
+    serve_parser.add_argument('--port', type=int, default=app.TILE_SERVER_PORT, help='待ち受けるポート')
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,36 @@
+import hashlib
+import json
+import os
 import streamlit as st
 import pandas as pd
-import folium
 from streamlit_folium import st_folium
-from datetime import datetime
-from math import radians, sin, cos, sqrt, atan2
-from typing import List, Tuple
-
-try:
-    import google.generativeai as genai
-    GENAI_AVAILABLE = True
-except ImportError:
-    GENAI_AVAILABLE = False
+from datetime import date, datetime
+from math import inf
+from typing import List, Optional, Tuple
+
+from hita_concierge import (
+    AI_PLAN_CACHE_SIZE, AI_PLAN_CACHE_TTL_SEC, DEFAULT_SHELTER_CAPACITY, FACILITY_SEARCH_RADIUS_KM,
+    HAZARD_AVOIDANCE, ISOCHRONE_MINUTES, ROUTE_CACHE_MAX_BYTES, ROUTE_CACHE_SIZE, ROUTE_CACHE_TTL_SEC, SPOT_LIST_PAGE_SIZE,
+    SPOT_LIST_SORTS, SPOT_LIST_TABLE_PAGE_SIZE, SPOT_LIST_TABLE_THRESHOLD, TRAVEL_MODES,
+    TRAVEL_ROAD_PROFILES, HazardDataError, HazardLayer, LiveStatusService, RoadDataError,
+    Isochrone, RoadGraph, RoadNetwork,
+    SpatialGridIndex, SpotListIndex, SpotStore, SpotsDataError, TTLCache, TileServer, TileStoreError,
+    TourSchedule, TransitDataError, TransitJourney, TransitTimetable,
+    TraceRegistry, TravelMatrix, ai_plan_cache_key, apply_live_status, assign_evacuees, begin_trace,
+    build_plan_prompt, calculate_distance, compute_isochrone, create_google_maps_link, create_google_maps_multi_link,
+    current_season, distances_from_point, evacuee_assignment_table,
+    evacuee_origins, find_hazard_file, find_live_sources_file, find_road_network_file, find_tiles_file,
+    find_transit_feeds, finish_trace,
+    format_clock, genai_available, generate_plan, hazard_road_graph, isochrone_origin, live_status_version,
+    load_hazard_layer,
+    load_road_network, load_transit_timetable, load_travel_matrix,
+    normalize_route_query, optimize_route_disaster, paginate, read_spots_workbook, road_route,
+    route_cache_key, route_coordinates, sample_spots_frames, schedule_tourism_route,
+    shelter_capacities, shelter_load_table, shelter_mask, simulate_evacuees, span, spots_file_mtime,
+    start_tile_server, static_dataset_version,
+    stream_plan_text, trace_env_enabled, traced,
+)
+from hita_concierge import ai, maps
 
 # ページ設定
 st.set_page_config(
@@ -20,6 +40,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# 処理時間の計測（デバッグ表示をオンにしたセッション、または環境変数 HITA_TRACE=1 の場合のみ）
+trace_recorder = begin_trace(st.session_state.get('debug_tracing', False) or trace_env_enabled())
+
 # セッション状態の初期化
 if 'mode' not in st.session_state:
     st.session_state.mode = '観光モード'
@@ -35,346 +58,193 @@ if 'disaster_optimized_route' not in st.session_state:
     st.session_state.disaster_optimized_route = None
 if 'gemini_api_key' not in st.session_state:
     st.session_state.gemini_api_key = ""
+if 'tour_start_time' not in st.session_state:
+    st.session_state.tour_start_time = datetime.now().time().replace(second=0, microsecond=0)
 
-# データ読み込み関数
+# データ読み込み関数（処理本体は hita_concierge、ここではキャッシュと画面表示のみ）
+@traced('app.load_spots_data')
 @st.cache_data
-def load_spots_data():
-    """Excelファイルからスポットデータを読み込む"""
+def load_spots_data(source_mtime: float = 0.0):
+    """
+    Excelファイルからスポットデータを読み込む
+    source_mtime にspots.xlsxの更新日時を渡すと、ファイル更新時にキャッシュが切り替わる
+    """
     try:
-        # Excelファイルから読み込み
-        tourism_df = pd.read_excel('spots.xlsx', sheet_name='観光')
-        disaster_df = pd.read_excel('spots.xlsx', sheet_name='防災')
-        
-        # カラム名の確認と標準化
-        required_cols_tourism = ['No', 'スポット名', '緯度', '経度', '説明']
-        required_cols_disaster = ['No', 'スポット名', '緯度', '経度', '説明']
-        
-        # 必須カラムの確認
-        for col in required_cols_tourism:
-            if col not in tourism_df.columns:
-                st.error(f"❌ 観光シートに'{col}'カラムがありません")
-                return None, None
-        
-        for col in required_cols_disaster:
-            if col not in disaster_df.columns:
-                st.error(f"❌ 防災シートに'{col}'カラムがありません")
-                return None, None
-        
-        # 所要時間の変換処理（「60分」→60のような変換）
-        def parse_time(value):
-            """所要時間の値を数値に変換"""
-            if pd.isna(value) or value == '-':
-                return 60  # デフォルト値
-            if isinstance(value, (int, float)):
-                return int(value)
-            if isinstance(value, str):
-                # 「60分」のような文字列から数値を抽出
-                import re
-                match = re.search(r'(\d+)', str(value))
-                if match:
-                    return int(match.group(1))
-            return 60  # パースできない場合はデフォルト値
-        
-        # 観光データの処理
-        if '所要時間（参考）' in tourism_df.columns:
-            tourism_df['所要時間（参考）'] = tourism_df['所要時間（参考）'].apply(parse_time)
-        else:
-            tourism_df['所要時間（参考）'] = 60  # デフォルト60分
-            
-        if 'カテゴリ' not in tourism_df.columns:
-            tourism_df['カテゴリ'] = '観光地'
-        if '営業時間' not in tourism_df.columns:
-            tourism_df['営業時間'] = '終日'
-        if '料金' not in tourism_df.columns:
-            tourism_df['料金'] = '無料'
-        if '待ち時間（分）' not in tourism_df.columns:
-            tourism_df['待ち時間（分）'] = 0
-        if '混雑状況' not in tourism_df.columns:
-            tourism_df['混雑状況'] = '空いている'
-        
-        # 防災データの処理
-        if '所要時間（参考）' in disaster_df.columns:
-            disaster_df['所要時間（参考）'] = disaster_df['所要時間（参考）'].apply(parse_time)
-            
-        if '収容人数' not in disaster_df.columns:
-            disaster_df['収容人数'] = 0
-        if '状態' not in disaster_df.columns:
-            disaster_df['状態'] = '待機中'
-        
-        # 待ち時間と収容人数を数値型に変換
-        tourism_df['待ち時間（分）'] = pd.to_numeric(tourism_df['待ち時間（分）'], errors='coerce').fillna(0).astype(int)
-        disaster_df['収容人数'] = pd.to_numeric(disaster_df['収容人数'], errors='coerce').fillna(0).astype(int)
+        return read_spots_workbook()
 
-        return tourism_df, disaster_df
-        
     except FileNotFoundError:
         st.warning("⚠️ spots.xlsxが見つかりません。サンプルデータを使用します。")
-        
-        # サンプルデータを作成
-        tourism_df = pd.DataFrame({
-            'No': [1, 2, 3, 4, 5, 6],
-            'スポット名': ['豆田町', '日田温泉', '咸宜園', '天ヶ瀬温泉', '小鹿田焼の里', '大山ダム'],
-            '緯度': [33.3219, 33.3200, 33.3240, 33.2967, 33.3500, 33.3800],
-            '経度': [130.9414, 130.9400, 130.9430, 130.9167, 130.9600, 130.9200],
-            '所要時間（参考）': [60, 120, 45, 90, 75, 30],
-            '説明': ['江戸時代の町並みが残る歴史的な地区', '日田の名湯・温泉施設',
-                   '日本最大の私塾跡・歴史的教育施設', '自然豊かな温泉街',
-                   '伝統工芸の陶器の里', '美しい景観のダム'],
-            'カテゴリ': ['歴史', 'グルメ', '歴史', '自然', '体験', '自然'],
-            '営業時間': ['終日', '9:00-21:00', '9:00-17:00', '終日', '9:00-17:00', '終日'],
-            '料金': ['無料', '500円', '300円', '無料', '無料', '無料'],
-            '待ち時間（分）': [0, 15, 0, 10, 5, 0],
-            '混雑状況': ['空いている', '混雑', '普通', '空いている', '空いている', '空いている']
-        })
-        disaster_df = pd.DataFrame({
-            'No': [1, 2, 3, 4, 5],
-            'スポット名': ['日田市役所（避難所）', '中央公民館', '総合体育館', '桂林公民館', '三花公民館'],
-            '緯度': [33.3219, 33.3250, 33.3180, 33.3300, 33.3100],
-            '経度': [130.9414, 130.9450, 130.9380, 130.9500, 130.9350],
-            '所要時間（参考）': [60, 60, 60, 60, 60],
-            '説明': ['市役所・第一避難所', '中央地区の避難所', '大規模避難所', 
-                   '桂林地区の避難所', '三花地区の避難所'],
-            '収容人数': [500, 300, 800, 200, 250],
-            '状態': ['開設中', '開設中', '開設中', '待機中', '待機中']
-        })
-        return tourism_df, disaster_df
-    
+        return sample_spots_frames()
+
+    except SpotsDataError as e:
+        st.error(f"❌ {e}")
+        return None, None
+
     except Exception as e:
         st.error(f"❌ Excelファイルの読み込みエラー: {e}")
         return None, None
 
-# 距離計算関数
-def calculate_distance(lat1, lng1, lat2, lng2):
-    """2点間の距離を計算（km）- ヒュベニの公式"""
-    R = 6371  # 地球の半径（km）
-
-    lat1_rad = radians(lat1)
-    lat2_rad = radians(lat2)
-    delta_lat = radians(lat2 - lat1)
-    delta_lng = radians(lng2 - lng1)
-
-    a = sin(delta_lat/2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(delta_lng/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-
-    return R * c
-
-# 最適化経路算出関数（観光モード：待ち時間考慮）
-def optimize_route_tourism(current_loc: List[float], spots_df: pd.DataFrame, selected_indices: List[int]) -> Tuple[List[int], float, float]:
+@st.cache_data
+def spots_data_versions(source_mtime: float, _tourism_df: Optional[pd.DataFrame],
+                        _disaster_df: Optional[pd.DataFrame]) -> Tuple[str, str]:
     """
-    観光モード用の最適化経路算出（待ち時間と距離を考慮）
-    Returns: (訪問順のインデックスリスト, 総移動距離, 総所要時間)
+    観光・防災データの版（load_spots_data と同じ source_mtime ごとに1回。Excelの値から算出する）
+    リアルタイム情報で上書きする列は含めないため、情報の更新で移動時間行列・AIプランのキャッシュを捨てない
     """
-    if not selected_indices:
-        return [], 0.0, 0.0
-
-    unvisited = selected_indices.copy()
-    route = []
-    current_position = current_loc
-    total_distance = 0.0
-    total_time = 0.0
-
-    while unvisited:
-        # 各未訪問スポットのスコアを計算
-        scores = []
-        distances = []
-        wait_times = []
-
-        for idx in unvisited:
-            spot = spots_df.iloc[idx]
-            dist = calculate_distance(
-                current_position[0], current_position[1],
-                spot['緯度'], spot['経度']
-            )
-            distances.append(dist)
-            wait_time = spot.get('待ち時間（分）', 0)
-            wait_times.append(wait_time)
-
-        # 距離ランキング（近い順に1, 2, 3...）
-        distance_ranks = [sorted(distances).index(d) + 1 for d in distances]
-
-        # 待ち時間ランキング（短い順に1, 2, 3...）
-        wait_time_ranks = [sorted(wait_times).index(w) + 1 for w in wait_times]
-
-        # スコア計算: S = RD + RW（小さいほど良い）
-        scores = [distance_ranks[i] + wait_time_ranks[i] for i in range(len(unvisited))]
+    if _tourism_df is None or _disaster_df is None:
+        return '', ''
+    return static_dataset_version(_tourism_df), static_dataset_version(_disaster_df)
+
+@st.cache_resource
+def build_spot_store(spots_df: pd.DataFrame) -> SpotStore:
+    """スポットデータのストアを作成（データ読み込みごとに1回）"""
+    return SpotStore.from_dataframe(spots_df)
+
+@st.cache_resource
+def build_spot_list_index(spots_df: pd.DataFrame) -> SpotListIndex:
+    """スポット一覧の検索・並び替え用の索引を作成（データ読み込みごとに1回）"""
+    return SpotListIndex(spots_df)
+
+@st.cache_resource
+def build_spatial_index(spots_df: pd.DataFrame) -> SpatialGridIndex:
+    """スポットデータの空間インデックスを作成（データ読み込みごとに1回）"""
+    return SpatialGridIndex.from_dataframe(spots_df)
+
+@st.cache_resource
+def load_road_network_data(path: str, source_mtime: float = 0.0) -> Optional[RoadNetwork]:
+    """
+    道路データ（OSM抽出）を読み込んで道路グラフを作成（ファイル更新時にキャッシュが切り替わる）
+    読み込めない場合はNone（直線距離で計算する）
+    """
+    try:
+        return load_road_network(path)
+    except RoadDataError as e:
+        st.warning(f"⚠️ {e}（直線距離で計算します）")
+        return None
 
-        # 最小スコアのスポットを選択
-        min_score_idx = scores.index(min(scores))
-        selected_idx = unvisited[min_score_idx]
+@st.cache_resource
+def load_hazard_layer_data(path: str, source_mtime: float = 0.0) -> Optional[HazardLayer]:
+    """
+    浸水・土砂災害の想定区域（GeoJSON）を読み込んで索引を作成（ファイル更新時にキャッシュが切り替わる）
+    読み込めない場合はNone（想定区域を考慮しない）
+    """
+    try:
+        return load_hazard_layer(path)
+    except HazardDataError as e:
+        st.warning(f"⚠️ {e}（想定区域を考慮せずに計算します）")
+        return None
+
+@st.cache_resource(max_entries=2)
+def load_transit_data(paths: Tuple[str, ...], source_mtimes: Tuple[float, ...],
+                      service_date: date) -> Optional[TransitTimetable]:
+    """
+    公共交通の時刻表（GTFS）から運行日の時刻表を作成（ファイル更新時・日付が変わったときにキャッシュが切り替わる）
+    読み込めない場合はNone（公共交通は車の所要時間で概算する）
+    """
+    try:
+        return load_transit_timetable(paths, service_date)
+    except (OSError, TransitDataError) as e:
+        st.warning(f"⚠️ {e}（公共交通は車の所要時間で概算します）")
+        return None
 
-        route.append(selected_idx)
-        selected_spot = spots_df.iloc[selected_idx]
+@st.cache_resource
+def get_tile_server(path: str) -> Optional[TileServer]:
+    """
+    オフラインの地図タイル（MBTiles）のタイルサーバー（全セッション共通。シードし直したタイルは再起動せずに配信する）
+    起動できない場合はNone（公開のタイルサーバーの地図を表示する）
+    """
+    try:
+        return start_tile_server(path)
+    except (TileStoreError, OSError) as e:
+        st.warning(f"⚠️ 地図タイルのサーバーを起動できません: {e}（公開の地図を表示します）")
+        return None
+
+@st.cache_resource(max_entries=4)
+def build_hazard_road_graph(_graph: RoadGraph, road_version: str, _layer: HazardLayer, hazard_version: str,
+                            factor: float) -> RoadGraph:
+    """想定区域を通る道路の重みを上げた徒歩の道路グラフ（道路データ・想定区域・倍率ごとに1回）"""
+    return hazard_road_graph(_graph, _layer, factor)
+
+@st.cache_data(max_entries=8)
+def shelter_hazard_kinds(version: str, _spots: SpotStore, _layer: HazardLayer, hazard_version: str) -> List[str]:
+    """避難所ごとの想定区域の種別（区域外は空。データの版・想定区域ごとに1回）"""
+    return [_layer.kinds[p] if p >= 0 else '' for p in _layer.locate(_spots.lats, _spots.lngs)]
+
+@st.cache_resource
+def get_live_status_service(path: str) -> LiveStatusService:
+    """
+    リアルタイム情報の取得サービス（全セッション共通。設定ファイルの更新はサービスが読み込み直すため作り直さない）
+    設定を読み込めない間は、理由をファイル名をキーに errors に記録して前の情報源（最初はなし）のまま動く
+    """
+    return LiveStatusService.from_file(path)
 
-        # 移動距離と時間を加算
-        travel_dist = distances[min_score_idx]
-        total_distance += travel_dist
-        total_time += (travel_dist / 40) * 60  # 時速40kmで計算（分）
-        total_time += selected_spot.get('所要時間（参考）', 60)
-        total_time += selected_spot.get('待ち時間（分）', 0)
+@st.cache_resource(max_entries=8)
+def load_travel_matrix_data(name: str, version: str, _spots: SpotStore, mode: str,
+                            _road_graph: Optional[RoadGraph], road_version: str) -> TravelMatrix:
+    """
+    スポット間の移動時間行列（データの版・移動手段・道路データごとに1回）
+    ファイルのキャッシュから読み込み、データが変わった場合は追加・移動したスポットの分だけ計算する
+    """
+    return load_travel_matrix(_spots, version, mode, _road_graph, name=name)
 
-        # 現在地を更新
-        current_position = [selected_spot['緯度'], selected_spot['経度']]
-        unvisited.remove(selected_idx)
+@st.cache_resource(max_entries=64)
+def isochrone_for(origin: Tuple[float, float], mode: str, _road_graph: Optional[RoadGraph],
+                  road_version: str) -> Isochrone:
+    """
+    到達圏（出発地のセル・移動手段・道路データごとに1回。全セッション共通）
+    origin には isochrone_origin で丸めた出発地を渡し、同じセルの現在地は計算結果を共有する
+    """
+    return compute_isochrone(origin, mode, _road_graph)
 
-    return route, total_distance, total_time
+# 地図作成関数
+@st.cache_data(max_entries=32)
+def build_marker_data(version: str, _spots_df: pd.DataFrame, center_lat: float, center_lng: float) -> List[list]:
+    """スポットマーカーのデータを作成（データの版と現在地ごとにキャッシュ）"""
+    return maps.build_marker_data(_spots_df, center_lat, center_lng)
 
-# 最適化経路算出関数（防災モード：最近傍法）
-def optimize_route_disaster(current_loc: List[float], spots_df: pd.DataFrame, selected_indices: List[int]) -> Tuple[List[int], float, float]:
+@traced('app.create_enhanced_map')
+def create_enhanced_map(spots_df, version, center_location, selected_spot=None, show_route=False, road_route=None,
+                        hazard_layer=None, isochrone=None, isochrone_minutes=None):
     """
-    防災モード用の最適化経路算出（距離のみ考慮）
-    Returns: (訪問順のインデックスリスト, 総移動距離, 総所要時間)
+    Foliumマップを作成（スポットマーカーのデータと想定区域はキャッシュから再利用。タイルはローカルがあれば使う）
+    version は読み込み時に算出したデータの版。絞り込みで行が変わるため、行の見出しのハッシュ値を加えてキーにする
     """
-    if not selected_indices:
-        return [], 0.0, 0.0
-
-    unvisited = selected_indices.copy()
-    route = []
-    current_position = current_loc
-    total_distance = 0.0
-    total_time = 0.0
-
-    while unvisited:
-        # 最も近いスポットを選択
-        min_dist = float('inf')
-        nearest_idx = None
-
-        for idx in unvisited:
-            spot = spots_df.iloc[idx]
-            dist = calculate_distance(
-                current_position[0], current_position[1],
-                spot['緯度'], spot['経度']
-            )
-            if dist < min_dist:
-                min_dist = dist
-                nearest_idx = idx
-
-        route.append(nearest_idx)
-        selected_spot = spots_df.iloc[nearest_idx]
-
-        # 移動距離と時間を加算
-        total_distance += min_dist
-        total_time += (min_dist / 4) * 60  # 徒歩時速4kmで計算（分）
-
-        # 現在地を更新
-        current_position = [selected_spot['緯度'], selected_spot['経度']]
-        unvisited.remove(nearest_idx)
-
-    return route, total_distance, total_time
-
-# 地図作成関数（改良版）
-def create_enhanced_map(spots_df, center_location, selected_spot=None, show_route=False):
-    """Foliumマップを作成"""
-    m = folium.Map(
-        location=center_location,
-        zoom_start=13,
-        tiles='OpenStreetMap'
+    rows = hashlib.sha1(pd.util.hash_pandas_object(spots_df.index).to_numpy().tobytes()).hexdigest()[:16]
+    marker_data = build_marker_data(
+        f'{version}-{rows}', spots_df,
+        round(center_location[0], 6), round(center_location[1], 6)
+    )
+    return maps.create_enhanced_map(
+        spots_df, center_location, selected_spot, show_route, marker_data=marker_data, road_route=road_route,
+        hazard_layer=hazard_layer, tile_server=tile_server, isochrone=isochrone, isochrone_minutes=isochrone_minutes
     )
-    
-    # 現在地マーカー（赤・大きめ）
-    folium.Marker(
-        center_location,
-        popup=folium.Popup("📍 <b>現在地</b>", max_width=200),
-        tooltip="現在地",
-        icon=folium.Icon(color='red', icon='home', prefix='fa')
-    ).add_to(m)
-    
-    # スポットマーカー
-    for idx, row in spots_df.iterrows():
-        # 距離計算
-        distance = calculate_distance(
-            center_location[0], center_location[1],
-            row['緯度'], row['経度']
-        )
-        
-        # ポップアップHTML
-        popup_html = f"""
-        <div style="width: 250px; font-family: sans-serif;">
-            <h4 style="margin: 0 0 10px 0; color: #1f77b4;">{row['スポット名']}</h4>
-            <p style="margin: 5px 0;"><b>📝 説明:</b><br>{row['説明']}</p>
-            <p style="margin: 5px 0;"><b>📏 現在地から:</b> {distance:.2f} km</p>
-        """
-        
-        # カテゴリ情報（観光モード）
-        if 'カテゴリ' in row:
-            popup_html += f'<p style="margin: 5px 0;"><b>🏷️ カテゴリ:</b> {row["カテゴリ"]}</p>'
-        if '営業時間' in row:
-            popup_html += f'<p style="margin: 5px 0;"><b>🕐 営業時間:</b> {row["営業時間"]}</p>'
-        if '料金' in row:
-            popup_html += f'<p style="margin: 5px 0;"><b>💰 料金:</b> {row["料金"]}</p>'
-        
-        # 収容人数情報（防災モード）
-        if '収容人数' in row:
-            popup_html += f'<p style="margin: 5px 0;"><b>👥 収容人数:</b> {row["収容人数"]}名</p>'
-        if '状態' in row:
-            status_color = 'green' if row['状態'] == '開設中' else 'orange'
-            popup_html += f'<p style="margin: 5px 0;"><b>🚨 状態:</b> <span style="color: {status_color};">{row["状態"]}</span></p>'
-        
-        popup_html += "</div>"
-        
-        # マーカーの色を選択されたスポットで変更
-        marker_color = 'green' if selected_spot == row['スポット名'] else 'blue'
-        
-        folium.Marker(
-            [row['緯度'], row['経度']],
-            popup=folium.Popup(popup_html, max_width=300),
-            tooltip=row['スポット名'],
-            icon=folium.Icon(color=marker_color, icon='info-sign')
-        ).add_to(m)
-        
-        # 選択されたスポットへのルート（直線）を表示
-        if show_route and selected_spot == row['スポット名']:
-            folium.PolyLine(
-                locations=[center_location, [row['緯度'], row['経度']]],
-                color='red',
-                weight=3,
-                opacity=0.7,
-                popup=f"直線距離: {distance:.2f} km"
-            ).add_to(m)
-    
-    return m
-
-# Google Mapsリンク生成関数（単一目的地）
-def create_google_maps_link(origin, destination, mode='driving'):
-    """Google Mapsの外部リンクを生成（単一目的地）"""
-    modes = {
-        'driving': 'driving',
-        'walking': 'walking',
-        'bicycling': 'bicycling',
-        'transit': 'transit'
-    }
-    base_url = "https://www.google.com/maps/dir/?api=1"
-    link = f"{base_url}&origin={origin[0]},{origin[1]}&destination={destination[0]},{destination[1]}&travelmode={modes[mode]}"
-    return link
 
-# Google Mapsリンク生成関数（複数経由地）
-def create_google_maps_multi_link(origin: List[float], waypoints: List[Tuple[float, float]], destination: Tuple[float, float], mode='driving') -> str:
+# AIプラン提案関連
+@st.cache_data(max_entries=64)
+def build_spots_context(version: str, _tourism_df: pd.DataFrame, interests: Tuple[str, ...], season: str,
+                        budget: str, duration: str) -> ai.SpotsContext:
     """
-    Google Mapsの外部リンクを生成（複数経由地対応）
-    Args:
-        origin: 出発地 [緯度, 経度]
-        waypoints: 経由地のリスト [(緯度, 経度), ...]
-        destination: 最終目的地 (緯度, 経度)
-        mode: 移動手段
-    Returns:
-        Google Maps URL
+    プロンプト用のスポットリストを作成（データの版・条件ごとに1回）
+    条件に合うスポットをスポット一覧と同じ全文検索の索引で選び、トークン数の上限に収まる分だけ入れる
     """
-    modes = {
-        'driving': 'driving',
-        'walking': 'walking',
-        'bicycling': 'bicycling',
-        'transit': 'transit'
-    }
-
-    base_url = "https://www.google.com/maps/dir/?api=1"
-    url = f"{base_url}&origin={origin[0]},{origin[1]}&destination={destination[0]},{destination[1]}"
+    search_index = build_spot_list_index(_tourism_df).search_index
+    positions = ai.select_plan_spots(_tourism_df, search_index, list(interests), season, budget, duration)
+    return ai.build_spots_context(_tourism_df, positions)
 
-    if waypoints:
-        waypoints_str = "|".join([f"{lat},{lng}" for lat, lng in waypoints])
-        url += f"&waypoints={waypoints_str}"
+@st.cache_resource
+def get_ai_plan_cache() -> TTLCache:
+    """生成済みプランのキャッシュ（全セッション共通）"""
+    return TTLCache(AI_PLAN_CACHE_SIZE, AI_PLAN_CACHE_TTL_SEC)
 
-    url += f"&travelmode={modes.get(mode, 'driving')}"
+@st.cache_resource
+def get_route_cache() -> TTLCache:
+    """最適化ルートの算出結果のキャッシュ（全セッション共通。件数とメモリ使用量の上限つきLRU）"""
+    return TTLCache(ROUTE_CACHE_SIZE, ROUTE_CACHE_TTL_SEC, max_bytes=ROUTE_CACHE_MAX_BYTES)
 
-    return url
+@st.cache_resource
+def get_trace_registry() -> TraceRegistry:
+    """処理時間の集計（全セッション共通）"""
+    return TraceRegistry()
 
 # サイドバー
 with st.sidebar:
@@ -486,7 +356,201 @@ st.caption("Ver. 2.1 - 観光と防災におけるタイムパフォーマンス
 st.divider()
 
 # データ読み込み
-tourism_df, disaster_df = load_spots_data()
+spots_mtime = spots_file_mtime()
+tourism_df, disaster_df = load_spots_data(spots_mtime)
+tourism_version, disaster_version = spots_data_versions(spots_mtime, tourism_df, disaster_df)
+
+# リアルタイム情報（取得はバックグラウンドで行い、描画はキャッシュ済みの値だけを使う）
+live_sources_file = find_live_sources_file()
+live_service = get_live_status_service(live_sources_file) if live_sources_file else None
+live_status = None
+if live_service is not None:
+    live_service.refresh()
+    live_status = live_service.snapshot()
+    config_error = live_status.errors.get(os.path.basename(live_sources_file))
+    if config_error:
+        st.warning(f"⚠️ {config_error}（読み込めた設定がない情報源はExcelの値を使います）")
+    tourism_df = apply_live_status(tourism_df, live_status)
+    disaster_df = apply_live_status(disaster_df, live_status)
+    if live_status.updated_at is None:
+        live_caption = "📡 リアルタイム情報を取得中です（Excelの値を表示しています）"
+    else:
+        live_caption = (
+            f"📡 リアルタイム情報: {len(live_status.spots) + len(live_status.stores)}件の施設を更新"
+            f"（{datetime.fromtimestamp(live_status.updated_at):%H:%M:%S}時点）"
+        )
+    source_errors = len(live_status.errors) - bool(config_error)
+    if source_errors:
+        live_caption += f" ・ {source_errors}件の情報源から取得できません"
+    st.caption(live_caption)
+
+tourism_store = build_spot_store(tourism_df)
+disaster_store = build_spot_store(disaster_df)
+# リアルタイム情報の列だけの版（待ち時間を使うスケジュールのキャッシュキーに加える）
+tourism_live_version = live_status_version(tourism_df)
+# 地図のマーカーは避難所の状態も表示するため、リアルタイム情報の版も加える
+tourism_map_version = f'{tourism_version}-{tourism_live_version}'
+disaster_map_version = f'{disaster_version}-{live_status_version(disaster_df)}'
+
+# 道路データ（ない場合は直線距離で計算）
+road_network_file = find_road_network_file()
+road_network = (
+    load_road_network_data(road_network_file, os.path.getmtime(road_network_file))
+    if road_network_file else None
+)
+walking_graph = road_network.walking if road_network is not None else None
+if road_network is not None:
+    st.caption(f"🛣️ 道路データ（{os.path.basename(road_network.source)}）に沿った距離・所要時間で計算しています")
+
+# 浸水・土砂災害の想定区域（ない場合は考慮しない）
+hazard_file = find_hazard_file()
+hazard_layer = load_hazard_layer_data(hazard_file, os.path.getmtime(hazard_file)) if hazard_file else None
+
+# 公共交通の時刻表（ない場合は車の所要時間で概算する）
+transit_feeds = find_transit_feeds()
+transit_timetable = (
+    load_transit_data(tuple(transit_feeds), tuple(os.path.getmtime(p) for p in transit_feeds), date.today())
+    if transit_feeds else None
+)
+if transit_timetable is not None:
+    st.caption(
+        f"🚌 公共交通は時刻表（{transit_timetable.source}。本日{transit_timetable.trip_count}便）で所要時間を計算しています"
+    )
+
+# オフラインの地図タイル（ない場合は公開のタイルサーバーの地図を表示する）
+tiles_file = find_tiles_file()
+tile_server = get_tile_server(os.path.abspath(tiles_file)) if tiles_file else None
+if tile_server is not None:
+    st.caption(f"🗺️ 地図は保存済みのタイル（{os.path.basename(tiles_file)}）から表示しています")
+
+def evacuation_graph(hazard_factor: float) -> Optional[RoadGraph]:
+    """避難ルートの徒歩の道路グラフ（想定区域を考慮する場合は区域を通る道路の重みを上げたもの）"""
+    if walking_graph is None or hazard_layer is None or hazard_factor == 1.0:
+        return walking_graph
+    return build_hazard_road_graph(
+        walking_graph, walking_graph.fingerprint, hazard_layer, hazard_layer.fingerprint, hazard_factor
+    )
+
+def travel_matrix_for(name: str, version: str, spots: SpotStore, mode: str) -> TravelMatrix:
+    """データセット（version はリアルタイム情報の列を除いた版）と移動手段に対応するスポット間の移動時間行列"""
+    graph = road_network.graph(TRAVEL_ROAD_PROFILES[mode]) if road_network is not None else None
+    return load_travel_matrix_data(
+        name, version, spots, mode, graph, graph.fingerprint if graph is not None else ''
+    )
+
+@traced('app.tourism_schedule_for')
+def tourism_schedule_for(current_loc: List[float], selected_indices: List[int], start_minutes: int,
+                         matrix_mode: str, time_limit: Optional[int] = None,
+                         budget_yen: Optional[int] = None) -> TourSchedule:
+    """観光ルートのスケジュール（同じ条件の算出結果は全セッションで共有する。上限はNoneで指定なし）"""
+    origin, selected = normalize_route_query(current_loc, selected_indices)
+    limits = {
+        'time_limit': inf if time_limit is None else time_limit,
+        'budget_yen': inf if budget_yen is None else budget_yen,
+    }
+    if matrix_mode == 'transit' and transit_timetable is None:
+        matrix_mode = 'driving'  # 時刻表を読み込めなくなった場合は車の所要時間で概算する
+    if matrix_mode == 'transit':
+        key = route_cache_key(
+            'tourism_schedule', tourism_version, origin, selected, start_minutes=start_minutes,
+            mode=matrix_mode, transit=transit_timetable.fingerprint, time_limit=time_limit, budget_yen=budget_yen,
+            live=tourism_live_version
+        )
+        return get_route_cache().get_or_compute(key, lambda: schedule_tourism_route(
+            origin, tourism_store, selected, start_minutes=start_minutes, transit=transit_timetable, **limits
+        ))
+    matrix = travel_matrix_for('tourism', tourism_version, tourism_store, matrix_mode)
+    key = route_cache_key(
+        'tourism_schedule', matrix.version, origin, selected, start_minutes=start_minutes, mode=matrix_mode,
+        road=matrix.road_graph.fingerprint if matrix.road_graph is not None else '',
+        time_limit=time_limit, budget_yen=budget_yen, live=tourism_live_version
+    )
+    return get_route_cache().get_or_compute(key, lambda: schedule_tourism_route(
+        origin, tourism_store, selected, start_minutes=start_minutes, travel_matrix=matrix, **limits
+    ))
+
+def show_transit_journey(journey: TransitJourney):
+    """公共交通の経路（乗車・徒歩の区間）を表示"""
+    rides = [leg for leg in journey.legs if leg.kind == '乗車']
+    if not rides:
+        st.caption(f"🚶 時刻表では歩いた方が早く着きます（{format_clock(journey.arrive)}着・{int(journey.minutes)}分）")
+        return
+    st.metric("公共交通", f"{int(journey.minutes)}分", f"{format_clock(journey.arrive)}着・乗り換え{journey.transfers}回",
+              delta_color="off")
+    for leg in journey.legs:
+        if leg.kind == '乗車':
+            st.write(f"🚌 {format_clock(leg.depart)} {leg.from_name} → {format_clock(leg.arrive)} {leg.to_name}（{leg.route_name}）")
+        elif leg.arrive - leg.depart >= 1:
+            st.caption(f"🚶 {leg.from_name} → {leg.to_name}（徒歩{int(leg.arrive - leg.depart)}分）")
+
+
+def isochrone_controls(key: str, spots_df: pd.DataFrame) -> Tuple[Optional[Isochrone], int, pd.DataFrame]:
+    """
+    現在地からの到達圏の設定と、到達圏内のスポットの一覧
+    Returns: (地図に重ねる到達圏（表示しない場合はNone）, 区切りの分数, 地図に表示するスポット)
+    """
+    with st.expander("⏱️ 到達圏（何分で行けるか）"):
+        if not st.checkbox("現在地からの到達圏を地図に表示", key=f'{key}_isochrone_show'):
+            return None, 0, spots_df
+        profile = st.radio(
+            "移動手段", ['walking', 'driving'], format_func={'walking': '🚶 徒歩', 'driving': '🚗 車'}.get,
+            horizontal=True, key=f'{key}_isochrone_mode'
+        )
+        limit = st.radio(
+            "時間", list(ISOCHRONE_MINUTES), index=len(ISOCHRONE_MINUTES) - 1, format_func=lambda m: f"{m}分以内",
+            horizontal=True, key=f'{key}_isochrone_minutes'
+        )
+        graph = road_network.graph(profile) if road_network is not None else None
+        isochrone = isochrone_for(
+            isochrone_origin(*st.session_state.current_location), profile, graph,
+            graph.fingerprint if graph is not None else ''
+        )
+        spot_minutes = pd.Series(
+            isochrone.minutes_at(spots_df['緯度'], spots_df['経度']), index=spots_df.index
+        )
+        reachable = spot_minutes <= limit
+        st.caption(
+            "道路に沿った所要時間（道路から離れた場所は歩いた時間）で計算しています" if isochrone.on_roads
+            else "直線距離による概算です（道路データを置くと道路に沿って計算します）"
+        )
+        st.write(f"**{limit}分以内に行けるスポット: {int(reachable.sum())}件**")
+        if reachable.any():
+            st.dataframe(
+                spots_df[reachable].reindex(columns=['スポット名', 'カテゴリ'] if 'カテゴリ' in spots_df.columns
+                                            else ['スポット名']).assign(
+                    **{'所要時間（分）': spot_minutes[reachable].round().astype(int)}
+                ).sort_values('所要時間（分）'),
+                hide_index=True,
+                use_container_width=True
+            )
+        if st.checkbox("到達圏内のスポットだけを地図に表示", key=f'{key}_isochrone_filter'):
+            spots_df = spots_df[reachable]
+    return isochrone, limit, spots_df
+
+
+@traced('app.disaster_route_for')
+def disaster_route_for(current_loc: List[float], selected_indices: List[int],
+                       hazard_factor: float = 1.0) -> Tuple[List[int], float, float]:
+    """避難所の巡回ルート（同じ条件の算出結果は全セッションで共有する）"""
+    origin, selected = normalize_route_query(current_loc, selected_indices)
+    graph = evacuation_graph(hazard_factor)
+    if graph is walking_graph:
+        matrix = travel_matrix_for('disaster', disaster_version, disaster_store, 'walking')
+    else:
+        # 重みづけした道路グラフの行列は、倍率ごとに別のキャッシュファイルに保存する
+        matrix = load_travel_matrix_data(
+            f'disaster-hazard-x{hazard_factor:g}', disaster_version, disaster_store, 'walking',
+            graph, graph.fingerprint
+        )
+    hazards = hazard_layer if hazard_factor != 1.0 else None
+    key = route_cache_key(
+        'disaster_route', matrix.version, origin, selected,
+        road=matrix.road_graph.fingerprint if matrix.road_graph is not None else '',
+        hazard=hazards.fingerprint if hazards is not None else '', hazard_factor=hazard_factor
+    )
+    return get_route_cache().get_or_compute(key, lambda: optimize_route_disaster(
+        origin, disaster_store, selected, travel_matrix=matrix, hazards=hazards, hazard_factor=hazard_factor
+    ))
 
 # 現在のモード表示
 st.subheader(f"📍 {st.session_state.mode}")
@@ -535,27 +599,36 @@ if st.session_state.mode == '観光モード':
                 )
 
                 if destination != '選択してください':
-                    dest_row = filtered_df[filtered_df['スポット名'] == destination].iloc[0]
+                    dest_row = tourism_df.iloc[tourism_store.name_to_index[destination]]
                     dest_coords = (dest_row['緯度'], dest_row['経度'])
 
                     # 情報表示
                     st.info(f"📍 **{destination}**")
 
-                    # 距離表示
-                    distance = calculate_distance(
-                        st.session_state.current_location[0],
-                        st.session_state.current_location[1],
-                        dest_coords[0],
-                        dest_coords[1]
+                    # 距離表示（道路データがあれば道路に沿った距離）
+                    destination_road = (
+                        road_route(walking_graph, st.session_state.current_location, dest_coords)
+                        if walking_graph is not None else None
                     )
-
                     col_a, col_b = st.columns(2)
-                    with col_a:
-                        st.metric("直線距離", f"{distance:.2f} km")
-                    with col_b:
-                        # 徒歩時間の概算（時速4km）
-                        walk_time = int((distance / 4) * 60)
-                        st.metric("徒歩概算", f"{walk_time}分")
+                    if destination_road is not None:
+                        with col_a:
+                            st.metric("道路距離", f"{destination_road.distance_km:.2f} km")
+                        with col_b:
+                            st.metric("徒歩", f"{int(destination_road.minutes)}分")
+                    else:
+                        distance = calculate_distance(
+                            st.session_state.current_location[0],
+                            st.session_state.current_location[1],
+                            dest_coords[0],
+                            dest_coords[1]
+                        )
+                        with col_a:
+                            st.metric("直線距離", f"{distance:.2f} km")
+                        with col_b:
+                            # 徒歩時間の概算（時速4km）
+                            walk_time = int((distance / 4) * 60)
+                            st.metric("徒歩概算", f"{walk_time}分")
 
                     # 詳細情報
                     with st.expander("📝 詳細情報", expanded=True):
@@ -583,6 +656,13 @@ if st.session_state.mode == '観光モード':
                         key='map_travel_mode'
                     )
 
+                    # 公共交通の時刻表があれば、今から出発した場合の最早到着の経路を表示
+                    if travel_mode == 'transit' and transit_timetable is not None:
+                        now = datetime.now()
+                        show_transit_journey(transit_timetable.earliest_arrival(
+                            st.session_state.current_location, dest_coords, now.hour * 60 + now.minute
+                        ))
+
                     # Google Mapsで開くボタン
                     maps_link = create_google_maps_link(
                         st.session_state.current_location,
@@ -597,14 +677,19 @@ if st.session_state.mode == '観光モード':
                         type="primary"
                     )
 
-                    # 地図上に直線ルートを表示
-                    show_route = st.checkbox("地図上に直線を表示", value=True, key='map_show_route')
+                    # 地図上にルートを表示（道路データがない場合は直線）
+                    show_route = st.checkbox(
+                        "地図上にルートを表示" if destination_road is not None else "地図上に直線を表示",
+                        value=True, key='map_show_route'
+                    )
                 else:
                     destination = None
+                    destination_road = None
                     show_route = False
 
             else:  # 複数スポット選択モード
                 destination = None
+                destination_road = None
                 show_route = False
 
                 st.markdown("### 🎯 複数スポット選択")
@@ -631,25 +716,45 @@ if st.session_state.mode == '観光モード':
                         key='map_opt_travel_mode'
                     )
 
+                    # 出発時刻（営業時間に間に合うかの判定に使用）
+                    start_time = st.time_input("🕐 出発時刻", key='tour_start_time', step=300)
+
+                    # 時間・予算の上限（全部回れない場合は、おすすめ度の合計が最大になるスポットを選ぶ）
+                    time_limit, budget_yen = None, None
+                    if st.checkbox("⏳ 所要時間・料金の上限を指定", key='tour_limits'):
+                        limit_col1, limit_col2 = st.columns(2)
+                        with limit_col1:
+                            limit_hours = st.number_input(
+                                "所要時間の上限（時間）", min_value=0.5, max_value=24.0, value=4.0, step=0.5,
+                                key='tour_time_limit'
+                            )
+                        with limit_col2:
+                            budget_value = st.number_input(
+                                "料金の上限（円）", min_value=0, max_value=100000, value=3000, step=500,
+                                key='tour_budget'
+                            )
+                        time_limit, budget_yen = int(limit_hours * 60), int(budget_value)
+
                     if st.button("🎯 最適化ルートを算出", type="primary", use_container_width=True, key='map_optimize_btn'):
                         # 選択されたスポットのインデックスを取得
-                        selected_indices = []
-                        for spot_name in selected_spots_names:
-                            idx = tourism_df[tourism_df['スポット名'] == spot_name].index[0]
-                            selected_indices.append(idx)
-
-                        # 最適化ルート算出
-                        route, total_dist, total_time = optimize_route_tourism(
-                            st.session_state.current_location,
-                            tourism_df,
-                            selected_indices
-                        )
+                        selected_indices = tourism_store.indices_of(selected_spots_names)
+
+                        # 営業時間・所要時間・待ち時間を考慮したスケジュールを作成
+                        # 公共交通は時刻表（GTFS）があれば出発時刻からの便で、なければ車の所要時間で概算する
+                        transit_ready = travel_mode_opt == 'transit' and transit_timetable is not None
+                        query = {
+                            'current_loc': list(st.session_state.current_location),
+                            'selected_indices': selected_indices,
+                            'start_minutes': start_time.hour * 60 + start_time.minute,
+                            'matrix_mode': travel_mode_opt if travel_mode_opt in TRAVEL_MODES or transit_ready else 'driving',
+                            'time_limit': time_limit,
+                            'budget_yen': budget_yen,
+                        }
+                        tourism_schedule_for(**query)
 
-                        # セッション状態に保存
+                        # セッション状態には算出条件だけを保存（結果は全セッション共通のキャッシュ）
                         st.session_state.map_optimized_route = {
-                            'route': route,
-                            'total_distance': total_dist,
-                            'total_time': total_time,
+                            'query': query,
                             'mode': travel_mode_opt
                         }
 
@@ -659,44 +764,63 @@ if st.session_state.mode == '観光モード':
                     # 最適化ルート表示
                     if 'map_optimized_route' in st.session_state and st.session_state.map_optimized_route is not None:
                         route_data = st.session_state.map_optimized_route
-                        route = route_data['route']
-                        total_dist = route_data['total_distance']
-                        total_time = route_data['total_time']
+                        schedule = tourism_schedule_for(**route_data['query'])
+                        route = schedule.route
+                        total_dist = schedule.total_distance
+                        total_time = schedule.total_time
 
                         st.markdown("---")
                         st.markdown("### 📋 最適化された訪問順序")
 
                         # 統計情報
-                        col1, col2 = st.columns(2)
+                        col1, col2, col3 = st.columns(3)
                         with col1:
                             st.metric("総移動距離", f"{total_dist:.2f} km")
                         with col2:
                             hours = int(total_time // 60)
                             minutes = int(total_time % 60)
                             st.metric("総所要時間", f"{hours}時間{minutes}分")
-
-                        # 訪問順序リスト（簡易版）
-                        with st.expander("📍 訪問順序を確認", expanded=False):
-                            for i, idx in enumerate(route, 1):
-                                spot = tourism_df.iloc[idx]
-                                st.write(f"{i}. {spot['スポット名']}")
+                        with col3:
+                            st.metric("終了予定", format_clock(schedule.start_minutes + total_time))
+
+                        # 営業時間内に回れないスポット
+                        if schedule.infeasible:
+                            skipped = "、".join(
+                                f"{tourism_store.names[idx]}（{tourism_df['営業時間'].iloc[idx]}）"
+                                for idx in schedule.infeasible
+                            )
+                            st.warning(f"⚠️ 営業時間内に回れないため除外しました: {skipped}")
+                        if schedule.over_limit:
+                            dropped = "、".join(
+                                f"{tourism_store.names[idx]}（{tourism_df['料金'].iloc[idx]}）"
+                                for idx in schedule.over_limit
+                            )
+                            st.info(f"ℹ️ 所要時間・料金の上限に収まらないため除外しました: {dropped}")
+                        if schedule.unknown_fee:
+                            unknown = "、".join(
+                                f"{tourism_store.names[idx]}（{tourism_df['料金'].iloc[idx]}）"
+                                for idx in schedule.unknown_fee
+                            )
+                            st.warning(f"⚠️ 料金不明のため予算内か判断できず除外しました: {unknown}")
+                        if not route:
+                            st.error("❌ 出発時刻から営業時間・上限内に回れるスポットがありません")
+
+                        # 訪問スケジュール（到着・出発時刻）
+                        with st.expander("📍 訪問スケジュールを確認", expanded=False):
+                            for i, stop in enumerate(schedule.stops, 1):
+                                line = f"{i}. **{tourism_store.names[stop.index]}** {format_clock(stop.arrival)}着 → {format_clock(stop.departure)}発"
+                                if stop.idle_minutes >= 1:
+                                    line += f"（開館まで{int(stop.idle_minutes)}分待ち）"
+                                st.write(line)
 
                         # Google Maps複数経由地リンク生成
                         if len(route) > 0:
                             origin = st.session_state.current_location
 
-                            if len(route) == 1:
-                                dest_spot = tourism_df.iloc[route[0]]
-                                destination_coords = (dest_spot['緯度'], dest_spot['経度'])
-                                waypoints = []
-                            else:
-                                waypoints = []
-                                for idx in route[:-1]:
-                                    spot = tourism_df.iloc[idx]
-                                    waypoints.append((spot['緯度'], spot['経度']))
-
-                                dest_spot = tourism_df.iloc[route[-1]]
-                                destination_coords = (dest_spot['緯度'], dest_spot['経度'])
+                            # 最後のスポットを目的地、それ以外を経由地とする
+                            route_coords = route_coordinates(tourism_store, route)
+                            waypoints = route_coords[:-1]
+                            destination_coords = route_coords[-1]
 
                             maps_url = create_google_maps_multi_link(
                                 origin,
@@ -716,77 +840,109 @@ if st.session_state.mode == '観光モード':
                     st.warning("⚠️ 2つ以上のスポットを選択してください。")
                 else:
                     st.info("👆 訪問したいスポットを2つ以上選択してください。")
+
+            # 現在地から何分で行けるか（到達圏内のスポットに絞り込んで地図に表示できる）
+            isochrone, isochrone_minutes, map_spots_df = isochrone_controls('map', tourism_df)
         
         with col_map:
-            # 地図表示
-            m = create_enhanced_map(
-                tourism_df,
+            # 地図表示（マーカーはキャッシュし、現在地・ルート・到達圏のみ差分で追加）
+            m, route_layer = create_enhanced_map(
+                map_spots_df,
+                tourism_map_version,
                 st.session_state.current_location,
                 selected_spot=destination if destination != '選択してください' else None,
-                show_route=show_route
+                show_route=show_route,
+                road_route=destination_road,
+                isochrone=isochrone,
+                isochrone_minutes=isochrone_minutes
             )
-            st_folium(m, width=700, height=600, key='tourism_map')
+            with span('app.st_folium'):
+                st_folium(m, width=700, height=600, key='tourism_map', feature_group_to_add=route_layer)
     
     with tab2:
         st.subheader("📋 スポット一覧")
         
-        # 検索とフィルター
-        col1, col2 = st.columns([2, 1])
+        # 検索とフィルター（全件分の索引で検索・並び替えを行い、表示するページだけを描画する）
+        col1, col2, col3 = st.columns([2, 1, 1])
         with col1:
-            search = st.text_input("🔍 スポット名で検索", placeholder="例: 温泉")
+            search = st.text_input("🔍 スポットを検索", placeholder="例: 温泉　れきし")
         with col2:
-            sort_by = st.selectbox("並び替え", ["番号順", "距離が近い順", "名前順"])
-        
-        # データフィルタリング
-        display_df = tourism_df.copy()
-        
-        if search:
-            display_df = display_df[
-                display_df['スポット名'].str.contains(search, na=False) |
-                display_df['説明'].str.contains(search, na=False)
-            ]
-        
-        # 距離を計算
-        display_df['距離'] = display_df.apply(
-            lambda row: calculate_distance(
-                st.session_state.current_location[0],
-                st.session_state.current_location[1],
-                row['緯度'],
-                row['経度']
-            ),
-            axis=1
+            sort_by = st.selectbox("並び替え", list(SPOT_LIST_SORTS))
+        with col3:
+            list_view = st.radio(
+                "表示", ["カード", "表"], horizontal=True, key='spot_list_view',
+                index=1 if len(tourism_df) > SPOT_LIST_TABLE_THRESHOLD else 0
+            )
+
+        spot_list = build_spot_list_index(tourism_df)
+        spot_distances = distances_from_point(
+            st.session_state.current_location[0], st.session_state.current_location[1],
+            tourism_store.lats, tourism_store.lngs
         )
-        
-        # 並び替え
-        if sort_by == "距離が近い順":
-            display_df = display_df.sort_values('距離')
-        elif sort_by == "名前順":
-            display_df = display_df.sort_values('スポット名')
-        
-        st.write(f"**表示件数:** {len(display_df)}件")
-        
-        # カード表示
-        for idx, row in display_df.iterrows():
-            with st.container():
-                col1, col2, col3 = st.columns([3, 1, 1])
-                
-                with col1:
-                    st.markdown(f"### {row['スポット名']}")
-                    st.write(f"📝 {row['説明']}")
-                    st.caption(f"🏷️ {row['カテゴリ']} | 🕐 {row['営業時間']} | 💰 {row['料金']}")
-                
-                with col2:
-                    st.metric("距離", f"{row['距離']:.2f}km")
-                
-                with col3:
-                    maps_link = create_google_maps_link(
-                        st.session_state.current_location,
-                        (row['緯度'], row['経度']),
-                        'driving'
-                    )
-                    st.link_button("🗺️", maps_link, use_container_width=True)
-                
-                st.divider()
+        list_positions = spot_list.ordered(spot_list.search(search), sort_by, spot_distances)
+
+        # 条件が変わったら1ページ目に戻る
+        list_query = (search, sort_by, list_view)
+        if st.session_state.get('spot_list_query') != list_query:
+            st.session_state.spot_list_query = list_query
+            st.session_state.spot_list_page = 0
+        page_size = SPOT_LIST_TABLE_PAGE_SIZE if list_view == "表" else SPOT_LIST_PAGE_SIZE
+        _, _, page_total = paginate(list_positions, 0, page_size)
+
+        st.write(f"**表示件数:** {len(list_positions)}件")
+
+        # ページ送り（ボタンの結果を反映してからページを取り出す）
+        if page_total > 1:
+            col_prev, col_page, col_next = st.columns([1, 2, 1])
+            with col_prev:
+                if st.button("◀ 前へ", use_container_width=True, key='spot_list_prev',
+                             disabled=st.session_state.spot_list_page <= 0):
+                    st.session_state.spot_list_page -= 1
+            with col_next:
+                if st.button("次へ ▶", use_container_width=True, key='spot_list_next',
+                             disabled=st.session_state.spot_list_page >= page_total - 1):
+                    st.session_state.spot_list_page += 1
+        page_positions, page, page_total = paginate(list_positions, st.session_state.spot_list_page, page_size)
+        st.session_state.spot_list_page = page
+        if page_total > 1:
+            with col_page:
+                first = page * page_size + 1
+                st.caption(f"{page + 1} / {page_total} ページ（{first}〜{first + len(page_positions) - 1}件目）")
+
+        if list_view == "表":
+            # 1つの表として送る（行ごとの部品を作らない）
+            st.dataframe(
+                spot_list.page_table(page_positions, spot_distances, st.session_state.current_location),
+                column_config={
+                    '距離（km）': st.column_config.NumberColumn(format="%.2f"),
+                    'Google Maps': st.column_config.LinkColumn(display_text="🗺️ ルート"),
+                },
+                hide_index=True, use_container_width=True
+            )
+        else:
+            # カード表示（表示中のページのみ）
+            for idx in page_positions:
+                row = tourism_df.iloc[idx]
+                with st.container():
+                    col1, col2, col3 = st.columns([3, 1, 1])
+
+                    with col1:
+                        st.markdown(f"### {row['スポット名']}")
+                        st.write(f"📝 {row['説明']}")
+                        st.caption(f"🏷️ {row['カテゴリ']} | 🕐 {row['営業時間']} | 💰 {row['料金']}")
+
+                    with col2:
+                        st.metric("距離", f"{spot_distances[idx]:.2f}km")
+
+                    with col3:
+                        maps_link = create_google_maps_link(
+                            st.session_state.current_location,
+                            (row['緯度'], row['経度']),
+                            'driving'
+                        )
+                        st.link_button("🗺️", maps_link, use_container_width=True)
+
+                    st.divider()
 
     with tab3:
         st.subheader("📅 年間イベントカレンダー")
@@ -856,12 +1012,20 @@ if st.session_state.mode == '観光モード':
             ("月隈公園", "🌳 散策", "市街地を一望できる公園")
         ]
 
+        # 現在地から全スポットへの距離を一括計算
+        tourism_distances = distances_from_point(
+            st.session_state.current_location[0],
+            st.session_state.current_location[1],
+            tourism_store.lats,
+            tourism_store.lngs
+        )
+
         for i, (spot_name, badge, description) in enumerate(recommended_spots, 1):
             # スポット情報を取得
-            spot_df = tourism_df[tourism_df['スポット名'] == spot_name]
+            spot_pos = tourism_store.name_to_index.get(spot_name)
 
-            if len(spot_df) > 0:
-                spot = spot_df.iloc[0]
+            if spot_pos is not None:
+                spot = tourism_df.iloc[spot_pos]
 
                 with st.container():
                     col_rank, col_info, col_action = st.columns([0.5, 3, 1])
@@ -882,17 +1046,12 @@ if st.session_state.mode == '観光モード':
                         st.caption(f"🏷️ {spot['カテゴリ']} | 💰 {spot['料金']} | ⏱️ 所要時間: {spot['所要時間（参考）']}分")
 
                     with col_action:
-                        # 距離計算
-                        distance = calculate_distance(
-                            st.session_state.current_location[0],
-                            st.session_state.current_location[1],
-                            spot['緯度'],
-                            spot['経度']
-                        )
+                        # 距離（一括計算済み）
+                        distance = tourism_distances[spot_pos]
                         st.metric("距離", f"{distance:.1f}km")
                         maps_link = create_google_maps_link(
                             st.session_state.current_location,
-                            (spot['緯度'], spot['経度']),
+                            tourism_store.coords(spot_pos),
                             'driving'
                         )
                         st.link_button("🗺️", maps_link, use_container_width=True)
@@ -955,9 +1114,12 @@ if st.session_state.mode == '観光モード':
             key='ai_request'
         )
 
+        # 表示方法
+        stream_output = st.checkbox("⚡ 生成しながら表示する（ストリーミング）", value=True, key='ai_stream')
+
         # プラン生成ボタン
         if st.button("🎯 AIプランを生成", type="primary", use_container_width=True):
-            if not GENAI_AVAILABLE:
+            if not genai_available():
                 st.error("❌ google-generativeai パッケージがインストールされていません。")
                 st.info("以下のコマンドでインストールしてください: `pip install google-generativeai`")
             elif not st.session_state.gemini_api_key:
@@ -965,74 +1127,70 @@ if st.session_state.mode == '観光モード':
             elif not user_budget or not user_duration:
                 st.warning("⚠️ 予算と滞在時間を入力してください")
             else:
-                try:
-                    with st.spinner("🤖 AIがプランを生成中..."):
-                        # Gemini API設定
-                        genai.configure(api_key=st.session_state.gemini_api_key)
-                        model = genai.GenerativeModel('gemini-2.0-flash-exp')
-
-                        # スポットリスト作成
-                        spots_context = []
-                        for _, spot in tourism_df.iterrows():
-                            spots_context.append(
-                                f"- {spot['スポット名']}: {spot['説明']} (カテゴリ: {spot['カテゴリ']}, 料金: {spot['料金']}, 所要時間: {spot['所要時間（参考）']}分)"
-                            )
-                        spots_text = "\n".join(spots_context)
-
-                        # 現在の日時と季節情報を取得
-                        current_date = datetime.now()
-                        month = current_date.month
-
-                        # 季節判定
-                        if month in [3, 4, 5]:
-                            season = "春"
-                            season_desc = "桜の季節で、温暖な気候"
-                        elif month in [6, 7, 8]:
-                            season = "夏"
-                            season_desc = "暑い季節で、川開き観光祭や祇園祭などのイベントがある時期"
-                        elif month in [9, 10, 11]:
-                            season = "秋"
-                            season_desc = "紅葉が美しく、天領まつりやもみじ祭りがある時期"
-                        else:
-                            season = "冬"
-                            season_desc = "寒い季節で、温泉が特に人気"
-
-                        # プロンプト作成
-                        system_prompt = "あなたは日田市の観光コンシェルジュです。現在の天気・季節を考慮しながら、以下の観光スポットリストとユーザーの要望に基づき、魅力的な観光プランを提案してください。"
-
-                        user_prompt = f"""
-現在の日付: {current_date.strftime('%Y年%m月%d日')}
-現在の季節: {season}（{season_desc}）
-
-観光スポットリスト:
-{spots_text}
-
-ユーザーの要望:
-- 予算: {user_budget}
-- 滞在時間: {user_duration}
-- 興味: {', '.join(interest_categories)}
-- 同行者: {user_companion}
-{f'- その他の要望: {user_request}' if user_request else ''}
+                # 現在の日時と季節情報を取得
+                current_date = datetime.now()
+                season, season_desc = current_season(current_date.month)
+
+                # 同じ条件のプランはキャッシュから表示
+                plan_cache = get_ai_plan_cache()
+                cache_key = ai_plan_cache_key(
+                    tourism_version, user_budget, user_duration, interest_categories,
+                    user_companion, season, user_request
+                )
+                cached_plan = plan_cache.get(cache_key)
 
-上記の条件と現在の季節・天気を考慮して、日田市の観光プランを訪問順序を含めて具体的に提案してください。
-各スポットの魅力や、なぜそのスポットを選んだのか、季節に合わせたおすすめポイントも簡潔に説明してください。
-                        """
+                if cached_plan is not None:
+                    st.markdown("---")
+                    st.markdown("### 📋 AI提案プラン")
+                    st.markdown(cached_plan)
+                    st.caption("♻️ 同じ条件で生成済みのプランを表示しています")
+                    st.success("✅ プラン生成完了！")
+                else:
+                    try:
+                        # スポットリスト（条件に合うスポットだけを選んで入れる）
+                        spots_context = build_spots_context(
+                            tourism_version, tourism_df, tuple(sorted(interest_categories)), season,
+                            user_budget.strip(), user_duration.strip()
+                        )
 
-                        # API呼び出し
-                        response = model.generate_content(f"{system_prompt}\n\n{user_prompt}")
+                        # プロンプト作成
+                        prompt = build_plan_prompt(
+                            spots_context.text, current_date, season, season_desc,
+                            user_budget, user_duration, interest_categories, user_companion, user_request
+                        )
 
-                        # 結果表示
                         st.markdown("---")
                         st.markdown("### 📋 AI提案プラン")
-                        st.markdown(response.text)
+                        st.caption(
+                            f"🔎 {len(tourism_df)}件のスポットから条件に合う{spots_context.spot_count}件をAIに渡しています"
+                            f"（約{spots_context.tokens:,}トークン）"
+                        )
+
+                        # API呼び出し（ストリーミング時は届いた部分から表示）
+                        if stream_output:
+                            response = generate_plan(st.session_state.gemini_api_key, prompt, stream=True)
+                            with span('app.gemini_stream'):
+                                plan_text = st.write_stream(stream_plan_text(response))
+                        else:
+                            with st.spinner("🤖 AIがプランを生成中..."):
+                                response = generate_plan(st.session_state.gemini_api_key, prompt)
+                            plan_text = response.text
+                            st.markdown(plan_text)
+
+                        if isinstance(plan_text, str) and plan_text:
+                            plan_cache.set(cache_key, plan_text)
 
                         st.success("✅ プラン生成完了！")
 
-                except Exception as e:
-                    st.error(f"❌ エラーが発生しました: {str(e)}")
-                    st.info("💡 APIキーが正しいか確認してください。また、Gemini APIが有効化されているか確認してください。")
+                    except Exception as e:
+                        st.error(f"❌ エラーが発生しました: {str(e)}")
+                        st.info("💡 APIキーが正しいか確認してください。また、Gemini APIが有効化されているか確認してください。")
 
 else:  # 防災モード
+    # 空間インデックス（データ読み込みごとに1回作成）
+    disaster_index = build_spatial_index(disaster_df)
+    disaster_shelter_mask = shelter_mask(disaster_df)
+
     tab1, tab2, tab3 = st.tabs(["🏥 避難所マップ", "🗾 ハザードマップ", "📢 防災情報"])
     
     with tab1:
@@ -1043,10 +1201,50 @@ else:  # 防災モード
         with col_control:
             st.markdown("### 🚨 避難所情報")
 
+            # 浸水・土砂災害の想定区域（区域内の避難所は最寄りの候補から除き、ルートは区域を避ける）
+            if hazard_layer is not None:
+                hazard_avoidance = st.radio(
+                    "浸水・土砂災害の想定区域",
+                    list(HAZARD_AVOIDANCE),
+                    key='hazard_avoidance',
+                    help="「区域を通らない」は、ほかに道がない場合（現在地が区域内の場合など）だけ区域を通ります"
+                )
+                hazard_factor = HAZARD_AVOIDANCE[hazard_avoidance]
+                shelter_hazards = shelter_hazard_kinds(
+                    disaster_version, disaster_store, hazard_layer, hazard_layer.fingerprint
+                )
+                current_hazard = hazard_layer.locate(
+                    [st.session_state.current_location[0]], [st.session_state.current_location[1]]
+                )[0]
+                if current_hazard >= 0:
+                    st.error(
+                        f"⚠️ 現在地は{hazard_layer.kinds[current_hazard]}の想定区域内です。"
+                        "区域の外の避難所へ避難してください"
+                    )
+            else:
+                hazard_factor = 1.0
+                shelter_hazards = [''] * len(disaster_store)
+            safe_shelter_mask = disaster_shelter_mask
+            if hazard_factor != 1.0:
+                safe_shelter_mask = disaster_shelter_mask & (pd.Series(shelter_hazards).to_numpy() == '')
+
+            # 最寄りの避難所
+            nearest_pos, nearest_dist = disaster_index.query_nearest(
+                st.session_state.current_location[0],
+                st.session_state.current_location[1],
+                k=1,
+                mask=safe_shelter_mask
+            )
+            if len(nearest_pos) > 0:
+                st.success(
+                    f"🏃 **最寄りの避難所:** {disaster_store.names[nearest_pos[0]]}\n\n"
+                    f"距離 {nearest_dist[0]:.2f} km（徒歩 約{int((nearest_dist[0] / 4) * 60)}分）"
+                )
+
             # 選択モード
             selection_mode = st.radio(
                 "選択モード",
-                ["単一避難所", "複数避難所（最適化ルート）"],
+                ["単一避難所", "複数避難所（最適化ルート）", "避難者の一括割り当て（収容人数考慮）"],
                 key='disaster_selection_mode'
             )
 
@@ -1074,25 +1272,41 @@ else:  # 防災モード
                 )
 
                 if shelter != '選択してください':
-                    shelter_row = filtered_df[filtered_df['スポット名'] == shelter].iloc[0]
+                    shelter_row = disaster_df.iloc[disaster_store.name_to_index[shelter]]
                     shelter_coords = (shelter_row['緯度'], shelter_row['経度'])
 
                     # 情報表示
                     st.warning(f"🏥 **{shelter}**")
-
-                    # 距離表示
-                    distance = calculate_distance(
-                        st.session_state.current_location[0],
-                        st.session_state.current_location[1],
-                        shelter_coords[0],
-                        shelter_coords[1]
+                    shelter_hazard = shelter_hazards[disaster_store.name_to_index[shelter]]
+                    if shelter_hazard:
+                        st.error(f"⚠️ この避難所は{shelter_hazard}の想定区域内にあります")
+
+                    # 距離表示（道路データがあれば道路に沿った距離。想定区域を考慮する場合は区域を避けた経路）
+                    shelter_graph = evacuation_graph(hazard_factor)
+                    shelter_road = (
+                        road_route(shelter_graph, st.session_state.current_location, shelter_coords)
+                        if shelter_graph is not None else None
                     )
+                    if hazard_layer is not None and hazard_layer.path_crosses(
+                        shelter_road.coordinates if shelter_road is not None
+                        else [tuple(st.session_state.current_location), shelter_coords]
+                    ):
+                        st.warning("⚠️ このルートは想定区域を通ります")
+                    if shelter_road is not None:
+                        distance, walk_time = shelter_road.distance_km, int(shelter_road.minutes)
+                    else:
+                        distance = calculate_distance(
+                            st.session_state.current_location[0],
+                            st.session_state.current_location[1],
+                            shelter_coords[0],
+                            shelter_coords[1]
+                        )
+                        walk_time = int((distance / 4) * 60)
 
                     col_a, col_b = st.columns(2)
                     with col_a:
-                        st.metric("距離", f"{distance:.2f} km")
+                        st.metric("道路距離" if shelter_road is not None else "距離", f"{distance:.2f} km")
                     with col_b:
-                        walk_time = int((distance / 4) * 60)
                         st.metric("徒歩", f"{walk_time}分")
 
                     # 詳細情報
@@ -1115,45 +1329,67 @@ else:  # 防災モード
                         type="primary"
                     )
 
-                    show_route = st.checkbox("地図上に直線を表示", value=True, key='disaster_show_route')
+                    show_route = st.checkbox(
+                        "地図上にルートを表示" if shelter_road is not None else "地図上に直線を表示",
+                        value=True, key='disaster_show_route'
+                    )
                 else:
                     shelter = None
+                    shelter_road = None
                     show_route = False
 
-            else:  # 複数避難所選択モード
+            elif selection_mode == "複数避難所（最適化ルート）":
                 shelter = None
+                shelter_road = None
                 show_route = False
 
                 st.markdown("### 🎯 複数避難所選択")
 
+                # 最寄りの避難所を自動選択して最適化
+                if st.button("📍 最寄り3箇所で最適化", use_container_width=True, key='disaster_nearest_btn'):
+                    nearest_pos, _ = disaster_index.query_nearest(
+                        st.session_state.current_location[0],
+                        st.session_state.current_location[1],
+                        k=3,
+                        mask=safe_shelter_mask & disaster_df.index.isin(filtered_df.index)
+                    )
+                    nearest_indices = [int(pos) for pos in nearest_pos]
+                    st.session_state.disaster_multi_select = [disaster_store.names[idx] for idx in nearest_indices]
+
+                    query = {
+                        'current_loc': list(st.session_state.current_location),
+                        'selected_indices': nearest_indices,
+                        'hazard_factor': hazard_factor,
+                    }
+                    disaster_route_for(**query)
+                    st.session_state.disaster_optimized_route = {
+                        'query': query,
+                        'mode': 'walking'
+                    }
+
                 # 複数避難所選択
                 selected_shelters_names = st.multiselect(
                     "避難したい避難所を選択（2つ以上）",
                     filtered_df['スポット名'].tolist(),
-                    default=[],
                     key='disaster_multi_select'
                 )
 
                 if len(selected_shelters_names) >= 2:
                     if st.button("🎯 最適化避難ルートを算出", type="primary", use_container_width=True, key='disaster_optimize_btn'):
                         # 選択された避難所のインデックスを取得
-                        selected_indices = []
-                        for shelter_name in selected_shelters_names:
-                            idx = disaster_df[disaster_df['スポット名'] == shelter_name].index[0]
-                            selected_indices.append(idx)
+                        selected_indices = disaster_store.indices_of(selected_shelters_names)
 
                         # 最適化ルート算出（防災モード：最近傍法）
-                        route, total_dist, total_time = optimize_route_disaster(
-                            st.session_state.current_location,
-                            disaster_df,
-                            selected_indices
-                        )
+                        query = {
+                            'current_loc': list(st.session_state.current_location),
+                            'selected_indices': selected_indices,
+                            'hazard_factor': hazard_factor,
+                        }
+                        disaster_route_for(**query)
 
-                        # セッション状態に保存
+                        # セッション状態には算出条件だけを保存（結果は全セッション共通のキャッシュ）
                         st.session_state.disaster_optimized_route = {
-                            'route': route,
-                            'total_distance': total_dist,
-                            'total_time': total_time,
+                            'query': query,
                             'mode': 'walking'
                         }
 
@@ -1163,9 +1399,7 @@ else:  # 防災モード
                     # 最適化ルート表示
                     if 'disaster_optimized_route' in st.session_state and st.session_state.disaster_optimized_route is not None:
                         route_data = st.session_state.disaster_optimized_route
-                        route = route_data['route']
-                        total_dist = route_data['total_distance']
-                        total_time = route_data['total_time']
+                        route, total_dist, total_time = disaster_route_for(**route_data['query'])
 
                         st.markdown("---")
                         st.markdown("### 📋 最適化された避難順序")
@@ -1183,24 +1417,19 @@ else:  # 防災モード
                         with st.expander("📍 避難順序を確認", expanded=False):
                             for i, idx in enumerate(route, 1):
                                 shelter_info = disaster_df.iloc[idx]
-                                st.write(f"{i}. {shelter_info['スポット名']} (収容: {shelter_info['収容人数']}名)")
+                                hazard_note = f" ⚠️ {shelter_hazards[idx]}の想定区域内" if shelter_hazards[idx] else ""
+                                st.write(
+                                    f"{i}. {shelter_info['スポット名']} (収容: {shelter_info['収容人数']}名){hazard_note}"
+                                )
 
                         # Google Maps複数経由地リンク生成
                         if len(route) > 0:
                             origin = st.session_state.current_location
 
-                            if len(route) == 1:
-                                dest_shelter = disaster_df.iloc[route[0]]
-                                destination_coords = (dest_shelter['緯度'], dest_shelter['経度'])
-                                waypoints = []
-                            else:
-                                waypoints = []
-                                for idx in route[:-1]:
-                                    shelter_info = disaster_df.iloc[idx]
-                                    waypoints.append((shelter_info['緯度'], shelter_info['経度']))
-
-                                dest_shelter = disaster_df.iloc[route[-1]]
-                                destination_coords = (dest_shelter['緯度'], dest_shelter['経度'])
+                            # 最後の避難所を目的地、それ以外を経由地とする
+                            route_coords = route_coordinates(disaster_store, route)
+                            waypoints = route_coords[:-1]
+                            destination_coords = route_coords[-1]
 
                             maps_url = create_google_maps_multi_link(
                                 origin,
@@ -1220,16 +1449,125 @@ else:  # 防災モード
                     st.warning("⚠️ 2つ以上の避難所を選択してください。")
                 else:
                     st.info("👆 避難したい避難所を2つ以上選択してください。")
-        
+
+            else:  # 避難者の一括割り当てモード
+                shelter = None
+                shelter_road = None
+                show_route = False
+
+                st.markdown("### 👥 避難者の一括割り当て")
+                st.caption("多数の避難者を、各避難所の収容人数を超えないよう徒歩時間の合計が最小になるように割り当てます。")
+
+                origin_source = st.radio(
+                    "避難者の位置",
+                    ["現在地周辺の住民（シミュレーション）", "CSVをアップロード"],
+                    key='evacuation_origin_source'
+                )
+                origin_lats = origin_lngs = None
+                if origin_source == "CSVをアップロード":
+                    uploaded = st.file_uploader(
+                        "緯度・経度（任意で人数）の列を含むCSV",
+                        type=['csv'],
+                        key='evacuation_origin_file'
+                    )
+                    if uploaded is not None:
+                        try:
+                            origin_lats, origin_lngs = evacuee_origins(pd.read_csv(uploaded))
+                        except (ValueError, pd.errors.ParserError) as e:
+                            st.error(f"❌ {e}")
+                else:
+                    evacuee_count = st.number_input(
+                        "避難者数", min_value=1, max_value=100000, value=5000, step=1000,
+                        key='evacuation_count'
+                    )
+                    evacuee_radius = st.slider(
+                        "分布する半径（km）", min_value=0.5, max_value=10.0, value=3.0, step=0.5,
+                        key='evacuation_radius'
+                    )
+                    origin_lats, origin_lngs = simulate_evacuees(
+                        st.session_state.current_location[0],
+                        st.session_state.current_location[1],
+                        int(evacuee_count),
+                        float(evacuee_radius)
+                    )
+
+                default_capacity = st.number_input(
+                    "収容人数が不明な避難所の想定人数",
+                    min_value=1, value=DEFAULT_SHELTER_CAPACITY, step=50,
+                    key='evacuation_default_capacity'
+                )
+
+                if origin_lats is not None and len(origin_lats) > 0:
+                    if st.button("👥 避難所を割り当てる", type="primary", use_container_width=True, key='evacuation_assign_btn'):
+                        shelters_df = disaster_df[disaster_shelter_mask & disaster_df.index.isin(filtered_df.index)]
+                        with st.spinner("割り当てを計算中..."):
+                            result = assign_evacuees(
+                                origin_lats,
+                                origin_lngs,
+                                shelters_df['緯度'].to_numpy(),
+                                shelters_df['経度'].to_numpy(),
+                                shelter_capacities(shelters_df, int(default_capacity))
+                            )
+                        shelter_names = shelters_df['スポット名'].tolist()
+                        st.session_state.evacuation_assignment = {
+                            'loads': shelter_load_table(result, shelter_names),
+                            'evacuees': evacuee_assignment_table(origin_lats, origin_lngs, result, shelter_names),
+                            'unassigned': result.unassigned,
+                        }
+
+                    assignment_data = st.session_state.get('evacuation_assignment')
+                    if assignment_data is not None:
+                        evacuees = assignment_data['evacuees']
+                        walk = evacuees['徒歩（分）']
+
+                        st.markdown("---")
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            st.metric("割り当て人数", f"{int(walk.notna().sum()):,}名")
+                            st.metric("平均徒歩", f"{walk.mean():.1f}分" if walk.notna().any() else "-")
+                        with col2:
+                            st.metric("収容しきれない人数", f"{assignment_data['unassigned']:,}名")
+                            st.metric("最長徒歩", f"{walk.max():.1f}分" if walk.notna().any() else "-")
+
+                        if assignment_data['unassigned'] > 0:
+                            st.warning("⚠️ 避難所の収容人数の合計が避難者数を下回っています。")
+
+                        with st.expander("🏥 避難所ごとの割り当て", expanded=True):
+                            st.dataframe(
+                                assignment_data['loads'].sort_values('充足率（%）', ascending=False),
+                                hide_index=True,
+                                use_container_width=True
+                            )
+
+                        st.download_button(
+                            "📥 割り当て結果をダウンロード（CSV）",
+                            evacuees.to_csv(index=False).encode('utf-8-sig'),
+                            file_name='evacuation_assignment.csv',
+                            mime='text/csv',
+                            use_container_width=True,
+                            key='evacuation_download'
+                        )
+                else:
+                    st.info("👆 避難者の位置を指定してください。")
+
+            # 現在地から何分で行けるか（到達圏内の避難所に絞り込んで地図に表示できる）
+            isochrone, isochrone_minutes, map_spots_df = isochrone_controls('disaster', filtered_df)
+
         with col_map:
-            # 地図表示
-            m = create_enhanced_map(
-                filtered_df,
+            # 地図表示（マーカーはキャッシュし、現在地・ルート・到達圏のみ差分で追加）
+            m, route_layer = create_enhanced_map(
+                map_spots_df,
+                disaster_map_version,
                 st.session_state.current_location,
                 selected_spot=shelter if shelter != '選択してください' else None,
-                show_route=show_route
+                show_route=show_route,
+                road_route=shelter_road,
+                hazard_layer=hazard_layer,
+                isochrone=isochrone,
+                isochrone_minutes=isochrone_minutes
             )
-            st_folium(m, width=700, height=600, key='disaster_map')
+            with span('app.st_folium'):
+                st_folium(m, width=700, height=600, key='disaster_map', feature_group_to_add=route_layer)
 
     with tab2:
         st.subheader("🗾 ハザードマップ")
@@ -1244,6 +1582,28 @@ else:  # 防災モード
         - 家族との連絡方法を決めておく
         """)
 
+        # 読み込んだ想定区域（避難所マップに重ねて表示し、避難ルートの算出に使う）
+        if hazard_layer is not None:
+            st.markdown("### 🌊 浸水・土砂災害の想定区域")
+            kind_counts = pd.Series(hazard_layer.kinds).value_counts()
+            st.write(" ・ ".join(f"{kind}: {count}区域" for kind, count in kind_counts.items()))
+            hazard_shelters = [
+                name for name, kind in zip(disaster_store.names, shelter_hazard_kinds(
+                    disaster_version, disaster_store, hazard_layer, hazard_layer.fingerprint
+                )) if kind
+            ]
+            if hazard_shelters:
+                st.warning(f"⚠️ 想定区域内の避難所: {'、'.join(hazard_shelters)}")
+            st.caption(
+                f"📁 {os.path.basename(hazard_layer.source)} を読み込んでいます。"
+                "避難所マップに重ねて表示し、避難ルートは区域を避けて算出します"
+            )
+        else:
+            st.caption(
+                "💡 浸水・土砂災害の想定区域のGeoJSON（hazard.geojson）をアプリと同じフォルダに置くと、"
+                "避難所マップに重ねて表示し、区域を避けた避難ルートを算出します"
+            )
+
         st.divider()
 
         st.markdown("### 🗾 日田市公式ハザードマップ")
@@ -1278,20 +1638,50 @@ else:  # 防災モード
         with col1:
             st.markdown("### 🏪 営業中の店舗")
             
-            stores = [
-                ("ファミリーマート日田店", "✅ 営業中", "green"),
-                ("ローソン日田中央店", "✅ 営業中", "green"),
-                ("セブンイレブン日田店", "⚠️ 確認中", "orange"),
-                ("マックスバリュ日田店", "✅ 営業中", "green")
-            ]
-            
+            if live_status is not None and live_status.stores:
+                # リアルタイム情報の営業状況
+                stores = [
+                    (store_name, f"✅ {status}" if status == '営業中' else f"⚠️ {status or '確認中'}",
+                     "green" if status == '営業中' else "orange")
+                    for store_name, status in live_status.stores
+                ]
+            else:
+                stores = [
+                    ("ファミリーマート日田店", "✅ 営業中", "green"),
+                    ("ローソン日田中央店", "✅ 営業中", "green"),
+                    ("セブンイレブン日田店", "⚠️ 確認中", "orange"),
+                    ("マックスバリュ日田店", "✅ 営業中", "green")
+                ]
+
             for store_name, status, color in stores:
                 st.markdown(f":{color}[{status}] {store_name}")
         
         with col2:
-            st.markdown("### 🥤 近くの自動販売機")
-            st.info("現在地から500m圏内: 8台")
-            st.success("すべて稼働中")
+            st.markdown(f"### 📍 現在地から{int(FACILITY_SEARCH_RADIUS_KM * 1000)}m圏内の施設")
+
+            # 空間インデックスで半径内の施設を検索
+            nearby_pos, _ = disaster_index.query_radius(
+                st.session_state.current_location[0],
+                st.session_state.current_location[1],
+                FACILITY_SEARCH_RADIUS_KM
+            )
+            nearby_df = disaster_df.iloc[nearby_pos]
+
+            if 'カテゴリ' in nearby_df.columns:
+                category_counts = nearby_df['カテゴリ'].value_counts()
+            else:
+                category_counts = pd.Series({'避難所': len(nearby_df)})
+
+            if len(nearby_df) == 0:
+                st.info("圏内に登録施設はありません")
+            for category, count in category_counts.items():
+                if category == '危険個所':
+                    st.warning(f"⚠️ {category}: {count}箇所")
+                else:
+                    st.info(f"{category}: {count}箇所")
+
+            if '自動販売機' not in category_counts:
+                st.caption("🥤 自動販売機の位置データは未登録です")
         
         st.divider()
         
@@ -1365,7 +1755,7 @@ with st.expander("💡 使い方のヒント"):
     #### 観光モードでできること
     1. **地図でスポットを確認**: マップタブで日田市内の観光スポットを一覧表示
     2. **目的地を選択**: 行きたい場所を選ぶと、距離と概算時間を表示
-    3. **最適化ルート**: 複数スポットを選択すると、待ち時間と距離を考慮した最適な訪問順序を算出
+    3. **最適化ルート**: 複数スポットを選択すると、営業時間・待ち時間と距離を考慮した最適な訪問順序と到着時刻を算出
     4. **スポット検索**: スポット一覧タブでキーワード検索や並び替えが可能
     5. **天気情報**: 天気タブで気象情報サイトへアクセス
     6. **イベント情報**: 月別にイベントを確認できます
@@ -1376,26 +1766,59 @@ with st.expander("💡 使い方のヒント"):
     1. **最寄り避難所の確認**: 現在地から近い避難所を表示
     2. **最適化避難ルート**: 複数の避難所を選択すると、最短距離での巡回順序を算出
     3. **避難ルート**: 徒歩での避難ルートをGoogle Mapsで確認
-    4. **開設状況の確認**: 避難所の開設状況と収容人数をリアルタイム表示
-    5. **営業店舗情報**: 災害時の営業中コンビニ・スーパーを確認
-    6. **防災グッズ提案**: 予算に応じた防災グッズのおすすめ
+    4. **避難者の一括割り当て**: 多数の避難者（CSVまたはシミュレーション）を、収容人数を超えないよう徒歩時間の合計が最小になるように避難所へ割り当て
+    5. **開設状況の確認**: 避難所の開設状況と収容人数をリアルタイム表示
+    6. **営業店舗情報**: 災害時の営業中コンビニ・スーパーを確認
+    7. **防災グッズ提案**: 予算に応じた防災グッズのおすすめ
 
     #### 最適化ルート機能について
-    - **観光モード**: 待ち時間と距離を考慮したスコアリングで最適な訪問順序を算出
-    - **防災モード**: 最近傍法により最短距離での避難順序を算出
+    - **観光モード**: 出発時刻から営業時間内に回れる順序のうち、最も早く回り終える順序を算出（間に合わないスポットは除外して表示）
+    - **所要時間・料金の上限**: 指定すると、上限内でおすすめ度（データの「おすすめ度」列、なければ各1）の合計が最大になるスポットを選んで回ります
+    - **防災モード**: 最近傍法で初期順序を決め、移動距離が最短になるよう改善
+    - 12箇所以下は動的計画法による厳密解、それ以上は近似解（観光モード: 挿入法、防災モード: 2-opt・Or-opt）を算出
     - Google Maps連携で実際のルートをナビゲーション可能
 
     #### AIプラン提案機能について
     - Gemini API（gemini-2.0-flash-exp）を使用
     - ユーザーが自身のAPIキーを入力（セッション中のみ保持）
     - 予算、時間、興味、同行者に基づいた具体的なプランを生成
+    - 興味・季節・予算・滞在時間に合うスポットだけを選んでAIに渡すため、スポットが増えても生成の速さは変わりません
+    - 生成中の文章を順次表示（ストリーミング）し、同じ条件のプランは1時間再利用
 
     #### 便利な機能
     - **現在地の設定**: サイドバーから緯度・経度を入力、またはプリセット位置から選択
     - **カテゴリーフィルター**: 歴史、自然、グルメ、体験など、カテゴリー別に絞り込み
+    - **スポット検索**: スポット名・カテゴリー・説明から検索（空白で区切ると全ての語を含むスポットに絞り込み。ひらがな・カタカナ、全角・半角は区別しません）
     - **距離表示**: すべてのスポットに現在地からの距離を表示
     - **直線表示**: 地図上で現在地から目的地への直線を表示可能
     - **待ち時間・混雑状況**: 飲食店や観光地の待ち時間と混雑状況を確認可能
+    - **到達圏**: 観光マップ・避難所マップの「⏱️ 到達圏」で、現在地から徒歩・車で15・30・60分以内に行ける範囲を地図に塗り分け、範囲内のスポット・避難所を所要時間の順に一覧表示（範囲内だけを地図に表示することも可能）。道路データがあれば道路に沿って、なければ直線距離で計算し、現在地が約100m以内で同じ場合は計算結果を再利用します
+
+    #### 道路データについて
+    - アプリと同じフォルダに日田市周辺のOpenStreetMap抽出データ（hita.osm.pbf または hita.osm）を置くと、直線距離の代わりに道路に沿った距離・所要時間で計算し、地図にも道路に沿ったルートを表示します
+    - 道路データはオフラインで読み込み、外部サービスには接続しません（PBF形式の読み込みには osmium が必要）
+    - スポット間の移動時間は移動手段ごとに .spots_cache フォルダへ保存して再利用し、spots.xlsx を更新したときは追加・移動したスポットの分だけ計算し直します
+    - 道路データがない場合や道路から離れた地点は、従来どおり直線距離で計算します
+
+    #### 浸水・土砂災害の想定区域について
+    - アプリと同じフォルダに想定区域のGeoJSON（hazard.geojson。ポリゴンの「種別」「名称」プロパティを表示）を置くと、避難所マップに区域を重ねて表示します
+    - 避難ルートは区域を通る道路（道路データがない場合は区域を横切る直線）を避けて算出し、区域内の避難所は最寄りの候補から除きます
+    - 「区域を通らない」でも、現在地が区域内の場合など、ほかに道がないときは区域の外へ出るルートを表示します
+
+    #### 公共交通の時刻表について
+    - アプリと同じフォルダの gtfs フォルダに日田バス・JR九州などのGTFS（.zip または展開したフォルダ。複数可）を置くと、「🚌 公共交通」を選んだときの所要時間を時刻表から計算します
+    - 単一スポットでは今から出発して最も早く着く便と乗り換えを、最適化ルートでは出発時刻からの便の待ち時間を含む所要時間で訪問順を決めます
+    - 停留所までは1km以内、乗り換えは300m以内を歩き、乗り換え時間は1分以上とします。歩いた方が早い区間は徒歩の時間で計算します
+    - 時刻表がない場合や本日運行する便がない場合は、従来どおり車の所要時間で概算します
+
+    #### オフラインの地図タイルについて
+    - `python map_tiles.py seed --source <タイルのURL>` で日田市周辺の地図タイルを hita.mbtiles に保存し、アプリと同じフォルダに置くと、地図をアプリ内のタイルサーバーから表示します（通信が不安定な避難所でも地図を表示できます）
+    - シード元には一括取得が許可されたタイルサーバーを指定してください（OpenStreetMapの公開サーバーは一括取得を禁止しています）
+    - 保存したズームより拡大した場合は保存済みのタイルを引き伸ばして表示します。アプリを別のホストから開く場合は環境変数 HITA_TILE_URL にタイルサーバーのURLを指定してください
+
+    #### リアルタイム情報について
+    - アプリと同じフォルダに live_sources.json（施設ごとのHTTP/JSONの情報源の一覧）を置くと、待ち時間・混雑状況・避難所の状態・店舗の営業状況をExcelの値の代わりに表示し、最適化ルートにも反映します
+    - 情報源はバックグラウンドで並行して取得し、画面の表示は取得を待ちません（応答のない情報源や5分以上前の値はExcelの値に戻ります）
 
     #### Google Maps連携について
     - 実際の道路に沿ったルート案内は、「Google Mapsでルートを見る」ボタンから外部アプリで確認できます
@@ -1409,4 +1832,44 @@ if st.checkbox("🔧 デバッグ情報を表示", value=False):
     st.json({
         "現在地": st.session_state.current_location,
         "モード": st.session_state.mode
-    })
\ No newline at end of file
+    })
+
+# 処理時間の計測結果（サイドバーのデバッグ表示）
+trace_registry = get_trace_registry()
+route_cache_stats = get_route_cache().stats()
+trace_gauges = {
+    'hita_route_cache_hits': route_cache_stats.hits,
+    'hita_route_cache_misses': route_cache_stats.misses,
+    'hita_route_cache_evictions': route_cache_stats.evictions,
+    'hita_route_cache_entries': route_cache_stats.entries,
+    'hita_route_cache_bytes': route_cache_stats.size_bytes,
+}
+finish_trace(trace_recorder, trace_registry, trace_gauges)
+
+with st.sidebar:
+    st.divider()
+    st.checkbox("🛠️ 処理時間を表示（デバッグ）", key='debug_tracing')
+    if trace_recorder is not None and st.session_state.get('debug_tracing'):
+        st.caption(f"今回の再実行: {trace_recorder.total_ns / 1e6:.1f} ms")
+        st.dataframe(
+            pd.DataFrame([{
+                '処理': '　' * record.depth + record.name,
+                '開始（ms）': round(record.start_ns / 1e6, 2),
+                '時間（ms）': round(record.duration_ns / 1e6, 2),
+            } for record in trace_recorder.ordered_spans()]),
+            hide_index=True, use_container_width=True
+        )
+        with st.expander("📊 集計（全セッション）"):
+            st.dataframe(pd.DataFrame(trace_registry.summary()).round(2), hide_index=True, use_container_width=True)
+            st.caption(
+                f"ルートの共有キャッシュ: ヒット率 {route_cache_stats.hit_rate:.0%}"
+                f"（{route_cache_stats.entries}件・{route_cache_stats.size_bytes / 1024:.0f} KiB）"
+            )
+            st.download_button(
+                "📥 Prometheus形式", trace_registry.prometheus_text(trace_gauges),
+                file_name='hita_metrics.prom', mime='text/plain', use_container_width=True
+            )
+            st.download_button(
+                "📥 今回の計測（JSON）", json.dumps(trace_recorder.to_log_record(), ensure_ascii=False),
+                file_name='hita_trace.json', mime='application/json', use_container_width=True
+            )
\ No newline at end of file